@@ -0,0 +1,145 @@
+"""Rolling background models for background subtraction.
+
+A static background image has to be produced by hand and does not follow
+slow changes of the illumination. The models in this module are instead
+updated with every frame as the sequence streams, and the current estimate
+is subtracted from the frame before highpass filtering. Every update does a
+constant amount of work per pixel and the model stays in memory between
+frames.
+
+Available estimators:
+
+    min     running minimum of all frames seen so far
+    median  approximate running median: each pixel steps one gray level
+            towards the current frame (the sigma-delta filter). It has no
+            window; it tracks a stable scene's median at up to one gray
+            level per frame, so it takes about as many frames as the
+            background's gray level range to settle - thousands for 16-bit
+            images.
+    mean    exponential moving average with rate ``1 / window``
+
+Only the mean estimator has a window.
+"""
+
+from typing import Optional
+
+import numpy as np
+
+BACKGROUND_MODES = ("min", "median", "mean")
+
+# Default window of the mean estimator, in frames
+DEFAULT_WINDOW = 50
+
+
+def subtract_background(
+    img: np.ndarray, background: np.ndarray, out: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """Subtract a background image, clipping negative results to zero.
+
+    Args:
+        img: Integer image
+        background: Background of the same shape; converted to the image
+            type if necessary
+        out: Optional output array, may be ``img`` itself
+
+    Returns:
+        ``img - background`` clipped at zero, in the type of ``img``
+    """
+    if background.dtype != img.dtype:
+        background = background.astype(img.dtype)
+    if out is None:
+        out = np.empty_like(img)
+    # max(img, background) - background never wraps around
+    np.maximum(img, background, out=out)
+    np.subtract(out, background, out=out)
+    return out
+
+
+class BackgroundModel:
+    """Per-pixel background estimate of one camera, updated frame by frame."""
+
+    def __init__(self, mode: str = "median", window: int = DEFAULT_WINDOW):
+        """Initialize an empty model.
+
+        Args:
+            mode: One of ``BACKGROUND_MODES``
+            window: Effective memory of the mean estimator, in frames;
+                the min and median estimators do not use it
+
+        Raises:
+            ValueError: for an unknown mode or non-positive window
+        """
+        if mode not in BACKGROUND_MODES:
+            raise ValueError(
+                f"Unknown background mode {mode!r}, expected one of "
+                f"{', '.join(BACKGROUND_MODES)}"
+            )
+        if window < 1:
+            raise ValueError("Background window must be at least 1 frame")
+
+        self.mode = mode
+        self.window = window
+        self.n_frames = 0
+        self._model = None
+        self._dtype = None
+        self._step = None
+
+    def reset(self) -> None:
+        """Forget all frames seen so far."""
+        self.n_frames = 0
+        self._model = None
+        self._dtype = None
+        self._step = None
+
+    def update(self, img: np.ndarray) -> None:
+        """Add a frame to the estimate.
+
+        The first frame initializes the model. A frame of a different shape
+        or type than the previous ones restarts it.
+        """
+        if (self._model is None or self._model.shape != img.shape
+                or self._dtype != img.dtype):
+            self._dtype = img.dtype
+            if self.mode == "mean":
+                self._model = img.astype(np.float32)
+            else:
+                self._model = img.copy()
+            self._step = np.empty(img.shape, dtype=bool)
+            self.n_frames = 1
+            return
+
+        model = self._model
+        if self.mode == "min":
+            np.minimum(model, img, out=model)
+        elif self.mode == "median":
+            np.greater(img, model, out=self._step)
+            np.add(model, self._step, out=model, casting="unsafe")
+            np.less(img, model, out=self._step)
+            np.subtract(model, self._step, out=model, casting="unsafe")
+        else:
+            # Use the running average until the window is full
+            rate = 1.0 / min(self.n_frames + 1, self.window)
+            model += rate * (img - model)
+        self.n_frames += 1
+
+    @property
+    def background(self) -> Optional[np.ndarray]:
+        """The current estimate in the frame type, or None before any frame."""
+        if self._model is None:
+            return None
+        if self.mode == "mean":
+            return np.rint(self._model).astype(self._dtype)
+        return self._model
+
+    def apply(self, img: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Update the model with a frame and subtract the new estimate from it.
+
+        Args:
+            img: Integer image
+            out: Optional output array, may be ``img`` itself
+
+        Returns:
+            The background-subtracted frame
+        """
+        self.update(img)
+        return subtract_background(img, self.background, out=out)
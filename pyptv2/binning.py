@@ -0,0 +1,162 @@
+"""Binned quick-look processing.
+
+Checking detection parameters on a long recording does not need full
+resolution. In quick-look mode the images are binned by a factor of 2 or 4
+in each direction as they are loaded, which makes highpass filtering and
+target recognition 4-16 times cheaper. Binning averages blocks of pixels,
+so gray value thresholds keep their meaning; the image size and the target
+size limits, which count pixels, are scaled down with the helpers here.
+
+Targets found in binned images are mapped back to full-resolution pixel
+coordinates with ``unbin_targets()``, after which they go through the full
+resolution calibration, correspondences and tracking unchanged.
+"""
+
+from typing import Sequence
+
+import numpy as np
+from optv.parameters import ControlParams, TargetParams
+
+
+def _check_factor(factor: int) -> int:
+    factor = int(factor)
+    if factor < 1:
+        raise ValueError(f"Binning factor must be at least 1, got {factor}")
+    return factor
+
+
+def binned_shape(shape: Sequence[int], factor: int) -> tuple:
+    """Return the (height, width) of an image binned by ``factor``.
+
+    Rows and columns that do not fill a whole block are dropped.
+    """
+    factor = _check_factor(factor)
+    return shape[0] // factor, shape[1] // factor
+
+
+def bin_image(img: np.ndarray, factor: int) -> np.ndarray:
+    """Average ``factor`` x ``factor`` blocks of an image.
+
+    Args:
+        img: 2D integer image
+        factor: Block size; 1 returns the image itself
+
+    Returns:
+        The binned image, in the type of ``img``. Gray values are the block
+        means, rounded down.
+    """
+    factor = _check_factor(factor)
+    if factor == 1:
+        return img
+    height, width = binned_shape(img.shape, factor)
+    blocks = img[:height * factor, :width * factor].reshape(
+        height, factor, width, factor
+    )
+    sums = blocks.sum(axis=(1, 3), dtype=np.uint32)
+    sums //= factor * factor
+    return sums.astype(img.dtype)
+
+
+def binned_control_params(cpar: ControlParams, factor: int) -> ControlParams:
+    """Return a copy of the control parameters for binned images.
+
+    The image size is divided and the pixel size multiplied by the factor;
+    flags and multimedia parameters are copied.
+
+    Args:
+        cpar: Full-resolution control parameters
+        factor: Binning factor
+
+    Returns:
+        New ControlParams
+    """
+    factor = _check_factor(factor)
+    flags = []
+    if cpar.get_hp_flag():
+        flags.append("hp")
+    if cpar.get_allCam_flag():
+        flags.append("allcam")
+    if cpar.get_tiff_flag():
+        flags.append("headers")
+
+    imx, imy = cpar.get_image_size()
+    pix_x, pix_y = cpar.get_pixel_size()
+    mm = cpar.get_multimedia_params()
+    nlay = mm.get_nlay()
+    binned = ControlParams(
+        cpar.get_num_cams(),
+        flags,
+        image_size=(imx // factor, imy // factor),
+        pixel_size=(pix_x * factor, pix_y * factor),
+        cam_side_n=mm.get_n1(),
+        wall_ns=list(mm.get_n2()[:nlay]),
+        wall_thicks=list(mm.get_d()[:nlay]),
+        object_side_n=mm.get_n3(),
+    )
+    binned.set_chfield(cpar.get_chfield())
+    return binned
+
+
+def binned_target_params(
+    tpar: TargetParams, factor: int, num_cams: int = 4
+) -> TargetParams:
+    """Return a copy of the target parameters for binned images.
+
+    Pixel counts and the minimal sum of gray values shrink with the block
+    area, the size bounds with the factor. Lower bounds are rounded down and
+    upper bounds up, so no target accepted at full resolution is rejected
+    for rounding. Gray value thresholds and the discontinuity stay.
+
+    Args:
+        tpar: Full-resolution target parameters
+        factor: Binning factor
+        num_cams: Number of gray value thresholds to copy
+
+    Returns:
+        New TargetParams
+    """
+    factor = _check_factor(factor)
+    area = factor * factor
+
+    def shrink(bounds, scale):
+        low, high = bounds
+        return low // scale, -(-high // scale)
+
+    return TargetParams(
+        discont=tpar.get_max_discontinuity(),
+        gvthresh=list(tpar.get_grey_thresholds(num_cams)),
+        pixel_count_bounds=shrink(tpar.get_pixel_count_bounds(), area),
+        xsize_bounds=shrink(tpar.get_xsize_bounds(), factor),
+        ysize_bounds=shrink(tpar.get_ysize_bounds(), factor),
+        min_sum_grey=tpar.get_min_sum_grey() // area,
+        cross_size=tpar.get_cross_size(),
+        engine=tpar.get_engine(),
+    )
+
+
+def unbin_targets(targets, factor: int):
+    """Map targets found in binned images to full-resolution pixels, in place.
+
+    Positions are scaled by the factor: target recognition puts pixel
+    centers at half-integer coordinates, so pixel edges, and with them block
+    edges, are at integers in both resolutions. Pixel counts, sizes and gray
+    value sums are scaled to what the full-resolution target covers.
+
+    Args:
+        targets: TargetArray (or sequence of Targets) from a binned image
+        factor: Binning factor
+
+    Returns:
+        ``targets``
+    """
+    factor = _check_factor(factor)
+    if factor == 1:
+        return targets
+    area = factor * factor
+    for targ in targets:
+        x, y = targ.pos()
+        targ.set_pos((x * factor, y * factor))
+        n, nx, ny = targ.count_pixels()
+        targ.set_pixel_counts(n * area, nx * factor, ny * factor)
+        targ.set_sum_grey_value(targ.sum_grey_value() * area)
+    return targets
@@ -0,0 +1,168 @@
+"""Instant re-detection for interactive threshold tuning.
+
+Target recognition grows a blob from every local maximum above the grey
+value threshold and keeps the blobs within the size and brightness limits.
+Tuning these parameters by hand reruns it on every change of a slider. A
+``CandidateTable`` instead grows the blobs once, at a permissive base
+threshold, and keeps their pixels sorted by falling grey value with running
+sums. Detection at a threshold ``t`` at or above the base then only needs
+the number of pixels of each blob brighter than ``t``: the pixel count, the
+extents, the grey value sum and the threshold-weighted centroid of the
+target are read off the running sums at that position, and the limits are
+applied as a vectorized filter over all blobs.
+
+At the base threshold the targets are exactly those of
+``target_recognition``. At higher thresholds each base blob is taken to
+shrink to its pixels above the threshold, which is what target recognition
+finds as long as these stay connected; a blob that falls apart into several
+peaks at the higher threshold is still reported as one target. That is
+the right trade for a preview; the final detection runs the full search.
+"""
+
+import numpy as np
+from optv.segmentation import label_blobs
+from optv.tracking_framebuf import TARGET_DTYPE
+
+# Upper limit standing in for "no limit"
+_NO_LIMIT = np.iinfo(np.int32).max
+
+
+def _running_sum(values):
+    """Cumulative sums of ``values``, starting with the empty sum."""
+    sums = np.zeros(len(values) + 1, dtype=values.dtype)
+    np.cumsum(values, out=sums[1:])
+    return sums
+
+
+class CandidateTable:
+    """Blobs of an image at a base threshold, ready for re-detection."""
+
+    def __init__(self, img, base_threshold, discont, cpar, mask=None):
+        """Grow the blobs of an image and tabulate their pixels.
+
+        Args:
+            img: 8-bit or 16-bit (highpass) image
+            base_threshold: Lowest threshold ``detect()`` will accept
+            discont: Maximal discontinuity within a blob, as in TargetParams
+            cpar: ControlParams with the image size
+            mask: Optional TileMask, search only its live tiles
+        """
+        self.base_threshold = int(base_threshold)
+        labels, self.num_blobs = label_blobs(
+            img, self.base_threshold, int(discont), cpar, mask
+        )
+
+        flat = labels.ravel()
+        pixels = np.flatnonzero(flat)
+        grey = np.asarray(img).ravel()[pixels].astype(np.int64)
+        blob = flat[pixels]
+
+        # Blob by blob, brightest pixel first
+        order = np.lexsort((-grey, blob))
+        pixels, grey, blob = pixels[order], grey[order], blob[order]
+        imx = labels.shape[1]
+        y, x = np.divmod(pixels, imx)
+
+        self._grey = grey
+        self._starts = np.searchsorted(blob, np.arange(1, self.num_blobs + 1))
+        # Sums of the first i pixels of the table
+        self._sum_g = _running_sum(grey)
+        self._sum_x = _running_sum(x)
+        self._sum_y = _running_sum(y)
+        self._sum_xg = _running_sum(x * grey)
+        self._sum_yg = _running_sum(y * grey)
+
+        # Running extents within each blob; offsetting by the blob number
+        # restarts the accumulation at every blob
+        offset = blob * (2 * max(imx, labels.shape[0]) + 2)
+        self._xmax = np.maximum.accumulate(x + offset) - offset
+        self._xmin = offset - np.maximum.accumulate(offset - x)
+        self._ymax = np.maximum.accumulate(y + offset) - offset
+        self._ymin = offset - np.maximum.accumulate(offset - y)
+
+    def __len__(self):
+        return self.num_blobs
+
+    def detect(self, threshold, pixel_count_bounds=(0, _NO_LIMIT),
+               xsize_bounds=(0, _NO_LIMIT), ysize_bounds=(0, _NO_LIMIT),
+               min_sum_grey=-1):
+        """Return the targets at a threshold, within the given limits.
+
+        Args:
+            threshold: Grey value threshold, at least the base threshold
+            pixel_count_bounds: (min, max) number of pixels of a target
+            xsize_bounds: (min, max) extent of a target in x
+            ysize_bounds: (min, max) extent of a target in y
+            min_sum_grey: The grey value sum must exceed this
+
+        Returns:
+            Structured array of dtype TARGET_DTYPE, in the order target
+            recognition finds the targets; ``TargetArray.from_array()``
+            makes targets of it.
+
+        Raises:
+            ValueError: if the threshold is below the base threshold
+        """
+        threshold = int(threshold)
+        if threshold < self.base_threshold:
+            raise ValueError(
+                f"Threshold {threshold} is below the base threshold "
+                f"{self.base_threshold} of the candidate table"
+            )
+        if self.num_blobs == 0:
+            return np.empty(0, dtype=TARGET_DTYPE)
+
+        count = np.add.reduceat((self._grey > threshold).astype(np.intp),
+                                self._starts)
+        starts = self._starts[count > 0]
+        count = count[count > 0]
+        end = starts + count
+        last = end - 1
+
+        nx = self._xmax[last] - self._xmin[last] + 1
+        ny = self._ymax[last] - self._ymin[last] + 1
+        sumg = self._sum_g[end] - self._sum_g[starts]
+        keep = (
+            (count >= pixel_count_bounds[0]) & (count <= pixel_count_bounds[1])
+            & (nx >= xsize_bounds[0]) & (nx <= xsize_bounds[1])
+            & (ny >= ysize_bounds[0]) & (ny <= ysize_bounds[1])
+            & (sumg > min_sum_grey)
+        )
+        starts, end, count = starts[keep], end[keep], count[keep]
+        nx, ny, sumg = nx[keep], ny[keep], sumg[keep]
+
+        # Centroids weighted by the grey value above the threshold
+        weight = (sumg - threshold * count).astype(np.float64)
+        sum_x = (self._sum_xg[end] - self._sum_xg[starts]
+                 - threshold * (self._sum_x[end] - self._sum_x[starts]))
+        sum_y = (self._sum_yg[end] - self._sum_yg[starts]
+                 - threshold * (self._sum_y[end] - self._sum_y[starts]))
+
+        targets = np.empty(len(count), dtype=TARGET_DTYPE)
+        targets["pnr"] = np.arange(len(count))
+        targets["x"] = sum_x / weight + 0.5
+        targets["y"] = sum_y / weight + 0.5
+        targets["n"] = count
+        targets["nx"] = nx
+        targets["ny"] = ny
+        targets["sumg"] = sumg
+        targets["tnr"] = -1
+        return targets
+
+    def detect_params(self, tpar, cam=0):
+        """``detect()`` with the limits of a TargetParams.
+
+        Args:
+            tpar: TargetParams
+            cam: Camera number, selects the grey value threshold
+
+        Returns:
+            Structured array of targets, see ``detect()``
+        """
+        return self.detect(
+            tpar.get_grey_thresholds(cam + 1)[cam],
+            pixel_count_bounds=tpar.get_pixel_count_bounds(),
+            xsize_bounds=tpar.get_xsize_bounds(),
+            ysize_bounds=tpar.get_ysize_bounds(),
+            min_sum_grey=tpar.get_min_sum_grey(),
+        )
@@ -0,0 +1,811 @@
+"""Image preprocessing, particle detection and the sequence loop on optv.
+
+``FrameProcessor`` holds what processing the frames of one experiment needs
+beyond the parameter objects: the prefetching frame loader and its image
+stacks, quick-look binning, the dark/flat-field corrections and background
+models of the cameras, the tile, static and detection-window masks, and the
+candidate tables of the detection preview. It uses the optv bindings only,
+so the UI's PTVCore delegates to it, and it can be used and tested without
+the UI.
+
+A sequence frame goes through the same steps as in pyptv's sequence loop:
+
+    load         all cameras through ``SequenceFrameLoader``, from image
+                 stacks where there are some (see ``pyptv2.image_stack``)
+    preprocess   flat-field correction, inversion, background subtraction
+                 and highpass filtering (see ``PreprocessOptions``)
+    detect       target recognition in the live tiles of the masks
+    match        correspondences and 3D positions, written to the _targets
+                 and rt_is files
+"""
+
+import os
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from skimage.io import imread
+
+import optv.orientation
+from optv.correspondences import MatchedCoords, correspondences
+from optv.image_processing import (
+    FlatField,
+    StaticMask,
+    TileMask,
+    preprocess_images,
+)
+from optv.segmentation import frame_target_recognition, target_recognition
+from optv.tracker import default_naming
+
+from pyptv2.background import (
+    DEFAULT_WINDOW,
+    BackgroundModel,
+    subtract_background,
+)
+from pyptv2.binning import (
+    bin_image,
+    binned_control_params,
+    binned_target_params,
+    unbin_targets,
+)
+from pyptv2.detection_preview import CandidateTable
+from pyptv2.image_cache import read_image_cached, read_image_native_cached
+from pyptv2.image_stack import is_page_stack, open_stacks, stack_path
+from pyptv2.sequence_loader import (
+    DEFAULT_MAX_BYTES,
+    DEFAULT_READ_AHEAD,
+    SequenceFrameLoader,
+)
+from pyptv2.windowed_detection import (
+    DEFAULT_FULL_SCAN_INTERVAL,
+    DEFAULT_TILE_SIZE,
+    DetectionWindows,
+)
+
+# Half-width of the highpass box filter, as in pyptv's py_pre_processing_c
+HIGHPASS_FILTER_SIZE = 12
+
+
+@dataclass
+class PreprocessOptions:
+    """The preprocessing steps applied to each frame before detection.
+
+    Attributes:
+        inverse: Invert the gray values, for dark particles on a bright
+            background
+        subtract_mask: Subtract a background from each image
+        base_name_mask: Static background file name pattern, ``#`` replaced
+            by the camera index; used without a background mode
+        background_mode: Rolling background model mode ('min', 'median',
+            'mean', see ``pyptv2.background``), or empty for the static
+            background
+        background_window: Memory of the "mean" background model, in frames
+        dark_name, flat_name: Dark and flat frame file name patterns for the
+            flat-field correction, empty for none
+        highpass: Highpass-filter the images
+    """
+
+    inverse: bool = False
+    subtract_mask: bool = False
+    base_name_mask: str = ""
+    background_mode: str = ""
+    background_window: int = DEFAULT_WINDOW
+    dark_name: str = ""
+    flat_name: str = ""
+    highpass: bool = True
+
+
+@dataclass
+class SequenceLayout:
+    """Where the frames of a sequence are stored.
+
+    Attributes:
+        base_names: Per-camera image base names, e.g. ``img/cam1.%d``, or
+            names of multi-page TIFF or raw files
+        first_frame, last_frame: Frame range of the sequence, if known; the
+            first page of a multi-page file is ``first_frame``
+        raw_dtype, raw_header_size, raw_frame_header_size: Layout of raw
+            files, see ``pyptv2.image_stack.RawStack``
+    """
+
+    base_names: List[Optional[str]]
+    first_frame: Optional[int] = None
+    last_frame: Optional[int] = None
+    raw_dtype: str = "uint8"
+    raw_header_size: int = 0
+    raw_frame_header_size: int = 0
+
+
+class FrameProcessor:
+    """Preprocessing and detection state of the frames of one experiment."""
+
+    def __init__(self, cpar=None, tpar=None, vpar=None, cals=None,
+                 track_par=None, native_depth: bool = False):
+        """Initialize the processor.
+
+        Args:
+            cpar, tpar, vpar, track_par: ControlParams, TargetParams,
+                VolumeParams and TrackingParams of the experiment
+            cals: Per-camera Calibration objects
+            native_depth: Keep 16-bit images in their depth through highpass
+                filtering and detection, with the target thresholds in 16-bit
+                units; otherwise all images are converted to 8 bits
+        """
+        self.set_parameters(cpar, tpar, vpar, cals, track_par)
+        self.native_depth = native_depth
+
+        # Sequence image prefetching (see frame_loader)
+        self.prefetch_frames = DEFAULT_READ_AHEAD
+        self.prefetch_max_bytes = DEFAULT_MAX_BYTES
+        self._frame_loader = None
+
+        # Optional per-camera TileMask, restricting highpass and detection
+        # to the live image regions (see build_tile_masks)
+        self.tile_masks = None
+
+        # Optional per-camera StaticMask of pixels never to process, attached
+        # to the tile masks (see load_static_masks)
+        self.static_masks = None
+
+        # Optional DetectionWindows restricting each sequence frame to the
+        # surroundings of the last frame's particles (see
+        # set_windowed_detection), and the masks of the current frame
+        self.detection_windows = None
+        self._frame_masks = None
+
+        # Write the sequence's _targets files in the binary format, which
+        # tracking reads as well (see pyptv2.target_files). PTVCore sets it
+        # from the Binary_Targets sequence parameter.
+        self.binary_targets = False
+
+        # Background subtraction state (see preprocess)
+        self._background_models = []
+        self._static_backgrounds = {}
+
+        # Per-camera dark/flat-field correction, keyed by frame file names
+        self._flat_fields = {}
+
+        # Quick-look binning factor, 1 for full resolution (see set_binning)
+        self.binning = 1
+
+        # Per-camera CandidateTable of the images last previewed, with the
+        # images they were built from (see preview)
+        self._candidate_tables = []
+        self._candidate_images = []
+
+    def set_parameters(self, cpar, tpar, vpar, cals, track_par=None) -> None:
+        """Replace the parameter objects, e.g. after they were read again."""
+        self.cpar = cpar
+        self.tpar = tpar
+        self.vpar = vpar
+        self.cals = cals
+        self.track_par = track_par
+        self.n_cams = len(cals) if cals is not None else 0
+
+    def image_reader(self):
+        """Return the function decoding the camera images.
+
+        Decoded images go through the process-wide image cache (see
+        ``pyptv2.image_cache``), so reopening a frame does not decode it
+        again. Cached images are read-only.
+        """
+        if self.native_depth:
+            return read_image_native_cached
+        return read_image_cached
+
+    def image_shape(self) -> Tuple[int, int]:
+        """Return the full-resolution image size as (height, width)."""
+        imx, imy = self.cpar.get_image_size()
+        return imy, imx
+
+    def blank_image(self) -> np.ndarray:
+        """Return an empty full-resolution image."""
+        return np.zeros(self.image_shape(), dtype=np.uint8)
+
+    def frame_loader(self, layout: SequenceLayout) -> SequenceFrameLoader:
+        """Return the prefetching loader for a sequence.
+
+        The loader is kept between calls so that frames read ahead are
+        available when requested; it is replaced when the base names,
+        prefetch settings or depth policy change. Cameras with an image stack
+        next to their base name, or whose base name is a multi-page TIFF or
+        raw file, are served from the stack.
+
+        Args:
+            layout: Where the sequence's frames are stored
+
+        Returns:
+            The frame loader
+        """
+        loader = self._frame_loader
+        if (
+            loader is None
+            or loader.base_names != list(layout.base_names)
+            or loader.read_ahead != self.prefetch_frames
+            or loader.max_bytes != self.prefetch_max_bytes
+            or loader.native_depth != self.native_depth
+        ):
+            if loader is not None:
+                loader.close()
+
+            stacks = open_stacks(
+                layout.base_names,
+                first_frame=layout.first_frame or 0,
+                frame_shape=self.image_shape(),
+                raw_dtype=layout.raw_dtype,
+                raw_header_size=layout.raw_header_size,
+                raw_frame_header_size=layout.raw_frame_header_size,
+                native_depth=self.native_depth,
+            )
+            loader = SequenceFrameLoader(
+                layout.base_names,
+                read_ahead=self.prefetch_frames,
+                max_bytes=self.prefetch_max_bytes,
+                first_frame=layout.first_frame,
+                last_frame=layout.last_frame,
+                reader=self.image_reader(),
+                stacks=stacks,
+                native_depth=self.native_depth,
+            )
+            self._frame_loader = loader
+        return loader
+
+    def load_frame(self, layout: SequenceLayout, frame_num: int,
+                   camera_id: Optional[int] = None):
+        """Load the images of a sequence frame.
+
+        All cameras are decoded in parallel, and the following frames are
+        prefetched (see ``frame_loader``). A camera whose image cannot be
+        read gets an empty image. In quick-look mode the images are binned.
+
+        Args:
+            layout: Where the sequence's frames are stored
+            frame_num: Frame number to load
+            camera_id: Camera to load, or None for all
+
+        Returns:
+            List of per-camera images, or the image of ``camera_id``
+        """
+        loader = self.frame_loader(layout)
+        cams = range(len(layout.base_names)) if camera_id is None else [camera_id]
+
+        images = []
+        for cam in cams:
+            try:
+                images.append(loader.get(frame_num, cam))
+            except Exception as e:
+                print(f"Error loading image {cam} for frame {frame_num}: {e}")
+                images.append(self.blank_image())
+        images = self.quick_look(images)
+        return images if camera_id is None else images[0]
+
+    def set_binning(self, factor: int) -> None:
+        """Switch quick-look binning on or off.
+
+        With a factor above 1, images are binned by averaging ``factor`` x
+        ``factor`` pixel blocks as they are loaded, and highpass filtering
+        and detection run on the binned images with correspondingly scaled
+        image size, pixel size and target size limits (see
+        ``pyptv2.binning``). Tile masks are not used. Detected targets are
+        mapped back to full-resolution pixel coordinates.
+
+        Args:
+            factor: Binning factor, e.g. 2 or 4; 1 for full resolution
+        """
+        factor = int(factor)
+        if factor < 1:
+            raise ValueError(f"Binning factor must be at least 1, got {factor}")
+        if factor != self.binning:
+            self.binning = factor
+            self.reset_background()
+
+    def image_cpar(self):
+        """Return the control parameters matching the (binned) images."""
+        if self.binning == 1:
+            return self.cpar
+        return binned_control_params(self.cpar, self.binning)
+
+    def image_tpar(self):
+        """Return the target parameters matching the (binned) images."""
+        if self.binning == 1:
+            return self.tpar
+        return binned_target_params(self.tpar, self.binning, self.n_cams)
+
+    def quick_look(self, images: Sequence[np.ndarray]) -> List[np.ndarray]:
+        """Bin the full-resolution images among ``images`` in quick-look mode.
+
+        Args:
+            images: List of per-camera images
+
+        Returns:
+            List of images in the current processing resolution
+        """
+        if self.binning == 1:
+            return list(images)
+        full_shape = self.image_shape()
+        return [
+            bin_image(img, self.binning)
+            if img is not None and img.shape == full_shape else img
+            for img in images
+        ]
+
+    def reset_background(self) -> None:
+        """Forget the rolling background models, e.g. when a new sequence starts."""
+        self._background_models = []
+        self._static_backgrounds = {}
+
+    def preprocess(self, images: Sequence[np.ndarray],
+                   options: PreprocessOptions) -> List[np.ndarray]:
+        """Prepare the images of a frame for detection.
+
+        Bins the images in quick-look mode, then applies the dark/flat-field
+        correction, inversion, background subtraction and highpass filter
+        selected in ``options``, in that order.
+
+        Args:
+            images: List of per-camera images
+            options: The preprocessing steps to apply
+
+        Returns:
+            List of the preprocessed images
+
+        Raises:
+            ValueError: if the flat-field or background files cannot be used
+        """
+        images = self.quick_look(images)
+
+        # Remove fixed-pattern noise and vignetting first
+        if options.dark_name or options.flat_name:
+            try:
+                images = [
+                    self._correct_flat_field(
+                        cam, img, options.dark_name, options.flat_name
+                    )
+                    for cam, img in enumerate(images)
+                ]
+            except Exception as e:
+                raise ValueError(f"Failed flat-field correction: {e}")
+
+        if options.inverse:
+            images = [np.iinfo(img.dtype).max - img for img in images]
+
+        if options.subtract_mask:
+            try:
+                images = [
+                    self._subtract_background(cam, img, options)
+                    for cam, img in enumerate(images)
+                ]
+            except Exception as e:
+                raise ValueError(f"Failed subtracting mask: {e}")
+
+        if options.highpass:
+            images = self.highpass(images)
+        return images
+
+    def _subtract_background(self, cam: int, img: np.ndarray,
+                             options: PreprocessOptions) -> np.ndarray:
+        """Subtract the background of one camera from its current image.
+
+        With a background model mode set, the camera's rolling model is
+        updated with the image and its estimate subtracted. Otherwise the
+        static background file (``#`` in the mask name replaced by the camera
+        index) is subtracted; it is read once and kept in memory.
+        """
+        mode, window = options.background_mode, options.background_window
+        if mode:
+            while len(self._background_models) <= cam:
+                self._background_models.append(None)
+            model = self._background_models[cam]
+            if model is None or model.mode != mode or model.window != window:
+                model = BackgroundModel(mode, window)
+                self._background_models[cam] = model
+            return model.apply(img)
+
+        background_name = options.base_name_mask.replace("#", str(cam))
+        key = (background_name, self.binning)
+        background = self._static_backgrounds.get(key)
+        if background is None:
+            background = self.quick_look([imread(background_name)])[0]
+            self._static_backgrounds[key] = background
+        return subtract_background(img, background)
+
+    def _correct_flat_field(self, cam: int, img: np.ndarray, dark_name: str,
+                            flat_name: str) -> np.ndarray:
+        """Apply a camera's dark/flat-field correction to its current image.
+
+        The dark and flat frames (``#`` in their names replaced by the camera
+        index) are read once, and their correction maps kept. Writable
+        images are corrected in place; shared read-only images, such as
+        cached or memory-mapped frames, are corrected into a new array.
+        """
+        names = tuple(
+            name.replace("#", str(cam)) if name else ""
+            for name in (dark_name, flat_name)
+        )
+        key = names + (img.dtype.str, self.binning)
+        flat_field = self._flat_fields.get(key)
+        if flat_field is None:
+            dark, flat = (
+                self.quick_look([self.image_reader()(name)])[0] if name else None
+                for name in names
+            )
+            flat_field = FlatField(self.image_cpar(), dark, flat, dtype=img.dtype)
+            self._flat_fields[key] = flat_field
+        out = img if img.flags.writeable and img.flags.c_contiguous else None
+        return flat_field.correct(img, out)
+
+    def highpass(self, images: Sequence[np.ndarray]) -> List[np.ndarray]:
+        """Highpass-filter the images of all cameras in one native call.
+
+        The cameras are stacked into one 3D array and filtered in parallel
+        by ``preprocess_images``, within the current masks. 16-bit images
+        are filtered in their native depth; if any camera is 16-bit, all are
+        filtered as 16-bit.
+
+        Args:
+            images: List of per-camera uint8 or uint16 images
+
+        Returns:
+            List of highpass-filtered images (views into one 3D array)
+        """
+        return list(preprocess_images(
+            np.stack(images), 0, self.image_cpar(), HIGHPASS_FILTER_SIZE,
+            masks=self.masks(),
+        ))
+
+    def masks(self) -> Optional[List]:
+        """Return the per-camera TileMasks to process the images with.
+
+        These are the current frame's detection windows in a windowed
+        sequence, otherwise the tile masks. Binned images are processed
+        whole.
+        """
+        if self.binning > 1:
+            return None
+        if self._frame_masks is not None:
+            return self._frame_masks
+        return self.tile_masks
+
+    def set_windowed_detection(self, enabled: bool = True,
+                               full_scan_interval: int = DEFAULT_FULL_SCAN_INTERVAL,
+                               tile_size: int = DEFAULT_TILE_SIZE) -> None:
+        """Switch windowed detection of sequence frames on or off.
+
+        In windowed mode, ``run_sequence`` highpass-filters and searches
+        each frame only in windows around the particles of the previous
+        frame: their 3D positions, moved by the tracking velocity limits,
+        are projected into every camera (see ``pyptv2.windowed_detection``).
+        Every ``full_scan_interval`` frames the whole frame is searched, to
+        pick up particles entering the volume. Tile masks still apply;
+        binned quick-look frames are always searched whole.
+
+        Args:
+            enabled: Whether to use windowed detection
+            full_scan_interval: Frames between full-frame scans
+            tile_size: Side of the window mask tiles in pixels
+        """
+        if enabled:
+            self.detection_windows = DetectionWindows(
+                full_scan_interval, tile_size
+            )
+        else:
+            self.detection_windows = None
+
+    def build_tile_masks(self, tile_size: int = 64, margin: int = 1) -> List[float]:
+        """Restrict processing to the image regions that see the volume.
+
+        Builds a TileMask per camera by projecting the observed volume
+        (VolumeParams) through the camera's calibration. Highpass filtering
+        and particle detection then skip the dead tiles.
+
+        Args:
+            tile_size: Side of a tile in pixels
+            margin: Number of tiles to grow the live area by
+
+        Returns:
+            List of the per-camera live fractions
+        """
+        self.tile_masks = [
+            TileMask.from_volume(self.cpar, self.vpar, cal, tile_size, margin)
+            for cal in self.cals
+        ]
+        if self.static_masks is not None:
+            for mask, static in zip(self.tile_masks, self.static_masks):
+                mask.set_static(static)
+        return [mask.live_fraction() for mask in self.tile_masks]
+
+    def load_static_masks(self, base_name_mask: Optional[str],
+                          tile_size: int = DEFAULT_TILE_SIZE) -> Optional[List[float]]:
+        """Skip static image regions, e.g. reflections, in every frame.
+
+        Reads a mask image per camera (``#`` in the name replaced by the
+        camera index), processed where nonzero and masked where 0. The masks
+        are kept as run-length spans and attached to the tile masks - made
+        whole-image ones if there are none - so highpass filtering and
+        particle detection skip the masked pixels as they go, without a
+        masking pass over every frame. Binned quick-look frames are
+        processed whole.
+
+        Args:
+            base_name_mask: Mask file name pattern, e.g. ``masks/cam#.tif``;
+                None to drop the static masks
+            tile_size: Side of the tiles of new whole-image tile masks
+
+        Returns:
+            List of the per-camera fractions of processed pixels, or None
+            if the masks were dropped
+        """
+        if base_name_mask is None:
+            self.static_masks = None
+            if self.tile_masks is not None:
+                for mask in self.tile_masks:
+                    mask.set_static(None)
+            return None
+
+        self.static_masks = [
+            StaticMask(imread(base_name_mask.replace("#", str(cam))))
+            for cam in range(self.n_cams)
+        ]
+        if self.tile_masks is None:
+            self.tile_masks = [
+                TileMask.from_static(self.cpar, static, tile_size)
+                for static in self.static_masks
+            ]
+        else:
+            for mask, static in zip(self.tile_masks, self.static_masks):
+                mask.set_static(static)
+        return [static.live_fraction() for static in self.static_masks]
+
+    def detect(self, images: Sequence[np.ndarray]):
+        """Detect targets in preprocessed images.
+
+        At full resolution all cameras are processed in one native call,
+        in parallel threads, searching only the live tiles of the masks.
+        Binned images are searched whole, each in parallel strips, with the
+        binned parameters, and the targets mapped back to full resolution.
+
+        Args:
+            images: Per-camera images in the current processing resolution
+
+        Returns:
+            Tuple of per-camera lists (detections, corrected) of
+            TargetArray and MatchedCoords, like pyptv's
+            ``py_detection_proc_c``
+        """
+        if self.binning == 1:
+            return frame_target_recognition(
+                list(images), self.tpar, self.cpar, self.cals,
+                masks=self.masks(),
+            )
+
+        cpar, tpar = self.image_cpar(), self.image_tpar()
+        detections, corrected = [], []
+        for i_cam, img in enumerate(self.quick_look(images)):
+            targs = target_recognition(img, tpar, i_cam, cpar, num_threads=0)
+            unbin_targets(targs, self.binning)
+            targs.sort_y()
+            detections.append(targs)
+            corrected.append(MatchedCoords(targs, self.cpar, self.cals[i_cam]))
+        return detections, corrected
+
+    def preview(self, images: Sequence[np.ndarray], threshold: Optional[int] = None,
+                pixel_count_bounds: Optional[Tuple[int, int]] = None):
+        """Detect particles quickly while detection parameters are tuned.
+
+        The blobs of each camera's image are grown once into a
+        ``CandidateTable`` (see ``pyptv2.detection_preview``), at half the
+        requested threshold so that the threshold can also be lowered, and
+        kept until the images change or a threshold below the table's base
+        threshold is asked for. Each call then only filters the tables.
+        Results are exact where blobs do not fall apart above the base
+        threshold; use ``detect`` for the final detection.
+
+        Args:
+            images: Per-camera images, binned in quick-look mode
+            threshold: Grey value threshold for all cameras; None uses the
+                per-camera thresholds of the target parameters
+            pixel_count_bounds: (min, max) pixels of a target; None uses the
+                target parameters
+
+        Returns:
+            Tuple (x, y) of per-camera arrays of full-resolution target
+            image coordinates
+        """
+        images = self.quick_look(images)
+        cpar, tpar = self.image_cpar(), self.image_tpar()
+        masks = self.masks()
+        if pixel_count_bounds is None:
+            pixel_count_bounds = tpar.get_pixel_count_bounds()
+        thresholds = tpar.get_grey_thresholds(self.n_cams)
+        if threshold is not None:
+            thresholds = [threshold] * self.n_cams
+
+        if len(self._candidate_images) != len(images) or any(
+            img is not cached
+            for img, cached in zip(images, self._candidate_images)
+        ):
+            self._candidate_tables = [None] * len(images)
+            self._candidate_images = list(images)
+
+        x, y = [], []
+        for i_cam, img in enumerate(images):
+            table = self._candidate_tables[i_cam]
+            if table is None or thresholds[i_cam] < table.base_threshold:
+                table = CandidateTable(
+                    img, thresholds[i_cam] // 2, tpar.get_max_discontinuity(),
+                    cpar, None if masks is None else masks[i_cam],
+                )
+                self._candidate_tables[i_cam] = table
+
+            targets = table.detect(
+                thresholds[i_cam],
+                pixel_count_bounds=pixel_count_bounds,
+                xsize_bounds=tpar.get_xsize_bounds(),
+                ysize_bounds=tpar.get_ysize_bounds(),
+                min_sum_grey=tpar.get_min_sum_grey(),
+            )
+            x.append(targets["x"] * self.binning)
+            y.append(targets["y"] * self.binning)
+
+        return x, y
+
+    def statistics(self, images: Sequence[np.ndarray]) -> List[dict]:
+        """Gather detection statistics of the images.
+
+        Runs target recognition on each camera's image, in the current
+        processing resolution and within the current masks, with statistics
+        gathered in the search: histograms of the pixel count, extents and
+        grey value sum of the targets, and the number of blobs rejected
+        under each limit (see ``optv.segmentation.target_recognition``).
+
+        Args:
+            images: Per-camera images, binned in quick-look mode
+
+        Returns:
+            List of per-camera dicts of NumPy arrays
+        """
+        images = self.quick_look(images)
+        cpar, tpar = self.image_cpar(), self.image_tpar()
+        masks = self.masks()
+
+        stats = []
+        for i_cam, img in enumerate(images):
+            _, cam_stats = target_recognition(
+                img, tpar, i_cam, cpar,
+                mask=None if masks is None else masks[i_cam],
+                num_threads=0, stats=True,
+            )
+            stats.append(cam_stats)
+        return stats
+
+    def needs_own_loop(self, layout: SequenceLayout,
+                       options: PreprocessOptions) -> bool:
+        """Tell whether a sequence needs ``run_sequence`` rather than pyptv's loop.
+
+        pyptv's loop reads one 8-bit file per frame, subtracts at most a
+        static background and scans the whole frame. Anything else this
+        processor does - image stacks, rolling background models, dark/flat
+        fields, tile, static or window masks, quick-look binning, native
+        16-bit depth or binary _targets files - is only done by
+        ``run_sequence``.
+
+        Args:
+            layout: Where the sequence's frames are stored
+            options: The preprocessing steps to apply
+        """
+        return (
+            self.detection_windows is not None
+            or self.tile_masks is not None
+            or self.static_masks is not None
+            or self.binning > 1
+            or self.native_depth
+            or self.binary_targets
+            or bool(options.subtract_mask and options.background_mode)
+            or bool(options.dark_name or options.flat_name)
+            or any(
+                is_page_stack(name) or (
+                    bool(name) and os.path.exists(stack_path(name))
+                )
+                for name in layout.base_names
+            )
+        )
+
+    def run_sequence(self, layout: SequenceLayout, options: PreprocessOptions,
+                     start_frame: int, end_frame: int,
+                     corres_base: Optional[str] = None) -> None:
+        """Run the sequence loop on frames from the frame loader.
+
+        Does what pyptv's ``py_sequence_loop`` does - detection,
+        correspondences and 3D positions per frame, writing the _targets
+        and rt_is files - but reads the images through ``load_frame``, so
+        cameras recorded as one multi-page file are read from their
+        memory-mapped pages. With windowed detection on, each frame is only
+        processed in the windows predicted from the previous frame (see
+        ``set_windowed_detection``).
+
+        Args:
+            layout: Where the sequence's frames are stored; the _targets
+                files are written next to the images
+            options: The preprocessing steps to apply
+            start_frame, end_frame: Frame range to process (inclusive)
+            corres_base: Base name of the rt_is files, by default
+                ``res/rt_is`` in the working directory
+        """
+        self.reset_background()
+        windows = self.detection_windows if self.binning == 1 else None
+        if windows is not None:
+            windows.reset()
+
+        try:
+            for frame in range(start_frame, end_frame + 1):
+                if windows is not None:
+                    self._frame_masks = windows.masks(
+                        self.cpar, self.cals, self.track_par, self.tpar,
+                        self.tile_masks,
+                    )
+                pos = self.process_frame(layout, options, frame, corres_base)
+                if windows is not None:
+                    windows.update(pos, self._frame_masks is None)
+        finally:
+            self._frame_masks = None
+
+    def process_frame(self, layout: SequenceLayout, options: PreprocessOptions,
+                      frame: int, corres_base: Optional[str] = None) -> np.ndarray:
+        """Detect, match and locate the particles of one sequence frame.
+
+        Writes the frame's _targets and rt_is files.
+
+        Args:
+            layout: Where the sequence's frames are stored
+            options: The preprocessing steps to apply
+            frame: Frame number
+            corres_base: Base name of the rt_is files, see ``run_sequence``
+
+        Returns:
+            (N, 3) array of the frame's 3D positions
+        """
+        images = self.preprocess(self.load_frame(layout, frame), options)
+        detections, corrected = self.detect(images)
+
+        sorted_pos, sorted_corresp, _ = correspondences(
+            detections, corrected, self.cals, self.vpar, self.cpar
+        )
+
+        # Save targets only after correspondences numbered them
+        for i_cam, base_name in enumerate(layout.base_names):
+            detections[i_cam].write(
+                base_name.encode(), frame, binary=self.binary_targets
+            )
+
+        print(
+            f"Frame {frame} had "
+            f"{[s.shape[1] for s in sorted_pos]} correspondences."
+        )
+
+        # Distinction between quad/trip irrelevant here
+        sorted_pos = np.concatenate(sorted_pos, axis=1)
+        sorted_corresp = np.concatenate(sorted_corresp, axis=1)
+
+        flat = np.array([
+            corrected[i].get_by_pnrs(sorted_corresp[i])
+            for i in range(len(self.cals))
+        ])
+        pos, _ = optv.orientation.point_positions(
+            flat.transpose(1, 0, 2), self.cpar, self.cals, self.vpar
+        )
+
+        if len(self.cals) < 4:
+            print_corresp = -1 * np.ones((4, sorted_corresp.shape[1]))
+            print_corresp[:len(self.cals), :] = sorted_corresp
+        else:
+            print_corresp = sorted_corresp
+
+        if corres_base is None:
+            corres_base = default_naming["corres"].decode()
+        with open(f"{corres_base}.{frame}", "w", encoding="utf8") as rt_is:
+            rt_is.write(str(pos.shape[0]) + "\n")
+            for pix, pt in enumerate(pos):
+                pt_args = (pix + 1,) + tuple(pt) + tuple(print_corresp[:, pix])
+                rt_is.write("%4d %9.3f %9.3f %9.3f %4d %4d %4d %4d\n" % pt_args)
+
+        return pos
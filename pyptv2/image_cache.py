@@ -0,0 +1,140 @@
+"""Process-wide cache of decoded images.
+
+The GUI dialogs all go through ``PTVCore`` and tend to reopen the same
+frames as the user steps back and forth through a sequence. Decoding a TIFF
+every time is wasteful, so decoded images are kept in one cache shared by
+the whole process. Entries are keyed by (path, modification time, pixel
+type): an image file that changes on disk is decoded again, and the 8-bit
+and native-depth decodes of a file are kept apart. The least recently used
+images are evicted when the cache exceeds its byte budget.
+
+Cached images are shared between callers and therefore read-only.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Tuple
+
+import numpy as np
+
+from pyptv2.sequence_loader import read_image
+from pyptv2.image_stack import read_image_native
+
+# Default budget of the process-wide cache, in bytes
+DEFAULT_CACHE_BYTES = 256 * 1024 * 1024
+
+
+class ImageCache:
+    """Thread-safe LRU cache of decoded images under a byte budget."""
+
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_BYTES):
+        """Initialize an empty cache.
+
+        Args:
+            max_bytes: Budget for the cached images, in bytes. Images larger
+                than the budget are never cached.
+        """
+        self.max_bytes = int(max_bytes)
+        self.nbytes = 0
+        self._lock = threading.Lock()
+        # (path, mtime, dtype) -> image, least recently used first
+        self._images = OrderedDict()
+        # (path, dtype) -> current key, to drop outdated versions of a file
+        self._current = {}
+
+    def __len__(self) -> int:
+        return len(self._images)
+
+    @staticmethod
+    def _key(path: str, dtype: str) -> Tuple[str, int, str]:
+        path = os.path.abspath(path)
+        return path, os.stat(path).st_mtime_ns, dtype
+
+    def get(self, path: str, reader: Callable[[str], np.ndarray],
+            dtype: str) -> np.ndarray:
+        """Return the decoded image of a file, decoding it if necessary.
+
+        Args:
+            path: Image file name
+            reader: Function decoding the file on a cache miss
+            dtype: Name of the pixel type ``reader`` produces, part of the key
+
+        Returns:
+            The read-only decoded image
+
+        Raises:
+            OSError: if the file does not exist, or whatever ``reader`` raised
+        """
+        key = self._key(path, dtype)
+        with self._lock:
+            img = self._images.get(key)
+            if img is not None:
+                self._images.move_to_end(key)
+                return img
+
+        img = reader(path)
+        img.flags.writeable = False
+        self._put(key, img)
+        return img
+
+    def _put(self, key: Tuple[str, int, str], img: np.ndarray) -> None:
+        if img.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            outdated = self._current.get((key[0], key[2]))
+            if outdated is not None and outdated != key:
+                if outdated[1] > key[1]:
+                    # the file changed while it was decoded
+                    return
+                self._drop(outdated)
+            if key in self._images:
+                return
+            self._images[key] = img
+            self._current[(key[0], key[2])] = key
+            self.nbytes += img.nbytes
+            self._evict()
+
+    def _drop(self, key: Tuple[str, int, str]) -> None:
+        img = self._images.pop(key, None)
+        if img is not None:
+            self.nbytes -= img.nbytes
+        if self._current.get((key[0], key[2])) == key:
+            del self._current[(key[0], key[2])]
+
+    def _evict(self) -> None:
+        while self.nbytes > self.max_bytes and self._images:
+            self._drop(next(iter(self._images)))
+
+    def evict(self) -> None:
+        """Drop least recently used images until the budget is met.
+
+        Call after lowering ``max_bytes``; adding images evicts by itself.
+        """
+        with self._lock:
+            self._evict()
+
+    def clear(self) -> None:
+        """Drop all cached images."""
+        with self._lock:
+            self._images.clear()
+            self._current.clear()
+            self.nbytes = 0
+
+
+_image_cache = ImageCache()
+
+
+def get_image_cache() -> ImageCache:
+    """Return the process-wide image cache."""
+    return _image_cache
+
+
+def read_image_cached(path: str) -> np.ndarray:
+    """``read_image`` through the process-wide cache (8-bit gray)."""
+    return _image_cache.get(path, read_image, "uint8")
+
+
+def read_image_native_cached(path: str) -> np.ndarray:
+    """``read_image_native`` through the process-wide cache (native depth)."""
+    return _image_cache.get(path, read_image_native, "native")
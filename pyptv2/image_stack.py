@@ -0,0 +1,682 @@
+"""Memory-mapped per-camera image stacks.
+
+A sequence is normally stored as one image file per camera and frame
+(``img_base_name % frame``), which means every pass over the sequence decodes
+every file again. An image stack holds all frames of one camera in a single
+raw file that is memory-mapped, so a frame is a zero-copy slice of the map:
+no decoding and no per-frame allocation.
+
+File layout (little endian):
+
+    offset  size  content
+    0       8     magic, b"PTVSTK01"
+    8       2     pixel type, b"u1" (uint8) or b"u2" (uint16)
+    10      2     reserved, 0
+    12      4     first frame number (int32)
+    16      4     number of frames (int32)
+    20      4     image height (int32)
+    24      4     image width (int32)
+    28      8     newest modification time of the source images (float64),
+                  0 if unknown
+    36      1     depth of the frames: 1 native depth of the sources, 2
+                  converted to 8 bits, 0 unknown
+    37      27    padding to HEADER_SIZE
+    64      ...   frames, each height * width pixels, row-major
+
+Stacks are created from an existing sequence with ``convert_sequence()``, or
+from the command line::
+
+    python -m pyptv2.image_stack img/cam1.%d 10001 10100
+
+A stack next to a sequence is only used while it is current: if any of its
+source images changed after the conversion, or if native depth is asked
+for and the stack holds frames converted to 8 bits, the images are read
+instead (see ``open_stacks``).
+
+Many high-speed cameras write a whole recording as one multi-page TIFF (or
+BigTIFF) file, or as a headerless raw file. A sequence base name without a
+frame-number specifier that names such a file, e.g. ``img/cam1.tif``, is
+read as a page stack: page N is frame ``first_frame + N``, and is a view
+into the memory-mapped file as well. Only uncompressed, strip-organized
+gray pages can be mapped; other TIFF files must be converted.
+"""
+
+import argparse
+import os
+import re
+import struct
+from typing import List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from skimage.io import imread
+from skimage.util import img_as_ubyte
+from skimage.color import rgb2gray
+
+# File name suffix of image stacks
+STACK_SUFFIX = ".ptvstack"
+
+# Size of the file header, frames start at this offset
+HEADER_SIZE = 64
+
+_MAGIC = b"PTVSTK01"
+_HEADER = struct.Struct("<8s2s2xiiiidB")
+_DEPTH_UNKNOWN, _DEPTH_NATIVE, _DEPTH_8BIT = 0, 1, 2
+_DTYPES = {b"u1": np.dtype(np.uint8), b"u2": np.dtype("<u2")}
+_DTYPE_CODES = {dtype: code for code, dtype in _DTYPES.items()}
+
+# File name suffixes of multi-page files read as page stacks
+TIFF_SUFFIXES = (".tif", ".tiff")
+RAW_SUFFIXES = (".raw",)
+
+# TIFF tags needed to locate the pixels of a page
+_TIFF_NEW_SUBFILE_TYPE = 254
+_TIFF_IMAGE_WIDTH = 256
+_TIFF_IMAGE_LENGTH = 257
+_TIFF_BITS_PER_SAMPLE = 258
+_TIFF_COMPRESSION = 259
+_TIFF_STRIP_OFFSETS = 273
+_TIFF_SAMPLES_PER_PIXEL = 277
+_TIFF_STRIP_BYTE_COUNTS = 279
+_TIFF_TILE_WIDTH = 322
+_TIFF_SAMPLE_FORMAT = 339
+
+# TIFF field type -> struct format of one value
+_TIFF_TYPES = {1: "B", 3: "H", 4: "I", 16: "Q"}
+
+
+def stack_path(base_name: str) -> str:
+    """Return the stack file name belonging to a sequence base name.
+
+    The frame-number format specifier and anything after it are dropped, so
+    ``img/cam1.%d`` and ``img/cam1.%04d.tif`` both map to
+    ``img/cam1.ptvstack``. Base names that already name a stack are returned
+    unchanged.
+
+    Args:
+        base_name: printf-style image base name of one camera
+
+    Returns:
+        Path of the stack file
+    """
+    if base_name.endswith(STACK_SUFFIX):
+        return base_name
+    prefix = re.split(r"%0?\d*d", base_name, maxsplit=1)[0]
+    return prefix.rstrip("._-") + STACK_SUFFIX
+
+
+def is_page_stack(base_name: Optional[str]) -> bool:
+    """Tell whether a base name names a multi-page file instead of a pattern.
+
+    Args:
+        base_name: Image base name of one camera
+
+    Returns:
+        True for a TIFF or raw file name without a frame-number specifier
+    """
+    return bool(base_name) and "%" not in base_name and (
+        base_name.lower().endswith(TIFF_SUFFIXES + RAW_SUFFIXES)
+    )
+
+
+def read_image_native(path: str) -> np.ndarray:
+    """Read a gray image keeping 8/16-bit data in its native depth.
+
+    Color images and other pixel types are converted to 8-bit gray.
+    """
+    img = imread(path)
+    if img.ndim > 2:
+        img = img_as_ubyte(rgb2gray(img))
+    elif img.dtype not in (np.uint8, np.uint16):
+        img = img_as_ubyte(img)
+    return img
+
+
+class ImageStack:
+    """A memory-mapped stack of same-size frames of one camera."""
+
+    def __init__(self, path: Union[str, os.PathLike], mode: str = "r"):
+        """Open an existing stack file.
+
+        Args:
+            path: Path to the stack file
+            mode: ``"r"`` for read-only access, ``"r+"`` to allow writing frames
+
+        Raises:
+            ValueError: if the file is not a valid image stack
+        """
+        self.path = os.fspath(path)
+        with open(self.path, "rb") as f:
+            header = f.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            raise ValueError(f"{self.path} is too short to be an image stack")
+
+        (
+            magic, code, first, n_frames, height, width, source_mtime, depth
+        ) = _HEADER.unpack(header)
+        if magic != _MAGIC or code not in _DTYPES:
+            raise ValueError(f"{self.path} is not an image stack")
+
+        self.first_frame = first
+        self.n_frames = n_frames
+        self.frame_shape = (height, width)
+        self.dtype = _DTYPES[code]
+        # Newest modification time of the source images, None if unknown
+        self.source_mtime = source_mtime or None
+        # Whether the frames have the native depth of the sources, None if
+        # unknown
+        self.native_depth = {
+            _DEPTH_NATIVE: True, _DEPTH_8BIT: False
+        }.get(depth)
+        self.data = np.memmap(
+            self.path, dtype=self.dtype, mode=mode, offset=HEADER_SIZE,
+            shape=(n_frames, height, width),
+        )
+
+    @property
+    def last_frame(self) -> int:
+        """Number of the last frame in the stack."""
+        return self.first_frame + self.n_frames - 1
+
+    def __len__(self) -> int:
+        return self.n_frames
+
+    def __contains__(self, frame_num: int) -> bool:
+        return self.first_frame <= frame_num <= self.last_frame
+
+    def frame(self, frame_num: int) -> np.ndarray:
+        """Return a frame as a view into the memory map.
+
+        Args:
+            frame_num: Frame number, in the sequence numbering
+
+        Returns:
+            2D array sharing memory with the stack file
+
+        Raises:
+            IndexError: if the frame is not in the stack
+        """
+        if frame_num not in self:
+            raise IndexError(
+                f"Frame {frame_num} not in stack {self.path} "
+                f"({self.first_frame}-{self.last_frame})"
+            )
+        return self.data[frame_num - self.first_frame]
+
+    __getitem__ = frame
+
+    def flush(self) -> None:
+        """Write pending changes to disk (for stacks opened with ``r+``)."""
+        self.data.flush()
+
+    def close(self) -> None:
+        """Release the memory map."""
+        mmap = getattr(self.data, "_mmap", None)
+        self.data = None
+        if mmap is not None:
+            mmap.close()
+
+
+class PageStack:
+    """Frames stored as pages of a memory-mapped multi-page file.
+
+    Subclasses locate the pages: ``_offsets`` holds the byte offset of every
+    page in the file, all of shape ``frame_shape`` and type ``dtype``. Pages
+    need not be evenly spaced.
+    """
+
+    def __init__(self, path: Union[str, os.PathLike], first_frame: int = 0):
+        self.path = os.fspath(path)
+        self.first_frame = first_frame
+        self._map = np.memmap(self.path, dtype=np.uint8, mode="r")
+        self._offsets: List[int] = []
+        self.frame_shape: Tuple[int, int] = (0, 0)
+        self.dtype = np.dtype(np.uint8)
+
+    @property
+    def n_frames(self) -> int:
+        """Number of frames in the stack."""
+        return len(self._offsets)
+
+    @property
+    def last_frame(self) -> int:
+        """Number of the last frame in the stack."""
+        return self.first_frame + self.n_frames - 1
+
+    def __len__(self) -> int:
+        return self.n_frames
+
+    def __contains__(self, frame_num: int) -> bool:
+        return self.first_frame <= frame_num <= self.last_frame
+
+    def frame(self, frame_num: int) -> np.ndarray:
+        """Return a frame as a view into the memory map.
+
+        Big-endian 16-bit pages are byte-swapped into a copy instead, since
+        the processing routines expect native pixels.
+
+        Args:
+            frame_num: Frame number, in the sequence numbering
+
+        Returns:
+            Read-only 2D array
+
+        Raises:
+            IndexError: if the frame is not in the stack
+        """
+        if frame_num not in self:
+            raise IndexError(
+                f"Frame {frame_num} not in stack {self.path} "
+                f"({self.first_frame}-{self.last_frame})"
+            )
+        offset = self._offsets[frame_num - self.first_frame]
+        size = self.frame_shape[0] * self.frame_shape[1] * self.dtype.itemsize
+        page = self._map[offset:offset + size].view(self.dtype)
+        page = page.reshape(self.frame_shape)
+        if not self.dtype.isnative:
+            page = page.astype(self.dtype.newbyteorder("="))
+        return page
+
+    __getitem__ = frame
+
+    def close(self) -> None:
+        """Release the memory map."""
+        mmap = getattr(self._map, "_mmap", None)
+        self._map = None
+        if mmap is not None:
+            mmap.close()
+
+
+class TiffStack(PageStack):
+    """The pages of a multi-page TIFF or BigTIFF file as an image stack.
+
+    Only the page directories are read when the file is opened; the pixels
+    are mapped, not decoded. Reduced-resolution pages (thumbnails) are
+    skipped.
+    """
+
+    def __init__(self, path: Union[str, os.PathLike], first_frame: int = 0):
+        """Open a multi-page TIFF file.
+
+        Args:
+            path: Path to the TIFF file
+            first_frame: Frame number of the first page
+
+        Raises:
+            ValueError: if the file is not a TIFF file, or has pages that are
+                compressed, tiled, not gray 8/16-bit, or differ in size
+        """
+        super().__init__(path, first_frame)
+        buf = self._map
+        order = bytes(buf[:2])
+        if order not in (b"II", b"MM") or len(buf) < 16:
+            raise ValueError(f"{self.path} is not a TIFF file")
+        endian = "<" if order == b"II" else ">"
+
+        version = struct.unpack_from(endian + "H", buf, 2)[0]
+        if version == 42:
+            count_fmt, entry_fmt, offset_fmt, inline = "H", "HHII", "I", 4
+            ifd = struct.unpack_from(endian + "I", buf, 4)[0]
+        elif version == 43:
+            count_fmt, entry_fmt, offset_fmt, inline = "Q", "HHQQ", "Q", 8
+            ifd = struct.unpack_from(endian + "Q", buf, 8)[0]
+        else:
+            raise ValueError(f"{self.path} is not a TIFF file")
+        count_size = struct.calcsize(count_fmt)
+        entry = struct.Struct(endian + entry_fmt)
+
+        visited = set()
+        while ifd and ifd not in visited:
+            visited.add(ifd)
+            n_entries = struct.unpack_from(endian + count_fmt, buf, ifd)[0]
+            tags = {}
+            pos = ifd + count_size
+            for _ in range(n_entries):
+                tag, field_type, count, value = entry.unpack_from(buf, pos)
+                pos += entry.size
+                fmt = _TIFF_TYPES.get(field_type)
+                if fmt is None:
+                    continue
+                size = struct.calcsize(fmt) * count
+                start = pos - inline if size <= inline else value
+                tags[tag] = struct.unpack_from(f"{endian}{count}{fmt}", buf, start)
+            ifd = struct.unpack_from(endian + offset_fmt, buf, pos)[0]
+
+            if tags.get(_TIFF_NEW_SUBFILE_TYPE, (0,))[0] & 1:
+                continue
+            self._add_page(tags, endian)
+
+        if not self._offsets:
+            raise ValueError(f"{self.path} has no image pages")
+
+    def _add_page(self, tags: dict, endian: str) -> None:
+        """Check a page directory and record where its pixels are."""
+        page = len(self._offsets)
+        bits = tags.get(_TIFF_BITS_PER_SAMPLE, (1,))[0]
+        if (
+            tags.get(_TIFF_COMPRESSION, (1,))[0] != 1
+            or _TIFF_TILE_WIDTH in tags
+            or _TIFF_STRIP_OFFSETS not in tags
+            or tags.get(_TIFF_SAMPLES_PER_PIXEL, (1,))[0] != 1
+            or tags.get(_TIFF_SAMPLE_FORMAT, (1,))[0] != 1
+            or bits not in (8, 16)
+        ):
+            raise ValueError(
+                f"{self.path}: page {page} is not an uncompressed 8/16-bit "
+                "gray image in strips and cannot be memory-mapped"
+            )
+
+        shape = (tags[_TIFF_IMAGE_LENGTH][0], tags[_TIFF_IMAGE_WIDTH][0])
+        dtype = np.dtype(f"{endian}u{bits // 8}")
+        if not self._offsets:
+            self.frame_shape, self.dtype = shape, dtype
+        elif (shape, dtype) != (self.frame_shape, self.dtype):
+            raise ValueError(
+                f"{self.path}: page {page} is {dtype} {shape}, "
+                f"expected {self.dtype} {self.frame_shape}"
+            )
+
+        # The strips must follow each other to be mapped as one array
+        offsets = tags[_TIFF_STRIP_OFFSETS]
+        counts = tags.get(_TIFF_STRIP_BYTE_COUNTS)
+        size = shape[0] * shape[1] * dtype.itemsize
+        if counts is not None and len(counts) == len(offsets):
+            contiguous = all(
+                offsets[i] + counts[i] == offsets[i + 1]
+                for i in range(len(offsets) - 1)
+            )
+        else:
+            contiguous = len(offsets) == 1
+        if not contiguous or offsets[0] + size > len(self._map):
+            raise ValueError(
+                f"{self.path}: the strips of page {page} are not contiguous"
+            )
+        self._offsets.append(offsets[0])
+
+
+class RawStack(PageStack):
+    """A headerless raw recording: same-size frames one after the other."""
+
+    def __init__(
+        self,
+        path: Union[str, os.PathLike],
+        frame_shape: Tuple[int, int],
+        dtype=np.uint8,
+        first_frame: int = 0,
+        header_size: int = 0,
+        frame_header_size: int = 0,
+    ):
+        """Open a raw stack file.
+
+        Args:
+            path: Path to the raw file
+            frame_shape: (height, width) of every frame
+            dtype: Pixel type, uint8 or uint16 (little endian)
+            first_frame: Frame number of the first frame in the file
+            header_size: Bytes to skip at the start of the file
+            frame_header_size: Bytes to skip before each frame
+
+        Raises:
+            ValueError: for an unsupported pixel type
+        """
+        super().__init__(path, first_frame)
+        self.dtype = np.dtype(dtype).newbyteorder("<")
+        if self.dtype not in _DTYPE_CODES:
+            raise ValueError(f"Unsupported stack pixel type: {self.dtype}")
+        self.frame_shape = tuple(frame_shape)
+
+        size = self.frame_shape[0] * self.frame_shape[1] * self.dtype.itemsize
+        stride = frame_header_size + size
+        n_frames = max(0, (len(self._map) - header_size) // stride)
+        self._offsets = [
+            header_size + i * stride + frame_header_size for i in range(n_frames)
+        ]
+
+
+def open_page_stack(
+    path: str,
+    first_frame: int = 0,
+    frame_shape: Optional[Tuple[int, int]] = None,
+    raw_dtype=np.uint8,
+    raw_header_size: int = 0,
+    raw_frame_header_size: int = 0,
+) -> PageStack:
+    """Open a multi-page TIFF or raw file as an image stack.
+
+    Args:
+        path: TIFF or raw file name (see ``is_page_stack``)
+        first_frame: Frame number of the first page
+        frame_shape: (height, width) of the frames, needed for raw files
+        raw_dtype, raw_header_size, raw_frame_header_size: Layout of raw
+            files, see ``RawStack``
+
+    Returns:
+        A TiffStack or RawStack
+
+    Raises:
+        ValueError: if the file cannot be mapped as a stack
+    """
+    if path.lower().endswith(TIFF_SUFFIXES):
+        return TiffStack(path, first_frame)
+    if frame_shape is None:
+        raise ValueError(f"{path}: the frame size of raw stacks must be given")
+    return RawStack(
+        path, frame_shape, raw_dtype, first_frame, raw_header_size,
+        raw_frame_header_size,
+    )
+
+
+def create_image_stack(
+    path: Union[str, os.PathLike],
+    first_frame: int,
+    n_frames: int,
+    frame_shape: Tuple[int, int],
+    dtype=np.uint8,
+    source_mtime: Optional[float] = None,
+    native_depth: Optional[bool] = None,
+) -> ImageStack:
+    """Create an empty stack file and open it for writing.
+
+    Args:
+        path: Path of the new stack file (overwritten if it exists)
+        first_frame: Number of the first frame
+        n_frames: Number of frames in the stack
+        frame_shape: (height, width) of every frame
+        dtype: uint8 or uint16
+        source_mtime: Newest modification time of the images the frames are
+            made from, if any
+        native_depth: Whether the frames keep the depth of those images, or
+            were converted to 8 bits; None if unknown
+
+    Returns:
+        The new stack, opened in ``r+`` mode
+    """
+    dtype = np.dtype(dtype).newbyteorder("<")
+    if dtype not in _DTYPE_CODES:
+        raise ValueError(f"Unsupported stack pixel type: {dtype}")
+
+    depth = _DEPTH_UNKNOWN
+    if native_depth is not None:
+        depth = _DEPTH_NATIVE if native_depth else _DEPTH_8BIT
+    height, width = frame_shape
+    header = _HEADER.pack(
+        _MAGIC, _DTYPE_CODES[dtype], first_frame, n_frames, height, width,
+        source_mtime or 0.0, depth,
+    )
+    with open(path, "wb") as f:
+        f.write(header.ljust(HEADER_SIZE, b"\0"))
+        f.truncate(HEADER_SIZE + n_frames * height * width * dtype.itemsize)
+
+    return ImageStack(path, mode="r+")
+
+
+def convert_sequence(
+    base_name: str,
+    first_frame: int,
+    last_frame: int,
+    path: Optional[str] = None,
+    native_depth: bool = True,
+) -> str:
+    """Convert the per-frame image files of one camera to an image stack.
+
+    The first image sets the frame size and pixel type. With native depth,
+    16-bit images give a 16-bit stack, which can be used with and without
+    native depth processing. The newest modification time of the images
+    and their depth are recorded, so that ``open_stacks`` can tell when the
+    stack no longer matches them.
+
+    Args:
+        base_name: printf-style image base name, e.g. ``img/cam1.%d``
+        first_frame, last_frame: Frame range to convert (inclusive)
+        path: Output file (default: ``stack_path(base_name)``)
+        native_depth: Keep 16-bit images in their depth, rather than convert
+            them to 8 bits
+
+    Returns:
+        Path of the written stack
+
+    Raises:
+        ValueError: if the images differ in size or pixel type
+    """
+    if path is None:
+        path = stack_path(base_name)
+
+    def reader(frame_num):
+        img = read_image_native(base_name % frame_num)
+        return img if native_depth else img_as_ubyte(img)
+
+    # Taken before reading, so that images changed meanwhile make it stale
+    source_mtime = _newest_mtime(base_name, first_frame, last_frame)
+    first = reader(first_frame)
+    stack = create_image_stack(
+        path, first_frame, last_frame - first_frame + 1, first.shape,
+        first.dtype, source_mtime, native_depth,
+    )
+    try:
+        stack.data[0] = first
+        for frame_num in range(first_frame + 1, last_frame + 1):
+            img = reader(frame_num)
+            if img.shape != first.shape or img.dtype != first.dtype:
+                raise ValueError(
+                    f"{base_name % frame_num}: expected {first.dtype} "
+                    f"{first.shape}, got {img.dtype} {img.shape}"
+                )
+            stack.data[frame_num - first_frame] = img
+        stack.flush()
+    finally:
+        stack.close()
+
+    return path
+
+
+def _newest_mtime(base_name: str, first_frame: int, last_frame: int) -> float:
+    """Return the newest modification time of the existing images in a
+    frame range, or 0 if there are none."""
+    newest = 0.0
+    for frame_num in range(first_frame, last_frame + 1):
+        try:
+            newest = max(newest, os.path.getmtime(base_name % frame_num))
+        except OSError:
+            pass
+    return newest
+
+
+def _check_stack(stack: ImageStack, base_name: str, native_depth: bool = False):
+    """Check that a stack still matches the images it was converted from.
+
+    Images deleted after the conversion do not matter. For stacks that do
+    not record the modification time of their images, the time the stack
+    file was written is taken instead.
+
+    Args:
+        stack: Stack next to ``base_name``
+        base_name: printf-style image base name of the camera
+        native_depth: Whether the images are processed in their native depth
+
+    Raises:
+        ValueError: if an image changed after the conversion, or native depth
+            is asked for and the stack holds frames converted to 8 bits
+    """
+    if native_depth and stack.native_depth is False:
+        raise ValueError(
+            f"{stack.path} holds images converted to 8 bits, but native "
+            "depth is on"
+        )
+    converted = stack.source_mtime or os.path.getmtime(stack.path)
+    if _newest_mtime(base_name, stack.first_frame, stack.last_frame) > converted:
+        raise ValueError(
+            f"{stack.path} is older than the images of {base_name}; "
+            "convert them again"
+        )
+
+
+def open_stacks(
+    base_names: Sequence[Optional[str]],
+    first_frame: int = 0,
+    frame_shape: Optional[Tuple[int, int]] = None,
+    raw_dtype=np.uint8,
+    raw_header_size: int = 0,
+    raw_frame_header_size: int = 0,
+    native_depth: bool = False,
+) -> List[Optional[Union[ImageStack, PageStack]]]:
+    """Open the image stacks of all cameras that have one.
+
+    A camera has a stack if its base name names a multi-page TIFF or raw file
+    (see ``is_page_stack``), or if a stack file exists next to its base name
+    (see ``stack_path``) and still matches the images (see ``_check_stack``).
+
+    Args:
+        base_names: Per-camera image base names
+        first_frame: Frame number of the first page of multi-page files
+        frame_shape, raw_dtype, raw_header_size, raw_frame_header_size:
+            Layout of raw files, see ``RawStack``
+        native_depth: Whether the images are processed in their native depth
+
+    Returns:
+        A list with a stack for each camera that has one, and None for the
+        others.
+    """
+    stacks = []
+    for base_name in base_names:
+        stack = None
+        try:
+            if is_page_stack(base_name):
+                stack = open_page_stack(
+                    base_name, first_frame, frame_shape, raw_dtype,
+                    raw_header_size, raw_frame_header_size,
+                )
+            elif base_name and os.path.exists(stack_path(base_name)):
+                stack = ImageStack(stack_path(base_name))
+                try:
+                    _check_stack(stack, base_name, native_depth)
+                except ValueError:
+                    stack.close()
+                    raise
+        except (OSError, ValueError) as e:
+            print(f"Ignoring image stack: {e}")
+            stack = None
+        stacks.append(stack)
+    return stacks
+
+
+def main(argv=None):
+    """Convert per-frame image files to image stacks from the command line."""
+    parser = argparse.ArgumentParser(
+        description="Convert per-frame image files to memory-mapped image stacks"
+    )
+    parser.add_argument("base_names", nargs="+",
+                        help="printf-style image base names, e.g. img/cam1.%%d")
+    parser.add_argument("first", type=int, help="First frame number")
+    parser.add_argument("last", type=int, help="Last frame number")
+    parser.add_argument("--8bit", dest="eight_bit", action="store_true",
+                        help="Convert 16-bit images to 8 bits")
+    args = parser.parse_args(argv)
+
+    for base_name in args.base_names:
+        path = convert_sequence(
+            base_name, args.first, args.last, native_depth=not args.eight_bit
+        )
+        print(f"Wrote {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,22 +5,92 @@
 #define IMAGE_PROCESSING_C
 
 #include "parameters.h"
+#include "tile_mask.h"
 
 typedef double filter_t[3][3];
 
+/* A 3x3 filter prepared for repeated application, see filter_kernel_init() */
+typedef struct {
+    filter_t filt;      /* the matrix as given */
+    double sum;         /* normalization: sum of all elements */
+    int min_val;        /* minimal brightness of filtered pixels */
+    int integer;        /* nonzero if all elements are integers */
+    int ifilt[3][3];    /* integer elements, if integer */
+    int isum;
+    int separable;      /* nonzero if ifilt[i][j] == col[i]*row[j] */
+    int row[3], col[3];
+} filter_kernel;
+
+/* Row-by-row producer of the highpass image, see highpass_stream_init() */
+typedef struct {
+    unsigned char *img;
+    int filt_span, imx, imy;
+    int ring_len;       /* number of row sums kept */
+    int *row_accum;     /* ring of box-blur row sums */
+    int *col_accum;     /* running column sums */
+    int next_row;       /* next highpass row to produce */
+    int next_sum;       /* next row whose sums are to be computed */
+} highpass_stream;
+
+/* Number of ints in the scratch buffer of a highpass_stream */
+#define HIGHPASS_STREAM_ACCUM_LEN(cpar, dim_lp) \
+    ((cpar)->imx * (2*(dim_lp) + 3))
+
+/* Fixed-point position of the gain maps of flat_field_correct(): a gain of
+   1 is 1 << FLAT_FIELD_SHIFT, and the largest gain is just under 16. */
+#define FLAT_FIELD_SHIFT 12
+
+/* Number of ints in the scratch buffer of fast_box_blur_buf() */
+#define BOX_BLUR_ACCUM_LEN(cpar) ((cpar)->imx * ((cpar)->imy + 1))
+
 int filter_3(unsigned char *img, unsigned char *img_lp, filter_t filt,
     control_par *cpar);
 void lowpass_3(unsigned char *img, unsigned char *img_lp, control_par *cpar);
+int filter_kernel_init(filter_kernel *kern, filter_t filt, int min_val);
+int read_filter_kernel(filter_kernel *kern, char *filter_file);
+void lowpass_kernel(filter_kernel *kern);
+void apply_filter_kernel(unsigned char *img, unsigned char *img_out,
+    filter_kernel *kern, int *scratch, control_par *cpar);
 int fast_box_blur(int filt_span, unsigned char *src, unsigned char *dest, 
     control_par *cpar);
+void fast_box_blur_buf(int filt_span, unsigned char *src, unsigned char *dest,
+    int *accum, control_par *cpar);
+int highpass_stream_init(highpass_stream *hs, unsigned char *img, int dim_lp,
+    int *accum, control_par *cpar);
+int highpass_stream_next(highpass_stream *hs, unsigned char *row_out);
 void split(unsigned char *img, int half_selector, control_par *cpar);
 void subtract_img(unsigned char *img1, unsigned char *img2, unsigned char *img_new, 
     control_par *cpar);
+void flat_field_correct(unsigned char *img, unsigned char *img_out, 
+    unsigned char *dark, unsigned short *gain, control_par *cpar);
 void subtract_mask(unsigned char *img1, unsigned char *img_mask, unsigned char *img_new, 
     control_par *cpar);
 void copy_images(unsigned char	*img1, unsigned char *img2, control_par *cpar);
 int prepare_image(unsigned char  *img, unsigned char  *img_hp, int dim_lp,
     int filter_hp, char *filter_file, control_par *cpar);
+int prepare_image_buf(unsigned char *img, unsigned char *img_hp, 
+    unsigned char *img_lp, int *accum, int dim_lp, int filter_hp, 
+    filter_kernel *kern, control_par *cpar);
+int prepare_image_tiles(unsigned char *img, unsigned char *img_hp, 
+    unsigned char *img_lp, unsigned char *img_sub, int *accum, int dim_lp, 
+    int filter_hp, filter_kernel *kern, tile_mask *mask, control_par *cpar);
+
+/* 16-bit versions, with gray values in the camera's native units */
+void apply_filter_kernel_u16(unsigned short *img, unsigned short *img_out,
+    filter_kernel *kern, int *scratch, control_par *cpar);
+void fast_box_blur_buf_u16(int filt_span, unsigned short *src, 
+    unsigned short *dest, int *accum, control_par *cpar);
+void split_u16(unsigned short *img, int half_selector, control_par *cpar);
+void subtract_img_u16(unsigned short *img1, unsigned short *img2, 
+    unsigned short *img_new, control_par *cpar);
+void flat_field_correct_u16(unsigned short *img, unsigned short *img_out,
+    unsigned short *dark, unsigned short *gain, control_par *cpar);
+int prepare_image_buf_u16(unsigned short *img, unsigned short *img_hp, 
+    unsigned short *img_lp, int *accum, int dim_lp, int filter_hp, 
+    filter_kernel *kern, control_par *cpar);
+int prepare_image_tiles_u16(unsigned short *img, unsigned short *img_hp, 
+    unsigned short *img_lp, unsigned short *img_sub, int *accum, int dim_lp, 
+    int filter_hp, filter_kernel *kern, tile_mask *mask, control_par *cpar);
 
 #endif
 
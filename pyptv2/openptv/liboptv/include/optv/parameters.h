@@ -70,6 +70,10 @@ control_par * new_control_par(int cams);
 control_par * read_control_par(char *filename);
 void free_control_par(control_par *cp);
 
+/* Target recognition engines, see targ_rec() */
+#define TARG_REC_GROW 0         /* region growing from each peak */
+#define TARG_REC_UNION_FIND 1   /* two-pass connected component labeling */
+
 /* Parameters for target recognition */
 typedef struct {
     int discont;
@@ -79,9 +83,11 @@ typedef struct {
     int nymin, nymax;
     int sumg_min;
     int cr_sz;
+    int engine;     /* TARG_REC_GROW or TARG_REC_UNION_FIND */
 } target_par;
 
-/* Reads target recognition parameters from file.
+/* Reads target recognition parameters from file. The engine is an optional
+ * last line, TARG_REC_GROW if missing.
  * Parameter: filename - the absolute/relative path to file from which the parameters will be read.
  * Returns: pointer to a new target_par structure. */
 target_par* read_target_par(char *filename);
@@ -12,6 +12,7 @@
 
 #include "tracking_frame_buf.h"
 #include "parameters.h" 
+#include "tile_mask.h"
 #include <stdlib.h>
 
 
@@ -25,6 +26,38 @@ typedef struct
 }
 peak;
 
+/* A growable array of targets. Routines filling one realloc() pix as 
+   needed, so it must be heap memory or NULL; cap is its length. */
+typedef struct {
+    target *pix;
+    int cap;
+} target_list;
+
+int target_list_reserve(target_list *targs, int num);
+
+/* Detection statistics gathered while searching, see targ_rec_buf(). The 
+   histograms count the accepted targets: pixel counts and extents with one 
+   bin per value, the last bin holding all values from TARG_STATS_BINS - 1 
+   up; grey value sums by powers of two, bin k holding the sums from 2^k to 
+   2^(k+1) - 1 (bin 0 also holds 0). Rejected blobs are counted under the 
+   first limit they fail, indexed by TARG_REJECT_*. */
+#define TARG_STATS_BINS 64
+#define TARG_STATS_SUMG_BINS 32
+
+#define TARG_REJECT_BORDER 0        /* touches the search area border */
+#define TARG_REJECT_PIXEL_COUNT 1
+#define TARG_REJECT_XSIZE 2
+#define TARG_REJECT_YSIZE 3
+#define TARG_REJECT_SUM_GREY 4
+#define TARG_REJECT_KINDS 5
+
+typedef struct {
+    int n[TARG_STATS_BINS], nx[TARG_STATS_BINS], ny[TARG_STATS_BINS];
+    int sumg[TARG_STATS_SUMG_BINS];
+    int rejected[TARG_REJECT_KINDS];
+} targ_stats;
+
+void targ_stats_add(targ_stats *total, targ_stats *part);
 
 
 int peak_fit(unsigned char *img, target_par *targ_par, 
@@ -35,6 +68,48 @@ void check_touch (peak *tpeak, int p1, int p2);
 
 int targ_rec (unsigned char *img, target_par *targ_par, int xmin, 
 int xmax, int ymin, int ymax, control_par *cpar, int num_cam, target pix[]);
+
+int targ_rec_tiles (unsigned char *img, target_par *targ_par, int xmin, 
+    int xmax, int ymin, int ymax, control_par *cpar, int num_cam, 
+    tile_mask *mask, target pix[]);
+
+int targ_rec_u16 (unsigned short *img, target_par *targ_par, int xmin, 
+    int xmax, int ymin, int ymax, control_par *cpar, int num_cam, 
+    target pix[]);
+
+int targ_rec_tiles_u16 (unsigned short *img, target_par *targ_par, int xmin, 
+    int xmax, int ymin, int ymax, control_par *cpar, int num_cam, 
+    tile_mask *mask, target pix[]);
+
+int targ_rec_buf (unsigned char *img, target_par *targ_par, int xmin, 
+    int xmax, int ymin, int ymax, control_par *cpar, int num_cam, 
+    tile_mask *mask, unsigned char *img0, unsigned char **rows, 
+    targ_stats *stats, target_list *targs);
+
+int targ_rec_buf_u16 (unsigned short *img, target_par *targ_par, int xmin, 
+    int xmax, int ymin, int ymax, control_par *cpar, int num_cam, 
+    tile_mask *mask, unsigned short *img0, unsigned short **rows, 
+    targ_stats *stats, target_list *targs);
+
+int targ_rec_parallel (unsigned char *img, target_par *targ_par, int xmin, 
+    int xmax, int ymin, int ymax, control_par *cpar, int num_cam, 
+    tile_mask *mask, int num_strips, targ_stats *stats, target_list *targs);
+
+int targ_rec_parallel_u16 (unsigned short *img, target_par *targ_par, 
+    int xmin, int xmax, int ymin, int ymax, control_par *cpar, int num_cam, 
+    tile_mask *mask, int num_strips, targ_stats *stats, target_list *targs);
+
+int targ_rec_labels (unsigned char *img, target_par *targ_par, int xmin, 
+    int xmax, int ymin, int ymax, control_par *cpar, int num_cam, 
+    tile_mask *mask, int *labels, target_list *targs);
+
+int targ_rec_labels_u16 (unsigned short *img, target_par *targ_par, 
+    int xmin, int xmax, int ymin, int ymax, control_par *cpar, int num_cam, 
+    tile_mask *mask, int *labels, target_list *targs);
+
+int targ_rec_highpass(unsigned char *img, int dim_lp, target_par *targ_par, 
+    int xmin, int xmax, int ymin, int ymax, control_par *cpar, int num_cam, 
+    target_list *targs);
     
 
 #endif
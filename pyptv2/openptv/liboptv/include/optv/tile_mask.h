@@ -0,0 +1,47 @@
+/* Tile masks: coarse per-camera maps of the image regions worth processing,
+   so that preprocessing and target recognition can skip dead areas. A tile 
+   mask may carry a pixel-exact static mask, as run-length spans. */
+
+#ifndef TILE_MASK_H
+#define TILE_MASK_H
+
+#include "parameters.h"
+#include "calibration.h"
+
+/* Static camera mask, e.g. of reflections or parts of the setup in view:
+   for each image row, the spans of pixels to process. */
+typedef struct {
+    int imx, imy;        /* image size the mask applies to */
+    int *row_start;      /* imy+1 entries; spans of row y are row_start[y] 
+                            to row_start[y+1] - 1 */
+    int *spans;          /* (x0, x1) pairs, x1 exclusive, sorted and disjoint
+                            within a row */
+} span_mask;
+
+typedef struct {
+    int imx, imy;        /* image size the mask applies to */
+    int tile_size;       /* side of a square tile, pixels */
+    int ntx, nty;        /* number of tiles in x, y */
+    unsigned char *live; /* nty*ntx flags, row-major; nonzero for live tiles */
+    span_mask *spans;    /* static mask within the live tiles, or NULL. Not 
+                            owned by the tile mask. */
+} tile_mask;
+
+span_mask *span_mask_from_image(unsigned char *mask_img, int imx, int imy);
+void span_mask_free(span_mask *spans);
+int span_mask_live_pixels(span_mask *spans);
+
+tile_mask *tile_mask_new(int imx, int imy, int tile_size);
+void tile_mask_free(tile_mask *mask);
+void tile_mask_set_rect(tile_mask *mask, int xmin, int xmax, int ymin, int ymax,
+    int live);
+void tile_mask_dilate(tile_mask *mask, int tiles);
+int tile_mask_next_run(tile_mask *mask, int ty, int *tx, int *x0, int *x1);
+int tile_mask_live_tiles(tile_mask *mask);
+int tile_mask_set_spans(tile_mask *mask, span_mask *spans);
+int tile_mask_next_span(tile_mask *mask, int y, int *cursor, int *x0, int *x1);
+int tile_mask_live_pixel(tile_mask *mask, int x, int y);
+void tile_mask_from_volume(tile_mask *mask, Calibration *cal, 
+    control_par *cpar, volume_par *vpar);
+
+#endif
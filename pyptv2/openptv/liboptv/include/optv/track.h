@@ -17,7 +17,8 @@
  
  Note that MAX_TARGETS is taken from the global M, but I want a separate
  definition because the fb created here should be local, not used outside
- this file.
+ this file. It is only the initial size of the frames, which grow to the
+ particles and targets they get (see frame_grow()).
  
  MAX_CANDS is the max number of candidates sought in search volume for next
  link.
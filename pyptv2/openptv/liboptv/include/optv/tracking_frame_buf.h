@@ -25,9 +25,18 @@ target;
 
 int compare_targets(target *t1, target *t2);
 int read_targets(target buffer[], char* file_base, int frame_num);
+int read_targets_max(target buffer[], int max_targets, char* file_base, 
+    int frame_num);
+int read_targets_alloc(target **buffer, int *max_targets, char* file_base, 
+    int frame_num);
 int write_targets(target buffer[], int num_targets, char* file_base, \
     int frame_num);
 
+/* First bytes of a binary _targets file, see write_targets_bin(). */
+#define TARGETS_BIN_MAGIC "PTVTRG01"
+int write_targets_bin(target buffer[], int num_targets, char* file_base, \
+    int frame_num);
+
 typedef struct
 {
   int nr;
@@ -75,6 +84,7 @@ typedef struct {
 } frame;
 
 void frame_init(frame *new_frame, int num_cams, int max_targets);
+int frame_grow(frame *self, int max_targets);
 void free_frame(frame *self);
 int read_frame(frame *self, char *corres_file_base, char *linkage_file_base,
     char *prio_file_base, char **target_file_base, int frame_num);
@@ -113,6 +123,10 @@ int write_frame(frame *self, char *corres_file_base, char *linkage_file_base,
  * Note: fb_disk_free does not release the strings it holds, as I don't remember if
  * it owns them. 
  * 
+ * A second child class, framebuf_mem, keeps the frames in memory instead, so
+ * that tracking needs no files. Frames are put into it before a run with 
+ * fb_mem_put_frame() and taken out after it with fb_mem_get_frame().
+ * 
  * Yes, in C++ it's easier :)
  */
 
@@ -160,4 +174,35 @@ void fb_disk_free(framebuf_base *self);
 int fb_disk_read_frame_at_end(framebuf_base *self, int frame_num, int read_links);
 int fb_disk_write_frame_from_start(framebuf_base *self, int frame_num);
 
+// child class that keeps frames in memory, spilling to files over a budget.
+#define SPILL_DIR_MAX_LEN (STR_MAX_LEN - 32) /* room for "/fb<id>.frame.<int>" */
+#define SPILL_MAX_BUFFERS 1000 /* buffers that may share a spill directory */
+
+typedef struct {
+    int frame_num;
+    char *record; /* packed frame data, NULL if spilled */
+    long size;    /* bytes in the record */
+} fb_mem_entry;
+
+typedef struct {
+    framebuf_base base; // must be 1st member.
+    
+    fb_mem_entry *entries; /* sorted by frame number */
+    int num_entries, max_entries;
+    long mem_bytes, max_bytes; /* held in memory, and the budget; 0 for none */
+    char *spill_dir;           /* owned copy, or NULL to never spill */
+    int spill_id;              /* claimed in spill_dir, names the files */
+} framebuf_mem;
+
+void fb_mem_init(framebuf_mem *new_buf, int buf_len, int num_cams, 
+    int max_targets, long max_bytes, char *spill_dir);
+int fb_mem_put_frame(framebuf_mem *self, frame *frm, int frame_num);
+int fb_mem_get_frame(framebuf_mem *self, frame *frm, int frame_num, 
+    int read_links);
+int fb_mem_num_spilled(framebuf_mem *self);
+
+void fb_mem_free(framebuf_base *self);
+int fb_mem_read_frame_at_end(framebuf_base *self, int frame_num, int read_links);
+int fb_mem_write_frame_from_start(framebuf_base *self, int frame_num);
+
 #endif
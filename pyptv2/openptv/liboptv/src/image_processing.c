@@ -4,11 +4,15 @@
  *
  * Routines contained:    	
  *   filter_3:	3*3 filter, reads matrix from filter.par
+ *   filter_kernel_init, apply_filter_kernel: reusable, separable 3*3 filters
+ *   *_u16: 16-bit versions of the highpass routines, see image_processing_px.h
  *
  ***************************************************************************/
 
 #include <stdlib.h>
 #include <stdio.h>
+#include <math.h>
+#include <string.h>
 #include "image_processing.h"
 
 /*  This would be a function, only the original writer of these filters put a 
@@ -109,6 +113,142 @@ void lowpass_3(unsigned char *img, unsigned char *img_lp, control_par *cpar) {
 }
 
 
+/*  Greatest common divisor of two non-negative integers. */
+static int gcd(int a, int b) {
+    int t;
+    while (b != 0) {
+        t = a % b;
+        a = b;
+        b = t;
+    }
+    return a;
+}
+
+/*  filter_kernel_init() prepares a 3x3 filter matrix for repeated use by
+    apply_filter_kernel(). Integer matrices are kept in integer form, and 
+    integer matrices of rank 1 are split into a column and a row vector, so
+    that they can be applied as two 1-D passes.
+    
+    Arguments:
+    filter_kernel *kern - the kernel to fill in.
+    filter_t filt - the 3x3 matrix.
+    int min_val - minimal brightness of filtered pixels; filter_3() uses 8,
+        lowpass_3() uses 0.
+    
+    Returns:
+    0 if the filter is bad (all elements sum to zero), 1 otherwise.
+*/
+int filter_kernel_init(filter_kernel *kern, filter_t filt, int min_val) {
+    int i, j, i0 = -1, j0 = -1, g;
+    
+    kern->sum = 0;
+    kern->integer = 1;
+    kern->separable = 0;
+    kern->min_val = min_val;
+    
+    for (i = 0; i < 3; i++) {
+        for (j = 0; j < 3; j++) {
+            kern->filt[i][j] = filt[i][j];
+            kern->sum += filt[i][j];
+            
+            if (filt[i][j] != floor(filt[i][j]) || fabs(filt[i][j]) > 65535)
+                kern->integer = 0;
+        }
+    }
+    if (kern->sum == 0) return 0;
+    if (!kern->integer) return 1;
+    
+    kern->isum = (int) kern->sum;
+    for (i = 0; i < 3; i++) {
+        for (j = 0; j < 3; j++) {
+            kern->ifilt[i][j] = (int) filt[i][j];
+            if (i0 < 0 && kern->ifilt[i][j] != 0) {
+                i0 = i;
+                j0 = j;
+            }
+        }
+    }
+    
+    /* Rank-1 check: take the first nonzero row divided by the GCD of its 
+       elements as the row vector, then every row must be an integer multiple
+       of it. */
+    g = gcd(gcd(abs(kern->ifilt[i0][0]), abs(kern->ifilt[i0][1])), 
+        abs(kern->ifilt[i0][2]));
+    for (j = 0; j < 3; j++)
+        kern->row[j] = kern->ifilt[i0][j] / g;
+    
+    for (i = 0; i < 3; i++) {
+        if (kern->ifilt[i][j0] % kern->row[j0] != 0) return 1;
+        kern->col[i] = kern->ifilt[i][j0] / kern->row[j0];
+        
+        for (j = 0; j < 3; j++)
+            if (kern->col[i] * kern->row[j] != kern->ifilt[i][j]) return 1;
+    }
+    kern->separable = 1;
+    return 1;
+}
+
+/*  read_filter_kernel() reads a 3x3 filter matrix from a text file (one line 
+    per row, white-space separated columns) and prepares it with 
+    filter_kernel_init(), with the minimal brightness of filter_3().
+    
+    Arguments:
+    filter_kernel *kern - the kernel to fill in.
+    char *filter_file - path to the filter file.
+    
+    Returns:
+    0 if the file can't be read or the filter is bad, 1 otherwise.
+*/
+int read_filter_kernel(filter_kernel *kern, char *filter_file) {
+    int i;
+    FILE *fp;
+    filter_t filt;
+    
+    fp = fopen (filter_file, "r");
+    if (fp == NULL) return 0;
+    
+    for (i = 0; i < 9; i++) {
+        if (fscanf(fp, "%lf", (double *)filt + i) != 1) {
+            fclose(fp);
+            return 0;
+        }
+    }
+    fclose (fp);
+    
+    return filter_kernel_init(kern, filt, 8);
+}
+
+/*  lowpass_kernel() fills in the 3x3 averaging kernel of lowpass_3(). */
+void lowpass_kernel(filter_kernel *kern) {
+    filter_t filt = {{1, 1, 1}, {1, 1, 1}, {1, 1, 1}};
+    filter_kernel_init(kern, filt, 0);
+}
+
+/* Routines generic in the pixel type, for 8-bit and 16-bit images. */
+#define PIXEL unsigned char
+#define PIXEL_MAX 255
+#define PIXEL_FN(name) name
+/* filter_3() keeps the weighted sum and the quotient in an unsigned short,
+   so out of range values wrap around before they are clipped. */
+#define FILTER_QUOTIENT(total, sum) \
+    ((unsigned short) (int) ((unsigned short) (total) / (sum)))
+#include "image_processing_px.h"
+#undef PIXEL
+#undef PIXEL_MAX
+#undef PIXEL_FN
+#undef FILTER_QUOTIENT
+
+#define PIXEL unsigned short
+#define PIXEL_MAX 65535
+#define PIXEL_FN(name) name ## _u16
+#define FILTER_QUOTIENT(total, sum) ((int) ((total) / (sum)))
+#include "image_processing_px.h"
+#undef PIXEL
+#undef PIXEL_MAX
+#undef PIXEL_FN
+#undef FILTER_QUOTIENT
+
+
 /*  fast_box_blur() performs a box blur of an image using a given kernel size.
     It is equivalent to using an all-ones kernel of the given size in a 
     function like filter_3 (but adjusted to size). However, this algorithm runs
@@ -126,6 +266,8 @@ void lowpass_3(unsigned char *img, unsigned char *img_lp, control_par *cpar) {
     Returns:
     0 on failure (due to memory allocation error), 1 on success.
     
+    See also fast_box_blur_buf() for a version that does not allocate.
+    
     References:
     [1] http://www.filtermeister.com/tutorials/blur01.html
     [2] http://www.gamasutra.com/view/feature/131511/four_tricks_for_fast_blurring_in_.php
@@ -133,173 +275,126 @@ void lowpass_3(unsigned char *img, unsigned char *img_lp, control_par *cpar) {
 int fast_box_blur(int filt_span, unsigned char *src, unsigned char *dest, 
     control_par *cpar) 
 {
-    register unsigned char  *ptrl, *ptrr, *ptrz;
-    register int *ptr, *ptr1, *ptr2, *ptr3;
-    int *row_accum, *col_accum, accum, *end;
-    int row_start, n, nq, m;
-    register int i;
-    int image_size = cpar->imx * cpar->imy;
-    
-    n = 2*filt_span + 1;
-    nq = n*n;
-    
-    if ((row_accum = (int *)calloc(image_size, sizeof(int))) == NULL) return 0;
-    if ((col_accum = (int *)calloc(cpar->imx, sizeof(int))) == NULL) return 0;
-    
-    /* Sum over lines first [1]: */
-    for (i = 0; i < cpar->imy; i++) {
-        row_start = i * cpar->imx;
-        
-        /* first element has no filter around him */
-        accum = *(src + row_start);
-        *(row_accum + row_start) = accum * n;
-        
-        /* Elements 1..filt_span have a growing filter, as much as fits.
-           Each iteration increases the filter symmetrically, so 2 new elements 
-           are taken.
-        */
-        for (ptr = row_accum + row_start + 1, 
-            ptrr = src + row_start + 2, ptrl = ptrr - 1, m = 3;
-            ptr < row_accum + row_start + 1 + filt_span;
-            ptr++, ptrl+=2, ptrr+=2, m+=2) 
-        {    
-            accum += (*ptrl + *ptrr);
-            *ptr = accum * n / m; /* So small filters have same weight as
-                                         the largest size */
-        }
-        
-        /* Middle elements, having a constant-size filter. The sum is obtained
-           by adding the coming element and dropping the leaving element, in a 
-           sliding window fashion. 
-        */
-        for (ptr = row_accum + row_start + filt_span + 1,
-            ptrl = src + row_start, ptrr = src + row_start + n;
-            ptrr < src + row_start + cpar->imx;
-            ptrl++, ptr++, ptrr++)
-        {
-            accum += (*ptrr - *ptrl);
-            *ptr = accum;
-        }
-        
-        /* last elements in line treated like first ones, mutatis mutandis */
-        for (ptrl = src + row_start + cpar->imx - n,
-            ptrr = ptrl + 1, m = n - 2,
-            ptr = row_accum + row_start + cpar->imx - filt_span;
-            ptr < row_accum + row_start + cpar->imx;
-            ptrl += 2, ptrr += 2, ptr++, m-=2)
-        {
-            accum -= (*ptrl + *ptrr);
-            *ptr = accum * n / m;
-        }
-    }
-    
-    /* Sum over columns: */
-    
-    end = col_accum + cpar->imx;
-    
-    /* first line */
-    for (ptr1 = row_accum, ptr2 = col_accum, ptrz = dest; 
-        ptr2 < end; ptr1++, ptr2++, ptrz++)
-    {
-       *ptr2 = *ptr1;
-       *ptrz = *ptr2/n;
-    }
-    
-    /* Sum vertically the accumulated row values for lines 1 ... filt_span */
-    for (i = 1; i <= filt_span; i++) {
-        ptr1 = row_accum + (2*i - 1)*cpar->imx;
-        ptr2 = ptr1 + cpar->imx;
-        ptrz = dest + i*cpar->imx;
-        
-        for (ptr3 = col_accum; ptr3 < end; ptr1++, ptr2++, ptr3++, ptrz++) {
-            *ptr3 += (*ptr1 + *ptr2);
-            *ptrz = n * (*ptr3) / nq / (2*i + 1);
-        }
-    }
+    int *accum;
     
-    /* Middle lines with filter-size lines around them */
-    for (i = filt_span + 1, ptr1 = row_accum, 
-        ptrz = dest + cpar->imx*(filt_span + 1),
-        ptr2 = row_accum + cpar->imx*n; i < cpar->imy - filt_span; i++)
-    {
-        for (ptr3 = col_accum; ptr3 < end; ptr3++, ptr1++, ptrz++, ptr2++) {
-           *ptr3 += (*ptr2 - *ptr1);
-           *ptrz = *ptr3/nq;
-        }
-    }
-    
-    /* Last lines, similarly to first lines */
-    for (i = filt_span; i > 0; i--) {
-        ptr1 = row_accum + (cpar->imy - 2*i - 1)*cpar->imx;
-        ptr2 = ptr1 + cpar->imx;
-        ptrz = dest + (cpar->imy-i)*cpar->imx;
-        
-        for (ptr3 = col_accum; ptr3 < end; ptr1++, ptr2++, ptr3++, ptrz++) {
-            *ptr3 -= (*ptr1 + *ptr2);
-            *ptrz = n * (*ptr3) / nq / (2*i+1);
-        }
-    }
+    accum = (int *) malloc(BOX_BLUR_ACCUM_LEN(cpar) * sizeof(int));
+    if (accum == NULL) return 0;
     
-    /* ``dest`` now contains result. Finish up. */
-    free(row_accum);
-    free(col_accum);
+    fast_box_blur_buf(filt_span, src, dest, accum, cpar);
+    free(accum);
     
     return 1;
 }
 
-
-/*  split() crams into the first half of a given image either its even or odd 
-    lines. Used with interlaced cameras, a mostly obsolete device.
-    The lower half of the image is set to the number 2.
+/*  highpass_stream_init() prepares to produce the rows of the highpass image
+    of prepare_image() (with filter_hp = 0 and no field splitting) one at a 
+    time, from top to bottom, without ever holding the whole lowpass image.
+    Only the 2*dim_lp + 2 most recent row sums of the box blur are kept. Each
+    row equals the corresponding row of subtract_img(img, fast_box_blur(img)).
     
     Arguments:
-    unsigned char *img - the image to modify. Both input and output.
-    int half_selector - 0 to do nothing, 1 to take odd rows, 2 for even rows
+    highpass_stream *hs - the stream state to initialize.
+    unsigned char *img - the image to filter. Must stay valid while the 
+        stream is used.
+    int dim_lp - half-width of the box blur, see prepare_image().
+    int *accum - scratch memory of HIGHPASS_STREAM_ACCUM_LEN(cpar, dim_lp) 
+        ints, owned by the stream while it is used.
     control_par *cpar - contains image size parameters.
-*/
-void split(unsigned char *img, int half_selector, control_par *cpar) {
-    register int row, col;
-    register unsigned char *ptr;
-    unsigned char *end;
-    int image_size = cpar->imx * cpar->imy;
-    int cond_offs = (half_selector % 2) ? (cpar->imx) : (0);
     
-    if (half_selector == 0)
-        return;
+    Returns:
+    1 on success, 0 if the image has less than 2*dim_lp + 2 rows (use 
+    prepare_image() for such images).
+*/
+int highpass_stream_init(highpass_stream *hs, unsigned char *img, int dim_lp,
+    int *accum, control_par *cpar)
+{
+    if (cpar->imy < 2*dim_lp + 2)
+        return 0;
     
-    for (row = 0; row < cpar->imy/2; row++)
-        for (col = 0; col < cpar->imx; col++)
-            img[row*cpar->imx + col] = img[2*row*cpar->imx + cond_offs + col];
+    hs->img = img;
+    hs->filt_span = dim_lp;
+    hs->imx = cpar->imx;
+    hs->imy = cpar->imy;
+    hs->ring_len = 2*dim_lp + 2;
+    hs->row_accum = accum;
+    hs->col_accum = accum + hs->ring_len * cpar->imx;
+    hs->next_row = 0;
+    hs->next_sum = 0;
     
-    /* Erase lower half with magic 2 */
-    end = img + image_size;
-    for (ptr = img + image_size/2; ptr < end; ptr++)
-        *ptr = 2;
+    return 1;
 }
 
+/* Row sums of image row y, computed on first use. */
+static int *stream_row_sums(highpass_stream *hs, int y) {
+    while (hs->next_sum <= y) {
+        box_blur_row(hs->filt_span, hs->img + hs->next_sum * hs->imx, 
+            hs->row_accum + (hs->next_sum % hs->ring_len) * hs->imx, hs->imx);
+        hs->next_sum++;
+    }
+    return hs->row_accum + (y % hs->ring_len) * hs->imx;
+}
 
-/*  subtract_img() is a simple image arithmetic function that subtracts img2 from 
-    img1.
+/*  highpass_stream_next() produces the next row of the highpass image. The 
+    column sums are updated in the same order as in fast_box_blur_buf(), so
+    the results are identical.
     
     Arguments:
-    unsigned char *img1, *img2 - pointers to the original images.
-    unsigned char *img_new - pointer to result image buffer.
-    control_par *cpar - contains image size parameters.
+    highpass_stream *hs - the stream, see highpass_stream_init().
+    unsigned char *row_out - imx pixels receiving the row.
+    
+    Returns:
+    the number of the row produced, or -1 if all rows were already produced.
 */
-void subtract_img (unsigned char *img1,unsigned char *img2,unsigned char *img_new, control_par *cpar) 
-{
-    register unsigned char *ptr1, *ptr2, *ptr3;
-    int i;
-    int image_size = cpar->imx * cpar->imy;
+int highpass_stream_next(highpass_stream *hs, unsigned char *row_out) {
+    int *add1 = NULL, *add2 = NULL, *sub1 = NULL, *sub2 = NULL;
+    int *col = hs->col_accum;
+    int x, i, k, blur, div;
+    int fs = hs->filt_span, n = 2*hs->filt_span + 1, nq = n*n;
+    unsigned char *src;
     
-    for (i = 0, ptr1 = img1, ptr2 = img2, ptr3 = img_new; i < image_size; 
-        ptr1++, ptr2++, ptr3++, i++)
-    {
-        if ((*ptr1 - *ptr2) < 0)
-            *ptr3 = 0;
+    i = hs->next_row;
+    if (i >= hs->imy)
+        return -1;
+    
+    if (i == 0) {
+        memcpy(col, stream_row_sums(hs, 0), hs->imx * sizeof(int));
+        div = n;
+    } else if (i <= fs) {
+        add1 = stream_row_sums(hs, 2*i - 1);
+        add2 = stream_row_sums(hs, 2*i);
+        div = 0;
+    } else if (i < hs->imy - fs) {
+        add1 = stream_row_sums(hs, i + fs);
+        sub1 = stream_row_sums(hs, i - fs - 1);
+        div = nq;
+    } else {
+        k = hs->imy - i;
+        sub1 = stream_row_sums(hs, hs->imy - 2*k - 1);
+        sub2 = stream_row_sums(hs, hs->imy - 2*k);
+        div = 0;
+    }
+    
+    src = hs->img + i * hs->imx;
+    for (x = 0; x < hs->imx; x++) {
+        if (add1 != NULL) col[x] += add1[x];
+        if (add2 != NULL) col[x] += add2[x];
+        if (sub1 != NULL) col[x] -= sub1[x];
+        if (sub2 != NULL) col[x] -= sub2[x];
+        
+        if (div != 0)
+            blur = col[x] / div;
+        else if (i <= fs)
+            blur = n * col[x] / nq / (2*i + 1);
         else
-            *ptr3 = *ptr1 - *ptr2;
+            blur = n * col[x] / nq / (2*(hs->imy - i) + 1);
+        
+        /* as stored by fast_box_blur() and subtracted by subtract_img() */
+        blur = (unsigned char) blur;
+        row_out[x] = (src[x] > blur) ? src[x] - blur : 0;
     }
+    
+    hs->next_row++;
+    return i;
 }
 
 
@@ -375,44 +470,28 @@ void copy_images (unsigned char *src, unsigned char *dest, control_par *cpar)
 int prepare_image(unsigned char  *img, unsigned char  *img_hp, int dim_lp,
     int filter_hp, char *filter_file, control_par *cpar)
 {
-  register int  i;
-  FILE          *fp;
-  unsigned char *img_lp;
+  unsigned char *img_lp = NULL;
+  int *accum = NULL;
+  int success = 0;
   int image_size = cpar->imx * cpar->imy;
-  filter_t filt; /* for when filter_hp == 2 */
+  filter_kernel kern; /* for when filter_hp == 2 */
 
-  img_lp = (unsigned char *) calloc (image_size, 1);
-  if ( ! img_lp) {
-      puts ("calloc for img_lp --> error");
+  if (filter_hp == 2 && !read_filter_kernel(&kern, filter_file))
       return 0;
-  }
-  fast_box_blur(dim_lp, img, img_lp, cpar);
-  subtract_img (img, img_lp, img_hp, cpar);
-  
-  /* consider field mode */
-  if (cpar->chfield == 1 || cpar->chfield == 2)
-    split (img_hp, cpar->chfield, cpar);
-
-  /* filter highpass image, if wanted */
-  switch (filter_hp) {
-    case 0: break;
-    case 1: lowpass_3 (img_hp, img_hp, cpar);   break;
-    case 2:
-        /* read filter elements from parameter file */
-        fp = fopen (filter_file, "r");
-        for (i = 0; i < 9; i++) {
-            if (fscanf(fp, "%lf", (double *)filt + i) == 0) {
-                fclose(fp);
-                return 0;
-            }
-        }
-        fclose (fp);
 
-        filter_3 (img_hp, img_hp, filt, cpar);
-        break;
+  img_lp = (unsigned char *) malloc (image_size);
+  accum = (int *) malloc (BOX_BLUR_ACCUM_LEN(cpar) * sizeof(int));
+  if ( ! img_lp || ! accum) {
+      puts ("malloc for img_lp --> error");
+      goto finalize;
   }
   
+  success = prepare_image_buf(img, img_hp, img_lp, accum, dim_lp, filter_hp,
+      &kern, cpar);
+
+finalize:
   free (img_lp);
-  return 1;
+  free (accum);
+  return success;
 }
 
@@ -0,0 +1,481 @@
+/****************************************************************************
+ *
+ * Image processing routines that work the same on 8-bit and 16-bit images.
+ * This file is included by image_processing.c once per pixel type, with
+ *   PIXEL           the pixel type,
+ *   PIXEL_MAX       its largest value,
+ *   PIXEL_FN(name)  the name of a routine for that pixel type (the plain
+ *                   name for 8 bits, name_u16 for 16 bits)
+ *   FILTER_QUOTIENT(total, sum)  a 3x3 filter's integer weighted sum of a 
+ *                   pixel divided by the sum of its weights, before clipping
+ * defined. Intermediate sums are ints, which holds for 16-bit pixels and 
+ * lowpass filters of half-width up to about 90 pixels.
+ *
+ ***************************************************************************/
+
+/*  apply_filter_kernel() performs a 3x3 filtering like filter_3(), with a 
+    prepared kernel. The first and last lines are not processed, the rest 
+    uses wrap-around on the image edges; results are truncated to integers
+    and clipped to [kern->min_val, PIXEL_MAX]. On 8-bit images, weighted 
+    sums and quotients outside [0, 65535], as with negative weights, first 
+    wrap around like in filter_3(); on 16-bit images they are just clipped.
+    Separable kernels run as two 1-D integer passes, other integer kernels
+    as one integer pass.
+    
+    All neighbourhoods are taken from the unfiltered image, also when 
+    filtering in place.
+    
+    Arguments:
+    PIXEL *img - original image.
+    PIXEL *img_out - results buffer, same size as original image. May
+        be the same as img.
+    filter_kernel *kern - the kernel, from filter_kernel_init().
+    int *scratch - scratch memory of imx*imy ints.
+    control_par *cpar - contains image size parameters.
+*/
+void PIXEL_FN(apply_filter_kernel)(PIXEL *img, PIXEL *img_out,
+    filter_kernel *kern, int *scratch, control_par *cpar)
+{
+    int i, j, k, acc, val;
+    double dacc;
+    int imx = cpar->imx;
+    int image_size = cpar->imx * cpar->imy;
+    int start = imx + 1, end = image_size - imx - 1;
+    int r0 = kern->row[0], r1 = kern->row[1], r2 = kern->row[2];
+    int c0 = kern->col[0], c1 = kern->col[1], c2 = kern->col[2];
+    
+    if (end <= start) return;
+    
+    if (kern->separable) {
+        /* Horizontal pass over every pixel needed by the vertical pass. */
+        for (k = 1; k < image_size - 1; k++)
+            scratch[k] = r0*img[k - 1] + r1*img[k] + r2*img[k + 1];
+        
+        for (k = start; k < end; k++) {
+            acc = c0*scratch[k - imx] + c1*scratch[k] + c2*scratch[k + imx];
+            val = FILTER_QUOTIENT(acc, kern->isum);
+            if (val > PIXEL_MAX) val = PIXEL_MAX;
+            if (val < kern->min_val) val = kern->min_val;
+            img_out[k] = (PIXEL) val;
+        }
+        return;
+    }
+    
+    /* General kernel: results go to scratch first so that img_out may 
+       overwrite img. */
+    for (k = start; k < end; k++) {
+        if (kern->integer) {
+            acc = 0;
+            for (i = 0; i < 3; i++)
+                for (j = 0; j < 3; j++)
+                    acc += kern->ifilt[i][j] * img[k + (i - 1)*imx + j - 1];
+            val = FILTER_QUOTIENT(acc, kern->isum);
+        } else {
+            dacc = 0;
+            for (i = 0; i < 3; i++)
+                for (j = 0; j < 3; j++)
+                    dacc += kern->filt[i][j] * img[k + (i - 1)*imx + j - 1];
+            val = FILTER_QUOTIENT((int) dacc, kern->sum);
+        }
+        if (val > PIXEL_MAX) val = PIXEL_MAX;
+        if (val < kern->min_val) val = kern->min_val;
+        scratch[k] = val;
+    }
+    for (k = start; k < end; k++)
+        img_out[k] = (PIXEL) scratch[k];
+}
+
+
+/*  box_blur_row() sums one image row over a sliding window, the first pass of
+    fast_box_blur(). Sums near the row ends, where the window does not fit, 
+    are scaled up to the weight of the full window.
+    
+    Arguments:
+    int filt_span - see fast_box_blur().
+    PIXEL *src - the row of pixels.
+    int *row_accum - imx ints receiving the window sums.
+    int imx - row length.
+*/
+static void PIXEL_FN(box_blur_row)(int filt_span, PIXEL *src, int *row_accum,
+    int imx)
+{
+    register PIXEL  *ptrl, *ptrr;
+    register int *ptr;
+    int accum, n, m;
+    
+    n = 2*filt_span + 1;
+    
+    /* first element has no filter around him */
+    accum = *src;
+    *row_accum = accum * n;
+    
+    /* Elements 1..filt_span have a growing filter, as much as fits.
+       Each iteration increases the filter symmetrically, so 2 new elements 
+       are taken.
+    */
+    for (ptr = row_accum + 1, ptrr = src + 2, ptrl = ptrr - 1, m = 3;
+        ptr < row_accum + 1 + filt_span;
+        ptr++, ptrl+=2, ptrr+=2, m+=2) 
+    {    
+        accum += (*ptrl + *ptrr);
+        *ptr = accum * n / m; /* So small filters have same weight as
+                                     the largest size */
+    }
+    
+    /* Middle elements, having a constant-size filter. The sum is obtained
+       by adding the coming element and dropping the leaving element, in a 
+       sliding window fashion. 
+    */
+    for (ptr = row_accum + filt_span + 1, ptrl = src, ptrr = src + n;
+        ptrr < src + imx; ptrl++, ptr++, ptrr++)
+    {
+        accum += (*ptrr - *ptrl);
+        *ptr = accum;
+    }
+    
+    /* last elements in line treated like first ones, mutatis mutandis */
+    for (ptrl = src + imx - n, ptrr = ptrl + 1, m = n - 2,
+        ptr = row_accum + imx - filt_span;
+        ptr < row_accum + imx;
+        ptrl += 2, ptrr += 2, ptr++, m-=2)
+    {
+        accum -= (*ptrl + *ptrr);
+        *ptr = accum * n / m;
+    }
+}
+
+
+/*  fast_box_blur_buf() is fast_box_blur() with a caller-supplied accumulator,
+    so that repeated calls do no memory allocation. It does not keep any
+    state between calls, so it may run concurrently on different buffers.
+    
+    Arguments:
+    int filt_span, PIXEL *src, PIXEL *dest, 
+    control_par *cpar - see fast_box_blur().
+    int *accum_buf - scratch memory of BOX_BLUR_ACCUM_LEN(cpar) ints. Need not be
+        initialized.
+*/
+void PIXEL_FN(fast_box_blur_buf)(int filt_span, PIXEL *src, PIXEL *dest,
+    int *accum_buf, control_par *cpar)
+{
+    register PIXEL  *ptrz;
+    register int *ptr1, *ptr2, *ptr3;
+    int *row_accum, *col_accum, *end;
+    int row_start, n, nq;
+    register int i;
+    int image_size = cpar->imx * cpar->imy;
+    
+    n = 2*filt_span + 1;
+    nq = n*n;
+    
+    row_accum = accum_buf;
+    col_accum = accum_buf + image_size;
+    
+    /* Sum over lines first [1]: */
+    for (i = 0; i < cpar->imy; i++) {
+        row_start = i * cpar->imx;
+        PIXEL_FN(box_blur_row)(filt_span, src + row_start, 
+            row_accum + row_start, cpar->imx);
+    }
+    
+    /* Sum over columns: */
+    
+    end = col_accum + cpar->imx;
+    
+    /* first line */
+    for (ptr1 = row_accum, ptr2 = col_accum, ptrz = dest; 
+        ptr2 < end; ptr1++, ptr2++, ptrz++)
+    {
+       *ptr2 = *ptr1;
+       *ptrz = *ptr2/n;
+    }
+    
+    /* Sum vertically the accumulated row values for lines 1 ... filt_span */
+    for (i = 1; i <= filt_span; i++) {
+        ptr1 = row_accum + (2*i - 1)*cpar->imx;
+        ptr2 = ptr1 + cpar->imx;
+        ptrz = dest + i*cpar->imx;
+        
+        for (ptr3 = col_accum; ptr3 < end; ptr1++, ptr2++, ptr3++, ptrz++) {
+            *ptr3 += (*ptr1 + *ptr2);
+            *ptrz = n * (long long) (*ptr3) / nq / (2*i + 1);
+        }
+    }
+    
+    /* Middle lines with filter-size lines around them */
+    for (i = filt_span + 1, ptr1 = row_accum, 
+        ptrz = dest + cpar->imx*(filt_span + 1),
+        ptr2 = row_accum + cpar->imx*n; i < cpar->imy - filt_span; i++)
+    {
+        for (ptr3 = col_accum; ptr3 < end; ptr3++, ptr1++, ptrz++, ptr2++) {
+           *ptr3 += (*ptr2 - *ptr1);
+           *ptrz = *ptr3/nq;
+        }
+    }
+    
+    /* Last lines, similarly to first lines */
+    for (i = filt_span; i > 0; i--) {
+        ptr1 = row_accum + (cpar->imy - 2*i - 1)*cpar->imx;
+        ptr2 = ptr1 + cpar->imx;
+        ptrz = dest + (cpar->imy-i)*cpar->imx;
+        
+        for (ptr3 = col_accum; ptr3 < end; ptr1++, ptr2++, ptr3++, ptrz++) {
+            *ptr3 -= (*ptr1 + *ptr2);
+            *ptrz = n * (long long) (*ptr3) / nq / (2*i+1);
+        }
+    }
+    
+    /* ``dest`` now contains result. */
+}
+
+
+/*  split() crams into the first half of a given image either its even or odd 
+    lines. Used with interlaced cameras, a mostly obsolete device.
+    The lower half of the image is set to the number 2.
+    
+    Arguments:
+    PIXEL *img - the image to modify. Both input and output.
+    int half_selector - 0 to do nothing, 1 to take odd rows, 2 for even rows
+    control_par *cpar - contains image size parameters.
+*/
+void PIXEL_FN(split)(PIXEL *img, int half_selector, control_par *cpar) {
+    register int row, col;
+    register PIXEL *ptr;
+    PIXEL *end;
+    int image_size = cpar->imx * cpar->imy;
+    int cond_offs = (half_selector % 2) ? (cpar->imx) : (0);
+    
+    if (half_selector == 0)
+        return;
+    
+    for (row = 0; row < cpar->imy/2; row++)
+        for (col = 0; col < cpar->imx; col++)
+            img[row*cpar->imx + col] = img[2*row*cpar->imx + cond_offs + col];
+    
+    /* Erase lower half with magic 2 */
+    end = img + image_size;
+    for (ptr = img + image_size/2; ptr < end; ptr++)
+        *ptr = 2;
+}
+
+
+/*  subtract_img() is a simple image arithmetic function that subtracts img2 from 
+    img1.
+    
+    Arguments:
+    PIXEL *img1, *img2 - pointers to the original images.
+    PIXEL *img_new - pointer to result image buffer.
+    control_par *cpar - contains image size parameters.
+*/
+void PIXEL_FN(subtract_img) (PIXEL *img1,PIXEL *img2,PIXEL *img_new, control_par *cpar) 
+{
+    register PIXEL *ptr1, *ptr2, *ptr3;
+    int i;
+    int image_size = cpar->imx * cpar->imy;
+    
+    for (i = 0, ptr1 = img1, ptr2 = img2, ptr3 = img_new; i < image_size; 
+        ptr1++, ptr2++, ptr3++, i++)
+    {
+        if ((*ptr1 - *ptr2) < 0)
+            *ptr3 = 0;
+        else
+            *ptr3 = *ptr1 - *ptr2;
+    }
+}
+
+
+/*  flat_field_correct() removes a camera's fixed-pattern noise and 
+    vignetting: every pixel becomes (img - dark) * gain / 2^FLAT_FIELD_SHIFT,
+    rounded and clipped to [0, PIXEL_MAX]. The maps are precomputed, so this 
+    is one integer pass over the image.
+    
+    Arguments:
+    PIXEL *img - the raw image.
+    PIXEL *img_out - result buffer of the image size. May be the same as img.
+    PIXEL *dark - offset map (dark frame) of the image size, or NULL for none.
+    unsigned short *gain - gain map of the image size in units of 
+        1/2^FLAT_FIELD_SHIFT, or NULL for unity gain.
+    control_par *cpar - contains image size parameters.
+*/
+void PIXEL_FN(flat_field_correct)(PIXEL *img, PIXEL *img_out, PIXEL *dark,
+    unsigned short *gain, control_par *cpar)
+{
+    int i;
+    int image_size = cpar->imx * cpar->imy;
+    unsigned int val, half = 1u << (FLAT_FIELD_SHIFT - 1);
+    
+    if (gain == NULL) {
+        if (dark == NULL) {
+            if (img_out != img)
+                memcpy(img_out, img, image_size * sizeof(PIXEL));
+            return;
+        }
+        for (i = 0; i < image_size; i++)
+            img_out[i] = (img[i] > dark[i]) ? img[i] - dark[i] : 0;
+        return;
+    }
+    
+    if (dark == NULL) {
+        for (i = 0; i < image_size; i++) {
+            val = ((unsigned int) img[i] * gain[i] + half) >> FLAT_FIELD_SHIFT;
+            img_out[i] = (val > PIXEL_MAX) ? PIXEL_MAX : (PIXEL) val;
+        }
+        return;
+    }
+    
+    for (i = 0; i < image_size; i++) {
+        val = (img[i] > dark[i]) ? img[i] - dark[i] : 0;
+        val = (val * gain[i] + half) >> FLAT_FIELD_SHIFT;
+        img_out[i] = (val > PIXEL_MAX) ? PIXEL_MAX : (PIXEL) val;
+    }
+}
+
+
+/* prepare_image_buf() - same as prepare_image(), but the intermediate buffers
+   are supplied by the caller, so that processing a sequence does no memory 
+   allocation per frame, and the user-defined filter is given in its prepared
+   form, so the filter file is read only once. The function keeps no state 
+   between calls, so several threads may use it at once, each with its own 
+   buffers (e.g. one per camera); the kernel may be shared.
+   
+   Arguments:
+   PIXEL *img, *img_hp, int dim_lp, int filter_hp, control_par *cpar
+      - see prepare_image().
+   PIXEL *img_lp - scratch buffer of the image size.
+   int *accum - scratch buffer of BOX_BLUR_ACCUM_LEN(cpar) ints.
+   filter_kernel *kern - the filter to use in case ```filter_hp == 2```, see
+      read_filter_kernel(). Ignored otherwise.
+   
+   Returns:
+   1 on success, 0 if filter_hp == 2 and no kernel is given.
+*/
+int PIXEL_FN(prepare_image_buf)(PIXEL *img, PIXEL *img_hp, 
+    PIXEL *img_lp, int *accum, int dim_lp, int filter_hp, 
+    filter_kernel *kern, control_par *cpar)
+{
+  filter_kernel lowpass; /* for when filter_hp == 1 */
+
+  if (filter_hp == 2 && kern == NULL)
+    return 0;
+
+  PIXEL_FN(fast_box_blur_buf)(dim_lp, img, img_lp, accum, cpar);
+  PIXEL_FN(subtract_img) (img, img_lp, img_hp, cpar);
+  
+  /* consider field mode */
+  if (cpar->chfield == 1 || cpar->chfield == 2)
+    PIXEL_FN(split) (img_hp, cpar->chfield, cpar);
+
+  /* filter highpass image, if wanted. The box blur is done, so its 
+     accumulator serves as scratch memory here. */
+  switch (filter_hp) {
+    case 0: break;
+    case 1: 
+        lowpass_kernel (&lowpass);
+        PIXEL_FN(apply_filter_kernel) (img_hp, img_hp, &lowpass, accum, cpar);
+        break;
+    case 2:
+        PIXEL_FN(apply_filter_kernel) (img_hp, img_hp, kern, accum, cpar);
+        break;
+  }
+  
+  return 1;
+}
+
+/* prepare_image_tiles() - prepare_image_buf() restricted to the live tiles of
+   a tile mask. Each horizontal run of live tiles is filtered as a separate
+   sub-image, padded with enough surrounding pixels that the result inside 
+   the run equals the full-image result (except for the wrap-around of the 
+   3x3 post-filter on the left and right image edges). Dead tiles are set to 
+   0 in img_hp, and so are the pixels masked by the static mask attached to 
+   the tile mask, if any. Unlike with subtract_mask(), masked pixels still 
+   take part in filtering their unmasked neighbours, so the mask's edges
+   make no spurious highpass response.
+   
+   Interlaced (chfield != 0) images are always processed whole.
+   
+   Arguments:
+   PIXEL *img, *img_hp, *img_lp, int *accum, int dim_lp, 
+   int filter_hp, filter_kernel *kern, control_par *cpar - see 
+      prepare_image_buf().
+   PIXEL *img_sub - scratch buffer of the image size, holding the 
+      sub-images.
+   tile_mask *mask - the tiles to process. NULL to process the whole image.
+   
+   Returns:
+   1 on success, 0 if filter_hp == 2 and no kernel is given, or if the mask 
+   was made for another image size.
+*/
+int PIXEL_FN(prepare_image_tiles)(PIXEL *img, PIXEL *img_hp, 
+    PIXEL *img_lp, PIXEL *img_sub, int *accum, int dim_lp, 
+    int filter_hp, filter_kernel *kern, tile_mask *mask, control_par *cpar)
+{
+  int ty, tx, x0, x1, y0, y1, sx0, sx1, sy0, sy1, row, prev_x1;
+  int cursor, span_x0, span_x1;
+  int halo, imx = cpar->imx, imy = cpar->imy;
+  control_par sub_par;
+
+  if (mask == NULL || cpar->chfield != 0)
+    return PIXEL_FN(prepare_image_buf)(img, img_hp, img_lp, accum, dim_lp, 
+        filter_hp, kern, cpar);
+  if (filter_hp == 2 && kern == NULL)
+    return 0;
+  if (mask->imx != imx || mask->imy != imy)
+    return 0;
+
+  /* The box filter needs dim_lp pixels around a pixel, the 3x3 filter one 
+     more. */
+  halo = dim_lp + (filter_hp ? 1 : 0);
+  sub_par = *cpar;
+
+  for (ty = 0; ty < mask->nty; ty++) {
+    y0 = ty * mask->tile_size;
+    y1 = (y0 + mask->tile_size < imy) ? y0 + mask->tile_size : imy;
+    sy0 = (y0 - halo > 0) ? y0 - halo : 0;
+    sy1 = (y1 + halo < imy) ? y1 + halo : imy;
+    
+    tx = 0;
+    prev_x1 = 0;
+    while (tile_mask_next_run(mask, ty, &tx, &x0, &x1)) {
+      /* clear the dead span before the run */
+      for (row = y0; row < y1; row++)
+        memset(img_hp + row*imx + prev_x1, 0, 
+            (x0 - prev_x1) * sizeof(PIXEL));
+      prev_x1 = x1;
+      
+      sx0 = (x0 - halo > 0) ? x0 - halo : 0;
+      sx1 = (x1 + halo < imx) ? x1 + halo : imx;
+      sub_par.imx = sx1 - sx0;
+      sub_par.imy = sy1 - sy0;
+      
+      for (row = sy0; row < sy1; row++)
+        memcpy(img_sub + (row - sy0)*sub_par.imx, img + row*imx + sx0, 
+            sub_par.imx * sizeof(PIXEL));
+      
+      PIXEL_FN(prepare_image_buf)(img_sub, img_sub, img_lp, accum, dim_lp, 
+          filter_hp, kern, &sub_par);
+      
+      for (row = y0; row < y1; row++) {
+        if (mask->spans == NULL) {
+          memcpy(img_hp + row*imx + x0, 
+              img_sub + (row - sy0)*sub_par.imx + (x0 - sx0), 
+              (x1 - x0) * sizeof(PIXEL));
+          continue;
+        }
+        memset(img_hp + row*imx + x0, 0, (x1 - x0) * sizeof(PIXEL));
+        cursor = x0;
+        while (tile_mask_next_span(mask, row, &cursor, &span_x0, &span_x1)
+            && span_x0 < x1)
+        {
+          memcpy(img_hp + row*imx + span_x0, 
+              img_sub + (row - sy0)*sub_par.imx + (span_x0 - sx0), 
+              (span_x1 - span_x0) * sizeof(PIXEL));
+        }
+      }
+    }
+    
+    for (row = y0; row < y1; row++)
+      memset(img_hp + row*imx + prev_x1, 0, (imx - prev_x1) * sizeof(PIXEL));
+  }
+  
+  return 1;
+}
@@ -502,6 +502,17 @@ target_par* read_target_par(char *filename) {
         fclose(file);
         return NULL;
     }
+    
+    /* optional, files older than the engine choice end here */
+    if (fscanf(file, "%d", &ret->engine) != 1)
+        ret->engine = TARG_REC_GROW;
+    else if (ret->engine != TARG_REC_GROW && ret->engine != TARG_REC_UNION_FIND) {
+        printf("Unknown target recognition engine %d in %s\n", ret->engine, 
+            filename);
+        free(ret);
+        fclose(file);
+        return NULL;
+    }
 
     fclose(file);
     return ret;
@@ -523,7 +534,8 @@ int compare_target_par(target_par *targ1, target_par *targ2) {
             && targ1->nymin ==      targ2->nymin
             && targ1->nymax ==      targ2->nymax
             && targ1->sumg_min ==   targ2->sumg_min
-            && targ1->cr_sz ==      targ2->cr_sz);
+            && targ1->cr_sz ==      targ2->cr_sz
+            && targ1->engine ==     targ2->engine);
 }
 /* Writes target_par structure contents to a file.
  * Parameters:
@@ -550,6 +562,10 @@ void write_target_par(target_par *targ, char *filename) {
             targ->nymax,
             targ->sumg_min,
             targ->cr_sz);
+    
+    /* keep files of the default engine readable by older versions */
+    if (targ->engine != TARG_REC_GROW)
+        fprintf(file, "\n%d", targ->engine);
 
     fclose(file);
 }
@@ -15,15 +15,56 @@ Description:
 ****************************************************************************/
 
 #include "segmentation.h"
+#include "image_processing.h"
 #include <string.h>
 #include <stdio.h>
+#include <limits.h>
+#ifdef _OPENMP
+#include <omp.h>
+#endif
 
 typedef short targpix[2];
 
+/* Waitlist entries grow_target() keeps on the stack before moving to the 
+   heap. Most blobs fit. */
+#define WAITLIST_STACK_LEN 2048
+
+/* What grow_target() reports beyond the target itself. */
+typedef struct {
+    int ymax;       /* lowest row claimed by any target grown */
+    int overflow;   /* whether a target tried to leave the search window */
+    int *labels;    /* if not NULL, imx-wide image receiving blob numbers */
+    int imx;
+    int num_blobs;  /* blobs grown so far, accepted or not */
+    targ_stats *stats;  /* if not NULL, receives the detection statistics */
+} grow_info;
+
+/* The result of searching one strip on its own, see targ_rec_parallel(). */
+typedef struct {
+    int y0, y1;     /* rows of the strip */
+    void *sbuf;     /* the strip's private working copy */
+    target_list targs;
+    int num;
+    grow_info info;
+    targ_stats stats;
+    int failed;
+} strip_result;
+
+/* Moments of a connected component, see label_components(). */
+typedef struct {
+    int n, sumg;
+    double x, y;    /* coordinates weighted by grey value above threshold */
+    int xa, xb, ya, yb;
+    int seeded;     /* whether a peak of the component has been seen */
+} component;
+
 
 /*  targ_rec() thresholding and center of gravity with a peak fitting technique 
     uses 4 neighbours for connectivity and 8 to find local maxima, see:
     https://en.wikipedia.org/wiki/Connected-component_labeling     
+    targ_par->engine selects between growing a blob from each local maximum 
+    (TARG_REC_GROW) and two-pass union-find labeling (TARG_REC_UNION_FIND),
+    see label_components().
 
 Arguments:
     unsigned char *img - image buffer
@@ -45,163 +86,52 @@ Returns:
 int targ_rec (unsigned char *img, target_par *targ_par, int xmin, 
     int xmax, int ymin, int ymax, control_par *cpar, int num_cam, target pix[])
 {
-    register int  i, j, m;
-    int           n=0, n_wait=0, n_targets=0, sumg;
-    int           numpix;
-    int           thres, disco;
-    int           xa,ya,xb,yb, x4[4],y4[4], xn,yn, nx, ny; 
-    double            x, y;
-    unsigned char *img0;
-
-    register unsigned char    gv, gvref;
-
-    targpix waitlist[2048];
+    return targ_rec_tiles(img, targ_par, xmin, xmax, ymin, ymax, cpar, num_cam,
+        NULL, pix);
+}
 
-    /* avoid many dereferences */
-    int imx, imy;
-    imx = cpar->imx;
-    imy = cpar->imy;
+/*  targ_rec_u16() is targ_rec() for 16-bit images. The grey value 
+    thresholds and sums in targ_par are in the units of the image. */
+int targ_rec_u16 (unsigned short *img, target_par *targ_par, int xmin, 
+    int xmax, int ymin, int ymax, control_par *cpar, int num_cam, target pix[])
+{
+    return targ_rec_tiles_u16(img, targ_par, xmin, xmax, ymin, ymax, cpar, 
+        num_cam, NULL, pix);
+}
 
-    thres = targ_par->gvthres[num_cam];
-    disco = targ_par->discont;
+/*  target_list_reserve() makes room for at least num targets in a target 
+    list, growing it geometrically.
     
-    // printf("thres %d disco %d \n", thres, disco);
-
-    /* copy image to a temporary mask */
-    img0 = (unsigned char *) calloc (imx*imy, 1);
-    memcpy(img0, img, imx*imy);
-
-    // printf("in segmentation.c memcpy succeded\n");
-
-    /* Make sure the min/max coordinates don't cause us to access memory
-       outside the image memory.
-    */
-    if (xmin <= 0) xmin = 1;
-    if (ymin <= 0) ymin = 1;
-    if (xmax >= imx) xmax = imx - 1;
-    if (ymax >= imy) ymax = imy - 1;
+    Returns:
+    1 on success, 0 if memory could not be allocated (the list is intact).
+*/
+int target_list_reserve(target_list *targs, int num) {
+    int cap;
+    target *grown;
     
-    /*  thresholding and connectivity analysis in image  */
-    for (i=ymin; i<ymax; i++)  for (j=xmin; j<xmax; j++)
-    {
-        gv = *(img0 + i*imx + j);
-        if ( gv > thres)
-            if (gv >= *(img0 + i*imx + j-1)
-            &&  gv >= *(img0 + i*imx + j+1)
-            &&  gv >= *(img0 + (i-1)*imx + j)
-            &&  gv >= *(img0 + (i+1)*imx + j)
-            &&  gv >= *(img0 + (i-1)*imx + j-1)
-            &&  gv >= *(img0 + (i+1)*imx + j-1)
-            &&  gv >= *(img0 + (i-1)*imx + j+1)
-            &&  gv >= *(img0 + (i+1)*imx + j+1) )
-      /* => local maximum, 'peak' */
-          {
-            yn=i;  xn=j;
-            sumg = gv;  *(img0 + i*imx + j) = 0;
-            xa = xn;  xb = xn;  ya = yn;  yb = yn;
-            gv -= thres;
-            x = (xn) * gv;
-            y = yn * gv;
-            numpix = 1;
-            waitlist[0][0] = j;  waitlist[0][1] = i;  n_wait = 1;
-
-
-            while (n_wait > 0) {
-                gvref = *(img + imx*(waitlist[0][1]) + (waitlist[0][0]));
-
-                x4[0] = waitlist[0][0] - 1;  y4[0] = waitlist[0][1];
-                x4[1] = waitlist[0][0] + 1;  y4[1] = waitlist[0][1];
-                x4[2] = waitlist[0][0];  y4[2] = waitlist[0][1] - 1;
-                x4[3] = waitlist[0][0];  y4[3] = waitlist[0][1] + 1;
-
-
-                for (n=0; n<4; n++) {
-                    xn = x4[n];  yn = y4[n];
-                    if (!(xn < xmax) || !(yn < ymax)) continue;
-                    gv = *(img0 + imx*yn + xn);
-
-                    /* conditions for threshold, discontinuity, image borders */
-                    /* and peak fitting */
-                    if (   (gv > thres)
-                       && (xn > xmin - 1) && (xn < xmax + 1) 
-                       && (yn > ymin - 1) && (yn < ymax + 1)
-                       && (gv <= gvref+disco)
-                       && (gvref + disco >= *(img + imx*(yn-1) + xn))
-                       && (gvref + disco >= *(img + imx*(yn+1) + xn))
-                       && (gvref + disco >= *(img + imx*yn + (xn-1)))
-                       && (gvref + disco >= *(img + imx*yn + (xn+1)))  )
-                      {
-                        sumg += gv;  *(img0 + imx*yn + xn) = 0;
-                        if (xn < xa) 
-                            xa = xn;
-                        if (xn > xb)
-                            xb = xn;
-                        if (yn < ya)
-                            ya = yn;
-                        if (yn > yb)
-                            yb = yn;
-                        waitlist[n_wait][0] = xn;   waitlist[n_wait][1] = yn;
-                        
-                        /* Coordinates are weighted by grey value, normed 
-                           later. */
-                        x += (xn) * (gv - thres);
-                        y += yn * (gv - thres);
-                        
-                        numpix++;
-                        n_wait++;
-                      }
-                }
-
-                n_wait--;
-                for (m=0; m<n_wait; m++) {
-                    waitlist[m][0] = waitlist[m+1][0];
-                    waitlist[m][1] = waitlist[m+1][1];
-                }
-                waitlist[n_wait][0] = 0;  waitlist[n_wait][1] = 0;
-
-            }   /*  end of while-loop  */
-
-            /* check whether target touches image borders */
-            if (xa == (xmin - 1) || ya == (ymin - 1) || 
-                xb == (xmax + 1)|| yb == (ymax + 1)) 
-            {
-                continue;
-            }
+    if (num <= targs->cap)
+        return 1;
+    
+    cap = (targs->cap > 512) ? 2*targs->cap : 1024;
+    if (cap < num) cap = num;
+    grown = (target *) realloc(targs->pix, cap * sizeof(target));
+    if (grown == NULL)
+        return 0;
+    
+    targs->pix = grown;
+    targs->cap = cap;
+    return 1;
+}
 
-            /* get targets extensions in x and y */
-            nx = xb - xa + 1;  
-            ny = yb - ya + 1;
-
-            if (   (numpix >= targ_par->nnmin) && (numpix <= targ_par->nnmax)
-               && (nx >= targ_par->nxmin) && (nx <= targ_par->nxmax)
-               && (ny >= targ_par->nymin) && (ny <= targ_par->nymax)
-               && (sumg > targ_par->sumg_min) )
-              {
-                    pix[n_targets].n = numpix;
-                    pix[n_targets].nx = nx;
-                    pix[n_targets].ny = ny;
-                    pix[n_targets].sumg = sumg;
-                    sumg -= (numpix*thres);
-
-                    /* finish the grey-value weighting: */
-                    x /= sumg;  x += 0.5;   
-                    y /= sumg;  y += 0.5;
-                    
-                    pix[n_targets].x = x;
-                    pix[n_targets].y = y;
-                    pix[n_targets].tnr = CORRES_NONE;
-                    pix[n_targets].pnr = n_targets;
-                    n_targets++;
-                    
-                    xn = x;  
-                    yn = y;
-                    // printf("%d %d %d \n",n_targets, xn, yn);
-              }
-          } /*  end of if-loop  */
-    }
-    free(img0);
-    /* protect pix from zero memory */
-    if (n_targets < 1){
+/* targ_rec() adds a dummy target to empty results, so all variants do. 
+   Passes on failures (n_targets < 0). */
+static int protect_empty(target_list *targs, int n_targets) {
+    target *pix;
+    
+    if (n_targets == 0) {
+        if (!target_list_reserve(targs, 1))
+            return -1;
+        pix = targs->pix;
         pix[0].n = 1;
         pix[0].nx = 1;
         pix[0].ny = 1;
@@ -212,8 +142,253 @@ int targ_rec (unsigned char *img, target_par *targ_par, int xmin,
         pix[0].pnr = 1;
         n_targets++;
     }
-    // printf("final n_targets %d\n",n_targets);
-    return(n_targets);
+    return n_targets;
+}
+
+/*  targ_stats_add() adds the counts of part to total, see targ_stats. */
+void targ_stats_add(targ_stats *total, targ_stats *part) {
+    int k;
+    
+    for (k = 0; k < TARG_STATS_BINS; k++) {
+        total->n[k] += part->n[k];
+        total->nx[k] += part->nx[k];
+        total->ny[k] += part->ny[k];
+    }
+    for (k = 0; k < TARG_STATS_SUMG_BINS; k++)
+        total->sumg[k] += part->sumg[k];
+    for (k = 0; k < TARG_REJECT_KINDS; k++)
+        total->rejected[k] += part->rejected[k];
+}
+
+/* Histogram bin of a pixel count or extent, see targ_stats. */
+static int size_bin(int size) {
+    return (size < TARG_STATS_BINS - 1) ? size : TARG_STATS_BINS - 1;
+}
+
+/*  accept_target() checks a blob against the size and brightness limits 
+    and, if it passes, makes a target of it.
+    
+    Arguments:
+    target_par *targ_par - the limits.
+    targ_stats *stats - if not NULL, counts the target or the limit it 
+        failed.
+    int numpix, nx, ny, sumg - pixel count, extents and grey value sum.
+    double x, y - sums of the coordinates weighted by the grey value above 
+        the threshold thres.
+    int thres - the grey value threshold.
+    
+    Output:
+    target *pix - the target, if accepted. pnr and tnr are not set.
+    
+    Returns:
+    1 if the blob was accepted, 0 otherwise.
+*/
+static int accept_target(target_par *targ_par, targ_stats *stats, 
+    int numpix, int nx, int ny, int sumg, double x, double y, int thres, 
+    target *pix)
+{
+    int bin;
+    
+    if (   (numpix >= targ_par->nnmin) && (numpix <= targ_par->nnmax)
+       && (nx >= targ_par->nxmin) && (nx <= targ_par->nxmax)
+       && (ny >= targ_par->nymin) && (ny <= targ_par->nymax)
+       && (sumg > targ_par->sumg_min) )
+      {
+        pix->n = numpix;
+        pix->nx = nx;
+        pix->ny = ny;
+        pix->sumg = sumg;
+        
+        if (stats != NULL) {
+            stats->n[size_bin(numpix)]++;
+            stats->nx[size_bin(nx)]++;
+            stats->ny[size_bin(ny)]++;
+            for (bin = 0; (sumg >> bin) > 1; bin++);
+            stats->sumg[bin]++;
+        }
+        sumg -= (numpix*thres);
+        
+        /* finish the grey-value weighting: */
+        x /= sumg;  x += 0.5;   
+        y /= sumg;  y += 0.5;
+        
+        pix->x = x;
+        pix->y = y;
+        return 1;
+      }
+    
+    if (stats != NULL) {
+        if ((numpix < targ_par->nnmin) || (numpix > targ_par->nnmax))
+            stats->rejected[TARG_REJECT_PIXEL_COUNT]++;
+        else if ((nx < targ_par->nxmin) || (nx > targ_par->nxmax))
+            stats->rejected[TARG_REJECT_XSIZE]++;
+        else if ((ny < targ_par->nymin) || (ny > targ_par->nymax))
+            stats->rejected[TARG_REJECT_YSIZE]++;
+        else
+            stats->rejected[TARG_REJECT_SUM_GREY]++;
+    }
+    return 0;
+}
+
+/*  connects() tells whether label_components() puts two 4-neighbouring 
+    pixels above the threshold into one component. They are connected if 
+    the brighter one is the brightest neighbour of the other, which is the 
+    step along which grow_target() reaches every pixel of a blob from its 
+    peak; or if the discontinuity rule of grow_target() allows the step 
+    between them both ways, a seam smooth enough for a blob to grow across 
+    from either side.
+    
+    Arguments:
+    int gv1, gv2 - grey values of the pixels.
+    int max1, max2 - grey values of their brightest 4-neighbours.
+    int disco - maximal discontinuity.
+*/
+static int connects(int gv1, int max1, int gv2, int max2, int disco) {
+    if (gv1 < gv2)
+        return connects(gv2, max2, gv1, max1, disco);
+    
+    if (gv1 >= max2)
+        return 1;
+    return (gv1 <= gv2 + disco) && (gv2 + disco >= max1) 
+        && (gv1 + disco >= max2);
+}
+
+/* Union-find over provisional component labels, see label_components(). */
+static int uf_find(int *parent, int label) {
+    while (parent[label] != label) {
+        parent[label] = parent[parent[label]];
+        label = parent[label];
+    }
+    return label;
+}
+
+/* Merges the sets of two labels under the smaller root, returns the root. */
+static int uf_union(int *parent, int a, int b) {
+    a = uf_find(parent, a);
+    b = uf_find(parent, b);
+    if (a < b) {
+        parent[b] = a;
+        return a;
+    }
+    parent[a] = b;
+    return b;
+}
+
+/* Routines generic in the pixel type, for 8-bit and 16-bit images. */
+#define PIXEL unsigned char
+#define PIXEL_FN(name) name
+#include "segmentation_px.h"
+#undef PIXEL
+#undef PIXEL_FN
+
+#define PIXEL unsigned short
+#define PIXEL_FN(name) name ## _u16
+#include "segmentation_px.h"
+#undef PIXEL
+#undef PIXEL_FN
+
+/*  targ_rec_highpass() fuses prepare_image() (with filter_hp = 0) and 
+    targ_rec() into one pass over the raw image. The highpass image is 
+    produced row by row into a strip of 2*nymax + 5 rows, which moves down 
+    the image as the peak scan proceeds, so neither the lowpass nor the 
+    highpass image is ever held whole.
+    
+    The result equals targ_rec(prepared image) except around blobs taller 
+    than nymax rows: these are rejected as in targ_rec(), but only their part
+    inside the strip is removed from further search, so a lower part of 
+    such a blob may still yield a target. Interlaced images (cpar->chfield 
+    != 0), images too small for the strip and the union-find engine are 
+    processed with the full image buffers.
+    
+    Arguments:
+    unsigned char *img - the raw image.
+    int dim_lp - half-width of the lowpass filter, see prepare_image().
+    target_par *targ_par, int xmin, int xmax, int ymin, int ymax, 
+    control_par *cpar, int num_cam - see targ_rec().
+    
+    Output:
+    target_list *targs - receives the targets, see targ_rec_buf().
+    
+    Returns:
+    number of targets found, -1 on memory allocation failure.
+*/
+int targ_rec_highpass(unsigned char *img, int dim_lp, target_par *targ_par, 
+    int xmin, int xmax, int ymin, int ymax, control_par *cpar, int num_cam, 
+    target_list *targs)
+{
+    int i, y, last, strip_len, reach;
+    int n_targets = 0, thres, disco;
+    int imx = cpar->imx, imy = cpar->imy;
+    unsigned char *strip = NULL, *img_hp, **rows = NULL, **rows0;
+    int *accum = NULL;
+    highpass_stream hs;
+    
+    thres = targ_par->gvthres[num_cam];
+    disco = targ_par->discont;
+    
+    /* Rows a target may reach above and below its peak */
+    reach = targ_par->nymax;
+    strip_len = 2*reach + 5;
+    
+    if (cpar->chfield != 0 || strip_len >= imy || imy < 2*dim_lp + 2
+        || targ_par->engine == TARG_REC_UNION_FIND) 
+    {
+        img_hp = (unsigned char *) malloc(2*imx*imy);
+        rows = (unsigned char **) malloc(2 * imy * sizeof(unsigned char *));
+        n_targets = -1;
+        
+        if (img_hp != NULL && rows != NULL && 
+            prepare_image(img, img_hp, dim_lp, 0, NULL, cpar)) 
+        {
+            n_targets = targ_rec_buf(img_hp, targ_par, xmin, xmax, ymin, ymax,
+                cpar, num_cam, NULL, img_hp + imx*imy, rows, NULL, targs);
+        }
+        free(img_hp);
+        free(rows);
+        return n_targets;
+    }
+    
+    strip = (unsigned char *) malloc(2 * strip_len * imx);
+    rows = (unsigned char **) malloc(2 * imy * sizeof(unsigned char *));
+    accum = (int *) malloc(HIGHPASS_STREAM_ACCUM_LEN(cpar, dim_lp) * sizeof(int));
+    if (strip == NULL || rows == NULL || accum == NULL) {
+        n_targets = -1;
+        goto finalize;
+    }
+    
+    /* Image rows map cyclically onto the strip */
+    rows0 = rows + imy;
+    for (y = 0; y < imy; y++) {
+        rows[y] = strip + (y % strip_len) * imx;
+        rows0[y] = strip + (strip_len + y % strip_len) * imx;
+    }
+    highpass_stream_init(&hs, img, dim_lp, accum, cpar);
+    
+    if (xmin <= 0) xmin = 1;
+    if (ymin <= 0) ymin = 1;
+    if (xmax >= imx) xmax = imx - 1;
+    if (ymax >= imy) ymax = imy - 1;
+    
+    for (i = ymin; i < ymax && n_targets >= 0; i++) {
+        /* Rows reachable from peaks in row i, and their neighbours */
+        last = i + reach + 2;
+        if (last >= imy) last = imy - 1;
+        while (hs.next_row <= last) {
+            y = highpass_stream_next(&hs, rows[hs.next_row]);
+            memcpy(rows0[y], rows[y], imx);
+        }
+        
+        n_targets = scan_run(rows, rows0, i, xmin, xmax, thres, disco,
+            xmin, xmax, ymin, ymax, i - reach, i + reach + 1, targ_par, NULL, 
+            targs, n_targets);
+    }
+    n_targets = protect_empty(targs, n_targets);
+    
+finalize:
+    free(strip);
+    free(rows);
+    free(accum);
+    return n_targets;
 }
 
 
@@ -0,0 +1,831 @@
+/****************************************************************************
+ *
+ * Target recognition routines that work the same on 8-bit and 16-bit images.
+ * This file is included by segmentation.c once per pixel type, with
+ *   PIXEL           the pixel type,
+ *   PIXEL_FN(name)  the name of a routine for that pixel type (the plain
+ *                   name for 8 bits, name_u16 for 16 bits)
+ * defined. Thresholds and grey value sums are in the units of the pixels.
+ *
+ ***************************************************************************/
+
+/*  grow_target() grows a target from a peak found by targ_rec() and checks
+    it against the target parameters. Images are accessed through tables of 
+    row pointers, so that they need not be held whole in memory.
+    
+    Arguments:
+    PIXEL **img - rows of the image, used for discontinuity checks.
+    PIXEL **img0 - rows of the working copy of the image. Pixels 
+        joined to the target are set to 0.
+    int xp, yp - the peak pixel.
+    int thres, disco - grey value threshold and discontinuity of targ_par.
+    int xmin, xmax, ymin, ymax - search area, already clipped to the image.
+    int win_lo, win_hi - rows the target may occupy (win_hi exclusive). A 
+        target that would extend beyond them is rejected. Rows win_lo - 2 to 
+        win_hi + 1 must be readable.
+    target_par *targ_par - size and brightness limits of a target.
+    grow_info *info - if not NULL, updated with the lowest row claimed and 
+        whether the target tried to leave the window, the blob's pixels 
+        labeled with its number if info->labels is set, and the blob counted
+        in info->stats if that is set.
+    
+    Output:
+    target *pix - the target, if accepted. pnr and tnr are not set.
+    
+    Returns:
+    1 if the target was accepted, 0 otherwise, -1 if the waitlist could not
+    grow.
+*/
+static int PIXEL_FN(grow_target)(PIXEL **img, PIXEL **img0, int xp, 
+    int yp, int thres, int disco, int xmin, int xmax, int ymin, int ymax, 
+    int win_lo, int win_hi, target_par *targ_par, grow_info *info, 
+    target *pix)
+{
+    int           n, n_wait, head, wait_cap, sumg, numpix, overflow = 0;
+    int           xa,ya,xb,yb, x4[4],y4[4], xn,yn, nx, ny; 
+    double            x, y;
+    register PIXEL    gv, gvref;
+    
+    /* Pixels joined but not yet expanded are waitlist[head..n_wait - 1]. 
+       Large blobs move the list from the stack to the heap. */
+    targpix wait_stack[WAITLIST_STACK_LEN], *waitlist = wait_stack, *grown;
+    wait_cap = WAITLIST_STACK_LEN;
+    
+    yn = yp;  xn = xp;
+    gv = img0[yn][xn];
+    sumg = gv;  img0[yn][xn] = 0;
+    xa = xn;  xb = xn;  ya = yn;  yb = yn;
+    gv -= thres;
+    x = (xn) * gv;
+    y = yn * gv;
+    numpix = 1;
+    waitlist[0][0] = xp;  waitlist[0][1] = yp;  n_wait = 1;  head = 0;
+    
+    while (head < n_wait) {
+        gvref = img[waitlist[head][1]][waitlist[head][0]];
+        
+        x4[0] = waitlist[head][0] - 1;  y4[0] = waitlist[head][1];
+        x4[1] = waitlist[head][0] + 1;  y4[1] = waitlist[head][1];
+        x4[2] = waitlist[head][0];  y4[2] = waitlist[head][1] - 1;
+        x4[3] = waitlist[head][0];  y4[3] = waitlist[head][1] + 1;
+        
+        for (n=0; n<4; n++) {
+            xn = x4[n];  yn = y4[n];
+            if (!(xn < xmax) || !(yn < ymax)) continue;
+            gv = img0[yn][xn];
+            
+            /* conditions for threshold, discontinuity, image borders */
+            /* and peak fitting */
+            if (   (gv > thres)
+               && (xn > xmin - 1) && (xn < xmax + 1) 
+               && (yn > ymin - 1) && (yn < ymax + 1)
+               && (gv <= gvref+disco)
+               && (gvref + disco >= img[yn-1][xn])
+               && (gvref + disco >= img[yn+1][xn])
+               && (gvref + disco >= img[yn][xn-1])
+               && (gvref + disco >= img[yn][xn+1])  )
+              {
+                if (yn < win_lo || yn >= win_hi) {
+                    overflow = 1;
+                    continue;
+                }
+                sumg += gv;  img0[yn][xn] = 0;
+                if (xn < xa) 
+                    xa = xn;
+                if (xn > xb)
+                    xb = xn;
+                if (yn < ya)
+                    ya = yn;
+                if (yn > yb)
+                    yb = yn;
+                
+                if (n_wait == wait_cap) {
+                    wait_cap *= 2;
+                    if (waitlist == wait_stack) {
+                        grown = (targpix *) malloc(wait_cap * sizeof(targpix));
+                        if (grown != NULL)
+                            memcpy(grown, wait_stack, sizeof(wait_stack));
+                    } else {
+                        grown = (targpix *) realloc(waitlist, 
+                            wait_cap * sizeof(targpix));
+                    }
+                    if (grown == NULL) {
+                        if (waitlist != wait_stack) free(waitlist);
+                        return -1;
+                    }
+                    waitlist = grown;
+                }
+                waitlist[n_wait][0] = xn;   waitlist[n_wait][1] = yn;
+                
+                /* Coordinates are weighted by grey value, normed 
+                   later. */
+                x += (xn) * (gv - thres);
+                y += yn * (gv - thres);
+                
+                numpix++;
+                n_wait++;
+              }
+        }
+        
+        head++;
+    }   /*  end of while-loop  */
+    
+    if (info != NULL) {
+        if (overflow) info->overflow = 1;
+        if (yb > info->ymax) info->ymax = yb;
+        
+        /* the waitlist holds all pixels of the blob now */
+        if (info->labels != NULL) {
+            info->num_blobs++;
+            for (n = 0; n < n_wait; n++)
+                info->labels[waitlist[n][1]*info->imx + waitlist[n][0]] = 
+                    info->num_blobs;
+        }
+    }
+    
+    if (waitlist != wait_stack)
+        free(waitlist);
+    
+    /* check whether target touches image borders or leaves the window */
+    if (overflow || xa == (xmin - 1) || ya == (ymin - 1) || 
+        xb == (xmax + 1)|| yb == (ymax + 1)) 
+    {
+        if (info != NULL && info->stats != NULL)
+            info->stats->rejected[TARG_REJECT_BORDER]++;
+        return 0;
+    }
+    
+    /* get targets extensions in x and y */
+    nx = xb - xa + 1;  
+    ny = yb - ya + 1;
+    
+    return accept_target(targ_par, (info != NULL) ? info->stats : NULL, 
+        numpix, nx, ny, sumg, x, y, thres, pix);
+}
+
+/*  scan_run() looks for peaks in pixels xmin_run..xmax_run - 1 of row i and 
+    grows a target from each, see targ_rec() and grow_target() for the 
+    arguments. Accepted targets are added to targs after the first n_targets,
+    growing it as needed.
+    
+    Returns:
+    the new number of targets in targs, -1 if memory ran out.
+*/
+static int PIXEL_FN(scan_run)(PIXEL **img, PIXEL **img0, int i, 
+    int xmin_run, int xmax_run, int thres, int disco, int xmin, int xmax, 
+    int ymin, int ymax, int win_lo, int win_hi, target_par *targ_par, 
+    grow_info *info, target_list *targs, int n_targets)
+{
+    register int j;
+    int accepted;
+    register PIXEL gv;
+    PIXEL *above = img0[i - 1], *row = img0[i], *below = img0[i + 1];
+    
+    for (j=xmin_run; j<xmax_run; j++)
+    {
+        gv = row[j];
+        if ( gv > thres)
+            if (gv >= row[j-1]
+            &&  gv >= row[j+1]
+            &&  gv >= above[j]
+            &&  gv >= below[j]
+            &&  gv >= above[j-1]
+            &&  gv >= below[j-1]
+            &&  gv >= above[j+1]
+            &&  gv >= below[j+1] )
+        /* => local maximum, 'peak' */
+        {
+            if (!target_list_reserve(targs, n_targets + 1))
+                return -1;
+            accepted = PIXEL_FN(grow_target)(img, img0, j, i, thres, disco, 
+                xmin, xmax, ymin, ymax, win_lo, win_hi, targ_par, info, 
+                targs->pix + n_targets);
+            if (accepted < 0)
+                return -1;
+            if (accepted) {
+                targs->pix[n_targets].tnr = CORRES_NONE;
+                targs->pix[n_targets].pnr = n_targets;
+                n_targets++;
+            }
+        }
+    }
+    return n_targets;
+}
+
+/*  copy_live() copies rows y0 to y1 - 1 of the live spans of an image to a
+    zeroed working copy, or the whole rows if there is no mask.
+    
+    Arguments:
+    PIXEL *img - the image.
+    PIXEL *img0 - the working copy of rows y0..y1 - 1, imx pixels per row.
+    tile_mask *mask - the tiles (and static mask) to copy, or NULL for all.
+    int imx, y0, y1 - image width and the rows to copy.
+*/
+static void PIXEL_FN(copy_live)(PIXEL *img, PIXEL *img0, tile_mask *mask, 
+    int imx, int y0, int y1)
+{
+    int row, cursor, x0, x1;
+    
+    if (mask == NULL) {
+        memcpy(img0, img + y0*imx, (y1 - y0)*imx*sizeof(PIXEL));
+        return;
+    }
+    for (row = y0; row < y1; row++) {
+        cursor = 0;
+        while (tile_mask_next_span(mask, row, &cursor, &x0, &x1))
+            memcpy(img0 + (row - y0)*imx + x0, img + row*imx + x0, 
+                (x1 - x0) * sizeof(PIXEL));
+    }
+}
+
+/*  scan_row() scans row i for peaks, over the live spans of the mask 
+    (the whole search width without a mask), and grows targets from them. 
+    See scan_run() for the other arguments.
+    
+    Returns:
+    the new number of targets in targs, -1 if memory ran out.
+*/
+static int PIXEL_FN(scan_row)(PIXEL **img, PIXEL **img0, int i, 
+    tile_mask *mask, int thres, int disco, int xmin, int xmax, int ymin, 
+    int ymax, int win_lo, int win_hi, target_par *targ_par, grow_info *info,
+    target_list *targs, int n_targets)
+{
+    int cursor = 0, x0, x1, run_xmin, run_xmax;
+    
+    if (mask == NULL)
+        return PIXEL_FN(scan_run)(img, img0, i, xmin, xmax, thres, disco, 
+            xmin, xmax, ymin, ymax, win_lo, win_hi, targ_par, info, targs, 
+            n_targets);
+    
+    while (n_targets >= 0 && 
+        tile_mask_next_span(mask, i, &cursor, &x0, &x1)) 
+    {
+        run_xmin = (x0 > xmin) ? x0 : xmin;
+        run_xmax = (x1 < xmax) ? x1 : xmax;
+        n_targets = PIXEL_FN(scan_run)(img, img0, i, run_xmin, run_xmax, 
+            thres, disco, xmin, xmax, ymin, ymax, win_lo, win_hi, targ_par, 
+            info, targs, n_targets);
+    }
+    return n_targets;
+}
+
+/*  max4() returns the grey value of the brightest 4-neighbour of pixel 
+    (x, y), which must not be on the image border. */
+static int PIXEL_FN(max4)(PIXEL **img, int x, int y)
+{
+    int gv_max = img[y-1][x];
+    
+    if (img[y+1][x] > gv_max) gv_max = img[y+1][x];
+    if (img[y][x-1] > gv_max) gv_max = img[y][x-1];
+    if (img[y][x+1] > gv_max) gv_max = img[y][x+1];
+    return gv_max;
+}
+
+/*  label_components() is the union-find engine of target recognition
+    (targ_par->engine == TARG_REC_UNION_FIND). Instead of growing a blob 
+    from each peak, it labels the connected components of the pixels above 
+    the threshold in two raster passes: the first gives every pixel a 
+    provisional label and merges the labels of 4-neighbours that connects() 
+    joins; the second resolves the labels and sums the moments of each 
+    component. Components are made targets in the order of their first peak
+    (a pixel no darker than its 8 neighbours), which is the order the 
+    growing engine finds them in; components without a peak are dropped.
+    
+    On separated blobs both engines give the same targets. Where blobs touch,
+    the growing engine splits them depending on which blob reaches the seam
+    first, which no order-free labeling can reproduce. The two agree closely
+    for discontinuities small against the blob contrast; for large ones the
+    growing engine keeps more touching blobs apart.
+    
+    Arguments:
+    PIXEL **img, PIXEL **img0 - rows of the image and of its working copy,
+        see grow_target(). img0 is not changed.
+    int thres, disco - grey value threshold and discontinuity of targ_par.
+    int xmin, xmax, ymin, ymax - search area, already clipped to the image.
+    target_par *targ_par - size and brightness limits of a target.
+    targ_stats *stats - if not NULL, receives the detection statistics.
+    target_list *targs - receives the targets after the first n_targets,
+        grown as needed.
+    int n_targets - number of targets already in targs.
+    
+    Returns:
+    the new number of targets in targs, -1 if memory ran out.
+*/
+static int PIXEL_FN(label_components)(PIXEL **img, PIXEL **img0, int thres,
+    int disco, int xmin, int xmax, int ymin, int ymax, target_par *targ_par,
+    targ_stats *stats, target_list *targs, int n_targets)
+{
+    int w = xmax - xmin, h = ymax - ymin, x, y, k, label, up, root;
+    int num_labels = 0, label_cap = 1024, num_order = 0, gv;
+    int *labels, *parent, *order = NULL, *grown, *max_buf;
+    int *max_row, *max_above, *swap;
+    component *comps = NULL, *comp;
+    PIXEL *row, *above, *below;
+    
+    if (w <= 0 || h <= 0)
+        return n_targets;
+    
+    labels = (int *) malloc(w * h * sizeof(int));
+    parent = (int *) malloc(label_cap * sizeof(int));
+    max_buf = (int *) malloc(2 * w * sizeof(int));
+    if (labels == NULL || parent == NULL || max_buf == NULL) {
+        n_targets = -1;
+        goto done;
+    }
+    max_row = max_buf;
+    max_above = max_buf + w;
+    
+    /* first pass: provisional labels, equivalences in parent. Only pixels 
+       above the threshold are labeled, and only they are read back. max_row
+       holds max4() of those of the row, max_above of the row above. */
+    for (y = ymin; y < ymax; y++) {
+        row = img0[y];  above = img0[y - 1];
+        swap = max_above;  max_above = max_row;  max_row = swap;
+        
+        for (x = xmin; x < xmax; x++) {
+            gv = row[x];
+            if (gv <= thres)
+                continue;
+            k = (y - ymin)*w + x - xmin;
+            max_row[x - xmin] = PIXEL_FN(max4)(img, x, y);
+            
+            label = 0;
+            if (x > xmin && row[x - 1] > thres
+                && connects(gv, max_row[x - xmin], row[x - 1], 
+                    max_row[x - xmin - 1], disco))
+                label = labels[k - 1];
+            
+            if (y > ymin && above[x] > thres 
+                && connects(gv, max_row[x - xmin], above[x], 
+                    max_above[x - xmin], disco))
+            {
+                up = labels[k - w];
+                label = (label != 0) ? uf_union(parent, label, up) : up;
+            }
+            
+            if (label == 0) {
+                if (++num_labels == label_cap) {
+                    label_cap *= 2;
+                    grown = (int *) realloc(parent, label_cap * sizeof(int));
+                    if (grown == NULL) {
+                        n_targets = -1;
+                        goto done;
+                    }
+                    parent = grown;
+                }
+                label = num_labels;
+                parent[label] = label;
+            }
+            labels[k] = label;
+        }
+    }
+    
+    /* Roots are the smallest labels of their sets, so resolving the labels
+       in increasing order points each straight at its root. */
+    for (label = 1; label <= num_labels; label++)
+        parent[label] = parent[parent[label]];
+    
+    comps = (component *) calloc(num_labels + 1, sizeof(component));
+    order = (int *) malloc((num_labels + 1) * sizeof(int));
+    if (comps == NULL || order == NULL) {
+        n_targets = -1;
+        goto done;
+    }
+    
+    /* second pass: moments per component, components by first peak */
+    for (y = ymin; y < ymax; y++) {
+        above = img0[y - 1];  row = img0[y];  below = img0[y + 1];
+        for (x = xmin; x < xmax; x++) {
+            gv = row[x];
+            if (gv <= thres)
+                continue;
+            
+            root = parent[labels[(y - ymin)*w + x - xmin]];
+            comp = comps + root;
+            if (comp->n == 0) {
+                comp->xa = comp->xb = x;
+                comp->ya = comp->yb = y;
+            }
+            comp->n++;
+            comp->sumg += gv;
+            comp->x += x * (gv - thres);
+            comp->y += y * (gv - thres);
+            if (x < comp->xa) comp->xa = x;
+            if (x > comp->xb) comp->xb = x;
+            comp->yb = y;
+            
+            if (!comp->seeded
+                && gv >= row[x-1] && gv >= row[x+1]
+                && gv >= above[x] && gv >= below[x]
+                && gv >= above[x-1] && gv >= below[x-1]
+                && gv >= above[x+1] && gv >= below[x+1])
+            {
+                comp->seeded = 1;
+                order[num_order++] = root;
+            }
+        }
+    }
+    
+    for (k = 0; k < num_order; k++) {
+        comp = comps + order[k];
+        if (!target_list_reserve(targs, n_targets + 1)) {
+            n_targets = -1;
+            goto done;
+        }
+        if (accept_target(targ_par, stats, comp->n, comp->xb - comp->xa + 1,
+            comp->yb - comp->ya + 1, comp->sumg, comp->x, comp->y, thres,
+            targs->pix + n_targets))
+        {
+            targs->pix[n_targets].tnr = CORRES_NONE;
+            targs->pix[n_targets].pnr = n_targets;
+            n_targets++;
+        }
+    }
+    
+done:
+    free(order);
+    free(comps);
+    free(max_buf);
+    free(parent);
+    free(labels);
+    return n_targets;
+}
+
+/*  targ_rec_tiles() is targ_rec() restricted to the live tiles of a tile 
+    mask: only live tiles are copied and scanned for peaks, and targets do not 
+    grow into dead tiles. Pixels masked by the static mask attached to the
+    tile mask, if any, are skipped like dead tiles.
+    
+    Arguments:
+    PIXEL *img, target_par *targ_par, int xmin, int xmax, int ymin, 
+    int ymax, control_par *cpar, int num_cam - see targ_rec().
+    tile_mask *mask - the tiles to search, or NULL for the whole image. Must
+        be made for the image size in cpar.
+    
+    Output:
+    target pix[] - see targ_rec(). Must have room for all targets found;
+        see targ_rec_buf() for a growable target list.
+    
+    Returns:
+    number of targets found, -1 if memory ran out.
+*/
+int PIXEL_FN(targ_rec_tiles) (PIXEL *img, target_par *targ_par, int xmin, 
+    int xmax, int ymin, int ymax, control_par *cpar, int num_cam, 
+    tile_mask *mask, target pix[])
+{
+    int n_targets = -1;
+    PIXEL *img0, **rows;
+    target_list targs;
+    
+    /* the caller's array is assumed large enough, never grown */
+    targs.pix = pix;
+    targs.cap = INT_MAX;
+    
+    img0 = (PIXEL *) malloc(cpar->imx * cpar->imy * sizeof(PIXEL));
+    rows = (PIXEL **) malloc(2 * cpar->imy * sizeof(PIXEL *));
+    
+    if (img0 != NULL && rows != NULL)
+        n_targets = PIXEL_FN(targ_rec_buf)(img, targ_par, xmin, xmax, ymin, 
+            ymax, cpar, num_cam, mask, img0, rows, NULL, &targs);
+    
+    free(rows);
+    free(img0);
+    return n_targets;
+}
+
+/*  targ_rec_buf() is targ_rec_tiles() with caller-supplied scratch memory,
+    so that a sequence of images is searched without allocating anything
+    per frame.
+    
+    Arguments:
+    PIXEL *img, target_par *targ_par, int xmin, int xmax, int ymin, 
+    int ymax, control_par *cpar, int num_cam, tile_mask *mask - see 
+        targ_rec_tiles().
+    PIXEL *img0 - scratch for the working copy of the image, imx*imy pixels.
+    PIXEL **rows - scratch for row tables, 2*imy pointers.
+    
+    Output:
+    targ_stats *stats - if not NULL, the statistics of the blobs found are 
+        added to it: histograms of the targets accepted and counts of the 
+        blobs rejected, see targ_stats.
+    target_list *targs - receives the targets, see targ_rec(); grown as 
+        needed.
+    
+    Returns:
+    number of targets found, -1 if memory ran out.
+*/
+int PIXEL_FN(targ_rec_buf) (PIXEL *img, target_par *targ_par, int xmin, 
+    int xmax, int ymin, int ymax, control_par *cpar, int num_cam, 
+    tile_mask *mask, PIXEL *img0, PIXEL **rows, targ_stats *stats, 
+    target_list *targs)
+{
+    register int  i;
+    int           n_targets=0;
+    int           thres, disco;
+    PIXEL **rows0;
+    grow_info info;
+
+    /* avoid many dereferences */
+    int imx, imy, row;
+    imx = cpar->imx;
+    imy = cpar->imy;
+
+    thres = targ_par->gvthres[num_cam];
+    disco = targ_par->discont;
+
+    /* copy image to a temporary mask, dead tiles are 0 */
+    if (mask != NULL)
+        memset(img0, 0, imx*imy*sizeof(PIXEL));
+    PIXEL_FN(copy_live)(img, img0, mask, imx, 0, imy);
+    
+    rows0 = rows + imy;
+    for (row = 0; row < imy; row++) {
+        rows[row] = img + row*imx;
+        rows0[row] = img0 + row*imx;
+    }
+
+    /* Make sure the min/max coordinates don't cause us to access memory
+       outside the image memory.
+    */
+    if (xmin <= 0) xmin = 1;
+    if (ymin <= 0) ymin = 1;
+    if (xmax >= imx) xmax = imx - 1;
+    if (ymax >= imy) ymax = imy - 1;
+    
+    /*  thresholding and connectivity analysis in image, run by run of live
+        tiles (a single run over the whole width without a mask) */
+    if (targ_par->engine == TARG_REC_UNION_FIND) {
+        n_targets = PIXEL_FN(label_components)(rows, rows0, thres, disco, 
+            xmin, xmax, ymin, ymax, targ_par, stats, targs, 0);
+    } else {
+        info.ymax = -1;
+        info.overflow = 0;
+        info.labels = NULL;
+        info.stats = stats;
+        for (i=ymin; i<ymax && n_targets >= 0; i++)
+            n_targets = PIXEL_FN(scan_row)(rows, rows0, i, mask, thres, 
+                disco, xmin, xmax, ymin, ymax, 0, imy, targ_par, &info, targs,
+                n_targets);
+    }
+    
+    /* protect pix from zero memory */
+    return protect_empty(targs, n_targets);
+}
+
+/*  targ_rec_parallel() is targ_rec_tiles() run on horizontal strips of the 
+    image in parallel (with OpenMP, where available), giving the same targets
+    in the same order.
+    
+    Each strip is first searched on its own, in a private working copy, with 
+    targets confined to the strip. The strips are then merged top to bottom 
+    into the working copy of the whole image, replaying the serial search: 
+    a strip's result is kept if none of its targets reached a seam, no 
+    earlier target grew into it, and no pixel claimed just above its top 
+    seam could have made a peak of its first row. Otherwise the strip is 
+    searched again serially, in the merged working copy, where its targets 
+    may cross seams freely. Sparse images thus run nearly fully in parallel, 
+    and blobs on the seams cost a serial pass over their strips only. The 
+    union-find engine always runs serially.
+    
+    Arguments:
+    PIXEL *img, target_par *targ_par, int xmin, int xmax, int ymin, 
+    int ymax, control_par *cpar, int num_cam, tile_mask *mask - see 
+        targ_rec_tiles().
+    int num_strips - number of strips, e.g. the number of threads. Values 
+        below 1 use the OpenMP thread count.
+    
+    Output:
+    targ_stats *stats - if not NULL, receives the detection statistics, see 
+        targ_rec_buf(). Strips searched again count only once.
+    target_list *targs - receives the targets, see targ_rec_buf().
+    
+    Returns:
+    number of targets found, or -1 if memory could not be allocated.
+*/
+int PIXEL_FN(targ_rec_parallel) (PIXEL *img, target_par *targ_par, int xmin, 
+    int xmax, int ymin, int ymax, control_par *cpar, int num_cam, 
+    tile_mask *mask, int num_strips, targ_stats *stats, target_list *targs)
+{
+    int imx = cpar->imx, imy = cpar->imy;
+    int thres = targ_par->gvthres[num_cam], disco = targ_par->discont;
+    int n_targets = 0, failed = 0, strip_rows, claimed_max, serial, row, i, j;
+    int k, y0, y1;
+    PIXEL *img0, **rows, **rows0;
+    strip_result *strips;
+    grow_info info;
+    
+    if (num_strips < 1) {
+#ifdef _OPENMP
+        num_strips = omp_get_max_threads();
+#else
+        num_strips = 1;
+#endif
+    }
+    
+    if (xmin <= 0) xmin = 1;
+    if (ymin <= 0) ymin = 1;
+    if (xmax >= imx) xmax = imx - 1;
+    if (ymax >= imy) ymax = imy - 1;
+    
+    /* strips of at least a few rows, so seams stay few */
+    strip_rows = (ymax - ymin + num_strips - 1) / num_strips;
+    if (strip_rows < 16) strip_rows = 16;
+    num_strips = (ymax - ymin > 0) ? 
+        (ymax - ymin + strip_rows - 1) / strip_rows : 1;
+    
+    img0 = (PIXEL *) calloc(imx*imy, sizeof(PIXEL));
+    rows = (PIXEL **) malloc(2 * imy * sizeof(PIXEL *));
+    strips = (strip_result *) calloc(num_strips, sizeof(strip_result));
+    if (img0 == NULL || rows == NULL || strips == NULL) {
+        free(img0); free(rows); free(strips);
+        return -1;
+    }
+    if (num_strips == 1 || targ_par->engine == TARG_REC_UNION_FIND) {
+        n_targets = PIXEL_FN(targ_rec_buf)(img, targ_par, xmin, xmax, ymin, 
+            ymax, cpar, num_cam, mask, img0, rows, stats, targs);
+        free(img0); free(rows); free(strips);
+        return n_targets;
+    }
+    PIXEL_FN(copy_live)(img, img0, mask, imx, 0, imy);
+    rows0 = rows + imy;
+    for (row = 0; row < imy; row++) {
+        rows[row] = img + row*imx;
+        rows0[row] = img0 + row*imx;
+    }
+    
+    /* Search the strips in parallel. Rows outside a strip are read from the
+       untouched merged copy, rows inside from a private one. 
+       
+       The Python bindings compile this file into every extension, sharing 
+       the object, so setup.py builds them all with the same OpenMP flags. */
+#ifdef _OPENMP
+#pragma omp parallel for schedule(dynamic, 1) private(i, row, y0, y1)
+#endif
+    for (k = 0; k < num_strips; k++) {
+        strip_result *res = strips + k;
+        PIXEL **srows0;
+        PIXEL *sbuf;
+        
+        y0 = ymin + k*strip_rows;
+        y1 = (y0 + strip_rows < ymax) ? y0 + strip_rows : ymax;
+        res->info.ymax = -1;
+        res->info.stats = (stats != NULL) ? &res->stats : NULL;
+        
+        sbuf = (PIXEL *) calloc((y1 - y0)*imx, sizeof(PIXEL));
+        srows0 = (PIXEL **) malloc(imy * sizeof(PIXEL *));
+        if (sbuf == NULL || srows0 == NULL) {
+            res->failed = 1;
+        } else {
+            PIXEL_FN(copy_live)(img, sbuf, mask, imx, y0, y1);
+            for (row = 0; row < imy; row++)
+                srows0[row] = (row >= y0 && row < y1) ? 
+                    sbuf + (row - y0)*imx : rows0[row];
+            
+            for (i = y0; i < y1 && res->num >= 0; i++)
+                res->num = PIXEL_FN(scan_row)(rows, srows0, i, mask, thres, 
+                    disco, xmin, xmax, ymin, ymax, y0, y1, targ_par, 
+                    &res->info, &res->targs, res->num);
+            if (res->num < 0)
+                res->failed = 1;
+            res->sbuf = sbuf;
+            res->y0 = y0;
+            res->y1 = y1;
+            sbuf = NULL;
+        }
+        free(sbuf);
+        free(srows0);
+    }
+    
+    for (k = 0; k < num_strips; k++)
+        if (strips[k].failed) failed = 1;
+    
+    /* Merge top to bottom, replaying the serial search where a strip's own
+       result may differ from it. */
+    claimed_max = -1;
+    for (k = 0; k < num_strips && !failed; k++) {
+        strip_result *res = strips + k;
+        y0 = res->y0;
+        y1 = res->y1;
+        
+        serial = res->info.overflow || claimed_max >= y0;
+        if (!serial && k > 0) {
+            /* A claimed pixel above the seam reads as 0 in the serial 
+               search, which could make a peak of a bright pixel below it. */
+            for (j = xmin; j < xmax && !serial; j++) {
+                if (rows0[y0 - 1][j] != 0 || img[(y0 - 1)*imx + j] <= thres)
+                    continue;
+                if (mask != NULL && !tile_mask_live_pixel(mask, j, y0 - 1))
+                    continue;   /* dead, not claimed */
+                if (img[y0*imx + j - 1] > thres || img[y0*imx + j] > thres 
+                    || img[y0*imx + j + 1] > thres)
+                {
+                    serial = 1;
+                }
+            }
+        }
+        
+        if (!serial) {
+            if (!target_list_reserve(targs, n_targets + res->num)) {
+                failed = 1;
+                break;
+            }
+            memcpy(rows0[y0], res->sbuf, (y1 - y0)*imx*sizeof(PIXEL));
+            if (stats != NULL)
+                targ_stats_add(stats, &res->stats);
+            for (i = 0; i < res->num; i++) {
+                targs->pix[n_targets] = res->targs.pix[i];
+                targs->pix[n_targets].pnr = n_targets;
+                n_targets++;
+            }
+            continue;
+        }
+        
+        info.ymax = -1;
+        info.overflow = 0;
+        info.labels = NULL;
+        info.stats = stats;
+        for (i = y0; i < y1 && n_targets >= 0; i++)
+            n_targets = PIXEL_FN(scan_row)(rows, rows0, i, mask, thres, 
+                disco, xmin, xmax, ymin, ymax, 0, imy, targ_par, &info, targs,
+                n_targets);
+        if (n_targets < 0) {
+            failed = 1;
+            break;
+        }
+        if (info.ymax > claimed_max)
+            claimed_max = info.ymax;
+    }
+    
+    for (k = 0; k < num_strips; k++) {
+        free(strips[k].sbuf);
+        free(strips[k].targs.pix);
+    }
+    free(strips);
+    free(rows);
+    free(img0);
+    
+    if (failed)
+        return -1;
+    return protect_empty(targs, n_targets);
+}
+
+/*  targ_rec_labels() is targ_rec_tiles() that also labels the pixels of each 
+    blob grown, whether accepted as a target or not, with the blob's number: 
+    1 for the first blob grown, in the order of the peak scan. Pixels of no 
+    blob are left as they are.
+    
+    Arguments:
+    PIXEL *img, target_par *targ_par, int xmin, int xmax, int ymin, 
+    int ymax, control_par *cpar, int num_cam, tile_mask *mask - see 
+        targ_rec_tiles().
+    
+    Output:
+    int *labels - imx*imy blob numbers, to be zeroed by the caller.
+    target_list *targs - receives the targets, see targ_rec_buf().
+    
+    Returns:
+    number of blobs labeled, -1 if memory ran out.
+*/
+int PIXEL_FN(targ_rec_labels) (PIXEL *img, target_par *targ_par, int xmin, 
+    int xmax, int ymin, int ymax, control_par *cpar, int num_cam, 
+    tile_mask *mask, int *labels, target_list *targs)
+{
+    int imx = cpar->imx, imy = cpar->imy, row, i, n_targets = 0;
+    PIXEL *img0, **rows, **rows0;
+    grow_info info;
+    
+    img0 = (PIXEL *) calloc(imx*imy, sizeof(PIXEL));
+    rows = (PIXEL **) malloc(2 * imy * sizeof(PIXEL *));
+    if (img0 == NULL || rows == NULL) {
+        free(img0);
+        free(rows);
+        return -1;
+    }
+    PIXEL_FN(copy_live)(img, img0, mask, imx, 0, imy);
+    rows0 = rows + imy;
+    for (row = 0; row < imy; row++) {
+        rows[row] = img + row*imx;
+        rows0[row] = img0 + row*imx;
+    }
+    
+    info.ymax = -1;
+    info.overflow = 0;
+    info.labels = labels;
+    info.imx = imx;
+    info.num_blobs = 0;
+    info.stats = NULL;
+    
+    if (xmin <= 0) xmin = 1;
+    if (ymin <= 0) ymin = 1;
+    if (xmax >= imx) xmax = imx - 1;
+    if (ymax >= imy) ymax = imy - 1;
+    
+    for (i = ymin; i < ymax && n_targets >= 0; i++)
+        n_targets = PIXEL_FN(scan_row)(rows, rows0, i, mask, 
+            targ_par->gvthres[num_cam], targ_par->discont, xmin, xmax, ymin, 
+            ymax, 0, imy, targ_par, &info, targs, n_targets);
+    
+    free(rows);
+    free(img0);
+    return (n_targets < 0) ? -1 : info.num_blobs;
+}
@@ -0,0 +1,431 @@
+/****************************************************************************
+
+Tile masks mark the parts of an image that are worth processing, in units of
+square tiles. Large image areas outside the illuminated volume can then be 
+skipped by the preprocessing and target recognition routines.
+
+A mask is either filled in explicitly (tile_mask_set_rect()) or derived from
+the observed volume and the camera calibration (tile_mask_from_volume()).
+
+Static camera masks (the mask images of subtract_mask()) are kept as 
+run-length spans of the pixels to process in each row, and attached to a 
+tile mask with tile_mask_set_spans(). The routines that iterate over the live
+area with tile_mask_next_span() then skip the masked pixels as they go, 
+instead of spending a full pass over each image on zeroing them.
+
+****************************************************************************/
+
+#include <stdlib.h>
+#include <string.h>
+#include "tile_mask.h"
+#include "trafo.h"
+#include "ray_tracing.h"
+#include "multimed.h"
+
+/* Number of samples per tile side, and along each ray through the volume,
+   used by tile_mask_from_volume(). */
+#define VOLUME_TILE_SAMPLES 4
+#define VOLUME_RAY_SAMPLES 16
+
+/*  tile_mask_new() allocates a mask for an image, with all tiles dead.
+    
+    Arguments:
+    int imx, imy - image size in pixels.
+    int tile_size - side of a tile in pixels. Tiles on the right and bottom 
+        image edges may be smaller.
+    
+    Returns:
+    the new mask, or NULL on allocation failure or invalid sizes.
+*/
+tile_mask *tile_mask_new(int imx, int imy, int tile_size) {
+    tile_mask *mask;
+    
+    if (imx <= 0 || imy <= 0 || tile_size <= 0) return NULL;
+    
+    mask = (tile_mask *) malloc(sizeof(tile_mask));
+    if (mask == NULL) return NULL;
+    
+    mask->imx = imx;
+    mask->imy = imy;
+    mask->tile_size = tile_size;
+    mask->ntx = (imx + tile_size - 1) / tile_size;
+    mask->nty = (imy + tile_size - 1) / tile_size;
+    mask->spans = NULL;
+    mask->live = (unsigned char *) calloc(mask->ntx * mask->nty, 1);
+    if (mask->live == NULL) {
+        free(mask);
+        return NULL;
+    }
+    return mask;
+}
+
+/*  tile_mask_free() releases the memory of a mask created by tile_mask_new().
+    An attached span mask is not freed.
+*/
+void tile_mask_free(tile_mask *mask) {
+    if (mask == NULL) return;
+    free(mask->live);
+    free(mask);
+}
+
+/*  tile_mask_set_rect() marks all tiles overlapping a pixel rectangle as live
+    or dead.
+    
+    Arguments:
+    tile_mask *mask - the mask to modify.
+    int xmin, xmax, ymin, ymax - the rectangle, in pixels. Minimum inclusive,
+        maximum exclusive. Clipped to the image.
+    int live - 1 to mark the tiles live, 0 to mark them dead.
+*/
+void tile_mask_set_rect(tile_mask *mask, int xmin, int xmax, int ymin, int ymax,
+    int live)
+{
+    int tx, ty, tx0, tx1, ty0, ty1;
+    
+    if (xmin < 0) xmin = 0;
+    if (ymin < 0) ymin = 0;
+    if (xmax > mask->imx) xmax = mask->imx;
+    if (ymax > mask->imy) ymax = mask->imy;
+    if (xmin >= xmax || ymin >= ymax) return;
+    
+    tx0 = xmin / mask->tile_size;
+    tx1 = (xmax - 1) / mask->tile_size;
+    ty0 = ymin / mask->tile_size;
+    ty1 = (ymax - 1) / mask->tile_size;
+    
+    for (ty = ty0; ty <= ty1; ty++)
+        for (tx = tx0; tx <= tx1; tx++)
+            mask->live[ty*mask->ntx + tx] = (live != 0);
+}
+
+/*  tile_mask_dilate() grows the live area by a number of tiles in every 
+    direction (including diagonals), e.g. to keep targets that straddle the
+    border of the live area whole.
+    
+    Arguments:
+    tile_mask *mask - the mask to modify.
+    int tiles - number of tiles to grow by.
+*/
+void tile_mask_dilate(tile_mask *mask, int tiles) {
+    int tx, ty, step;
+    int ntx = mask->ntx, nty = mask->nty;
+    unsigned char *src;
+    
+    if (tiles <= 0) return;
+    src = (unsigned char *) malloc(ntx * nty);
+    if (src == NULL) return;
+    
+    /* Repeated 3x3 dilation; masks are small, this is cheap. */
+    for (step = 0; step < tiles; step++) {
+        memcpy(src, mask->live, ntx * nty);
+        for (ty = 0; ty < nty; ty++) {
+            for (tx = 0; tx < ntx; tx++) {
+                if (!src[ty*ntx + tx]) continue;
+                tile_mask_set_rect(mask, 
+                    (tx - 1) * mask->tile_size, (tx + 2) * mask->tile_size,
+                    (ty - 1) * mask->tile_size, (ty + 2) * mask->tile_size, 1);
+            }
+        }
+    }
+    free(src);
+}
+
+/*  tile_mask_next_run() finds the next horizontal run of live tiles in a row
+    of tiles. Used for iterating over the live area row by row:
+    
+        tx = 0;
+        while (tile_mask_next_run(mask, ty, &tx, &x0, &x1)) { ... }
+    
+    Arguments:
+    tile_mask *mask - the mask to search.
+    int ty - index of the row of tiles.
+    int *tx - input: tile column to start searching from. Output: the tile 
+        column after the run found.
+    
+    Output:
+    int *x0, *x1 - pixel columns of the run. x0 inclusive, x1 exclusive.
+    
+    Returns:
+    1 if a run was found, 0 if the rest of the row is dead.
+*/
+int tile_mask_next_run(tile_mask *mask, int ty, int *tx, int *x0, int *x1) {
+    unsigned char *row = mask->live + ty*mask->ntx;
+    int start, end;
+    
+    for (start = *tx; start < mask->ntx && !row[start]; start++);
+    if (start >= mask->ntx) {
+        *tx = mask->ntx;
+        return 0;
+    }
+    for (end = start; end < mask->ntx && row[end]; end++);
+    
+    *tx = end;
+    *x0 = start * mask->tile_size;
+    *x1 = end * mask->tile_size;
+    if (*x1 > mask->imx) *x1 = mask->imx;
+    return 1;
+}
+
+/*  tile_mask_live_tiles() returns the number of live tiles in a mask. */
+int tile_mask_live_tiles(tile_mask *mask) {
+    int i, count = 0;
+    for (i = 0; i < mask->ntx * mask->nty; i++)
+        if (mask->live[i]) count++;
+    return count;
+}
+
+/*  span_mask_from_image() converts a static mask image to run-length spans.
+    
+    Arguments:
+    unsigned char *mask_img - imx*imy mask, row-major. Like in subtract_mask(),
+        pixels are processed where the mask is nonzero and masked where it is 
+        0.
+    int imx, imy - image size in pixels.
+    
+    Returns:
+    the new span mask, or NULL on allocation failure or invalid sizes.
+*/
+span_mask *span_mask_from_image(unsigned char *mask_img, int imx, int imy) {
+    span_mask *spans;
+    unsigned char *row;
+    int x, y, x0, num = 0;
+    
+    if (imx <= 0 || imy <= 0) return NULL;
+    
+    /* Count the spans first, then fill them in. */
+    for (y = 0; y < imy; y++) {
+        row = mask_img + y*imx;
+        for (x = 0; x < imx; x++)
+            if (row[x] && (x == 0 || !row[x - 1])) num++;
+    }
+    
+    spans = (span_mask *) malloc(sizeof(span_mask));
+    if (spans == NULL) return NULL;
+    spans->imx = imx;
+    spans->imy = imy;
+    spans->row_start = (int *) malloc((imy + 1) * sizeof(int));
+    spans->spans = (int *) malloc((2*num + 1) * sizeof(int));
+    if (spans->row_start == NULL || spans->spans == NULL) {
+        span_mask_free(spans);
+        return NULL;
+    }
+    
+    num = 0;
+    for (y = 0; y < imy; y++) {
+        row = mask_img + y*imx;
+        spans->row_start[y] = num;
+        for (x = 0; x < imx; ) {
+            for (; x < imx && !row[x]; x++);
+            if (x >= imx) break;
+            for (x0 = x; x < imx && row[x]; x++);
+            spans->spans[2*num] = x0;
+            spans->spans[2*num + 1] = x;
+            num++;
+        }
+    }
+    spans->row_start[imy] = num;
+    return spans;
+}
+
+/*  span_mask_free() releases the memory of a span mask. */
+void span_mask_free(span_mask *spans) {
+    if (spans == NULL) return;
+    free(spans->row_start);
+    free(spans->spans);
+    free(spans);
+}
+
+/*  span_mask_live_pixels() returns the number of pixels to process. */
+int span_mask_live_pixels(span_mask *spans) {
+    int k, count = 0;
+    for (k = 0; k < spans->row_start[spans->imy]; k++)
+        count += spans->spans[2*k + 1] - spans->spans[2*k];
+    return count;
+}
+
+/*  tile_mask_set_spans() attaches a static mask to a tile mask, and kills the 
+    tiles it masks completely, so that they are skipped as a whole.
+    
+    Arguments:
+    tile_mask *mask - the mask to modify.
+    span_mask *spans - the static mask, which must stay allocated while 
+        attached. NULL detaches the static mask; the tiles it killed stay 
+        dead.
+    
+    Returns:
+    1 on success, 0 if the static mask was made for another image size.
+*/
+int tile_mask_set_spans(tile_mask *mask, span_mask *spans) {
+    int tx, ty, y, y1, k, x0, x1, first, last, live;
+    
+    if (spans == NULL) {
+        mask->spans = NULL;
+        return 1;
+    }
+    if (spans->imx != mask->imx || spans->imy != mask->imy) return 0;
+    
+    for (ty = 0; ty < mask->nty; ty++) {
+        y1 = (ty + 1) * mask->tile_size;
+        if (y1 > mask->imy) y1 = mask->imy;
+        
+        for (tx = 0; tx < mask->ntx; tx++) {
+            if (!mask->live[ty*mask->ntx + tx]) continue;
+            x0 = tx * mask->tile_size;
+            x1 = x0 + mask->tile_size;
+            
+            live = 0;
+            for (y = ty * mask->tile_size; y < y1 && !live; y++) {
+                first = spans->row_start[y];
+                last = spans->row_start[y + 1];
+                for (k = first; k < last && !live; k++)
+                    live = (spans->spans[2*k] < x1 && spans->spans[2*k + 1] > x0);
+            }
+            mask->live[ty*mask->ntx + tx] = live;
+        }
+    }
+    mask->spans = spans;
+    return 1;
+}
+
+/*  tile_mask_next_span() finds the next span of pixels to process in an 
+    image row: the next part of a live tile run that the static mask, if 
+    any, does not mask. Used like tile_mask_next_run(), for a pixel row:
+    
+        cursor = 0;
+        while (tile_mask_next_span(mask, y, &cursor, &x0, &x1)) { ... }
+    
+    Arguments:
+    tile_mask *mask - the mask to search.
+    int y - the image row.
+    int *cursor - input: pixel column to start searching from. Output: the 
+        column after the span found.
+    
+    Output:
+    int *x0, *x1 - pixel columns of the span. x0 inclusive, x1 exclusive.
+    
+    Returns:
+    1 if a span was found, 0 if the rest of the row is not processed.
+*/
+int tile_mask_next_span(tile_mask *mask, int y, int *cursor, int *x0, int *x1) 
+{
+    span_mask *spans = mask->spans;
+    int tx, run_x0, run_x1, lo, hi, mid, last;
+    
+    while (*cursor < mask->imx) {
+        tx = *cursor / mask->tile_size;
+        if (!tile_mask_next_run(mask, y / mask->tile_size, &tx, &run_x0, 
+            &run_x1)) 
+        {
+            break;
+        }
+        if (run_x0 < *cursor) run_x0 = *cursor;
+        
+        if (spans == NULL) {
+            *x0 = run_x0;
+            *x1 = *cursor = run_x1;
+            return 1;
+        }
+        
+        /* First span of the row ending after the run starts, by bisection */
+        lo = spans->row_start[y];
+        last = hi = spans->row_start[y + 1];
+        while (lo < hi) {
+            mid = (lo + hi) / 2;
+            if (spans->spans[2*mid + 1] <= run_x0) lo = mid + 1;
+            else hi = mid;
+        }
+        if (lo == last) break;
+        
+        if (spans->spans[2*lo] >= run_x1) {
+            /* masked to the end of the run */
+            *cursor = spans->spans[2*lo];
+            continue;
+        }
+        *x0 = (spans->spans[2*lo] > run_x0) ? spans->spans[2*lo] : run_x0;
+        *x1 = (spans->spans[2*lo + 1] < run_x1) ? spans->spans[2*lo + 1] : run_x1;
+        *cursor = *x1;
+        return 1;
+    }
+    *cursor = mask->imx;
+    return 0;
+}
+
+/*  tile_mask_live_pixel() returns 1 if pixel (x, y) is processed under the 
+    mask: its tile is live and the static mask, if any, does not mask it. */
+int tile_mask_live_pixel(tile_mask *mask, int x, int y) {
+    int cursor = x, x0, x1;
+    return tile_mask_next_span(mask, y, &cursor, &x0, &x1) && x0 == x;
+}
+
+/*  ray_hits_volume() checks whether a ray passes through the observed volume,
+    by sampling points along it between the extreme Z values of the volume.
+    The volume is bounded in X and Z as described by volume_par; like 
+    elsewhere in liboptv, it is not bounded in Y.
+*/
+static int ray_hits_volume(vec3d vertex, vec3d direct, volume_par *vpar) {
+    int i;
+    double Z, Zlo, Zhi, Zmin, Zmax, frac;
+    vec3d pos;
+    
+    Zlo = (vpar->Zmin_lay[0] < vpar->Zmin_lay[1]) ? 
+        vpar->Zmin_lay[0] : vpar->Zmin_lay[1];
+    Zhi = (vpar->Zmax_lay[0] > vpar->Zmax_lay[1]) ? 
+        vpar->Zmax_lay[0] : vpar->Zmax_lay[1];
+    
+    for (i = 0; i < VOLUME_RAY_SAMPLES; i++) {
+        Z = Zlo + (Zhi - Zlo) * i / (VOLUME_RAY_SAMPLES - 1);
+        move_along_ray(Z, vertex, direct, pos);
+        
+        if (pos[0] < vpar->X_lay[0] || pos[0] > vpar->X_lay[1]) continue;
+        
+        frac = (vpar->X_lay[1] == vpar->X_lay[0]) ? 0 :
+            (pos[0] - vpar->X_lay[0]) / (vpar->X_lay[1] - vpar->X_lay[0]);
+        Zmin = vpar->Zmin_lay[0] + frac * (vpar->Zmin_lay[1] - vpar->Zmin_lay[0]);
+        Zmax = vpar->Zmax_lay[0] + frac * (vpar->Zmax_lay[1] - vpar->Zmax_lay[0]);
+        if (Z >= Zmin && Z <= Zmax) return 1;
+    }
+    return 0;
+}
+
+/*  tile_mask_from_volume() marks live every tile through which the camera 
+    sees part of the observed volume. Rays through a grid of points in each
+    tile are traced into the volume and sampled along its depth; since this is
+    a sampling test, callers will usually want to tile_mask_dilate() the 
+    result by a tile.
+    
+    Tiles already marked live are left live.
+    
+    Arguments:
+    tile_mask *mask - the mask to fill in.
+    Calibration *cal - the camera's calibration.
+    control_par *cpar - image size, pixel size and multimedia parameters.
+    volume_par *vpar - the observed volume.
+*/
+void tile_mask_from_volume(tile_mask *mask, Calibration *cal, 
+    control_par *cpar, volume_par *vpar)
+{
+    int tx, ty, sx, sy, hit;
+    double px, py, x, y, step;
+    vec3d vertex, direct;
+    
+    step = (double) mask->tile_size / VOLUME_TILE_SAMPLES;
+    
+    for (ty = 0; ty < mask->nty; ty++) {
+        for (tx = 0; tx < mask->ntx; tx++) {
+            if (mask->live[ty*mask->ntx + tx]) continue;
+            
+            for (hit = 0, sy = 0; sy <= VOLUME_TILE_SAMPLES && !hit; sy++) {
+                for (sx = 0; sx <= VOLUME_TILE_SAMPLES && !hit; sx++) {
+                    px = tx * mask->tile_size + sx * step;
+                    py = ty * mask->tile_size + sy * step;
+                    
+                    pixel_to_metric(&x, &y, px, py, cpar);
+                    dist_to_flat(x, y, cal, &x, &y, 0.00001);
+                    ray_tracing(x, y, cal, *(cpar->mm), vertex, direct);
+                    hit = ray_hits_volume(vertex, direct, vpar);
+                }
+            }
+            mask->live[ty*mask->ntx + tx] = hit;
+        }
+    }
+}
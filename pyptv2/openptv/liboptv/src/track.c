@@ -680,7 +680,7 @@ int assess_new_position(vec3d pos, vec2d targ_pos[],
  * frame, along with associated targets.
  * 
  * Arguments:
- * frame *frm - the frame to store the particle.
+ * frame *frm - the frame to store the particle, grown if it is full.
  * vec3d pos - position of inserted particle in the global coordinates.
  * int cand_inds[][MAX_CANDS] - indices of candidate targets for association
  *    with this particle.
@@ -692,6 +692,12 @@ void add_particle(frame *frm, vec3d pos, int cand_inds[][MAX_CANDS]) {
     target **ref_targets;
     
     num_parts = frm->num_parts;
+    if (num_parts >= frm->max_targets 
+        && !frame_grow(frm, 2*frm->max_targets + 1)) 
+    {
+        printf("Out of memory adding a particle, skipped.\n");
+        return;
+    }
     ref_path_inf = &(frm->path_info[num_parts]);
     vec_copy(ref_path_inf->x, pos);
     reset_links(ref_path_inf);
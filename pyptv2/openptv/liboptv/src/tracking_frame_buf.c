@@ -9,6 +9,7 @@ reading targets, correspondences, etc.
 #include <string.h>
 #include <stdio.h>
 #include <stdlib.h>
+#include <limits.h>
 #include "tracking_frame_buf.h"
 
 /* Check that target t1 is equal to target t2, i.e. all their fields are equal.
@@ -26,25 +27,56 @@ int compare_targets(target *t1, target *t2) {
         (t1->sumg == t2->sumg) && (t1->tnr == t2->tnr));
 }
 
-/* Reads targets from a file. The number of targets is read from the first
- * line, then each line is one target.
+/* Binary _targets files: a 16-byte header - the magic TARGETS_BIN_MAGIC, 
+ * the number of targets and the record size as 32-bit integers - followed by
+ * one packed record per target, in the byte order of the writing machine: 
+ * pnr, x, y, n, nx, ny, sumg, tnr as in the target struct, without its 
+ * padding.
+ */
+#define TARGET_RECORD_SIZE 40
+
+static void pack_target(char *rec, target *t) {
+    memcpy(rec, &(t->pnr), 4);
+    memcpy(rec + 4, &(t->x), 8);
+    memcpy(rec + 12, &(t->y), 8);
+    memcpy(rec + 20, &(t->n), 4);
+    memcpy(rec + 24, &(t->nx), 4);
+    memcpy(rec + 28, &(t->ny), 4);
+    memcpy(rec + 32, &(t->sumg), 4);
+    memcpy(rec + 36, &(t->tnr), 4);
+}
+
+static void unpack_target(target *t, char *rec) {
+    memcpy(&(t->pnr), rec, 4);
+    memcpy(&(t->x), rec + 4, 8);
+    memcpy(&(t->y), rec + 12, 8);
+    memcpy(&(t->n), rec + 20, 4);
+    memcpy(&(t->nx), rec + 24, 4);
+    memcpy(&(t->ny), rec + 28, 4);
+    memcpy(&(t->sumg), rec + 32, 4);
+    memcpy(&(t->tnr), rec + 36, 4);
+}
+
+/* Opens a targets file, text or binary, and reads the number of targets in 
+ * it, leaving the file at the first target.
  * 
  * Arguments:
- * target buffer[] - an allocated array of target structs to fill in from
- *   files.
- * char* file_base - base name of the files to read, to which a frame number
- *   and the suffix '_targets' is added.
- * int frame_num - number of frame to add to file_base. A value of 0 or less
- *   means that no frame number should be added.
+ * char* file_base, int frame_num - see read_targets().
+ * 
+ * Output:
+ * char *filein - the file name, at least STR_MAX_LEN + 1 long.
+ * int *num_targets - the number of targets in the file.
+ * int *binary - whether the file is a binary one.
  * 
  * Returns:
- * the number of targets found in the file, or -1 if an error occurred.
+ * the open file, or NULL if an error occurred.
 */
-
-int read_targets(target buffer[], char* file_base, int frame_num) {
+static FILE *open_targets(char* file_base, int frame_num, char *filein, 
+    int *num_targets, int *binary) 
+{
     FILE *FILEIN;
-    int	tix, num_targets, scanf_ok;
-    char filein[STR_MAX_LEN + 1];
+    int header[2];
+    char magic[sizeof(TARGETS_BIN_MAGIC) - 1];
 
     if (frame_num > 0) {
         sprintf(filein, "%s%04d%s", file_base, frame_num, "_targets");
@@ -53,37 +85,184 @@ int read_targets(target buffer[], char* file_base, int frame_num) {
         strncat(filein, "_targets", STR_MAX_LEN);
     }
     
-    FILEIN = fopen (filein, "r");
+    FILEIN = fopen (filein, "rb");
     if (! FILEIN) {
         printf("Can't open ascii file: %s\n", filein);
-        goto handle_error;
+        return NULL;
     }
-
-    if (fscanf(FILEIN, "%d\n", &num_targets) == 0) {
-        printf("Bad format for file: %s\n", filein);
-        goto handle_error;
+    
+    *binary = (fread(magic, 1, sizeof(magic), FILEIN) == sizeof(magic)
+        && memcmp(magic, TARGETS_BIN_MAGIC, sizeof(magic)) == 0);
+    if (*binary) {
+        if (fread(header, sizeof(int), 2, FILEIN) != 2 || header[0] < 0 
+            || header[1] != TARGET_RECORD_SIZE)
+        {
+            printf("Bad format for file: %s\n", filein);
+            fclose (FILEIN);
+            return NULL;
+        }
+        *num_targets = header[0];
+        return FILEIN;
     }
-    for (tix = 0; tix < num_targets; tix++)	{
-	  scanf_ok = fscanf (FILEIN, "%d %lf %lf %d %d %d %d %d\n",
-		  &(buffer[tix].pnr),  &(buffer[tix].x),
-		  &(buffer[tix].y),    &(buffer[tix].n),
-		  &(buffer[tix].nx),   &(buffer[tix].ny),
-		  &(buffer[tix].sumg), &(buffer[tix].tnr) );
-      
-      if (scanf_ok == 0) {
+    
+    rewind(FILEIN);
+    if (fscanf(FILEIN, "%d\n", num_targets) != 1 || *num_targets < 0) {
         printf("Bad format for file: %s\n", filein);
-        goto handle_error;
-      }
-	}
+        fclose (FILEIN);
+        return NULL;
+    }
+    return FILEIN;
+}
+
+/* Reads the targets of a file opened by open_targets() and closes it. The
+ * binary records are read with one bulk read.
+ * 
+ * Arguments:
+ * target buffer[] - room for num_targets targets.
+ * int num_targets - the number of targets in the file.
+ * FILE *FILEIN, char *filein, int binary - see open_targets().
+ * 
+ * Returns:
+ * the number of targets, or -1 if an error occurred.
+*/
+static int read_target_records(target buffer[], int num_targets, 
+    FILE *FILEIN, char *filein, int binary) 
+{
+    int tix, scanf_ok;
+    char *recs;
+    
+    if (binary && num_targets > 0) {
+        recs = (char *) malloc((size_t) num_targets * TARGET_RECORD_SIZE);
+        if (recs == NULL) {
+            printf("Out of memory reading file: %s\n", filein);
+            goto handle_error;
+        }
+        if (fread(recs, TARGET_RECORD_SIZE, num_targets, FILEIN) 
+            != (size_t) num_targets)
+        {
+            printf("Bad format for file: %s\n", filein);
+            free(recs);
+            goto handle_error;
+        }
+        for (tix = 0; tix < num_targets; tix++)
+            unpack_target(buffer + tix, recs + tix*TARGET_RECORD_SIZE);
+        free(recs);
+    } 
+    else if (!binary) {
+        for (tix = 0; tix < num_targets; tix++)	{
+            scanf_ok = fscanf (FILEIN, "%d %lf %lf %d %d %d %d %d\n",
+                &(buffer[tix].pnr),  &(buffer[tix].x),
+                &(buffer[tix].y),    &(buffer[tix].n),
+                &(buffer[tix].nx),   &(buffer[tix].ny),
+                &(buffer[tix].sumg), &(buffer[tix].tnr) );
+            
+            if (scanf_ok == 0) {
+                printf("Bad format for file: %s\n", filein);
+                goto handle_error;
+            }
+        }
+    }
     
     fclose (FILEIN);
-	return num_targets;
+    return num_targets;
 
 handle_error:
-    if (FILEIN != NULL) fclose (FILEIN);
+    fclose (FILEIN);
     return -1;
 }
 
+/* Reads targets from a file, either a text file - the number of targets on 
+ * the first line, then each line is one target - or a binary file written 
+ * by write_targets_bin(), told apart by its magic.
+ * 
+ * Arguments:
+ * target buffer[] - an allocated array of target structs to fill in from
+ *   files, with room for all the targets of the file. Use read_targets_max()
+ *   or read_targets_alloc() when that is not known.
+ * char* file_base - base name of the files to read, to which a frame number
+ *   and the suffix '_targets' is added.
+ * int frame_num - number of frame to add to file_base. A value of 0 or less
+ *   means that no frame number should be added.
+ * 
+ * Returns:
+ * the number of targets found in the file, or -1 if an error occurred.
+*/
+
+int read_targets(target buffer[], char* file_base, int frame_num) {
+    return read_targets_max(buffer, INT_MAX, file_base, frame_num);
+}
+
+/* Reads targets from a file like read_targets(), into a buffer of known 
+ * size. A file with more targets than that is not read.
+ * 
+ * Arguments:
+ * target buffer[] - an allocated array of max_targets target structs.
+ * int max_targets - the number of targets the buffer has room for.
+ * char* file_base, int frame_num - see read_targets().
+ * 
+ * Returns:
+ * the number of targets found in the file, or -1 if an error occurred or 
+ * the file has more than max_targets targets.
+*/
+int read_targets_max(target buffer[], int max_targets, char* file_base, 
+    int frame_num) 
+{
+    FILE *FILEIN;
+    int num_targets, binary;
+    char filein[STR_MAX_LEN + 1];
+    
+    FILEIN = open_targets(file_base, frame_num, filein, &num_targets, &binary);
+    if (FILEIN == NULL) return -1;
+    
+    if (num_targets > max_targets) {
+        printf("Too many targets (%d, room for %d) in file: %s\n", 
+            num_targets, max_targets, filein);
+        fclose (FILEIN);
+        return -1;
+    }
+    return read_target_records(buffer, num_targets, FILEIN, filein, binary);
+}
+
+/* Reads targets from a file like read_targets(), growing the buffer to the
+ * number of targets in the file if it is too small.
+ * 
+ * Arguments:
+ * target **buffer - points to a malloc()ed array of target structs, or to 
+ *   NULL. It is reallocated if the file has more than *max_targets targets.
+ * int *max_targets - the number of targets *buffer has room for, updated 
+ *   when it is reallocated.
+ * char* file_base, int frame_num - see read_targets().
+ * 
+ * Returns:
+ * the number of targets found in the file, or -1 if an error occurred or 
+ * memory ran out. The buffer is kept, and stays the caller's to free.
+*/
+int read_targets_alloc(target **buffer, int *max_targets, char* file_base, 
+    int frame_num) 
+{
+    FILE *FILEIN;
+    int num_targets, binary;
+    char filein[STR_MAX_LEN + 1];
+    target *grown;
+    
+    FILEIN = open_targets(file_base, frame_num, filein, &num_targets, &binary);
+    if (FILEIN == NULL) return -1;
+    
+    if (*buffer == NULL || num_targets > *max_targets) {
+        /* Room for at least one, so an empty file gives a valid buffer. */
+        grown = (target *) realloc(*buffer, 
+            (num_targets > 0 ? num_targets : 1) * sizeof(target));
+        if (grown == NULL) {
+            printf("Out of memory reading file: %s\n", filein);
+            fclose (FILEIN);
+            return -1;
+        }
+        *buffer = grown;
+        *max_targets = num_targets > 0 ? num_targets : 1;
+    }
+    return read_target_records(*buffer, num_targets, FILEIN, filein, binary);
+}
+
 /* Writes targets to a file. The number of targets is written to the first
  * line, then each line is one target.
  * 
@@ -141,6 +320,62 @@ finalize:
     return success;
 }
 
+/* Writes targets to a binary file, see read_targets(), with one bulk write.
+ * Much faster to write and read than the text format, for many targets.
+ * 
+ * Arguments:
+ * target buffer[], int num_targets, char* file_base, int frame_num - see 
+ *   write_targets().
+ * 
+ * Returns:
+ * True value on success, or 0 if an error occurred.
+*/
+int write_targets_bin(target buffer[], int num_targets, char* file_base, \
+    int frame_num) {
+    
+    FILE *FILEOUT = NULL;
+    int	tix, header[2], success = 0;
+    char fileout[STR_MAX_LEN + 1], *recs;
+    
+    if (frame_num == 0){
+        sprintf(fileout, "%s%s", file_base, "_targets");
+    } else {
+        sprintf(fileout, "%s%04d%s", file_base, frame_num, "_targets");
+    }
+    
+    recs = (char *) malloc(num_targets * TARGET_RECORD_SIZE + 1);
+    if (recs == NULL) {
+        printf("Out of memory writing file %s\n", fileout);
+        goto finalize;
+    }
+    for (tix = 0; tix < num_targets; tix++)
+        pack_target(recs + tix*TARGET_RECORD_SIZE, buffer + tix);
+    
+    FILEOUT = fopen(fileout, "wb");
+    if (! FILEOUT) {
+        printf("Can't open binary file: %s\n", fileout);
+        goto finalize;
+    }
+    
+    header[0] = num_targets;
+    header[1] = TARGET_RECORD_SIZE;
+    if (fwrite(TARGETS_BIN_MAGIC, 1, sizeof(TARGETS_BIN_MAGIC) - 1, FILEOUT)
+            != sizeof(TARGETS_BIN_MAGIC) - 1
+        || fwrite(header, sizeof(int), 2, FILEOUT) != 2
+        || fwrite(recs, TARGET_RECORD_SIZE, num_targets, FILEOUT) 
+            != (size_t) num_targets)
+    {
+        printf("Write error in file %s\n", fileout);
+        goto finalize;
+    }
+    success = 1;
+
+finalize:
+    if (FILEOUT != NULL) fclose (FILEOUT);
+    free(recs);
+    return success;
+}
+
 /* Check that two correspondence structs are equal, i.e. all their fields are 
  * equal.
  * 
@@ -451,6 +686,49 @@ void frame_init(frame *new_frame, int num_cams, int max_targets) {
     new_frame->num_parts = 0;
 }
 
+/* frame_grow() makes room in a frame's buffers for at least max_targets 
+ * particles, and as many targets per camera, keeping their contents. The 
+ * new elements are zeroed like those of frame_init().
+ *  
+ * Arguments:
+ * frame *self - the frame to grow.
+ * int max_targets - the number of elements the buffers need.
+ * 
+ * Returns:
+ * True on success, false if memory ran out. The frame is then unchanged, 
+ * except that some of its buffers may have grown.
+ */
+int frame_grow(frame *self, int max_targets) {
+    int cam, old_max = self->max_targets;
+    P *path_info;
+    corres *correspond;
+    target *targets;
+    
+    if (max_targets <= old_max) return 1;
+    
+    path_info = (P *) realloc(self->path_info, max_targets * sizeof(P));
+    if (path_info == NULL) return 0;
+    memset(path_info + old_max, 0, (max_targets - old_max) * sizeof(P));
+    self->path_info = path_info;
+    
+    correspond = (corres *) realloc(self->correspond, 
+        max_targets * sizeof(corres));
+    if (correspond == NULL) return 0;
+    memset(correspond + old_max, 0, (max_targets - old_max) * sizeof(corres));
+    self->correspond = correspond;
+    
+    for (cam = 0; cam < self->num_cams; cam++) {
+        targets = (target *) realloc(self->targets[cam], 
+            max_targets * sizeof(target));
+        if (targets == NULL) return 0;
+        memset(targets + old_max, 0, (max_targets - old_max) * sizeof(target));
+        self->targets[cam] = targets;
+    }
+    
+    self->max_targets = max_targets;
+    return 1;
+}
+
 /* free_frame() frees all memory allocated for the frame arrays.
  * 
  * Arguments:
@@ -480,7 +758,8 @@ void free_frame(frame *self) {
  * NULL as name (only the path-info and prio files).
  * 
  * Arguments:
- * frame *self - the frame object to fill with the data read.
+ * frame *self - the frame object to fill with the data read. Its buffers 
+ *   are grown to the number of particles and targets in the files.
  * char* corres_file_base, *linkage_file_base - base names of the output
  *   correspondence and likage files respectively, to which a frame number
  *   is added. Without separator.
@@ -499,18 +778,43 @@ int read_frame(frame *self, char *corres_file_base, char *linkage_file_base,
     char *prio_file_base, char **target_file_base,
     int frame_num)
 {
-    int cam;
+    FILE *FILEIN;
+    int cam, num_parts, num_targets, binary;
+    char fname[STR_MAX_LEN + 1];
+    
+    /* Prevent crashes by testing for initial allocation */
+    if (self->num_targets == 0) return 0;
+    
+    /* The rt_is file starts with its number of particles. */
+    sprintf(fname, "%s.%d", corres_file_base, frame_num);
+    FILEIN = fopen(fname, "r");
+    if (FILEIN != NULL) {
+        if (fscanf(FILEIN, "%d", &num_parts) == 1 
+            && !frame_grow(self, num_parts))
+        {
+            printf("Out of memory reading file: %s\n", fname);
+            fclose(FILEIN);
+            return 0;
+        }
+        fclose(FILEIN);
+    }
     
     self->num_parts = read_path_frame(self->correspond, self->path_info,
         corres_file_base, linkage_file_base, prio_file_base, frame_num);
     if (self->num_parts == -1) return 0;
     
-    /* Prevent crashes by testing for initial allocation */
-    if (self->num_targets == 0) return 0;
-    
     for (cam = 0; cam < self->num_cams; cam++) {
-        self->num_targets[cam] = read_targets(
-            self->targets[cam], target_file_base[cam], frame_num);
+        FILEIN = open_targets(target_file_base[cam], frame_num, fname, 
+            &num_targets, &binary);
+        if (FILEIN == NULL) return 0;
+        
+        if (!frame_grow(self, num_targets)) {
+            printf("Out of memory reading file: %s\n", fname);
+            fclose(FILEIN);
+            return 0;
+        }
+        self->num_targets[cam] = read_target_records(self->targets[cam], 
+            num_targets, FILEIN, fname, binary);
         if (self->num_targets[cam] == -1) return 0;
     }
     
@@ -722,3 +1026,439 @@ int fb_disk_write_frame_from_start(framebuf_base *self_base, int frame_num) {
         frame_num);
 }
 
+
+// -------- In-memory frame buffer.
+
+/* The persistent part of a particle's correspondence and path info, as the 
+   disk frame buffer keeps it in the rt_is, ptv_is and added files. */
+typedef struct {
+    vec3d x;
+    int p[4];
+    int prev, next, prio;
+} mem_particle;
+
+/* pack_frame() packs the persistent data of a frame into one record: the 
+ * number of particles, the number of targets of each camera, then the 
+ * particles and the targets of each camera.
+ * 
+ * Arguments:
+ * frame *frm - the frame to pack.
+ * 
+ * Output:
+ * long *size - number of bytes in the record.
+ * 
+ * Returns:
+ * the newly allocated record, or NULL if memory ran out.
+ */
+static char *pack_frame(frame *frm, long *size) {
+    int cam, part, num_targets = 0;
+    char *record, *pos;
+    mem_particle mp;
+    
+    for (cam = 0; cam < frm->num_cams; cam++)
+        num_targets += frm->num_targets[cam];
+    
+    *size = (1 + frm->num_cams) * sizeof(int) 
+        + frm->num_parts * sizeof(mem_particle) + num_targets * sizeof(target);
+    record = (char *) malloc(*size);
+    if (record == NULL) return NULL;
+    
+    pos = record;
+    memcpy(pos, &frm->num_parts, sizeof(int));
+    pos += sizeof(int);
+    memcpy(pos, frm->num_targets, frm->num_cams * sizeof(int));
+    pos += frm->num_cams * sizeof(int);
+    
+    for (part = 0; part < frm->num_parts; part++) {
+        vec_copy(mp.x, frm->path_info[part].x);
+        memcpy(mp.p, frm->correspond[part].p, sizeof(mp.p));
+        mp.prev = frm->path_info[part].prev;
+        mp.next = frm->path_info[part].next;
+        mp.prio = frm->path_info[part].prio;
+        memcpy(pos, &mp, sizeof(mem_particle));
+        pos += sizeof(mem_particle);
+    }
+    
+    for (cam = 0; cam < frm->num_cams; cam++) {
+        memcpy(pos, frm->targets[cam], frm->num_targets[cam] * sizeof(target));
+        pos += frm->num_targets[cam] * sizeof(target);
+    }
+    return record;
+}
+
+/* unpack_frame() fills a frame from a record made by pack_frame(), setting 
+ * the fields that are not kept like read_frame() does.
+ * 
+ * Arguments:
+ * char *record - the record.
+ * long size - number of bytes in the record.
+ * frame *frm - the frame to fill, grown to the record's particles and 
+ *     targets if needed.
+ * int read_links - whether to restore the prev, next and prio links, or set
+ *     them to the defaults as if the linkage and prio files were not read.
+ * 
+ * Returns:
+ * True on success, false if the record is malformed or memory ran out.
+ */
+static int unpack_frame(char *record, long size, frame *frm, int read_links) {
+    int cam, part, alt_link, max_targets, num_targets = 0;
+    char *pos = record;
+    mem_particle mp;
+    P *path;
+    
+    if (size < (long) ((1 + frm->num_cams) * sizeof(int))) return 0;
+    memcpy(&frm->num_parts, pos, sizeof(int));
+    pos += sizeof(int);
+    memcpy(frm->num_targets, pos, frm->num_cams * sizeof(int));
+    pos += frm->num_cams * sizeof(int);
+    
+    max_targets = frm->num_parts;
+    for (cam = 0; cam < frm->num_cams; cam++) {
+        if (frm->num_targets[cam] < 0) return 0;
+        if (frm->num_targets[cam] > max_targets) 
+            max_targets = frm->num_targets[cam];
+        num_targets += frm->num_targets[cam];
+    }
+    if (frm->num_parts < 0 || size != (pos - record)
+        + frm->num_parts * (long) sizeof(mem_particle) 
+        + num_targets * (long) sizeof(target))
+    {
+        return 0;
+    }
+    if (!frame_grow(frm, max_targets)) return 0;
+    
+    for (part = 0; part < frm->num_parts; part++) {
+        memcpy(&mp, pos, sizeof(mem_particle));
+        pos += sizeof(mem_particle);
+        
+        path = frm->path_info + part;
+        vec_copy(path->x, mp.x);
+        memcpy(frm->correspond[part].p, mp.p, sizeof(mp.p));
+        frm->correspond[part].nr = part + 1;
+        
+        if (read_links) {
+            path->prev = mp.prev;
+            path->next = mp.next;
+            path->prio = mp.prio;
+        } else {
+            /* The defaults of read_path_frame() */
+            path->prev = -1;
+            path->next = -2;
+            path->prio = 4;
+        }
+        
+        path->inlist = 0;
+        path->finaldecis = 1000000.0;
+        for (alt_link = 0; alt_link < POSI; alt_link++) {
+            path->decis[alt_link] = 0.0;
+            path->linkdecis[alt_link] = -999;
+        }
+    }
+    
+    for (cam = 0; cam < frm->num_cams; cam++) {
+        memcpy(frm->targets[cam], pos, frm->num_targets[cam] * sizeof(target));
+        pos += frm->num_targets[cam] * sizeof(target);
+    }
+    return 1;
+}
+
+/* spill_name() makes the name of the file a frame's record is spilled to. 
+ * The buffer's spill ID keeps it apart from the files of other buffers 
+ * spilling to the same directory.
+ */
+static void spill_name(framebuf_mem *self, int frame_num, char *fname) {
+    sprintf(fname, "%s/fb%d.frame.%d", self->spill_dir, self->spill_id, 
+        frame_num);
+}
+
+/* spill_lock_name() makes the name of the file claiming a spill ID. */
+static void spill_lock_name(framebuf_mem *self, char *fname) {
+    sprintf(fname, "%s/fb%d.lock", self->spill_dir, self->spill_id);
+}
+
+/* claim_spill_id() finds a spill ID no other buffer uses in the spill 
+ * directory, and claims it by creating its lock file, which fails if the 
+ * file already exists.
+ * 
+ * Arguments:
+ * framebuf_mem *self - the frame buffer, with spill_dir set. spill_id is set
+ *     to the claimed ID.
+ * 
+ * Returns:
+ * True on success, false if no ID could be claimed, e.g. because the 
+ * directory does not exist.
+ */
+static int claim_spill_id(framebuf_mem *self) {
+    char fname[STR_MAX_LEN + 1];
+    FILE *lock;
+    
+    for (self->spill_id = 0; self->spill_id < SPILL_MAX_BUFFERS; 
+        self->spill_id++) 
+    {
+        spill_lock_name(self, fname);
+        lock = fopen(fname, "wx");
+        if (lock != NULL) {
+            fclose(lock);
+            return 1;
+        }
+    }
+    return 0;
+}
+
+/* fb_mem_find() searches the stored frames by bisection.
+ * 
+ * Arguments:
+ * framebuf_mem *self - the frame buffer to search.
+ * int frame_num - the frame number to look for.
+ * 
+ * Output:
+ * int *ix - index of the frame's entry, or where to insert it if not found.
+ * 
+ * Returns:
+ * True if the frame is stored, false otherwise.
+ */
+static int fb_mem_find(framebuf_mem *self, int frame_num, int *ix) {
+    int lo = 0, hi = self->num_entries, mid;
+    
+    while (lo < hi) {
+        mid = (lo + hi) / 2;
+        if (self->entries[mid].frame_num < frame_num) lo = mid + 1;
+        else hi = mid;
+    }
+    *ix = lo;
+    return (lo < self->num_entries && self->entries[lo].frame_num == frame_num);
+}
+
+/* fb_mem_init() initializes a frame buffer that keeps the frames passing 
+ * through it in memory rather than in files. While the frames held in 
+ * memory would exceed the budget, further frames are spilled to files in the
+ * spill directory, in the same compact format.
+ * 
+ * Arguments:
+ * framebuf_mem *new_buf - the frame buffer object to initialize.
+ * int buf_len - number of frames in the buffer.
+ * int num_cams - number of cameras per frame.
+ * int max_targets - number of elements to allocate for the different buffers
+ *     held by a frame.
+ * long max_bytes - memory budget for the stored frames, in bytes. 0 for no 
+ *     limit.
+ * char *spill_dir - an existing directory for the frames over budget, or 
+ *     NULL to keep all frames in memory regardless of the budget. Copied.
+ *     Names over SPILL_DIR_MAX_LEN characters are not used. Several buffers
+ *     may spill to the same directory; each claims an ID, by a lock file 
+ *     removed with the buffer, and names its files by it.
+ */
+void fb_mem_init(framebuf_mem *new_buf, int buf_len, int num_cams, 
+    int max_targets, long max_bytes, char *spill_dir)
+{
+    fb_base_init(&new_buf->base, buf_len, num_cams, max_targets);
+    
+    new_buf->entries = NULL;
+    new_buf->num_entries = 0;
+    new_buf->max_entries = 0;
+    new_buf->mem_bytes = 0;
+    new_buf->max_bytes = max_bytes;
+    new_buf->spill_dir = NULL;
+    new_buf->spill_id = -1;
+    if (spill_dir != NULL && strlen(spill_dir) <= SPILL_DIR_MAX_LEN) {
+        new_buf->spill_dir = (char *) malloc(strlen(spill_dir) + 1);
+        if (new_buf->spill_dir != NULL) {
+            strcpy(new_buf->spill_dir, spill_dir);
+            if (!claim_spill_id(new_buf)) {
+                free(new_buf->spill_dir);
+                new_buf->spill_dir = NULL;
+                new_buf->spill_id = -1;
+            }
+        }
+    }
+    
+    new_buf->base._vptr->free = fb_mem_free;
+    new_buf->base._vptr->read_frame_at_end = fb_mem_read_frame_at_end;
+    new_buf->base._vptr->write_frame_from_start = fb_mem_write_frame_from_start;
+}
+
+/* fb_mem_put_frame() stores a copy of a frame's data under a frame number, 
+ * replacing what was stored under it before.
+ * 
+ * Arguments:
+ * framebuf_mem *self - the frame buffer to store into.
+ * frame *frm - the frame to store.
+ * int frame_num - the frame's number in the sequence.
+ * 
+ * Returns:
+ * True on success, false if memory ran out.
+ */
+int fb_mem_put_frame(framebuf_mem *self, frame *frm, int frame_num) {
+    char *record, fname[STR_MAX_LEN + 1];
+    long size;
+    int ix, spilled = 0;
+    fb_mem_entry *entry, *grown;
+    FILE *fout;
+    
+    record = pack_frame(frm, &size);
+    if (record == NULL) return 0;
+    
+    if (!fb_mem_find(self, frame_num, &ix)) {
+        if (self->num_entries == self->max_entries) {
+            grown = (fb_mem_entry *) realloc(self->entries, 
+                (2*self->max_entries + 16) * sizeof(fb_mem_entry));
+            if (grown == NULL) {
+                free(record);
+                return 0;
+            }
+            self->entries = grown;
+            self->max_entries = 2*self->max_entries + 16;
+        }
+        memmove(self->entries + ix + 1, self->entries + ix, 
+            (self->num_entries - ix) * sizeof(fb_mem_entry));
+        self->num_entries++;
+        
+        entry = self->entries + ix;
+        entry->frame_num = frame_num;
+        entry->record = NULL;
+        entry->size = 0;
+    } else {
+        entry = self->entries + ix;
+        if (entry->record != NULL) {
+            free(entry->record);
+            entry->record = NULL;
+            self->mem_bytes -= entry->size;
+        } else {
+            /* Don't leave the old record behind if the new one stays in 
+               memory. */
+            spill_name(self, frame_num, fname);
+            remove(fname);
+        }
+    }
+    
+    if (self->spill_dir != NULL && self->max_bytes > 0 
+        && self->mem_bytes + size > self->max_bytes)
+    {
+        spill_name(self, frame_num, fname);
+        fout = fopen(fname, "wb");
+        if (fout != NULL) {
+            spilled = (fwrite(record, 1, size, fout) == (size_t) size);
+            if (fclose(fout) != 0) spilled = 0;
+        }
+    }
+    
+    entry->size = size;
+    if (spilled) {
+        free(record);
+    } else {
+        /* Within budget, or the spill failed; keep it rather than lose it. */
+        entry->record = record;
+        self->mem_bytes += size;
+    }
+    return 1;
+}
+
+/* fb_mem_get_frame() fills a frame with the data stored under a frame 
+ * number.
+ * 
+ * Arguments:
+ * framebuf_mem *self - the frame buffer to read from.
+ * frame *frm - the frame to fill. It is left empty if the frame number is not
+ *     stored.
+ * int frame_num - the frame's number in the sequence.
+ * int read_links - whether to restore the links to the previous and next 
+ *     frames, like reading the linkage and prio files.
+ * 
+ * Returns:
+ * True on success, false if nothing is stored under frame_num, or the stored
+ * data could not be read or does not fit the frame.
+ */
+int fb_mem_get_frame(framebuf_mem *self, frame *frm, int frame_num, 
+    int read_links) 
+{
+    char *record, fname[STR_MAX_LEN + 1];
+    int ix, cam, success = 0;
+    fb_mem_entry *entry;
+    FILE *fin;
+    
+    if (fb_mem_find(self, frame_num, &ix)) {
+        entry = self->entries + ix;
+        if (entry->record != NULL) {
+            success = unpack_frame(entry->record, entry->size, frm, read_links);
+        } else {
+            spill_name(self, frame_num, fname);
+            fin = fopen(fname, "rb");
+            record = (char *) malloc(entry->size);
+            if (fin != NULL && record != NULL && 
+                fread(record, 1, entry->size, fin) == (size_t) entry->size)
+            {
+                success = unpack_frame(record, entry->size, frm, read_links);
+            }
+            if (fin != NULL) fclose(fin);
+            free(record);
+        }
+    }
+    
+    if (!success) {
+        frm->num_parts = 0;
+        for (cam = 0; cam < frm->num_cams; cam++)
+            frm->num_targets[cam] = 0;
+    }
+    return success;
+}
+
+/* fb_mem_num_spilled() returns the number of stored frames that are held in
+ * spill files rather than in memory. */
+int fb_mem_num_spilled(framebuf_mem *self) {
+    int ix, count = 0;
+    for (ix = 0; ix < self->num_entries; ix++)
+        if (self->entries[ix].record == NULL) count++;
+    return count;
+}
+
+/* fb_mem_free() frees the frames, the stored records and the spill files of
+ * an in-memory frame buffer.
+ * 
+ * Arguments:
+ * framebuf_base *self - the framebuf_mem holding the memory to free.
+ */
+void fb_mem_free(framebuf_base *self_base) {
+    framebuf_mem *self = (framebuf_mem *) self_base;
+    char fname[STR_MAX_LEN + 1];
+    int ix;
+    
+    for (ix = 0; ix < self->num_entries; ix++) {
+        if (self->entries[ix].record != NULL) {
+            free(self->entries[ix].record);
+        } else {
+            spill_name(self, self->entries[ix].frame_num, fname);
+            remove(fname);
+        }
+    }
+    free(self->entries);
+    self->entries = NULL;
+    self->num_entries = self->max_entries = 0;
+    self->mem_bytes = 0;
+    
+    if (self->spill_dir != NULL) {
+        spill_lock_name(self, fname);
+        remove(fname);
+        free(self->spill_dir);
+        self->spill_dir = NULL;
+    }
+    
+    fb_base_free(self_base);
+}
+
+/* fb_mem_read_frame_at_end() fills the last position in the ring from the 
+ * stored frames. See fb_disk_read_frame_at_end().
+ */
+int fb_mem_read_frame_at_end(framebuf_base *self_base, int frame_num, 
+    int read_links) 
+{
+    return fb_mem_get_frame((framebuf_mem *) self_base, 
+        self_base->buf[self_base->buf_len - 1], frame_num, read_links);
+}
+
+/* fb_mem_write_frame_from_start() stores the frame at the first position in 
+ * the ring. See fb_disk_write_frame_from_start().
+ */
+int fb_mem_write_frame_from_start(framebuf_base *self_base, int frame_num) {
+    return fb_mem_put_frame((framebuf_mem *) self_base, self_base->buf[0], 
+        frame_num);
+}
@@ -1,9 +1,110 @@
-from optv.parameters cimport control_par
+from optv.parameters cimport control_par, volume_par
+from optv.calibration cimport calibration
+cimport numpy as np
+
+cdef extern from "optv/tile_mask.h":
+    ctypedef struct span_mask:
+        int imx, imy
+        int *row_start
+        int *spans
+    
+    ctypedef struct tile_mask:
+        int imx, imy
+        int tile_size
+        int ntx, nty
+        unsigned char *live
+        span_mask *spans
+    
+    span_mask *span_mask_from_image(unsigned char *mask_img, int imx, int imy)
+    void span_mask_free(span_mask *spans)
+    int span_mask_live_pixels(span_mask *spans)
+    
+    tile_mask *tile_mask_new(int imx, int imy, int tile_size)
+    void tile_mask_free(tile_mask *mask)
+    void tile_mask_set_rect(tile_mask *mask, int xmin, int xmax, int ymin, 
+        int ymax, int live)
+    void tile_mask_dilate(tile_mask *mask, int tiles)
+    int tile_mask_live_tiles(tile_mask *mask)
+    int tile_mask_set_spans(tile_mask *mask, span_mask *spans)
+    void tile_mask_from_volume(tile_mask *mask, calibration *cal, 
+        control_par *cpar, volume_par *vpar)
 
 cdef extern from "optv/image_processing.h":
+    ctypedef double filter_t[3][3]
+    
+    ctypedef struct filter_kernel:
+        filter_t filt
+        int separable
+    
+    int BOX_BLUR_ACCUM_LEN(control_par * cpar)
+    int FLAT_FIELD_SHIFT
+    int filter_kernel_init(filter_kernel * kern, filter_t filt, int min_val)
+    int read_filter_kernel(filter_kernel * kern, char * filter_file)
+    
+    void flat_field_correct(unsigned char * img,
+                        unsigned char * img_out,
+                        unsigned char * dark,
+                        unsigned short * gain,
+                        control_par * cpar) nogil
+    void flat_field_correct_u16(unsigned short * img,
+                        unsigned short * img_out,
+                        unsigned short * dark,
+                        unsigned short * gain,
+                        control_par * cpar) nogil
+    
     int prepare_image(unsigned char * img,
                         unsigned char * img_hp,
                         int dim_lp,
                         int filter_hp,
                         char * filter_file,
                         control_par * cpar)
+    int prepare_image_buf(unsigned char * img,
+                        unsigned char * img_hp,
+                        unsigned char * img_lp,
+                        int * accum,
+                        int dim_lp,
+                        int filter_hp,
+                        filter_kernel * kern,
+                        control_par * cpar) nogil
+    int prepare_image_tiles(unsigned char * img,
+                        unsigned char * img_hp,
+                        unsigned char * img_lp,
+                        unsigned char * img_sub,
+                        int * accum,
+                        int dim_lp,
+                        int filter_hp,
+                        filter_kernel * kern,
+                        tile_mask * mask,
+                        control_par * cpar) nogil
+    int prepare_image_tiles_u16(unsigned short * img,
+                        unsigned short * img_hp,
+                        unsigned short * img_lp,
+                        unsigned short * img_sub,
+                        int * accum,
+                        int dim_lp,
+                        int filter_hp,
+                        filter_kernel * kern,
+                        tile_mask * mask,
+                        control_par * cpar) nogil
+
+cdef class StaticMask:
+    cdef span_mask * _spans
+
+cdef class TileMask:
+    cdef tile_mask * _mask
+    cdef StaticMask _static
+
+cdef class FilterKernel:
+    cdef filter_kernel _kernel
+
+cdef class FlatField:
+    cdef np.ndarray _dark
+    cdef np.ndarray _gain
+    cdef object _dtype
+    cdef readonly int imx, imy
+
+cdef class PreprocessBuffers:
+    cdef np.ndarray _img_lp
+    cdef np.ndarray _img_sub
+    cdef np.ndarray _accum
+    cdef readonly int imx, imy
@@ -1,21 +1,442 @@
-from optv.parameters cimport ControlParams, control_par
+from optv.parameters cimport ControlParams, VolumeParams, control_par
+from optv.calibration cimport Calibration
+from cython.parallel cimport parallel, prange, threadid
+from libc.stdlib cimport malloc, free
 import numpy as np
 cimport numpy as np
+import os
 from six import string_types
 
-def preprocess_image(np.ndarray[ndim=2, dtype=np.uint8_t] input_img,
+cdef class PreprocessBuffers:
+    '''
+    Scratch memory for preprocess_image(), so that a sequence of same-size
+    images is filtered without allocating anything per frame. A buffers
+    object may only be used by one thread at a time; give each camera its 
+    own to filter cameras concurrently.
+    '''
+    def __init__(self, ControlParams control, dtype=np.uint8):
+        '''
+        Arguments:
+        ControlParams control - the image size is taken from here.
+        dtype - pixel type of the images to filter, np.uint8 or np.uint16.
+        '''
+        self.imx = control._control_par.imx
+        self.imy = control._control_par.imy
+        dtype = _pixel_dtype(dtype)
+        self._img_lp = np.empty((self.imy, self.imx), dtype=dtype)
+        self._img_sub = np.empty((self.imy, self.imx), dtype=dtype)
+        self._accum = np.empty(
+            BOX_BLUR_ACCUM_LEN(control._control_par), dtype=np.intc)
+
+cdef class StaticMask:
+    '''
+    A camera's static mask, e.g. of reflections or parts of the setup in 
+    view, kept as the spans of pixels to process in each row. Attached to a 
+    TileMask, it makes preprocessing and target recognition skip the masked 
+    pixels as they go, instead of zeroing them in every frame like 
+    subtract_mask() does. Made once per experiment and shared by any number
+    of tile masks.
+    '''
+    def __init__(self, mask_img):
+        '''
+        Arguments:
+        mask_img - 2D array of the image size. Pixels are processed where it 
+            is nonzero and masked where it is 0, as in subtract_mask().
+        '''
+        cdef np.ndarray[ndim=2, dtype=np.uint8_t] mask_arr
+        
+        mask_img = np.asarray(mask_img)
+        if mask_img.ndim != 2:
+            raise ValueError("Expecting a 2D mask image.")
+        mask_arr = np.ascontiguousarray(mask_img != 0, dtype=np.uint8)
+        self._spans = span_mask_from_image(<unsigned char *>mask_arr.data,
+            mask_arr.shape[1], mask_arr.shape[0])
+        if self._spans == NULL:
+            raise ValueError("Invalid mask image.")
+    
+    def __dealloc__(self):
+        span_mask_free(self._spans)
+    
+    @property
+    def image_size(self):
+        """Image size as (imx, imy), like ControlParams.get_image_size()"""
+        return (self._spans.imx, self._spans.imy)
+    
+    def num_spans(self):
+        """Number of runs of processed pixels, over all rows."""
+        return self._spans.row_start[self._spans.imy]
+    
+    def live_fraction(self):
+        """Fraction of the pixels that are processed."""
+        return span_mask_live_pixels(self._spans) / \
+            float(self._spans.imx * self._spans.imy)
+    
+    def to_image(self):
+        '''
+        Returns the mask as an (imy, imx) boolean array, True where pixels are
+        processed.
+        '''
+        cdef:
+            np.ndarray[ndim=2, dtype=np.uint8_t] img = np.zeros(
+                (self._spans.imy, self._spans.imx), dtype=np.uint8)
+            int y, k
+        
+        for y in range(self._spans.imy):
+            for k in range(self._spans.row_start[y], self._spans.row_start[y + 1]):
+                img[y, self._spans.spans[2*k]:self._spans.spans[2*k + 1]] = 1
+        return img.astype(bool)
+
+cdef class TileMask:
+    '''
+    A coarse map of the image regions worth processing, in square tiles.
+    Preprocessing and target recognition given a mask only touch its live 
+    tiles; dead tiles come out black and yield no targets. A StaticMask may
+    be attached to also skip single pixels within the live tiles.
+    '''
+    def __init__(self, ControlParams control, int tile_size=64):
+        '''
+        Creates a mask with all tiles dead.
+        
+        Arguments:
+        ControlParams control - the image size is taken from here.
+        int tile_size - side of a tile in pixels.
+        '''
+        self._mask = tile_mask_new(control._control_par.imx, 
+            control._control_par.imy, tile_size)
+        if self._mask == NULL:
+            raise ValueError("Invalid image or tile size.")
+    
+    def __dealloc__(self):
+        tile_mask_free(self._mask)
+    
+    @classmethod
+    def from_volume(cls, ControlParams control, VolumeParams vpar, 
+        Calibration cal, int tile_size=64, int margin=1):
+        '''
+        Creates a mask of the tiles through which a camera sees the observed
+        volume.
+        
+        Arguments:
+        ControlParams control - image size, pixel size and multimedia 
+            parameters.
+        VolumeParams vpar - the observed volume.
+        Calibration cal - the camera's calibration.
+        int tile_size - side of a tile in pixels.
+        int margin - number of tiles to grow the live area by, for targets 
+            on its border and for the sampling of the volume test.
+        
+        Returns:
+        a new TileMask.
+        '''
+        cdef TileMask mask = cls(control, tile_size)
+        tile_mask_from_volume(mask._mask, cal._calibration, 
+            control._control_par, vpar._volume_par)
+        mask.dilate(margin)
+        return mask
+    
+    @classmethod
+    def from_static(cls, ControlParams control, StaticMask static, 
+        int tile_size=64):
+        '''
+        Creates a mask processing the whole image except for the pixels 
+        masked by a static mask.
+        
+        Arguments:
+        ControlParams control - the image size is taken from here.
+        StaticMask static - the static mask to attach.
+        int tile_size - side of a tile in pixels.
+        
+        Returns:
+        a new TileMask.
+        '''
+        cdef TileMask mask = cls(control, tile_size)
+        mask.set_rect(0, control._control_par.imx, 0, 
+            control._control_par.imy)
+        mask.set_static(static)
+        return mask
+    
+    @property
+    def static(self):
+        """The attached StaticMask, or None."""
+        return self._static
+    
+    def set_static(self, StaticMask static):
+        '''
+        Attaches a static mask, or detaches it given None. Tiles that the
+        static mask masks completely are marked dead, and stay so when it is
+        detached.
+        '''
+        if static is None:
+            tile_mask_set_spans(self._mask, NULL)
+        elif not tile_mask_set_spans(self._mask, static._spans):
+            raise ValueError("Static mask was made for another image size.")
+        self._static = static
+    
+    @property
+    def tile_size(self):
+        return self._mask.tile_size
+    
+    @property
+    def image_size(self):
+        """Image size as (imx, imy), like ControlParams.get_image_size()"""
+        return (self._mask.imx, self._mask.imy)
+    
+    def set_rect(self, int xmin, int xmax, int ymin, int ymax, live=True):
+        '''
+        Marks all tiles overlapping a pixel rectangle (maximum exclusive) as 
+        live or dead.
+        '''
+        tile_mask_set_rect(self._mask, xmin, xmax, ymin, ymax, bool(live))
+    
+    def dilate(self, int tiles=1):
+        """Grows the live area by the given number of tiles."""
+        tile_mask_dilate(self._mask, tiles)
+    
+    def get_tiles(self):
+        '''
+        Returns a copy of the tile flags as a (rows, columns) boolean array.
+        '''
+        cdef np.ndarray[ndim=2, dtype=np.uint8_t] tiles = np.empty(
+            (self._mask.nty, self._mask.ntx), dtype=np.uint8)
+        cdef int i
+        for i in range(self._mask.nty * self._mask.ntx):
+            tiles.data[i] = self._mask.live[i]
+        return tiles.astype(bool)
+    
+    def set_tiles(self, tiles):
+        '''
+        Sets all tile flags from a (rows, columns) boolean array.
+        '''
+        cdef int i
+        flat = np.asarray(tiles, dtype=bool)
+        if flat.shape != (self._mask.nty, self._mask.ntx):
+            raise ValueError("Expecting tiles of shape %s" % 
+                ((self._mask.nty, self._mask.ntx),))
+        flat = flat.ravel()
+        for i in range(self._mask.nty * self._mask.ntx):
+            self._mask.live[i] = flat[i]
+    
+    def live_fraction(self):
+        """Fraction of the tiles that are live."""
+        return tile_mask_live_tiles(self._mask) / \
+            float(self._mask.ntx * self._mask.nty)
+    
+    def check_size(self, ControlParams control):
+        """Raises ValueError unless the mask fits the control's image size."""
+        if (self._mask.imx != control._control_par.imx or 
+                self._mask.imy != control._control_par.imy):
+            raise ValueError("Tile mask was made for another image size.")
+
+cdef class FilterKernel:
+    '''
+    A user-defined 3x3 filter for ``filter_hp == 2``, read and prepared once
+    and then reused for any number of images (also from several threads).
+    Separable integer filters are applied as two 1-D integer passes.
+    '''
+    def __init__(self, filter_file=None, matrix=None):
+        '''
+        Arguments:
+        filter_file - path to a text file containing the filter matrix. One 
+            line per row, white-space separated columns.
+        matrix - alternatively, the 3x3 filter matrix as an array.
+        '''
+        cdef:
+            filter_t filt
+            int i, j
+        
+        if (filter_file is None) == (matrix is None):
+            raise ValueError("Expecting exactly one of filter_file or matrix.")
+        
+        if filter_file is not None:
+            if not isinstance(filter_file, string_types):
+                raise ValueError("Expecting a filter file name, received non-string.")
+            if not read_filter_kernel(&self._kernel, filter_file.encode()):
+                raise ValueError(
+                    "Can't read a valid 3x3 filter from %s" % filter_file)
+        else:
+            matrix = np.asarray(matrix, dtype=np.float64)
+            if matrix.shape != (3, 3):
+                raise ValueError("Filter matrix must be 3x3.")
+            for i in range(3):
+                for j in range(3):
+                    filt[i][j] = matrix[i, j]
+            if not filter_kernel_init(&self._kernel, filt, 8):
+                raise ValueError("Filter matrix elements sum to zero.")
+    
+    @property
+    def separable(self):
+        """True if the filter is applied as two 1-D passes."""
+        return bool(self._kernel.separable)
+    
+    def get_matrix(self):
+        """Return the filter matrix as a 3x3 array."""
+        return np.array([[self._kernel.filt[i][j] for j in range(3)]
+                         for i in range(3)])
+
+cdef class FlatField:
+    '''
+    Dark and flat-field correction of one camera's images, removing the 
+    fixed-pattern noise and vignetting before preprocessing. The dark frame
+    is subtracted and the result multiplied by a gain map that evens out the
+    flat frame's response. Both maps are prepared once, as integers in the
+    pixel type and as fixed-point gains, so that correcting an image is a 
+    single integer pass.
+    '''
+    def __init__(self, ControlParams control, dark=None, flat=None, 
+        dtype=None):
+        '''
+        Arguments:
+        ControlParams control - the image size is taken from here.
+        dark - optional 2D array, the camera's response to no light. Omitted
+            for no offset correction.
+        flat - optional 2D array, the camera's response to uniform light.
+            Omitted for no gain correction.
+        dtype - pixel type of the images to correct, np.uint8 or np.uint16.
+            Defaults to the type of the dark or flat frame.
+        
+        Gains are limited to just under 16; pixels that do not respond in 
+        the flat frame keep a gain of 1.
+        '''
+        self.imx = control._control_par.imx
+        self.imy = control._control_par.imy
+        
+        if dtype is None:
+            if dark is None and flat is None:
+                raise ValueError("Expecting a dark or a flat frame.")
+            dtype = (dark if dark is not None else flat).dtype
+        self._dtype = _pixel_dtype(dtype)
+        
+        for frame in (dark, flat):
+            if frame is not None and np.shape(frame) != (self.imy, self.imx):
+                raise ValueError(
+                    "Frame shape does not match the control parameters.")
+        
+        self._dark = None
+        if dark is not None:
+            self._dark = np.ascontiguousarray(dark, dtype=self._dtype)
+        
+        self._gain = None
+        if flat is not None:
+            response = np.asarray(flat, dtype=np.float64)
+            if dark is not None:
+                response = response - self._dark
+            live = response > 0
+            gain = np.ones_like(response)
+            if live.any():
+                gain[live] = response[live].mean() / response[live]
+            self._gain = np.clip(np.rint(gain * (1 << FLAT_FIELD_SHIFT)),
+                0, np.iinfo(np.uint16).max).astype(np.uint16)
+    
+    @property
+    def dtype(self):
+        """Pixel type of the images this object corrects."""
+        return self._dtype
+    
+    def get_dark(self):
+        """Returns a copy of the offset map, or None."""
+        return None if self._dark is None else self._dark.copy()
+    
+    def get_gain(self):
+        """Returns the gain map as floats, or None."""
+        if self._gain is None:
+            return None
+        return self._gain / float(1 << FLAT_FIELD_SHIFT)
+    
+    def correct(self, np.ndarray img, np.ndarray out=None):
+        '''
+        Corrects an image. Runs without holding the GIL.
+        
+        Arguments:
+        np.ndarray img - 2D image of the size and type given on creation.
+        np.ndarray out - optional C-contiguous array receiving the result, 
+            same size and type as img. Pass img itself to correct in place.
+        
+        Returns:
+        the corrected image (``out`` if given).
+        '''
+        cdef:
+            control_par cpar
+            void *in_ptr
+            void *out_ptr
+            void *dark_ptr = NULL
+            unsigned short *gain_ptr = NULL
+            bint wide = self._dtype == np.uint16
+        
+        if img.ndim != 2 or img.shape[0] != self.imy or img.shape[1] != self.imx:
+            raise ValueError("Image shape does not match the correction maps.")
+        if img.dtype != self._dtype:
+            raise ValueError("Image type does not match the correction maps.")
+        
+        if out is None:
+            out = np.empty((self.imy, self.imx), dtype=self._dtype)
+        elif out.ndim != 2 or out.shape[0] != self.imy or \
+                out.shape[1] != self.imx or out.dtype != self._dtype:
+            raise ValueError("Different shapes or types of input and output.")
+        elif not out.flags['C_CONTIGUOUS']:
+            raise ValueError("Output image must be C-contiguous.")
+        
+        img = np.ascontiguousarray(img)
+        in_ptr = img.data
+        out_ptr = out.data
+        if self._dark is not None:
+            dark_ptr = self._dark.data
+        if self._gain is not None:
+            gain_ptr = <unsigned short *> self._gain.data
+        cpar.imx = self.imx
+        cpar.imy = self.imy
+        
+        with nogil:
+            if wide:
+                flat_field_correct_u16(<unsigned short *> in_ptr, 
+                    <unsigned short *> out_ptr, <unsigned short *> dark_ptr,
+                    gain_ptr, &cpar)
+            else:
+                flat_field_correct(<unsigned char *> in_ptr, 
+                    <unsigned char *> out_ptr, <unsigned char *> dark_ptr,
+                    gain_ptr, &cpar)
+        return out
+
+def _filter_kernel_arg(int filter_hp, filter_file):
+    """Check the filter file argument and prepare the kernel for C."""
+    if filter_hp != 2:
+        return None
+    if isinstance(filter_file, FilterKernel):
+        return filter_file
+    if filter_file == None or not isinstance(filter_file, string_types):
+        raise ValueError("Expecting a filter file name, received None or non-string.")
+    return FilterKernel(filter_file)
+
+def _pixel_dtype(dtype):
+    '''
+    Returns the NumPy dtype of the given pixel type, raising TypeError for 
+    types other than 8 and 16 bit unsigned integers.
+    '''
+    dtype = np.dtype(dtype)
+    if dtype != np.uint8 and dtype != np.uint16:
+        raise TypeError("Only 8-bit and 16-bit unsigned images are supported.")
+    return dtype
+
+def preprocess_image(np.ndarray input_img,
                    int filter_hp,
                    ControlParams control,
                    int lowpass_dim=1,
                    filter_file=None,
-                   np.ndarray[ndim=2, dtype=np.uint8_t] output_img=None):
+                   np.ndarray output_img=None,
+                   PreprocessBuffers buffers=None,
+                   TileMask mask=None):
     '''
     preprocess_image() - perform the steps necessary for preparing an image to 
     particle detection: an averaging (smoothing) filter on an image, optionally
     followed by additional user-defined filter.
     
+    The filtering runs without holding the GIL, so different cameras may be
+    processed concurrently from Python threads, each with its own output
+    image and buffers.
+    
     Arguments:
-    numpy.ndarray input_img - numpy 2d array representing the source image to filter.
+    numpy.ndarray input_img - numpy 2d array representing the source image to 
+        filter. 8-bit (uint8) or 16-bit (uint16) gray values; 16-bit images
+        are filtered in their own units, without conversion.
     int filter_hp - flag for additional filtering of _hp. 1 for lowpass, 2 for 
         general 3x3 filter given in parameter ``filter_file``.
     ControlParams control - image details such as size and image half for 
@@ -24,39 +445,224 @@ def preprocess_image(np.ndarray[ndim=2, dtype=np.uint8_t] input_img,
       parameter.
     filter_file - path to a text file containing the filter matrix to be
         used in case ```filter_hp == 2```. One line per row, white-space 
-        separated columns.
-    numpy.ndarray output_img - result numpy 2d array representing the source 
-        image to filter. Same size as img.
+        separated columns. A FilterKernel may be given instead, to avoid
+        reading the file for every image.
+    numpy.ndarray output_img - optional C-contiguous numpy 2d array receiving
+        the result. Same size and type as img. If None, a new array is 
+        allocated.
+    PreprocessBuffers buffers - optional scratch memory for the intermediate
+        results, to reuse between calls, allocated for the type of img. If 
+        None, temporary buffers are allocated.
+    TileMask mask - optional, filter only the live tiles of this mask and 
+        set the rest of the output to 0, as well as the pixels masked by its
+        static mask.
     
     Returns:
-    numpy.ndarray representing the result image.
+    numpy.ndarray representing the result image (``output_img`` if given).
     '''
-
+    cdef:
+        int success
+        bint wide
+        void *img_lp
+        void *img_sub
+        void *in_ptr
+        void *out_ptr
+        int *accum
+        FilterKernel kernel
+        filter_kernel *c_kernel = NULL
+        tile_mask *c_mask = NULL
+        control_par *cpar = control._control_par
+    
     # check arrays dimensions
     if input_img.ndim != 2:
         raise TypeError("Input array must be two-dimensional")
-    if (output_img is not None) and (input_img.shape[0] != output_img.shape[0] or
-                         input_img.shape[1] != output_img.shape[1]):
-        raise ValueError("Different shapes of input and output images.")
-    else:
+    wide = _pixel_dtype(input_img.dtype) == np.uint16
+    
+    if output_img is None:
         output_img = np.empty_like(input_img)
+    elif output_img.ndim != 2 or (input_img.shape[0] != output_img.shape[0] or
+            input_img.shape[1] != output_img.shape[1]):
+        raise ValueError("Different shapes of input and output images.")
+    elif output_img.dtype != input_img.dtype:
+        raise ValueError("Different types of input and output images.")
+    elif not output_img.flags['C_CONTIGUOUS']:
+        raise ValueError("Output image must be C-contiguous.")
+    
+    if input_img.shape[0] != cpar.imy or input_img.shape[1] != cpar.imx:
+        raise ValueError("Image shape does not match the control parameters.")
+    
+    kernel = _filter_kernel_arg(filter_hp, filter_file)
+    if kernel is not None:
+        c_kernel = &kernel._kernel
     
-    if filter_hp == 2:
-        if filter_file == None or not isinstance(filter_file, string_types):
-            raise ValueError("Expecting a filter file name, received None or non-string.")
+    input_img = np.ascontiguousarray(input_img)
+    
+    if buffers is None:
+        buffers = PreprocessBuffers(control, input_img.dtype)
+    elif buffers.imx != cpar.imx or buffers.imy != cpar.imy:
+        raise ValueError("Buffers were allocated for a different image size.")
+    elif buffers._img_lp.dtype != input_img.dtype:
+        raise ValueError("Buffers were allocated for a different pixel type.")
+    img_lp = buffers._img_lp.data
+    img_sub = buffers._img_sub.data
+    accum = <int *> buffers._accum.data
+    in_ptr = input_img.data
+    out_ptr = output_img.data
+    
+    if mask is not None:
+        mask.check_size(control)
+        c_mask = mask._mask
+    
+    with nogil:
+        if wide:
+            success = prepare_image_tiles_u16(<unsigned short *> in_ptr,
+                                              <unsigned short *> out_ptr,
+                                              <unsigned short *> img_lp,
+                                              <unsigned short *> img_sub,
+                                              accum, lowpass_dim, filter_hp,
+                                              c_kernel, c_mask, cpar)
+        else:
+            success = prepare_image_tiles(<unsigned char *> in_ptr,
+                                          <unsigned char *> out_ptr,
+                                          <unsigned char *> img_lp,
+                                          <unsigned char *> img_sub,
+                                          accum, lowpass_dim, filter_hp,
+                                          c_kernel, c_mask, cpar)
+    if success != 1:
+        raise Exception("prepare_image C function failed")
+    return output_img
+
+def preprocess_images(np.ndarray input_imgs,
+                      int filter_hp,
+                      ControlParams control,
+                      int lowpass_dim=1,
+                      filter_file=None,
+                      np.ndarray output_imgs=None,
+                      int num_threads=0,
+                      masks=None):
+    '''
+    preprocess_images() - preprocess_image() for a stack of same-size images,
+    e.g. all cameras of a frame or many frames of one camera, in one call. 
+    The images are distributed over several threads, each with its own 
+    scratch buffers.
+    
+    Arguments:
+    numpy.ndarray input_imgs - 3d array (image, y, x) of source images, 8-bit
+        or 16-bit.
+    int filter_hp, ControlParams control, int lowpass_dim, filter_file - 
+        see preprocess_image().
+    numpy.ndarray output_imgs - optional C-contiguous 3d array receiving the
+        results. Same shape and type as input_imgs. If None, a new array is 
+        allocated.
+    int num_threads - number of threads to use. 0 (default) for one per CPU.
+        Without OpenMP support in the build, one thread is used regardless.
+    masks - optional TileMask for all images, or a sequence with a TileMask 
+        (or None) per image, e.g. one per camera. See preprocess_image().
+    
+    Returns:
+    numpy.ndarray, the 3d array of results (``output_imgs`` if given).
+    '''
+    cdef:
+        Py_ssize_t i, num_imgs, image_size, accum_len
+        int tid
+        bint wide
+        np.ndarray img_lp, img_sub, accum, success
+        char *in_ptr
+        char *out_ptr
+        char *lp_ptr
+        char *sub_ptr
+        Py_ssize_t image_bytes
+        tile_mask **mask_ptrs
+        TileMask mask
+        int *accum_ptr
+        unsigned char *success_ptr
+        FilterKernel kernel
+        filter_kernel *c_kernel = NULL
+        control_par *cpar = control._control_par
+    
+    if input_imgs.ndim != 3:
+        raise TypeError("Input array must be three-dimensional")
+    wide = _pixel_dtype(input_imgs.dtype) == np.uint16
+    
+    if output_imgs is None:
+        output_imgs = np.empty_like(input_imgs)
+    elif (<object> input_imgs).shape != (<object> output_imgs).shape:
+        raise ValueError("Different shapes of input and output images.")
+    elif output_imgs.dtype != input_imgs.dtype:
+        raise ValueError("Different types of input and output images.")
+    elif not output_imgs.flags['C_CONTIGUOUS']:
+        raise ValueError("Output images must be C-contiguous.")
+    
+    if input_imgs.shape[1] != cpar.imy or input_imgs.shape[2] != cpar.imx:
+        raise ValueError("Image shape does not match the control parameters.")
+    
+    kernel = _filter_kernel_arg(filter_hp, filter_file)
+    if kernel is not None:
+        c_kernel = &kernel._kernel
+    
+    input_imgs = np.ascontiguousarray(input_imgs)
+    num_imgs = input_imgs.shape[0]
+    if num_imgs == 0:
+        return output_imgs
+    
+    if num_threads <= 0:
+        num_threads = os.cpu_count() or 1
+    num_threads = min(num_threads, num_imgs)
+    
+    # one set of scratch buffers per thread
+    image_size = cpar.imx * cpar.imy
+    image_bytes = image_size * input_imgs.itemsize
+    accum_len = BOX_BLUR_ACCUM_LEN(cpar)
+    img_lp = np.empty(num_threads * image_size, dtype=input_imgs.dtype)
+    img_sub = np.empty(num_threads * image_size, dtype=input_imgs.dtype)
+    accum = np.empty(num_threads * accum_len, dtype=np.intc)
+    success = np.empty(num_imgs, dtype=np.uint8)
+    
+    if masks is None or isinstance(masks, TileMask):
+        masks = [masks] * num_imgs
     else:
-        filter_file=b""
-        
-    for arr in (input_img, output_img):
-        if not arr.flags['C_CONTIGUOUS']:
-            np.ascontiguousarray(arr)
-    
-    if (1 != prepare_image( < unsigned char *> input_img.data,
-                            < unsigned char *> output_img.data,
-                            lowpass_dim,
-                            filter_hp,
-                            filter_file,
-                            control._control_par)):
-        raise Exception("prepare_image C function failed: "
-                      + "failure of memory allocation or filter file reading")
-    return output_img              
+        masks = list(masks)
+        if len(masks) != num_imgs:
+            raise ValueError("Expecting one tile mask per image.")
+    for mask in masks:
+        if mask is not None:
+            mask.check_size(control)
+    
+    in_ptr = input_imgs.data
+    out_ptr = output_imgs.data
+    lp_ptr = img_lp.data
+    sub_ptr = img_sub.data
+    accum_ptr = <int *> accum.data
+    success_ptr = <unsigned char *> success.data
+    
+    mask_ptrs = <tile_mask **> malloc(num_imgs * sizeof(tile_mask *))
+    if mask_ptrs == NULL:
+        raise MemoryError("Failed to allocate tile mask pointers.")
+    for i in range(num_imgs):
+        mask = masks[i]
+        mask_ptrs[i] = mask._mask if mask is not None else NULL
+    
+    with nogil, parallel(num_threads=num_threads):
+        tid = threadid()
+        for i in prange(num_imgs, schedule='dynamic'):
+            if wide:
+                success_ptr[i] = prepare_image_tiles_u16(
+                    <unsigned short *> (in_ptr + i * image_bytes),
+                    <unsigned short *> (out_ptr + i * image_bytes),
+                    <unsigned short *> (lp_ptr + tid * image_bytes),
+                    <unsigned short *> (sub_ptr + tid * image_bytes),
+                    accum_ptr + tid * accum_len, lowpass_dim, filter_hp,
+                    c_kernel, mask_ptrs[i], cpar)
+            else:
+                success_ptr[i] = prepare_image_tiles(
+                    <unsigned char *> (in_ptr + i * image_bytes),
+                    <unsigned char *> (out_ptr + i * image_bytes),
+                    <unsigned char *> (lp_ptr + tid * image_bytes),
+                    <unsigned char *> (sub_ptr + tid * image_bytes),
+                    accum_ptr + tid * accum_len, lowpass_dim, filter_hp,
+                    c_kernel, mask_ptrs[i], cpar)
+    free(mask_ptrs)
+    
+    if not success.all():
+        raise Exception("prepare_image C function failed")
+    return output_imgs
@@ -44,6 +44,10 @@ cdef extern from "optv/parameters.h":
         int nymin, nymax  # same in y dimension.
         int sumg_min      # minimal sum of grey values in target.
         int cr_sz         # correspondence parameter.
+        int engine        # TARG_REC_GROW or TARG_REC_UNION_FIND.
+    
+    int TARG_REC_GROW
+    int TARG_REC_UNION_FIND
         
 cdef class MultimediaParams:
     cdef mm_np* _mm_np
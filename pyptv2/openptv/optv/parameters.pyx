@@ -732,6 +732,9 @@ cdef class ControlParams:
         self._control_par[0].mm = NULL
         c_free_control_par(self._control_par)
 
+# Target recognition engines, indexed by their target_par.engine value
+TARGET_ENGINES = ("grow", "union_find")
+
 cdef class TargetParams:
     """
     Wrapping the target_par C struct (declared in liboptv/paramethers.h) for 
@@ -741,7 +744,7 @@ cdef class TargetParams:
     def __init__(self, int discont=0, gvthresh=None, 
         pixel_count_bounds=(0, 1000),
         xsize_bounds=(0, 100), ysize_bounds=(0, 100), int min_sum_grey=0, 
-        int cross_size=2):
+        int cross_size=2, engine="grow"):
         """
         Arguments (all optional):
         int discont - maximum discontinuity parameter.
@@ -752,6 +755,8 @@ cdef class TargetParams:
             in the respective dimension.
         int min_sum_grey - minimal sum of grey values in a target.
         int cross_size - legacy parameter, don't use.
+        engine - target recognition engine, one of TARGET_ENGINES, see 
+            set_engine().
         """
         if gvthresh is None:
             gvthresh = [0] * 4
@@ -765,6 +770,7 @@ cdef class TargetParams:
         self.set_ysize_bounds(ysize_bounds)
         self.set_min_sum_grey(min_sum_grey)
         self.set_cross_size(cross_size)
+        self.set_engine(engine)
     
     def get_max_discontinuity(self):
         return self._targ_par.discont
@@ -850,6 +856,28 @@ cdef class TargetParams:
     def set_cross_size(self, int cr_sz):
         self._targ_par.cr_sz = cr_sz
     
+    def get_engine(self):
+        """
+        Returns the name of the target recognition engine, see set_engine().
+        """
+        return TARGET_ENGINES[self._targ_par.engine]
+    
+    def set_engine(self, engine):
+        """
+        Selects the target recognition engine.
+        
+        Arguments:
+        engine - "grow" grows each target from a local maximum (the 
+            classic algorithm), "union_find" labels connected components in 
+            two passes over the image. Both apply the same threshold and 
+            discontinuity rules and agree on separated blobs; the union-find
+            engine does not slow down on large blobs, but runs on one thread.
+        """
+        if engine not in TARGET_ENGINES:
+            raise ValueError("Unknown target recognition engine %r, "
+                "expecting one of %s." % (engine, TARGET_ENGINES))
+        self._targ_par.engine = TARGET_ENGINES.index(engine)
+    
     def read(self, inp_filename):
         """
         Reads target recognition parameters from a legacy .par file, which 
@@ -868,6 +896,7 @@ cdef class TargetParams:
         11. nymax
         12. sumg_min
         13. cr_sz
+        14. engine (optional, 0 for "grow", 1 for "union_find")
         
         Fills up the fields of the object from the file and returns.
         """
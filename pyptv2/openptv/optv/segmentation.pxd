@@ -7,8 +7,71 @@ Created on Thu Aug 18 11:12:36 2016
 
 from optv.tracking_framebuf cimport target
 from optv.parameters cimport target_par, control_par
+from optv.image_processing cimport tile_mask, TileMask
+from optv.parameters cimport TargetParams, ControlParams
+cimport numpy as np
 
 cdef extern from "optv/segmentation.h":
+    ctypedef struct target_list:
+        target *pix
+        int cap
+    
+    int target_list_reserve(target_list *targs, int num)
+    
+    enum:
+        TARG_STATS_BINS
+        TARG_STATS_SUMG_BINS
+        TARG_REJECT_KINDS
+    ctypedef struct targ_stats:
+        int n[TARG_STATS_BINS]
+        int nx[TARG_STATS_BINS]
+        int ny[TARG_STATS_BINS]
+        int sumg[TARG_STATS_SUMG_BINS]
+        int rejected[TARG_REJECT_KINDS]
+    
     int targ_rec (unsigned char *img, target_par *targ_par, int xmin, 
         int xmax, int ymin, int ymax, control_par *cpar, int num_cam, 
-        target pix[])
\ No newline at end of file
+        target pix[])
+    int targ_rec_tiles (unsigned char *img, target_par *targ_par, int xmin, 
+        int xmax, int ymin, int ymax, control_par *cpar, int num_cam, 
+        tile_mask *mask, target pix[]) nogil
+    int targ_rec_tiles_u16 (unsigned short *img, target_par *targ_par, 
+        int xmin, int xmax, int ymin, int ymax, control_par *cpar, int num_cam,
+        tile_mask *mask, target pix[]) nogil
+    int targ_rec_buf (unsigned char *img, target_par *targ_par, int xmin, 
+        int xmax, int ymin, int ymax, control_par *cpar, int num_cam, 
+        tile_mask *mask, unsigned char *img0, unsigned char **rows, 
+        targ_stats *stats, target_list *targs) nogil
+    int targ_rec_buf_u16 (unsigned short *img, target_par *targ_par, 
+        int xmin, int xmax, int ymin, int ymax, control_par *cpar, int num_cam,
+        tile_mask *mask, unsigned short *img0, unsigned short **rows, 
+        targ_stats *stats, target_list *targs) nogil
+    int targ_rec_parallel (unsigned char *img, target_par *targ_par, 
+        int xmin, int xmax, int ymin, int ymax, control_par *cpar, int num_cam,
+        tile_mask *mask, int num_strips, targ_stats *stats, 
+        target_list *targs) nogil
+    int targ_rec_parallel_u16 (unsigned short *img, target_par *targ_par, 
+        int xmin, int xmax, int ymin, int ymax, control_par *cpar, int num_cam,
+        tile_mask *mask, int num_strips, targ_stats *stats, 
+        target_list *targs) nogil
+    int targ_rec_labels (unsigned char *img, target_par *targ_par, 
+        int xmin, int xmax, int ymin, int ymax, control_par *cpar, int num_cam,
+        tile_mask *mask, int *labels, target_list *targs) nogil
+    int targ_rec_labels_u16 (unsigned short *img, target_par *targ_par, 
+        int xmin, int xmax, int ymin, int ymax, control_par *cpar, int num_cam,
+        tile_mask *mask, int *labels, target_list *targs) nogil
+    int targ_rec_highpass(unsigned char *img, int dim_lp, target_par *targ_par,
+        int xmin, int xmax, int ymin, int ymax, control_par *cpar, int num_cam,
+        target_list *targs) nogil
+
+
+cdef class Segmenter:
+    cdef ControlParams _cparam
+    cdef TargetParams _tpar
+    cdef TileMask _mask
+    cdef np.ndarray _img0
+    cdef void **_rows
+    cdef target_list _targs
+    cdef targ_stats *_stats
+    cdef object _dtype
+    cdef readonly int imx, imy
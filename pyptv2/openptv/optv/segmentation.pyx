@@ -6,8 +6,11 @@ Created on Thu Aug 18 16:22:48 2016
 
 @author: yosef
 """
-from libc.stdlib cimport calloc, realloc, free
+from libc.stdlib cimport malloc, calloc, realloc, free
+from libc.string cimport memset, memcpy
 from libc.stdio cimport printf
+from cython.parallel cimport prange
+import os
 import numpy as np
 cimport numpy as np
 np.import_array()
@@ -16,26 +19,62 @@ np.import_array()
 # We now need to fix a datatype for our arrays. I've used the variable
 # DTYPE for this, which is assigned to the usual NumPy runtime
 # type info object.
-DTYPE = np.int64
+DTYPE = np.uint8
 
 # "ctypedef" assigns a corresponding compile-time type to DTYPE_t. For
 # every type in the numpy module there's a corresponding compile-time
 # type with a _t-suffix.
-ctypedef np.int64_t DTYPE_t
+ctypedef np.uint8_t DTYPE_t
 
-from optv.parameters cimport TargetParams, ControlParams
+from optv.parameters cimport TargetParams, ControlParams, target_par, \
+    control_par, TARG_REC_GROW
 from optv.tracking_framebuf cimport TargetArray
+from optv.image_processing cimport TileMask, tile_mask
+from optv.image_processing import _pixel_dtype
+from optv.calibration cimport Calibration, calibration
+from optv.correspondences cimport MatchedCoords, coord_2d
 
-def target_recognition(np.ndarray[np.uint8_t, ndim=2] img, TargetParams tpar, int cam, 
-    ControlParams cparam, subrange_x=None, subrange_y=None):
+cdef extern from "optv/correspondences.h":
+    void quicksort_target_y(target *pix, int num) nogil
+    void quicksort_coord2d_x(coord_2d *crd, int num) nogil
+
+cdef extern from "optv/trafo.h":
+    void pixel_to_metric(double *x_metric, double *y_metric, double x_pixel, 
+        double y_pixel, control_par *parameters) nogil
+    void dist_to_flat(double dist_x, double dist_y, calibration *cal,
+        double *flat_x, double *flat_y, double tol) nogil
+
+# The limits a blob can fail, indexing the 'rejected' counts of detection 
+# statistics (TARG_REJECT_* in liboptv).
+REJECT_REASONS = ("border", "pixel_count", "xsize", "ysize", "sum_grey")
+
+cdef dict _stats_dict(targ_stats *stats):
+    """
+    Copies detection statistics to NumPy arrays, see target_recognition().
+    """
+    return {
+        'n': np.array(stats.n, dtype=np.int64),
+        'nx': np.array(stats.nx, dtype=np.int64),
+        'ny': np.array(stats.ny, dtype=np.int64),
+        'sumg': np.array(stats.sumg, dtype=np.int64),
+        'rejected': np.array(stats.rejected, dtype=np.int64)}
+
+def target_recognition(np.ndarray img, TargetParams tpar, int cam, 
+    ControlParams cparam, subrange_x=None, subrange_y=None, 
+    TileMask mask=None, int num_threads=1, bint stats=False):
     """
-    Detects targets (contiguous bright blobs) in an image.
+    Detects targets (contiguous bright blobs) in an image. The number of 
+    targets and the size of blobs are limited by memory only.
     
-    Limited to ~20,000 targets per image for now. This limitation comes from
-    the structure of underlying C code.
+    The search runs without the GIL, so images of several cameras may be 
+    searched from several Python threads at once. With num_threads other 
+    than 1, the image itself is split into horizontal strips searched in 
+    parallel; the targets found are the same, in the same order.
     
     Arguments:
-    np.ndarray img - a numpy array holding the 8-bit gray image.
+    np.ndarray img - a numpy array holding the 8-bit (uint8) or 16-bit 
+        (uint16) gray image. The grey value thresholds and sums in tpar are 
+        in the units of the image.
     TargetParams tpar - target recognition parameters s.a. size bounds etc.
     int cam - number of camera that took the picture, needed for getting
         correct parameters for this image.
@@ -44,18 +83,497 @@ def target_recognition(np.ndarray[np.uint8_t, ndim=2] img, TargetParams tpar, in
         between. Default is to search entire image width.
     subrange_y - optional, tuple of min and max pixel coordinates to search
         between. Default is to search entire image height.
+    TileMask mask - optional, search only the live tiles of this mask, 
+        skipping the pixels masked by its static mask.
+    int num_threads - number of strips to search in parallel; 0 for one per
+        available thread. Strips run sequentially where optv was built 
+        without OpenMP.
+    bint stats - if True, also gather detection statistics during the 
+        search.
+    
+    Returns:
+    A TargetArray object holding the targets found. With stats, a tuple of 
+    it and a dict of NumPy arrays:
+        n, nx, ny - histograms of the pixel count and the x and y extents 
+            of the targets, one bin per value; the last bin (63) counts all 
+            values from 63 up.
+        sumg - histogram of the grey value sums of the targets: bin k counts
+            the sums from 2**k to 2**(k+1) - 1 (bin 0 also counts 0).
+        rejected - the number of blobs rejected under each limit, indexed 
+            like REJECT_REASONS. A blob is counted under the first limit it
+            fails.
+    """
+    cdef:
+        target_list targs
+        targ_stats c_stats
+        targ_stats *stats_ptr = NULL
+        int num_targs
+        int xmin, xmax, ymin, ymax
+        tile_mask *c_mask = NULL
+        bint wide
+        void *c_img
+    
+    xmin, xmax, ymin, ymax = _search_area(img, cparam, subrange_x, subrange_y)
+    img = np.ascontiguousarray(img)
+    wide = img.dtype == np.uint16
+    c_img = <void *>img.data
+
+    if mask is not None:
+        mask.check_size(cparam)
+        c_mask = mask._mask
+    if stats:
+        memset(&c_stats, 0, sizeof(targ_stats))
+        stats_ptr = &c_stats
+
+    # The core liboptv call, growing the target list as needed. A single 
+    # strip is the plain serial search.
+    targs.pix = NULL
+    targs.cap = 0
+    with nogil:
+        if wide:
+            num_targs = targ_rec_parallel_u16(<unsigned short *>c_img, 
+                tpar._targ_par, xmin, xmax, ymin, ymax, cparam._control_par, 
+                cam, c_mask, num_threads, stats_ptr, &targs)
+        else:
+            num_targs = targ_rec_parallel(<unsigned char *>c_img, 
+                tpar._targ_par, xmin, xmax, ymin, ymax, cparam._control_par, 
+                cam, c_mask, num_threads, stats_ptr, &targs)
+    
+    if num_targs < 0:
+        free(targs.pix)
+        raise MemoryError("Failed to allocate target recognition buffers.")
+    
+    if stats:
+        return _target_array(targs.pix, num_targs), _stats_dict(stats_ptr)
+    return _target_array(targs.pix, num_targs)
+
+def highpass_target_recognition(np.ndarray[np.uint8_t, ndim=2] img, 
+    TargetParams tpar, int cam, ControlParams cparam, int lowpass_dim=1, 
+    subrange_x=None, subrange_y=None):
+    """
+    Detects targets in a raw image, highpass-filtering it on the fly. Gives
+    the same targets as target_recognition(preprocess_image(img, 0, cparam, 
+    lowpass_dim), ...), but reads the raw image once and keeps only a strip 
+    of filtered rows in memory instead of the lowpass, highpass and working 
+    copies of the whole image.
+    
+    Blobs taller than the tpar's maximal target height are rejected as usual,
+    but may leave fragments that are detected as separate targets, since 
+    only their part inside the strip is removed from the search.
+    
+    Arguments:
+    np.ndarray img - a numpy array holding the raw 8-bit gray image.
+    TargetParams tpar - target recognition parameters s.a. size bounds etc.
+    int cam - number of camera that took the picture, needed for getting
+        correct parameters for this image.
+    ControlParams cparam - an object holding general control parameters.
+    int lowpass_dim - half-width of the lowpass filter subtracted from the
+        image, see preprocess_image().
+    subrange_x, subrange_y - optional search limits, see target_recognition().
     
     Returns:
     A TargetArray object holding the targets found.
     """
     cdef:
-        TargetArray t = TargetArray()
-        target *ret
-        target *targs = <target *> calloc(1024*20, sizeof(target))
+        target_list targs
         int num_targs
         int xmin, xmax, ymin, ymax
+        unsigned char *c_img = <unsigned char *>img.data
+    
+    xmin, xmax, ymin, ymax = _search_area(img, cparam, subrange_x, subrange_y)
+    
+    targs.pix = NULL
+    targs.cap = 0
+    with nogil:
+        num_targs = targ_rec_highpass(c_img, lowpass_dim, tpar._targ_par, 
+            xmin, xmax, ymin, ymax, cparam._control_par, cam, &targs)
+    
+    if num_targs < 0:
+        free(targs.pix)
+        raise MemoryError("Failed to allocate the highpass strip.")
+    
+    return _target_array(targs.pix, num_targs)
+
+def label_blobs(np.ndarray img, int threshold, int discont, 
+    ControlParams cparam, TileMask mask=None):
+    """
+    Grows blobs as target_recognition() does, with the given threshold and
+    discontinuity, and labels their pixels. Every blob grown is labeled, 
+    regardless of size and brightness limits, so that these can be applied 
+    afterwards.
+    
+    Arguments:
+    np.ndarray img - the 8-bit or 16-bit (highpass) image.
+    int threshold - grey value threshold for peaks and blob pixels.
+    int discont - maximal discontinuity within a blob.
+    ControlParams cparam - the image size is taken from here.
+    TileMask mask - optional, search only the live tiles of this mask.
+    
+    Returns:
+    labels - (imy, imx) array of np.intc, the number of the blob each pixel
+        belongs to, counting from 1 in the order target_recognition() finds 
+        them; 0 for pixels of no blob.
+    num_blobs - the number of blobs.
+    """
+    cdef:
+        target_par tpar
+        target_list targs
+        tile_mask *c_mask = NULL
+        np.ndarray labels
+        int num_blobs, xmin, xmax, ymin, ymax
+        void *c_img
+        int *c_labels
+        bint wide = img.dtype == np.uint16
+    
+    xmin, xmax, ymin, ymax = _search_area(img, cparam, None, None)
+    img = np.ascontiguousarray(img)
+    c_img = <void *>img.data
+    if mask is not None:
+        mask.check_size(cparam)
+        c_mask = mask._mask
+    
+    # Limits that accept every blob
+    tpar.discont = discont
+    tpar.gvthres[0] = threshold
+    tpar.nnmin, tpar.nnmax = 0, 2147483647
+    tpar.nxmin, tpar.nxmax = 0, 2147483647
+    tpar.nymin, tpar.nymax = 0, 2147483647
+    tpar.sumg_min = -1
+    tpar.engine = TARG_REC_GROW
     
+    labels = np.zeros((ymax, xmax), dtype=np.intc)
+    c_labels = <int *>labels.data
+    targs.pix = NULL
+    targs.cap = 0
+    with nogil:
+        if wide:
+            num_blobs = targ_rec_labels_u16(<unsigned short *>c_img, &tpar, 
+                xmin, xmax, ymin, ymax, cparam._control_par, 0, c_mask, 
+                c_labels, &targs)
+        else:
+            num_blobs = targ_rec_labels(<unsigned char *>c_img, &tpar, 
+                xmin, xmax, ymin, ymax, cparam._control_par, 0, c_mask, 
+                c_labels, &targs)
+    free(targs.pix)
+    
+    if num_blobs < 0:
+        raise MemoryError("Failed to allocate target recognition buffers.")
+    return labels, num_blobs
+
+cdef int _detect_camera(void *img, bint wide, target_par *tpar, 
+    control_par *cpar, calibration *cal, int cam, tile_mask *mask, 
+    target_list *targs, coord_2d **flat) nogil:
+    """
+    One camera's share of frame_target_recognition(): finds the targets, 
+    sorts them by y and computes their x-sorted flat coordinates. Returns 
+    the number of targets, -1 if memory ran out.
+    """
+    cdef:
+        int num_targs, tnum
+        target *targ
+    
+    if wide:
+        num_targs = targ_rec_parallel_u16(<unsigned short *>img, tpar, 0, 
+            cpar.imx, 0, cpar.imy, cpar, cam, mask, 1, NULL, targs)
+    else:
+        num_targs = targ_rec_parallel(<unsigned char *>img, tpar, 0, 
+            cpar.imx, 0, cpar.imy, cpar, cam, mask, 1, NULL, targs)
+    if num_targs < 0:
+        return -1
+    
+    quicksort_target_y(targs.pix, num_targs)
+    flat[0] = <coord_2d *> malloc(num_targs * sizeof(coord_2d))
+    if flat[0] == NULL:
+        return -1
+    
+    for tnum in range(num_targs):
+        targ = targs.pix + tnum
+        targ.pnr = tnum
+        pixel_to_metric(&flat[0][tnum].x, &flat[0][tnum].y, targ.x, targ.y,
+            cpar)
+        dist_to_flat(flat[0][tnum].x, flat[0][tnum].y, cal, 
+            &flat[0][tnum].x, &flat[0][tnum].y, 0.00001)
+        flat[0][tnum].pnr = tnum
+    quicksort_coord2d_x(flat[0], num_targs)
+    return num_targs
+
+def frame_target_recognition(images, tpar, ControlParams cparam, cals, 
+    masks=None, int num_threads=0):
+    """
+    Detects the targets in the images of all cameras of a frame and prepares
+    them for correspondences: for each camera, the targets are found as by 
+    target_recognition(), sorted by y and numbered, and converted to 
+    x-sorted flat coordinates as by MatchedCoords(targets, cparam, cal). 
+    The cameras are processed in parallel native threads, without the GIL.
+    
+    Arguments:
+    images - the highpass images of the cameras, a 3D array or a sequence of
+        2D uint8 or uint16 arrays, each the size given in cparam.
+    tpar - a TargetParams for all cameras (thresholds are looked up by 
+        camera number), or a sequence with one per camera.
+    ControlParams cparam - image size, pixel size etc.
+    cals - sequence of one Calibration per camera.
+    masks - optional TileMask for all cameras, or a sequence with one (or 
+        None) per camera.
+    int num_threads - number of threads; 0 (default) for one per CPU.
+    
+    Returns:
+    targets - list of TargetArray, one per camera, sorted by y.
+    corrected - list of MatchedCoords, one per camera, as expected by 
+        correspondences().
+    """
+    cdef:
+        int num_cams, cam, failed = 0
+        void **img_ptrs
+        unsigned char *wide
+        target_par **tpar_ptrs
+        calibration **cal_ptrs
+        tile_mask **mask_ptrs
+        target_list *targ_lists
+        coord_2d **flat
+        int *num_targs
+        control_par *cpar = cparam._control_par
+        MatchedCoords matched
+        target *pix
+    
+    images = [np.ascontiguousarray(img) for img in images]
+    num_cams = len(images)
+    for img in images:
+        _search_area(img, cparam, None, None)
+    
+    if isinstance(tpar, TargetParams):
+        tpar = [tpar] * num_cams
+    if masks is None or isinstance(masks, TileMask):
+        masks = [masks] * num_cams
+    tpar, cals, masks = list(tpar), list(cals), list(masks)
+    if len(tpar) != num_cams or len(cals) != num_cams or \
+            len(masks) != num_cams:
+        raise ValueError("Expecting parameters for each of the %d cameras." % 
+            num_cams)
+    for cam in range(num_cams):
+        if not isinstance(tpar[cam], TargetParams) or \
+                not isinstance(cals[cam], Calibration):
+            raise TypeError("Expecting TargetParams and Calibration objects.")
+        if masks[cam] is not None:
+            (<TileMask?>masks[cam]).check_size(cparam)
+    
+    if num_threads <= 0:
+        num_threads = os.cpu_count() or 1
+    num_threads = max(1, min(num_threads, num_cams))
+    
+    img_ptrs = <void **> malloc(num_cams * sizeof(void *))
+    wide = <unsigned char *> malloc(num_cams)
+    tpar_ptrs = <target_par **> malloc(num_cams * sizeof(target_par *))
+    cal_ptrs = <calibration **> malloc(num_cams * sizeof(calibration *))
+    mask_ptrs = <tile_mask **> malloc(num_cams * sizeof(tile_mask *))
+    targ_lists = <target_list *> malloc(num_cams * sizeof(target_list))
+    flat = <coord_2d **> malloc(num_cams * sizeof(coord_2d *))
+    num_targs = <int *> malloc(num_cams * sizeof(int))
+    if targ_lists != NULL and flat != NULL:
+        for cam in range(num_cams):
+            targ_lists[cam].pix = NULL
+            targ_lists[cam].cap = 0
+            flat[cam] = NULL
+    
+    try:
+        if img_ptrs == NULL or wide == NULL or tpar_ptrs == NULL or \
+                cal_ptrs == NULL or mask_ptrs == NULL or targ_lists == NULL \
+                or flat == NULL or num_targs == NULL:
+            raise MemoryError("Failed to allocate per-camera tables.")
+        
+        for cam in range(num_cams):
+            img_ptrs[cam] = (<np.ndarray>images[cam]).data
+            wide[cam] = images[cam].dtype == np.uint16
+            tpar_ptrs[cam] = (<TargetParams>tpar[cam])._targ_par
+            cal_ptrs[cam] = (<Calibration>cals[cam])._calibration
+            mask_ptrs[cam] = (<TileMask>masks[cam])._mask \
+                if masks[cam] is not None else NULL
+        
+        for cam in prange(num_cams, nogil=True, num_threads=num_threads, 
+                schedule='dynamic'):
+            num_targs[cam] = _detect_camera(img_ptrs[cam], wide[cam], 
+                tpar_ptrs[cam], cpar, cal_ptrs[cam], cam, mask_ptrs[cam], 
+                &targ_lists[cam], &flat[cam])
+        
+        for cam in range(num_cams):
+            if num_targs[cam] < 0:
+                raise MemoryError("Failed to allocate target buffers.")
+        
+        targets, corrected = [], []
+        for cam in range(num_cams):
+            pix = targ_lists[cam].pix
+            targ_lists[cam].pix = NULL  # taken over by the TargetArray
+            targets.append(_target_array(pix, num_targs[cam]))
+            
+            matched = MatchedCoords.__new__(MatchedCoords)
+            matched.buf = flat[cam]
+            matched._num_pts = num_targs[cam]
+            flat[cam] = NULL
+            corrected.append(matched)
+        
+        return targets, corrected
+    
+    finally:
+        if targ_lists != NULL and flat != NULL:
+            for cam in range(num_cams):
+                free(targ_lists[cam].pix)
+                free(flat[cam])
+        free(img_ptrs)
+        free(wide)
+        free(tpar_ptrs)
+        free(cal_ptrs)
+        free(mask_ptrs)
+        free(targ_lists)
+        free(flat)
+        free(num_targs)
 
+cdef class Segmenter:
+    """
+    Target recognition bound to an image size, pixel type and target 
+    parameters, owning its scratch memory: the working copy of the image, 
+    the row tables and the target buffer are allocated once and reused, so 
+    that searching a sequence of frames only allocates the targets returned
+    for each. A segmenter may only be used by one thread at a time; give each 
+    camera its own to search cameras concurrently.
+    
+    Optionally, the segmenter gathers detection statistics over all frames 
+    searched, see statistics().
+    """
+    def __init__(self, ControlParams cparam, TargetParams tpar, 
+        TileMask mask=None, dtype=np.uint8, bint stats=False):
+        """
+        Arguments:
+        ControlParams cparam - the image size is taken from here.
+        TargetParams tpar - target recognition parameters. Changes to the 
+            object apply to later searches.
+        TileMask mask - optional, search only the live tiles of this mask.
+        dtype - pixel type of the images to search, np.uint8 or np.uint16.
+        bint stats - if True, gather detection statistics.
+        """
+        self.imx = cparam._control_par.imx
+        self.imy = cparam._control_par.imy
+        self._cparam = cparam
+        self._tpar = tpar
+        if mask is not None:
+            mask.check_size(cparam)
+        self._mask = mask
+        self._dtype = _pixel_dtype(dtype)
+        
+        self._img0 = np.empty((self.imy, self.imx), dtype=self._dtype)
+        self._rows = <void **> malloc(2 * self.imy * sizeof(void *))
+        self._targs.pix = NULL
+        self._targs.cap = 0
+        if stats:
+            self._stats = <targ_stats *> calloc(1, sizeof(targ_stats))
+        if self._rows == NULL or not target_list_reserve(&self._targs, 1024)\
+                or (stats and self._stats == NULL):
+            raise MemoryError("Failed to allocate segmenter buffers.")
+    
+    def __dealloc__(self):
+        free(self._rows)
+        free(self._targs.pix)
+        free(self._stats)
+    
+    def statistics(self):
+        """
+        Returns the detection statistics of the frames searched since the 
+        segmenter was made or the statistics were reset, as a dict of NumPy
+        arrays; see target_recognition() for its contents.
+        
+        Raises:
+        ValueError if the segmenter does not gather statistics.
+        """
+        if self._stats == NULL:
+            raise ValueError("The segmenter does not gather statistics.")
+        return _stats_dict(self._stats)
+    
+    def reset_statistics(self):
+        """
+        Zeroes the detection statistics, e.g. to get them per frame.
+        """
+        if self._stats != NULL:
+            memset(self._stats, 0, sizeof(targ_stats))
+    
+    @property
+    def dtype(self):
+        """Pixel type of the images this object searches."""
+        return self._dtype
+    
+    def segment(self, np.ndarray img, int cam, subrange_x=None, 
+        subrange_y=None):
+        """
+        Detects targets in an image, like target_recognition(). Runs without
+        holding the GIL.
+        
+        The search works in the segmenter's own target buffer; the targets
+        found are copied out of it, so the result stays valid after later
+        searches.
+        
+        Arguments:
+        np.ndarray img - 2D image of the size and type given on creation.
+        int cam - number of camera that took the picture, for the threshold.
+        subrange_x, subrange_y - optional search limits, see 
+            target_recognition().
+        
+        Returns:
+        A TargetArray of the targets found.
+        """
+        cdef:
+            int num_targs
+            target *tarr
+            int xmin, xmax, ymin, ymax
+            tile_mask *c_mask = NULL
+            bint wide = self._dtype == np.uint16
+            void *c_img
+            void *c_img0 = self._img0.data
+            TargetArray t = TargetArray()
+        
+        if img.dtype != self._dtype:
+            raise ValueError("Image type does not match the segmenter.")
+        xmin, xmax, ymin, ymax = _search_area(img, self._cparam, subrange_x, 
+            subrange_y)
+        if img.shape[0] != self.imy or img.shape[1] != self.imx:
+            raise ValueError("Image shape does not match the segmenter.")
+        img = np.ascontiguousarray(img)
+        c_img = <void *>img.data
+        if self._mask is not None:
+            c_mask = self._mask._mask
+        
+        with nogil:
+            if wide:
+                num_targs = targ_rec_buf_u16(<unsigned short *>c_img, 
+                    self._tpar._targ_par, xmin, xmax, ymin, ymax, 
+                    self._cparam._control_par, cam, c_mask, 
+                    <unsigned short *>c_img0, <unsigned short **>self._rows, 
+                    self._stats, &self._targs)
+            else:
+                num_targs = targ_rec_buf(<unsigned char *>c_img, 
+                    self._tpar._targ_par, xmin, xmax, ymin, ymax, 
+                    self._cparam._control_par, cam, c_mask, 
+                    <unsigned char *>c_img0, <unsigned char **>self._rows, 
+                    self._stats, &self._targs)
+        
+        if num_targs < 0:
+            raise MemoryError("Failed to grow the target buffer.")
+        
+        # The next search may move the buffer when it grows.
+        tarr = <target *> malloc((num_targs if num_targs > 0 else 1) 
+            * sizeof(target))
+        if tarr == NULL:
+            raise MemoryError("Failed to allocate the targets.")
+        memcpy(tarr, self._targs.pix, num_targs * sizeof(target))
+        t.set(tarr, num_targs, 1)
+        return t
+
+def _search_area(np.ndarray img, ControlParams cparam, subrange_x, subrange_y):
+    """
+    Checks the image against the control parameters and returns the search
+    area (xmin, xmax, ymin, ymax), the whole image where no subrange is given.
+    """
+    if img.ndim != 2:
+        raise ValueError("dimensions are not correct")
+    if img.dtype != np.uint8 and img.dtype != np.uint16:
+        raise TypeError("Only 8-bit and 16-bit unsigned images are supported.")
 
     # Set the subrange (to default if not given):
     if subrange_x is None:
@@ -70,12 +588,17 @@ def target_recognition(np.ndarray[np.uint8_t, ndim=2] img, TargetParams tpar, in
     
     if img.shape[0] != ymax or img.shape[1] != xmax:
         raise ValueError("dimensions are not correct")
+    
+    return xmin, xmax, ymin, ymax
 
-    assert img.dtype == DTYPE
-
-    # The core liboptv call:
-    num_targs = targ_rec(<unsigned char *>img.data, tpar._targ_par, 
-        xmin, xmax, ymin, ymax, cparam._control_par, cam, targs)
+cdef TargetArray _target_array(target *targs, int num_targs):
+    """
+    Wraps targets found by liboptv in a TargetArray, taking ownership of the
+    memory.
+    """
+    cdef:
+        TargetArray t = TargetArray()
+        target *ret
     
     # Fit the memory size snugly and generate the Python return value.
     ret = <target *>realloc(targs, num_targs * sizeof(target))
@@ -1,13 +1,13 @@
 
 from optv.parameters cimport sequence_par, track_par, volume_par, control_par
-from optv.tracking_framebuf cimport framebuf
+from optv.tracking_framebuf cimport framebuf_base, framebuf_mem
 from optv.calibration cimport calibration
 
 cdef extern from "optv/tracking_run.h":
     ctypedef struct tracking_run:
         sequence_par *seq_par
         calibration **cal
-        framebuf *fb
+        framebuf_base *fb
     
     tracking_run* tr_new(sequence_par *seq_par, track_par *tpar,
         volume_par *vpar, control_par *cpar, int buf_len, int max_targets,
@@ -26,5 +26,8 @@ cdef class Tracker:
     cdef tracking_run *run_info
     cdef int step
     cdef object _keepalive
+    cdef framebuf_mem *_mem_fb # NULL for the disk frame buffer
+    
+    cdef framebuf_mem *_memory_framebuf(self) except NULL
 
     
@@ -7,11 +7,16 @@ Created on Sun Apr 23 15:41:32 2017
 @author: yosef
 """
 
-from libc.stdlib cimport free
+from libc.stdlib cimport malloc, free
+from libc.string cimport memcpy
+import numpy as np
+
 from optv.parameters cimport ControlParams, TrackingParams, SequenceParams, \
     VolumeParams
 from optv.orientation cimport cal_list2arr
-from optv.tracking_framebuf cimport fb_free
+from optv.tracking_framebuf cimport fb_free, framebuf_base, framebuf_mem, \
+    fb_mem_init, fb_mem_put_frame, fb_mem_get_frame, fb_mem_num_spilled, \
+    frame, frame_init, target, Frame, TargetArray, CORRES_NONE, SPILL_DIR_MAX_LEN
 
 default_naming = {
     'corres': b'res/rt_is',
@@ -25,10 +30,16 @@ cdef class Tracker:
     call either ``step_forward()`` while it still return True, then call
     ``finalize()`` to finish the run. Alternatively, ``full_forward()`` will 
     do all this for you.
+    
+    With the 'memory' frame buffer backend, the frames are not read from and 
+    written to the traditional files, but kept in memory: put the sequence's
+    frames in with ``put_frame()`` before tracking, and take the tracked 
+    frames out with ``get_frame()`` after it.
     """
     def __init__(self, ControlParams cpar, VolumeParams vpar, 
         TrackingParams tpar, SequenceParams spar, list cals,
-        dict naming=default_naming, flatten_tol=0.0001):
+        dict naming=default_naming, flatten_tol=0.0001, backend='disk',
+        memory_budget=0, spill_dir=None):
         """
         Arguments:
         ControlParams cpar, VolumeParams vpar, TrackingParams tpar, 
@@ -37,7 +48,27 @@ cdef class Tracker:
         cals - a list of Calibratiopn objects.
         dict naming - a dictionary with naming rules for the frame buffer 
             files. See the ``default_naming`` member (which is the default).
+        backend - frame buffer type: 'disk' to read and write the frames as 
+            files named by ``naming``, or 'memory' to keep them in memory.
+        memory_budget - for the 'memory' backend, bytes of frame data 
+            to hold in memory before spilling further frames to files in 
+            ``spill_dir``. 0 for no limit.
+        spill_dir - an existing directory for the spilled frames. Required 
+            with a memory budget. May be shared by several Trackers, whose
+            files are named apart. The spill files are removed with the 
+            Tracker.
         """
+        cdef framebuf_mem *mem_fb
+        
+        if backend not in ('disk', 'memory'):
+            raise ValueError("Unknown frame buffer %r, expecting 'disk' or "
+                "'memory'" % (backend,))
+        if backend == 'memory' and memory_budget > 0:
+            if spill_dir is None:
+                raise ValueError("A memory budget requires a spill directory.")
+            if len(spill_dir) > SPILL_DIR_MAX_LEN:
+                raise ValueError("Spill directory name is too long.")
+        
         # We need to keep a reference to the Python objects so that their
         # allocations are not freed.
         self._keepalive = (cpar, vpar, tpar, spar, cals)
@@ -46,6 +77,122 @@ cdef class Tracker:
             vpar._volume_par, cpar._control_par, TR_BUFSPACE, MAX_TARGETS,
             naming['corres'], naming['linkage'], naming['prio'], 
             cal_list2arr(cals), flatten_tol)
+        
+        if backend == 'memory':
+            # Replace the disk frame buffer made by tr_new().
+            fb_free(self.run_info.fb)
+            free(self.run_info.fb)
+            self.run_info.fb = NULL
+            mem_fb = <framebuf_mem *> malloc(sizeof(framebuf_mem))
+            if mem_fb == NULL:
+                raise MemoryError("Could not allocate the frame buffer.")
+            if spill_dir is None:
+                fb_mem_init(mem_fb, TR_BUFSPACE, cpar.get_num_cams(), 
+                    MAX_TARGETS, memory_budget, NULL)
+            else:
+                spill_dir = spill_dir.encode() if isinstance(spill_dir, str) \
+                    else spill_dir
+                fb_mem_init(mem_fb, TR_BUFSPACE, cpar.get_num_cams(), 
+                    MAX_TARGETS, memory_budget, spill_dir)
+            self.run_info.fb = <framebuf_base *> mem_fb
+            self._mem_fb = mem_fb
+    
+    cdef framebuf_mem *_memory_framebuf(self) except NULL:
+        if self._mem_fb == NULL:
+            raise ValueError("Only the 'memory' frame buffer stores frames.")
+        return self._mem_fb
+    
+    def put_frame(self, int frame_num, positions, corresp, list targets):
+        """
+        Stores a frame of the sequence in the 'memory' frame buffer, as the
+        sequence loop would write it to the rt_is and _targets files.
+        
+        Arguments:
+        int frame_num - the frame's number in the sequence.
+        positions - (n,3) array, the 3D positions of the frame's particles.
+        corresp - (c,n) array, for each camera the index of the target of 
+            each particle, or -1 (CORRES_NONE). c may be less than 4.
+        list targets - a TargetArray for each camera, numbered so that the
+            indices of corresp point into them.
+        """
+        cdef:
+            framebuf_mem *mem_fb = self._memory_framebuf()
+            int num_cams = len(targets)
+            int pt, cam, size
+            frame *frm
+            Frame holder
+            TargetArray tarr
+        
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        corresp = np.asarray(corresp, dtype=np.intc)
+        if corresp.size == 0:
+            corresp = corresp.reshape(0, positions.shape[0])
+        if corresp.ndim != 2 or corresp.shape[0] > 4 or \
+                corresp.shape[1] != positions.shape[0]:
+            raise ValueError("Expecting correspondences of shape (c, %d), "
+                "c <= 4." % positions.shape[0])
+        if num_cams != self._keepalive[0].get_num_cams():
+            raise ValueError("Expecting targets of %d cameras." % 
+                self._keepalive[0].get_num_cams())
+        
+        # frame_init() also sizes the per-camera target counts by this.
+        size = max([positions.shape[0], num_cams] + [len(t) for t in targets])
+        
+        # The holder frees the frame.
+        holder = Frame(num_cams)
+        frm = <frame *> malloc(sizeof(frame))
+        frame_init(frm, num_cams, size)
+        holder._frm = frm
+        
+        frm.num_parts = positions.shape[0]
+        for pt in range(frm.num_parts):
+            for cam in range(3):
+                frm.path_info[pt].x[cam] = positions[pt, cam]
+            frm.path_info[pt].prev = -1
+            frm.path_info[pt].next = -2
+            frm.path_info[pt].prio = 4
+            frm.correspond[pt].nr = pt + 1
+            for cam in range(4):
+                frm.correspond[pt].p[cam] = corresp[cam, pt] \
+                    if cam < corresp.shape[0] else CORRES_NONE
+        
+        for cam in range(num_cams):
+            tarr = targets[cam]
+            frm.num_targets[cam] = len(tarr)
+            memcpy(frm.targets[cam], tarr._tarr, 
+                len(tarr) * sizeof(target))
+        
+        if not fb_mem_put_frame(mem_fb, frm, frame_num):
+            raise MemoryError("Could not store frame %d." % frame_num)
+    
+    def get_frame(self, int frame_num):
+        """
+        Returns a frame stored in the 'memory' frame buffer, with the links
+        tracking made.
+        
+        Arguments:
+        int frame_num - the frame's number in the sequence.
+        
+        Returns:
+        a Frame object.
+        """
+        cdef:
+            framebuf_mem *mem_fb = self._memory_framebuf()
+            int num_cams = self._keepalive[0].get_num_cams()
+            Frame ret = Frame(num_cams)
+        
+        ret._frm = <frame *> malloc(sizeof(frame))
+        frame_init(ret._frm, num_cams, MAX_TARGETS)
+        if not fb_mem_get_frame(mem_fb, ret._frm, frame_num, 1):
+            raise KeyError("Frame %d is not in the frame buffer." % frame_num)
+        return ret
+    
+    def num_spilled(self):
+        """
+        Returns the number of frames in the 'memory' frame buffer that were
+        spilled to files.
+        """
+        return fb_mem_num_spilled(self._memory_framebuf())
     
     def restart(self):
         """
@@ -93,8 +240,13 @@ cdef class Tracker:
         return self.step
     
     def __dealloc__(self):
+        if self.run_info == NULL:
+            return # __init__ failed before allocating
+        
         # Don't call tr_free, just free the memory that belongs to us.
-        fb_free(self.run_info.fb)
+        if self.run_info.fb != NULL:
+            fb_free(self.run_info.fb)
+            free(self.run_info.fb)
         free(self.run_info.cal) # allocated by cal_list2arr, leafs belong to
                                 # owner of the Tracker.
         free(self.run_info) # not using tr_free() which assumes ownership of 
@@ -30,10 +30,28 @@ cdef extern from "optv/tracking_frame_buf.h":
         int num_cams, max_targets, num_parts
         int *num_targets
     
+    ctypedef struct framebuf_base:
+        pass
+    
     ctypedef struct framebuf:
         pass
     
-    void fb_free(framebuf *self)
+    ctypedef struct framebuf_mem:
+        pass
+    
+    void frame_init(frame *new_frame, int num_cams, int max_targets)
+    void free_frame(frame *self)
+    
+    void fb_free(framebuf_base *self)
+    void fb_mem_init(framebuf_mem *new_buf, int buf_len, int num_cams, 
+        int max_targets, long max_bytes, char *spill_dir)
+    int fb_mem_put_frame(framebuf_mem *self, frame *frm, int frame_num)
+    int fb_mem_get_frame(framebuf_mem *self, frame *frm, int frame_num, 
+        int read_links)
+    int fb_mem_num_spilled(framebuf_mem *self)
+    
+    enum:
+        SPILL_DIR_MAX_LEN
     
 cdef class Target:
     cdef target* _targ
@@ -44,6 +62,8 @@ cdef class TargetArray:
     cdef target* _tarr
     cdef int _num_targets
     cdef int _owns_data
+    cdef Py_ssize_t _shape[1]
+    cdef Py_ssize_t _strides[1]
     
     cdef void set(TargetArray self, target* tarr, int num_targets,
         int owns_data)
@@ -1,28 +1,66 @@
 # Implementation of the trackin_frame_buf minimal interface.
 
 from libc.stdlib cimport malloc, free
+from libc.string cimport memcpy
 cimport numpy as np
 import numpy as np
 
 from optv.vec_utils cimport vec3d, vec_copy
 
 cdef extern from "optv/tracking_frame_buf.h":
-    int c_read_targets "read_targets" (target buffer[], \
+    int read_targets_alloc(target **buffer, int *max_targets, \
         char* file_base, int frame_num)
     int write_targets(target buffer[], int num_targets, char* file_base, \
         int frame_num)
+    int write_targets_bin(target buffer[], int num_targets, char* file_base, \
+        int frame_num)
     
-    void frame_init(frame *new_frame, int num_cams, int max_targets)
-    void free_frame(frame *self)
     int read_frame(frame *self, char *corres_file_base, char *linkage_file_base,
         char *prio_file_base, char **target_file_base, int frame_num)
 
 cdef extern from "optv/correspondences.h":
     void quicksort_target_y(target *pix, int num)
 
-DEF MAX_TARGETS = 20000 # Until improvement of read_targets to auto-allocate.
+DEF MAX_TARGETS = 20000 # Initial size of frames; read_frame() grows them.
 ctypedef np.float64_t pos_t
 
+cdef _target_layout():
+    """
+    Returns the NumPy dtype and the buffer format string matching the C 
+    target struct, padding included.
+    """
+    cdef:
+        target t
+        char *base = <char *>&t
+    
+    fields = [
+        ('pnr', 'i', <char *>&t.pnr - base), ('x', 'd', <char *>&t.x - base),
+        ('y', 'd', <char *>&t.y - base), ('n', 'i', <char *>&t.n - base),
+        ('nx', 'i', <char *>&t.nx - base), ('ny', 'i', <char *>&t.ny - base),
+        ('sumg', 'i', <char *>&t.sumg - base), 
+        ('tnr', 'i', <char *>&t.tnr - base)]
+    
+    dtype = np.dtype({
+        'names': [f[0] for f in fields],
+        'formats': [np.intc if f[1] == 'i' else np.float64 for f in fields],
+        'offsets': [f[2] for f in fields],
+        'itemsize': sizeof(target)})
+    
+    fmt, pos = '=T{', 0
+    for name, code, offset in fields:
+        if offset > pos:
+            fmt += '%dx' % (offset - pos)
+        fmt += '%s:%s:' % (code, name)
+        pos = offset + dtype.fields[name][0].itemsize
+    if sizeof(target) > pos:
+        fmt += '%dx' % (sizeof(target) - pos)
+    return dtype, (fmt + '}').encode('ascii')
+
+# The record type of a TargetArray viewed as a NumPy array.
+TARGET_DTYPE, _TARGET_FORMAT = _target_layout()
+cdef char *_target_format = _TARGET_FORMAT
+cdef target _no_targets
+
 cdef class Target:
     def __init__(self, **kwd):
         """
@@ -124,6 +162,11 @@ cdef class Target:
 cdef class TargetArray:
     """
     Represents an array of targets. Allows indexing and iteration.
+    
+    The targets are also exposed through the buffer protocol, so that 
+    ``np.asarray(targets)`` is a structured array of dtype TARGET_DTYPE 
+    (fields pnr, x, y, n, nx, ny, sumg, tnr) viewing the targets without 
+    copying; writing to it changes the targets.
     """
     def __init__(self, int size=0):
         """
@@ -145,6 +188,57 @@ cdef class TargetArray:
         self._num_targets = num_targets
         self._owns_data = owns_data
     
+    @classmethod
+    def from_array(cls, arr):
+        """
+        Creates a TargetArray holding a copy of the targets in a structured 
+        array.
+        
+        Arguments:
+        arr - 1D array with (at least) the fields of TARGET_DTYPE, e.g. a 
+            view of another TargetArray, filtered.
+        
+        Returns:
+        a new TargetArray owning its targets.
+        """
+        cdef:
+            TargetArray ret
+            np.ndarray src
+        
+        arr = np.asarray(arr)
+        if arr.ndim != 1 or arr.dtype.names is None or \
+                not set(TARGET_DTYPE.names) <= set(arr.dtype.names):
+            raise ValueError("Expecting a 1D array with the target fields.")
+        
+        src = np.empty(len(arr), dtype=TARGET_DTYPE)
+        for name in TARGET_DTYPE.names:
+            src[name] = arr[name]
+        
+        ret = cls(len(arr))
+        if len(arr) > 0:
+            memcpy(ret._tarr, src.data, len(arr) * sizeof(target))
+        return ret
+    
+    def __getbuffer__(self, Py_buffer *buffer, int flags):
+        self._shape[0] = self._num_targets
+        self._strides[0] = sizeof(target)
+        
+        buffer.buf = <void *>(self._tarr if self._tarr != NULL 
+            else &_no_targets)
+        buffer.obj = self
+        buffer.len = self._num_targets * sizeof(target)
+        buffer.readonly = 0
+        buffer.itemsize = sizeof(target)
+        buffer.format = _target_format
+        buffer.ndim = 1
+        buffer.shape = self._shape
+        buffer.strides = self._strides
+        buffer.suboffsets = NULL
+        buffer.internal = NULL
+    
+    def __releasebuffer__(self, Py_buffer *buffer):
+        pass
+    
     def sort_y(self):
         """
         Sorts the targets in-place by their Y coordinate. This is required for
@@ -156,17 +250,32 @@ cdef class TargetArray:
         for tnum in range(self._num_targets):
             self._tarr[tnum].pnr = tnum
         
-    def write(self, char *file_base, int frame_num):
+    def write(self, char *file_base, int frame_num, binary=False):
         """
-        Writes a _targets file - a text format for targets. First line: number
-        of targets. Each following line: pnr, x, y, n, nx, ny, sumg, tnr.
-        the output file name is of the form <base_name><frame>_targets.
+        Writes a _targets file. The text format has the number of targets on
+        the first line, then one line per target: pnr, x, y, n, nx, ny, sumg,
+        tnr. The binary format packs the same fields after a short header, 
+        and is much faster to write and read for many targets; 
+        ``read_targets()`` and ``Frame.read()`` read either. The output file 
+        name is of the form <base_name><frame>_targets.
         
         Arguments:
         file_base - path to the file, base part.
         frame_num - frame number part of the file name.
+        binary - if True, write the binary format.
+        
+        Raises:
+        IOError if the file could not be written.
         """
-        write_targets(self._tarr, self._num_targets, file_base, frame_num)
+        if binary:
+            success = write_targets_bin(self._tarr, self._num_targets, 
+                file_base, frame_num)
+        else:
+            success = write_targets(self._tarr, self._num_targets, file_base,
+                frame_num)
+        if not success:
+            raise IOError("Could not write targets to %s" % 
+                file_base.decode('UTF-8', 'replace'))
 
     def __getitem__(self, int ix):
         """
@@ -198,7 +307,8 @@ cdef class TargetArray:
     
 def read_targets(basename, int frame_num):
     """
-    Reads a targets file and returns the targets within.
+    Reads a targets file, text or binary (see ``TargetArray.write()``), 
+    and returns the targets within.
     
     Arguments:
     basename - Beginning of the image file name, to which the frame number and
@@ -208,10 +318,13 @@ def read_targets(basename, int frame_num):
     
     Returns:
     A TargetArray object pointing to the read array.
+    
+    Raises:
+    IOError if the file could not be read.
     """
     cdef:
-        int num_targets
-        target *tarr = <target *>malloc(MAX_TARGETS * sizeof(target))
+        int num_targets, max_targets = 0
+        target *tarr = NULL
         TargetArray ret = TargetArray()
         char* c_string
     
@@ -219,7 +332,12 @@ def read_targets(basename, int frame_num):
     py_byte_string = basename.encode('UTF-8')
     c_string = py_byte_string
     
-    num_targets = c_read_targets(tarr, c_string, frame_num)
+    # Sized to the file, however many targets it has.
+    num_targets = read_targets_alloc(&tarr, &max_targets, c_string, frame_num)
+    if num_targets < 0:
+        free(tarr)
+        raise IOError("Could not read targets of %s, frame %d" % 
+            (basename, frame_num))
     ret.set(tarr, num_targets, 1)
     
     return ret
@@ -261,7 +379,8 @@ cdef class Frame:
     def read(Frame self, char *corres_file_base, char *linkage_file_base,
         list target_file_base, int frame_num, prio_file_base):
         """
-        Reads frame data from traditional text files.
+        Reads frame data from traditional text files. The _targets files 
+        may also be binary, see ``TargetArray.write()``.
         
         Arguments:
         corres_file_base, linkage_file_base - base names of the output
@@ -344,6 +463,19 @@ cdef class Frame:
         
         return pos2d
     
+    def links(Frame self):
+        """
+        Returns an (n,2) array with the index of each particle's link in the 
+        previous and the next frame, in the order of ``positions()``. 
+        Particles without a link have -1 (previous) or -2 (next).
+        """
+        links = np.empty((self._frm.num_parts, 2), dtype=np.intc)
+        for pt in range(self._frm.num_parts):
+            links[pt, 0] = self._frm.path_info[pt].prev
+            links[pt, 1] = self._frm.path_info[pt].next
+        
+        return links
+    
     def __dealloc__(self):
         if self._frm == NULL:
             return
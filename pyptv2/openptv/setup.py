@@ -6,6 +6,7 @@ import os
 import shutil
 import sys
 import glob
+import tempfile
 from setuptools import Extension
 from setuptools.command.build_ext import build_ext
 import importlib
@@ -58,6 +59,38 @@ class BuildExt(build_ext, object):
 
         # We inherite from object to make super() work, see here: https://stackoverflow.com/a/18392639/871910
 
+    def build_extensions(self):
+        # Parallel loops get OpenMP flags if the compiler has them. Without OpenMP the loops still
+        # work, they just run on one thread. The flags go to every extension, not just those with
+        # prange() loops: the liboptv sources, which have OpenMP loops too, are compiled into each
+        # extension and share their object files between them, so an object compiled with OpenMP
+        # may be linked into any extension.
+        flags = self.get_openmp_flags()
+        for extension in self.extensions:
+            extension.extra_compile_args += flags
+            extension.extra_link_args += flags
+        super(BuildExt, self).build_extensions()
+
+    def get_openmp_flags(self):
+        if self.compiler.compiler_type == 'msvc':
+            return ['/openmp']
+
+        flags = ['-fopenmp']
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            test_file = os.path.join(tmp_dir, 'test_openmp.c')
+            with open(test_file, 'w') as f:
+                f.write('#include <omp.h>\nint main(void) { return omp_get_max_threads() < 1; }\n')
+            objects = self.compiler.compile([test_file], output_dir=tmp_dir, extra_postargs=flags)
+            self.compiler.link_executable(objects, os.path.join(tmp_dir, 'test_openmp'),
+                                          extra_postargs=flags)
+        except Exception:
+            print('OpenMP not available, building without it', file=sys.stderr)
+            return []
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        return flags
+
     @staticmethod
     def get_numpy_include_dir():
         # Get the numpy include directory, adapted from the following  RLs:
@@ -137,7 +170,8 @@ setup(
     ext_modules=ext_mods,
     include_package_data=True,
     data_files=[
-        ('liboptv', glob.glob('liboptv/src/*.c') + glob.glob('liboptv/include/optv/*.h'))
+        ('liboptv', glob.glob('liboptv/src/*.c') + glob.glob('liboptv/src/*.h')
+            + glob.glob('liboptv/include/optv/*.h'))
     ],
     package_data={
         'optv': ['*.pxd', '*.c', '*.h'],
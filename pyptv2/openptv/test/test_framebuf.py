@@ -7,8 +7,9 @@ References:
 [1] https://nose.readthedocs.org/en/latest/
 """
 
-import unittest, os, numpy as np
-from optv.tracking_framebuf import read_targets, Target, TargetArray, Frame
+import unittest, os, shutil, tempfile, numpy as np
+from optv.tracking_framebuf import read_targets, Target, TargetArray, Frame, \
+    TARGET_DTYPE
 
 class TestTargets(unittest.TestCase):
     def test_fill_target(self):
@@ -27,6 +28,51 @@ class TestTargets(unittest.TestCase):
         self.assertEqual(tarr[0].pos(), (1.5, 2.5))
         self.assertEqual(tarr[1].pos(), (3.5, 4.5))
 
+    def test_array_view(self):
+        """Viewing a target array as a structured NumPy array"""
+        targs = read_targets("testing_fodder/frame/cam1.", 333)
+        arr = np.asarray(targs)
+        
+        self.assertEqual(arr.dtype, TARGET_DTYPE)
+        self.assertEqual(len(arr), len(targs))
+        np.testing.assert_array_equal(arr['x'], [t.pos()[0] for t in targs])
+        np.testing.assert_array_equal(arr['sumg'], 
+            [t.sum_grey_value() for t in targs])
+        np.testing.assert_array_equal(arr['nx'], 
+            [t.count_pixels()[1] for t in targs])
+        
+        # No copy: writes go through, and the view keeps the targets alive
+        arr['y'][0] = 123.25
+        self.assertEqual(targs[0].pos()[1], 123.25)
+        del targs
+        self.assertEqual(arr['y'][0], 123.25)
+        
+        self.assertEqual(len(np.asarray(TargetArray())), 0)
+    
+    def test_from_array(self):
+        """Building a target array from a structured array"""
+        targs = read_targets("testing_fodder/frame/cam1.", 333)
+        arr = np.asarray(targs)
+        bright = arr[arr['sumg'] > np.median(arr['sumg'])]
+        
+        copy = TargetArray.from_array(bright)
+        self.assertEqual(len(copy), len(bright))
+        for t, rec in zip(copy, bright):
+            self.assertEqual(t.pos(), (rec['x'], rec['y']))
+            self.assertEqual(t.pnr(), rec['pnr'])
+            self.assertEqual(t.tnr(), rec['tnr'])
+        
+        # Any layout with the target fields will do
+        loose = np.zeros(2, dtype=[('x', float), ('y', float), ('n', int),
+            ('nx', int), ('ny', int), ('sumg', int), ('tnr', int), 
+            ('pnr', int), ('extra', float)])
+        loose['x'] = [1.5, 2.5]
+        copy = TargetArray.from_array(loose)
+        self.assertEqual(copy[1].pos(), (2.5, 0.))
+        
+        with self.assertRaises(ValueError):
+            TargetArray.from_array(np.zeros(3))
+
     def test_read_targets(self):
         """Reading a targets file from Python."""
         targs = read_targets("../../liboptv/tests/testing_fodder/sample_", 42)
@@ -59,6 +105,40 @@ class TestTargets(unittest.TestCase):
         self.assertEqual([targ.pos()[1] for targ in targs],
             [targ.pos()[1] for targ in tback])
         
+    def test_write_binary_targets(self):
+        """Round-trip test of binary targets files."""
+        targs = read_targets("testing_fodder/frame/cam1.", 333)
+        targs.write(b"testing_fodder/round_trip.", 1, binary=True)
+        
+        with open("testing_fodder/round_trip.0001_targets", "rb") as f:
+            self.assertEqual(f.read(8), b"PTVTRG01")
+        tback = read_targets("testing_fodder/round_trip.", 1)
+        np.testing.assert_array_equal(np.asarray(tback), np.asarray(targs))
+        
+        TargetArray().write(b"testing_fodder/round_trip.", 1, binary=True)
+        self.assertEqual(len(read_targets("testing_fodder/round_trip.", 1)), 0)
+        
+        with self.assertRaises(IOError):
+            targs.write(b"testing_fodder/no_such_dir/round_trip.", 1, 
+                binary=True)
+        with self.assertRaises(IOError):
+            read_targets("testing_fodder/no_such_dir/round_trip.", 1)
+
+    def test_read_many_targets(self):
+        """Files of more targets than the old fixed buffer read back whole."""
+        arr = np.zeros(60000, dtype=np.asarray(TargetArray()).dtype)
+        arr['pnr'] = np.arange(60000)
+        arr['x'] = np.arange(60000) * 0.5
+        targs = TargetArray.from_array(arr)
+
+        for binary in (True, False):
+            targs.write(b"testing_fodder/round_trip.", 1, binary=binary)
+            tback = read_targets("testing_fodder/round_trip.", 1)
+            self.assertEqual(len(tback), 60000)
+            np.testing.assert_array_equal(
+                np.asarray(tback)['pnr'], arr['pnr'])
+            np.testing.assert_array_equal(np.asarray(tback)['x'], arr['x'])
+
     def tearDown(self):
         filename = "testing_fodder/round_trip.0001_targets"
         if os.path.exists(filename):
@@ -89,6 +169,69 @@ class TestFrame(unittest.TestCase):
             [ 607., 209.],
             [ 563., 238.]])
         np.testing.assert_array_equal(targs, targs_correct)
+    
+    def test_read_binary_frame(self):
+        """Binary targets files are read like text ones"""
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            for name in ("rt_is.333", "ptv_is.333"):
+                shutil.copy("testing_fodder/frame/" + name, tmp_dir)
+            targ_files = []
+            for cam in range(1, 5):
+                targs = read_targets("testing_fodder/frame/cam%d." % cam, 333)
+                base = os.path.join(tmp_dir, "cam%d." % cam).encode()
+                targs.write(base, 333, binary=True)
+                targ_files.append(base)
+            
+            frm = Frame(4, corres_file_base=b"testing_fodder/frame/rt_is",
+                linkage_file_base=b"testing_fodder/frame/ptv_is", 
+                target_file_base=[b"testing_fodder/frame/cam%d." % c 
+                    for c in range(1, 5)], frame_num=333)
+            binary = Frame(4, 
+                corres_file_base=os.path.join(tmp_dir, "rt_is").encode(),
+                linkage_file_base=os.path.join(tmp_dir, "ptv_is").encode(),
+                target_file_base=targ_files, frame_num=333)
+            
+            for cam in range(4):
+                np.testing.assert_array_equal(
+                    binary.target_positions_for_camera(cam),
+                    frm.target_positions_for_camera(cam))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_read_large_frame(self):
+        """Frames grow to more particles and targets than preallocated"""
+        num = 30000
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            base = os.path.join(tmp_dir, "cam1.")
+            targs = TargetArray(num)
+            for ix in range(num):
+                targs[ix].set_pos((ix, 1.))
+                targs[ix].set_pnr(ix)
+            targs.write(base.encode(), 1, binary=True)
+
+            with open(os.path.join(tmp_dir, "rt_is.1"), "w") as rt_is, \
+                    open(os.path.join(tmp_dir, "ptv_is.1"), "w") as ptv_is:
+                rt_is.write("%d\n" % num)
+                ptv_is.write("%d\n" % num)
+                for ix in range(num):
+                    rt_is.write("%4d %9.3f %9.3f %9.3f %4d %4d %4d %4d\n" %
+                        (ix + 1, ix, 0., 0., ix, -1, -1, -1))
+                    ptv_is.write("%4d %4d %9.3f %9.3f %9.3f\n" %
+                        (-1, -2, ix, 0., 0.))
+
+            frm = Frame(1)
+            self.assertTrue(frm.read(
+                os.path.join(tmp_dir, "rt_is").encode(),
+                os.path.join(tmp_dir, "ptv_is").encode(),
+                [base.encode()], 1, None))
+
+            self.assertEqual(frm.positions().shape, (num, 3))
+            np.testing.assert_array_equal(
+                frm.target_positions_for_camera(0)[:, 0], np.arange(num))
+        finally:
+            shutil.rmtree(tmp_dir)
 
 if __name__ == "__main__":
     unittest.main()
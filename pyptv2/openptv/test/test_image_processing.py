@@ -1,7 +1,23 @@
 import unittest
-from optv.parameters import ControlParams
-from optv.image_processing import preprocess_image
-import numpy as np, os
+from optv.parameters import ControlParams, VolumeParams
+from optv.calibration import Calibration
+from optv.image_processing import preprocess_image, preprocess_images, \
+    PreprocessBuffers, FilterKernel, TileMask, StaticMask, FlatField
+import numpy as np, os, tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+def filter_3_reference(img, filt, min_val):
+    """Plain 3x3 filtering with the edge handling and the unsigned short 
+    arithmetic of filter_3()"""
+    flat = img.ravel().astype(np.int64)
+    res = img.copy().ravel()
+    imx = img.shape[1]
+    for k in range(imx + 1, flat.size - imx - 1):
+        acc = sum(filt[i][j] * flat[k + (i - 1)*imx + j - 1]
+                  for i in range(3) for j in range(3))
+        val = int((int(acc) % 65536) / np.sum(filt)) % 65536
+        res[k] = min(max(val, min_val), 255)
+    return res.reshape(img.shape)
 
 class Test_image_processing(unittest.TestCase):
         
@@ -14,6 +30,12 @@ class Test_image_processing(unittest.TestCase):
         self.filter_hp = 0
         self.control = ControlParams(4)
         self.control.set_image_size((5, 5))
+        self.correct_res = np.array([[ 0, 0, 0, 0, 0],
+                                     [ 0, 142, 85, 142, 0],
+                                     [ 0, 85, 0, 85, 0],
+                                     [ 0, 142, 85, 142, 0],
+                                     [ 0, 0, 0, 0, 0]],
+                                    dtype=np.uint8)
         
     def test_arguments(self):
         with self.assertRaises(ValueError):
@@ -46,6 +68,343 @@ class Test_image_processing(unittest.TestCase):
                                output_img=None)
         
         np.testing.assert_array_equal(res, correct_res)
+    
+    def test_output_img(self):
+        """The result is written into a given output array"""
+        output_img = np.full((5, 5), 7, dtype=np.uint8)
+        res = preprocess_image(self.input_img, self.filter_hp, self.control,
+                               lowpass_dim=1, output_img=output_img)
+        
+        self.assertIs(res, output_img)
+        np.testing.assert_array_equal(output_img, self.correct_res)
+        
+        with self.assertRaises(ValueError):
+            # non-contiguous output
+            preprocess_image(self.input_img, self.filter_hp, self.control,
+                             output_img=np.empty((5, 10), dtype=np.uint8)[:, ::2])
+    
+    def test_reuse_buffers(self):
+        """Buffers are reusable between calls and size-checked"""
+        buffers = PreprocessBuffers(self.control)
+        output_img = np.empty((5, 5), dtype=np.uint8)
+        for _ in range(3):
+            preprocess_image(self.input_img, self.filter_hp, self.control,
+                             output_img=output_img, buffers=buffers)
+            np.testing.assert_array_equal(output_img, self.correct_res)
+        
+        other_control = ControlParams(4)
+        other_control.set_image_size((6, 5))
+        with self.assertRaises(ValueError):
+            preprocess_image(self.input_img, self.filter_hp, self.control,
+                             buffers=PreprocessBuffers(other_control))
+    
+    def test_threads(self):
+        """Concurrent calls with separate buffers give identical results"""
+        def run(cam):
+            buffers = PreprocessBuffers(self.control)
+            output_img = np.empty((5, 5), dtype=np.uint8)
+            for _ in range(50):
+                preprocess_image(self.input_img, self.filter_hp, self.control,
+                                 output_img=output_img, buffers=buffers)
+            return output_img
+        
+        with ThreadPoolExecutor(4) as pool:
+            for res in pool.map(run, range(4)):
+                np.testing.assert_array_equal(res, self.correct_res)
+    
+    def test_filter_file(self):
+        """A 3x3 filter read from file; missing files raise an error"""
+        with tempfile.NamedTemporaryFile('w', suffix='.par', delete=False) as f:
+            f.write("0 0 0\n0 1 0\n0 0 0\n")
+        try:
+            res = preprocess_image(self.input_img, 2, self.control,
+                                   filter_file=f.name)
+            # filter_3() enforces a minimal brightness of 8 inside the image
+            correct_res = self.correct_res.copy()
+            correct_res.flat[6:19] = np.maximum(correct_res.flat[6:19], 8)
+            np.testing.assert_array_equal(res, correct_res)
+        finally:
+            os.remove(f.name)
+        
+        with self.assertRaises(Exception):
+            preprocess_image(self.input_img, 2, self.control,
+                             filter_file=f.name)
+    
+    def test_filter_file_negative_sum(self):
+        """Negative sums wrap around in an unsigned short, like filter_3()"""
+        with tempfile.NamedTemporaryFile('w', suffix='.par', delete=False) as f:
+            f.write("0 0 0\n0 -1 0\n0 0 0\n")
+        try:
+            res = preprocess_image(self.input_img, 2, self.control,
+                                   filter_file=f.name)
+        finally:
+            os.remove(f.name)
+        
+        # -p wraps to 65536 - p, divided by -1 that wraps back to p.
+        correct_res = self.correct_res.copy()
+        correct_res.flat[6:19] = np.maximum(correct_res.flat[6:19], 8)
+        np.testing.assert_array_equal(res, correct_res)
+
+    def test_filter_kernel(self):
+        """Filter kernels detect separability and match direct filtering"""
+        img = np.random.RandomState(0).randint(0, 256, (5, 5)).astype(np.uint8)
+        filters = [
+            ([[1, 2, 1], [2, 4, 2], [1, 2, 1]], True),
+            ([[0, -1, 0], [-1, 8, -1], [0, -1, 0]], False),
+            ([[2, 0, -2], [4, 0, -4], [2, 0, -2.]], False), # sums to zero
+            ([[0.5, 1, 0.5], [1, 2, 1], [0.5, 1, 0.5]], False),
+            ([[0, 1, 0], [1, -8, 1], [0, 1, 0]], False), # negative sum
+            ([[-1, -2, -1], [-2, -4.5, -2], [-1, -2, -1]], False),
+        ]
+        for filt, separable in filters:
+            if np.sum(filt) == 0:
+                with self.assertRaises(ValueError):
+                    FilterKernel(matrix=filt)
+                continue
+            
+            kernel = FilterKernel(matrix=filt)
+            self.assertEqual(kernel.separable, separable)
+            np.testing.assert_array_equal(kernel.get_matrix(), filt)
+            
+            # filter_hp=0 result, filtered by the kernel
+            hp = preprocess_image(img, 0, self.control, 1)
+            res = preprocess_image(img, 2, self.control, 1, filter_file=kernel)
+            np.testing.assert_array_equal(res,
+                filter_3_reference(hp, np.array(filt), 8))
+        
+        with self.assertRaises(ValueError):
+            FilterKernel()
+    
+    def test_lowpass_filter(self):
+        """filter_hp=1 averages the highpass result"""
+        img = np.random.RandomState(1).randint(0, 256, (5, 5)).astype(np.uint8)
+        hp = preprocess_image(img, 0, self.control, 1)
+        res = preprocess_image(img, 1, self.control, 1)
+        np.testing.assert_array_equal(res,
+            filter_3_reference(hp, np.ones((3, 3), dtype=int), 0))
+    
+    def test_preprocess_images(self):
+        """A stack of images is filtered in one call, into a given output"""
+        stack = np.array([self.input_img, 255 - self.input_img,
+                          np.zeros((5, 5), dtype=np.uint8)] * 3)
+        output_imgs = np.empty_like(stack)
+        
+        res = preprocess_images(stack, self.filter_hp, self.control,
+                                lowpass_dim=1, output_imgs=output_imgs,
+                                num_threads=2)
+        self.assertIs(res, output_imgs)
+        for img, hp in zip(stack, res):
+            np.testing.assert_array_equal(hp,
+                preprocess_image(img, self.filter_hp, self.control, 1))
+        
+        with self.assertRaises(ValueError):
+            preprocess_images(stack, self.filter_hp, self.control,
+                              output_imgs=np.empty((9, 5, 4), dtype=np.uint8))
+        
+        with self.assertRaises(ValueError):
+            # image size differs from control parameters
+            preprocess_images(stack[:, :4], self.filter_hp, self.control)
+
+    def test_16bit(self):
+        """16-bit images are filtered in their own units"""
+        control = ControlParams(4)
+        control.set_image_size((40, 30))
+        img = np.random.RandomState(3).randint(0, 256, (30, 40)).astype(np.uint8)
+        wide = img.astype(np.uint16)
+        
+        # Gray values that fit 8 bits give the 8-bit results
+        for filter_hp in (0, 1):
+            res = preprocess_image(wide, filter_hp, control, 3)
+            self.assertEqual(res.dtype, np.uint16)
+            np.testing.assert_array_equal(res, 
+                preprocess_image(img, filter_hp, control, 3))
+        
+        # A bright spot keeps its full dynamic range
+        spot = np.zeros((30, 40), dtype=np.uint16)
+        spot[15, 20] = 60000
+        res = preprocess_image(spot, 0, control, 1)
+        self.assertEqual(res[15, 20], 60000 - 60000 // 9)
+        
+        buffers = PreprocessBuffers(control, np.uint16)
+        np.testing.assert_array_equal(
+            preprocess_image(spot, 0, control, 1, buffers=buffers), res)
+        with self.assertRaises(ValueError):
+            preprocess_image(img, 0, control, 1, buffers=buffers)
+        with self.assertRaises(ValueError):
+            preprocess_image(spot, 0, control, 1, output_img=img)
+        with self.assertRaises(TypeError):
+            preprocess_image(spot.astype(np.float32), 0, control, 1)
+        
+        stack = np.array([wide, spot])
+        res = preprocess_images(stack, 0, control, 3, num_threads=2)
+        for img16, hp in zip(stack, res):
+            np.testing.assert_array_equal(hp,
+                preprocess_image(img16, 0, control, 3))
+
+    def test_tile_mask(self):
+        """Masked filtering matches full filtering in live tiles only"""
+        control = ControlParams(4)
+        control.set_image_size((40, 30))
+        img = np.random.RandomState(2).randint(0, 256, (30, 40)).astype(np.uint8)
+        
+        mask = TileMask(control, tile_size=8)
+        self.assertEqual(mask.get_tiles().shape, (4, 5))
+        self.assertEqual(mask.live_fraction(), 0)
+        
+        mask.set_rect(10, 20, 12, 14)
+        tiles = np.zeros((4, 5), dtype=bool)
+        tiles[1, 1:3] = True
+        np.testing.assert_array_equal(mask.get_tiles(), tiles)
+        
+        mask.set_rect(35, 40, 25, 30)
+        for filter_hp in (0, 1):
+            full = preprocess_image(img, filter_hp, control, 3)
+            res = preprocess_image(img, filter_hp, control, 3, mask=mask)
+            np.testing.assert_array_equal(res[8:16, 8:24], full[8:16, 8:24])
+            # the 3x3 filter's wrap-around on the image edge is not kept
+            np.testing.assert_array_equal(res[24:, 32:-1], full[24:, 32:-1])
+            res[8:16, 8:24] = 0
+            res[24:, 32:] = 0
+            self.assertFalse(res.any())
+        
+        stack = np.array([img, img])
+        res = preprocess_images(stack, 0, control, 3, masks=[mask, None])
+        np.testing.assert_array_equal(res[1], preprocess_image(img, 0, control, 3))
+        np.testing.assert_array_equal(res[0],
+            preprocess_image(img, 0, control, 3, mask=mask))
+        
+        mask.dilate(1)
+        self.assertEqual(mask.get_tiles()[0, 0], True)
+        
+        with self.assertRaises(ValueError):
+            preprocess_image(self.input_img, 0, self.control, mask=mask)
+
+    def test_static_mask(self):
+        """Masked pixels come out 0, the rest as filtered unmasked"""
+        control = ControlParams(4)
+        control.set_image_size((40, 30))
+        img = np.random.RandomState(4).randint(0, 256, (30, 40)).astype(np.uint8)
+        
+        keep = np.ones((30, 40), dtype=bool)
+        keep[:16, :8] = False
+        keep[5:20, 20:23] = False
+        keep[25, ::3] = False
+        static = StaticMask(keep.astype(np.uint8) * 255)
+        self.assertEqual(static.image_size, (40, 30))
+        np.testing.assert_array_equal(static.to_image(), keep)
+        self.assertEqual(static.live_fraction(), keep.mean())
+        self.assertEqual(static.num_spans(), 14 + 2*15 + 13)
+        
+        mask = TileMask.from_static(control, static, tile_size=8)
+        self.assertIs(mask.static, static)
+        tiles = np.ones((4, 5), dtype=bool)
+        tiles[:2, 0] = False
+        np.testing.assert_array_equal(mask.get_tiles(), tiles)
+        
+        for filter_hp in (0, 1):
+            full = preprocess_image(img, filter_hp, control, 3)
+            res = preprocess_image(img, filter_hp, control, 3, mask=mask)
+            self.assertFalse(res[~keep].any())
+            # the 3x3 filter's wrap-around on the edges of the filtered 
+            # tile runs is not kept
+            cols = slice(None) if filter_hp == 0 else slice(9, -1)
+            np.testing.assert_array_equal(res[:, cols], 
+                np.where(keep, full, 0)[:, cols])
+        
+        # Restricted to live tiles as well
+        mask.set_rect(0, 40, 0, 30, False)
+        mask.set_rect(16, 32, 0, 16)
+        res = preprocess_image(img, 0, control, 3, mask=mask)
+        full = preprocess_image(img, 0, control, 3)
+        keep[:, :16] = keep[16:] = keep[:, 32:] = False
+        np.testing.assert_array_equal(res, np.where(keep, full, 0))
+        
+        mask.set_static(None)
+        self.assertIsNone(mask.static)
+        np.testing.assert_array_equal(
+            preprocess_image(img, 0, control, 3, mask=mask)[:16, 16:32], 
+            full[:16, 16:32])
+        
+        with self.assertRaises(ValueError):
+            mask.set_static(StaticMask(np.ones((30, 41))))
+        with self.assertRaises(ValueError):
+            StaticMask(np.ones(30))
+
+    def test_tile_mask_from_volume(self):
+        """Only tiles seeing the observed volume are live"""
+        cpar = ControlParams(4)
+        cpar.read_control_par(b"testing_fodder/corresp/control.par")
+        cpar.get_multimedia_params().set_layers([1.0001], [1.])
+        cpar.get_multimedia_params().set_n3(1.0001)
+        vpar = VolumeParams()
+        vpar.read_volume_par(b"testing_fodder/corresp/criteria.par")
+        cal = Calibration()
+        cal.from_file(b"testing_fodder/calibration/sym_cam1.tif.ori",
+            b"testing_fodder/calibration/cam1.tif.addpar")
+        
+        mask = TileMask.from_volume(cpar, vpar, cal, tile_size=64, margin=0)
+        self.assertEqual(mask.live_fraction(), 1.)
+        
+        # A narrow volume around the origin, which is seen near the image 
+        # center. The volume is not bounded in Y.
+        vpar.set_X_lay([-20, 20])
+        vpar.set_Zmin_lay([-20, -20])
+        vpar.set_Zmax_lay([20, 20])
+        mask = TileMask.from_volume(cpar, vpar, cal, tile_size=64, margin=0)
+        tiles = mask.get_tiles()
+        self.assertTrue(tiles[528 // 64, 642 // 64])
+        self.assertFalse(tiles[:, 0].any())
+        self.assertFalse(tiles[:, -1].any())
+
+    def test_flat_field(self):
+        """Dark and gain maps applied with integer arithmetic"""
+        control = ControlParams(4)
+        control.set_image_size((4, 3))
+        dark = np.full((3, 4), 10, dtype=np.uint8)
+        dark[0, 0] = 50
+        flat = np.full((3, 4), 110, dtype=np.uint8)
+        flat[1, :] = 60  # vignetted row, half the response
+        flat[2, 3] = 5   # dead pixel keeps unit gain
+        
+        ff = FlatField(control, dark, flat)
+        self.assertEqual(ff.dtype, np.uint8)
+        gain = ff.get_gain()
+        mean_response = (flat.astype(float) - dark)[flat > dark].mean()
+        np.testing.assert_allclose(gain[1, 1], mean_response / 50., atol=1e-3)
+        self.assertEqual(gain[2, 3], 1.)
+        
+        img = np.full((3, 4), 60, dtype=np.uint8)
+        img[1, 0] = 255
+        res = ff.correct(img)
+        expected = np.clip(np.rint(
+            np.maximum(img.astype(float) - dark, 0) * gain), 0, 255)
+        np.testing.assert_array_equal(res, expected)
+        self.assertEqual(res[0, 0], round(10 * gain[0, 0]))
+        self.assertEqual(res[1, 0], 255)  # clipped
+        
+        # In place, and offset only
+        ff.correct(img, img)
+        np.testing.assert_array_equal(img, res)
+        np.testing.assert_array_equal(
+            FlatField(control, dark=dark).correct(res),
+            np.maximum(res.astype(int) - dark, 0))
+        
+        # 16-bit, gain only
+        flat = np.full((3, 4), 20000, dtype=np.uint16)
+        flat[1, 0] = 5000
+        ff = FlatField(control, flat=flat)
+        img = np.full((3, 4), 60000, dtype=np.uint16)
+        res = ff.correct(img)
+        self.assertEqual(res.dtype, np.uint16)
+        self.assertEqual(res[0, 0], 56250)
+        self.assertEqual(res[1, 0], 65535)
+        
+        with self.assertRaises(ValueError):
+            ff.correct(img.astype(np.uint8))
+        with self.assertRaises(ValueError):
+            FlatField(control)
+        with self.assertRaises(ValueError):
+            FlatField(control, dark=np.zeros((4, 4), dtype=np.uint8))
 
 if __name__ == "__main__":
     unittest.main()
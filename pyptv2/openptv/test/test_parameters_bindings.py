@@ -2,7 +2,7 @@ import unittest
 from optv.parameters import MultimediaParams, ControlParams, VolumeParams, \
     SequenceParams, TrackingParams, TargetParams
 
-import numpy, os, shutil
+import numpy, os, shutil, tempfile
 from numpy import r_
 
 class Test_MultimediaParams(unittest.TestCase):
@@ -403,6 +403,39 @@ class TestTargetParams(unittest.TestCase):
 
         numpy.testing.assert_array_equal(
             tp.get_grey_thresholds(), [2, 3, 4, 5])
+        self.assertEqual(tp.get_engine(), "grow")
+    
+    def test_engine(self):
+        tp = TargetParams(engine="union_find")
+        self.assertEqual(tp.get_engine(), "union_find")
+        
+        tp.set_engine("grow")
+        self.assertEqual(tp.get_engine(), "grow")
+        
+        with self.assertRaises(ValueError):
+            tp.set_engine("flood")
+    
+    def test_read_engine(self):
+        """The optional engine line of targ_rec.par"""
+        with open("testing_fodder/target_parameters/targ_rec.par") as f:
+            lines = f.read().split()
+        
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmp_dir, "targ_rec.par")
+            for engine, expected in (("1", "union_find"), ("0", "grow")):
+                with open(filename, "w") as f:
+                    f.write("\n".join(lines + [engine]) + "\n")
+                tp = TargetParams()
+                tp.read(filename.encode())
+                self.assertEqual(tp.get_engine(), expected)
+            
+            with open(filename, "w") as f:
+                f.write("\n".join(lines + ["7"]) + "\n")
+            with self.assertRaises(IOError):
+                TargetParams().read(filename.encode())
+        finally:
+            shutil.rmtree(tmp_dir)
         
 if __name__ == "__main__":
     unittest.main()
@@ -10,8 +10,13 @@ Created on Thu Aug 18 16:52:36 2016
 import unittest
 import numpy as np
 
-from optv.segmentation import target_recognition
+from optv.segmentation import target_recognition, \
+    highpass_target_recognition, Segmenter, frame_target_recognition, \
+    label_blobs, REJECT_REASONS
 from optv.parameters import ControlParams, TargetParams
+from optv.calibration import Calibration
+from optv.correspondences import MatchedCoords
+from optv.image_processing import TileMask, StaticMask, preprocess_image
 
 class TestTargRec(unittest.TestCase):
     def test_single_target(self):
@@ -33,6 +38,55 @@ class TestTargRec(unittest.TestCase):
         self.assertEqual(len(targs), 1)
         self.assertEqual(targs[0].count_pixels(), (9, 3, 3))
     
+    def test_16bit(self):
+        img = np.array([
+            [0,     0,     0,     0, 0],
+            [0, 60000, 60000, 60000, 0],
+            [0, 60000, 61000, 60000, 0],
+            [0, 60000, 60000, 60000, 0],
+            [0,     0,     0,     0, 0]
+        ], dtype=np.uint16)
+        
+        cpar = ControlParams(4, image_size=(5, 5))
+        tpar = TargetParams(gvthresh=[50000, 100, 20, 20], discont=1000,
+            pixel_count_bounds=(1, 10), min_sum_grey=500000, 
+            xsize_bounds=(1, 10), ysize_bounds=(1, 10))
+        
+        targs = target_recognition(img, tpar, 0, cpar)
+        
+        self.assertEqual(len(targs), 1)
+        self.assertEqual(targs[0].count_pixels(), (9, 3, 3))
+        self.assertEqual(targs[0].sum_grey_value(), 8*60000 + 61000)
+        np.testing.assert_array_almost_equal(targs[0].pos(), (2.5, 2.5))
+        
+        # The 8-bit version of the image gives the same target
+        tpar.set_grey_thresholds([50, 100, 20, 20])
+        tpar.set_max_discontinuity(5)
+        tpar.set_min_sum_grey(12)
+        targs8 = target_recognition((img // 256).astype(np.uint8), tpar, 0, 
+            cpar)
+        self.assertEqual(targs8[0].count_pixels(), (9, 3, 3))
+    
+    def test_tile_mask(self):
+        img = np.zeros((8, 8), dtype=np.uint8)
+        img[2, 2] = 255
+        img[5, 5] = 255
+        
+        cpar = ControlParams(4, image_size=(8, 8))
+        tpar = TargetParams(gvthresh=[250, 100, 20, 20], discont=5,
+            pixel_count_bounds=(1, 10), min_sum_grey=12, 
+            xsize_bounds=(1, 10), ysize_bounds=(1, 10))
+        
+        mask = TileMask(cpar, tile_size=4)
+        mask.set_rect(4, 8, 4, 8)
+        targs = target_recognition(img, tpar, 0, cpar, mask=mask)
+        
+        self.assertEqual(len(targs), 1)
+        np.testing.assert_array_equal(targs[0].pos(), (5.5, 5.5))
+        
+        # Without the mask both are found
+        self.assertEqual(len(target_recognition(img, tpar, 0, cpar)), 2)
+    
     def test_two_targets(self):
         img = np.array([
             [0,   0,   0,   0, 0],
@@ -78,5 +132,454 @@ class TestTargRec(unittest.TestCase):
         self.assertEqual(len(targs), 1)
         self.assertEqual(targs[0].count_pixels(), (4, 3, 2))
 
+    def test_highpass_fused(self):
+        """Fused highpass + recognition equals the two separate steps"""
+        rng = np.random.RandomState(42)
+        cpar = ControlParams(4, image_size=(90, 120))
+        tpar = TargetParams(gvthresh=[20, 20, 20, 20], discont=30,
+            pixel_count_bounds=(2, 40), min_sum_grey=50, 
+            xsize_bounds=(2, 8), ysize_bounds=(2, 8))
+        
+        yy, xx = np.mgrid[:120, :90]
+        img = rng.randint(0, 30, size=(120, 90)).astype(float)
+        for x, y in rng.uniform(3, 87, size=(60, 2)) * [1, 120/90.]:
+            img += 200*np.exp(-((xx - x)**2 + (yy - y)**2)/3.)
+        img = np.clip(img, 0, 255).astype(np.uint8)
+        
+        for lowpass_dim in (1, 2, 4):
+            hp = preprocess_image(img, 0, cpar, lowpass_dim)
+            expected = target_recognition(hp, tpar, 0, cpar)
+            targs = highpass_target_recognition(img, tpar, 0, cpar, 
+                lowpass_dim)
+            
+            self.assertGreater(len(expected), 10)
+            self.assertEqual(len(targs), len(expected))
+            for t, e in zip(targs, expected):
+                np.testing.assert_array_equal(t.pos(), e.pos())
+                self.assertEqual(t.count_pixels(), e.count_pixels())
+                self.assertEqual(t.sum_grey_value(), e.sum_grey_value())
+        
+        # A strip taller than the image falls back to whole-image buffers
+        tpar.set_ysize_bounds((2, 100))
+        targs = highpass_target_recognition(img, tpar, 0, cpar, 1)
+        expected = target_recognition(preprocess_image(img, 0, cpar, 1), 
+            tpar, 0, cpar)
+        self.assertEqual(len(targs), len(expected))
+
+    def test_parallel_strips(self):
+        """Searching strips in parallel gives the serial targets, in order"""
+        rng = np.random.RandomState(7)
+        cpar = ControlParams(4, image_size=(100, 160))
+        tpar = TargetParams(gvthresh=[20, 20, 20, 20], discont=30,
+            pixel_count_bounds=(2, 400), min_sum_grey=50, 
+            xsize_bounds=(2, 40), ysize_bounds=(2, 60))
+        
+        # Dense blobs, some elongated across several strips
+        yy, xx = np.mgrid[:160, :100]
+        img = rng.randint(0, 30, size=(160, 100)).astype(float)
+        for x, y in rng.uniform(3, 97, size=(120, 2)) * [1, 1.6]:
+            img += 200*np.exp(-((xx - x)**2 + (yy - y)**2)/3.)
+        for x, y in rng.uniform(10, 90, size=(6, 2)) * [1, 1.6]:
+            img += 150*np.exp(-(xx - x)**2/4. - (yy - y)**2/300.)
+        img = np.clip(img, 0, 255)
+        
+        mask = TileMask(cpar, 16)
+        mask.set_rect(0, 100, 0, 160, False)
+        mask.set_rect(20, 70, 30, 140, True)
+        
+        for dtype, scale in ((np.uint8, 1), (np.uint16, 200)):
+            tpar.set_grey_thresholds([20*scale]*4)
+            tpar.set_max_discontinuity(30*scale)
+            tpar.set_min_sum_grey(50*scale)
+            wide = (img*scale).astype(dtype)
+            
+            for tiles in (None, mask):
+                expected = target_recognition(wide, tpar, 0, cpar, mask=tiles)
+                self.assertGreater(len(expected), 10)
+                
+                for num_threads in (0, 2, 3, 7):
+                    targs = target_recognition(wide, tpar, 0, cpar, 
+                        mask=tiles, num_threads=num_threads)
+                    self.assertEqual(len(targs), len(expected))
+                    for n, (t, e) in enumerate(zip(targs, expected)):
+                        self.assertEqual(t.pnr(), n)
+                        np.testing.assert_array_equal(t.pos(), e.pos())
+                        self.assertEqual(t.count_pixels(), e.count_pixels())
+                        self.assertEqual(t.sum_grey_value(), 
+                            e.sum_grey_value())
+
+    def test_segmenter(self):
+        """A reused segmenter finds what target_recognition() finds"""
+        rng = np.random.RandomState(3)
+        cpar = ControlParams(4, image_size=(60, 50))
+        tpar = TargetParams(gvthresh=[20, 20, 20, 20], discont=30,
+            pixel_count_bounds=(2, 40), min_sum_grey=50, 
+            xsize_bounds=(2, 8), ysize_bounds=(2, 8))
+        mask = TileMask(cpar, 16)
+        mask.set_rect(0, 30, 0, 50)
+        
+        yy, xx = np.mgrid[:50, :60]
+        frames = []
+        for frame in range(3):
+            img = rng.randint(0, 30, size=(50, 60)).astype(float)
+            for x, y in rng.uniform(3, 47, size=(15, 2)) * [1.2, 1]:
+                img += 200*np.exp(-((xx - x)**2 + (yy - y)**2)/3.)
+            frames.append(np.clip(img, 0, 255).astype(np.uint8))
+        
+        for tiles in (None, mask):
+            seg = Segmenter(cpar, tpar, mask=tiles)
+            for img in frames:
+                targs = seg.segment(img, 0)
+                expected = target_recognition(img, tpar, 0, cpar, mask=tiles)
+                self.assertGreater(len(expected), 3)
+                self.assertEqual(len(targs), len(expected))
+                for t, e in zip(targs, expected):
+                    np.testing.assert_array_equal(t.pos(), e.pos())
+                    self.assertEqual(t.count_pixels(), e.count_pixels())
+        
+        # 16-bit images need a 16-bit segmenter
+        with self.assertRaises(ValueError):
+            seg.segment(frames[0].astype(np.uint16), 0)
+        seg = Segmenter(cpar, tpar, dtype=np.uint16)
+        self.assertEqual(seg.dtype, np.uint16)
+        tpar.set_grey_thresholds([20*256]*4)
+        tpar.set_max_discontinuity(30*256)
+        tpar.set_min_sum_grey(50*256)
+        targs = seg.segment(frames[0].astype(np.uint16) * 256, 0)
+        self.assertEqual(len(targs), len(target_recognition(
+            frames[0].astype(np.uint16) * 256, tpar, 0, cpar)))
+
+    def test_unbounded(self):
+        """Dense images and large blobs are found whole"""
+        cpar = ControlParams(4, image_size=(420, 400))
+        tpar = TargetParams(gvthresh=[20, 20, 20, 20], discont=5,
+            pixel_count_bounds=(1, 20000), min_sum_grey=10, 
+            xsize_bounds=(1, 200), ysize_bounds=(1, 200))
+        
+        # 40000 single-pixel targets, beyond the old 20480 limit
+        img = np.zeros((400, 420), dtype=np.uint8)
+        img[1:-1:2, 1:-1:2] = 100
+        for num_threads in (1, 3):
+            targs = target_recognition(img, tpar, 0, cpar, 
+                num_threads=num_threads)
+            self.assertEqual(len(targs), 199*209)
+        
+        seg = Segmenter(cpar, tpar)
+        self.assertEqual(len(seg.segment(img, 0)), 199*209)
+
+        # Earlier results survive a search that grows the target buffer
+        seg = Segmenter(cpar, tpar)
+        one = np.zeros((400, 420), dtype=np.uint8)
+        one[10, 20] = 100
+        first = seg.segment(one, 0)
+        self.assertEqual(len(seg.segment(img, 0)), 199*209)
+        self.assertEqual(first[0].pos(), (20.5, 10.5))
+        self.assertEqual(np.asarray(first)['x'].tolist(), [20.5])
+        
+        # A blob of 150x120 pixels overflows the old fixed waitlist
+        img[:] = 0
+        img[100:220, 50:200] = 100
+        img[160, 125] = 101
+        targs = target_recognition(img, tpar, 0, cpar)
+        self.assertEqual(len(targs), 1)
+        self.assertEqual(targs[0].count_pixels(), (150*120, 150, 120))
+        np.testing.assert_array_almost_equal(targs[0].pos(), (125., 160.), 
+            decimal=2)
+
+    def test_label_blobs(self):
+        """Blobs are labeled in scan order, accepted as targets or not"""
+        cpar = ControlParams(4, image_size=(420, 400))
+        img = np.zeros((400, 420), dtype=np.uint8)
+        img[100:220, 50:200] = 100
+        img[160, 125] = 101
+        img[20, 300] = 50
+        img[300:303, 10:12] = 60
+        
+        labels, num_blobs = label_blobs(img, 20, 5, cpar)
+        self.assertEqual(num_blobs, 3)
+        self.assertEqual(labels.shape, (400, 420))
+        self.assertEqual(labels[20, 300], 1)
+        self.assertTrue(np.all(labels[100:220, 50:200] == 2))
+        self.assertTrue(np.all(labels[300:303, 10:12] == 3))
+        self.assertEqual(np.count_nonzero(labels), 1 + 150*120 + 6)
+        
+        # Higher threshold, and only the live tiles
+        labels, num_blobs = label_blobs(img, 55, 5, cpar)
+        self.assertEqual(num_blobs, 2)
+        mask = TileMask(cpar, 64)
+        mask.set_rect(0, 64, 256, 320)
+        labels, num_blobs = label_blobs(img, 20, 5, cpar, mask)
+        self.assertEqual(num_blobs, 1)
+        self.assertEqual(labels[301, 11], 1)
+
+    def test_union_find(self):
+        """The union-find engine finds the targets of the grow engine"""
+        rng = np.random.RandomState(5)
+        cpar = ControlParams(4, image_size=(100, 160))
+        tpar = TargetParams(gvthresh=[20, 20, 20, 20], discont=255,
+            pixel_count_bounds=(2, 400), min_sum_grey=50, 
+            xsize_bounds=(2, 40), ysize_bounds=(2, 60))
+        uf_tpar = TargetParams(gvthresh=[20, 20, 20, 20], discont=255,
+            pixel_count_bounds=(2, 400), min_sum_grey=50, 
+            xsize_bounds=(2, 40), ysize_bounds=(2, 60), engine="union_find")
+        
+        # Separate blobs, so that both engines must agree exactly
+        yy, xx = np.mgrid[:160, :100]
+        img = rng.randint(0, 15, size=(160, 100)).astype(float)
+        for x in range(8, 100, 14):
+            for y in range(8, 160, 14):
+                x0, y0 = x + rng.uniform(-2, 2), y + rng.uniform(-2, 2)
+                img += 200*np.exp(-((xx - x0)**2 + (yy - y0)**2)/3.)
+        img = np.clip(img, 0, 255)
+        
+        mask = TileMask(cpar, 16)
+        mask.set_rect(0, 100, 0, 160, False)
+        mask.set_rect(20, 70, 30, 140, True)
+        
+        for dtype, scale in ((np.uint8, 1), (np.uint16, 200)):
+            for tp in (tpar, uf_tpar):
+                tp.set_grey_thresholds([20*scale]*4)
+                tp.set_max_discontinuity(255*scale)
+                tp.set_min_sum_grey(50*scale)
+            wide = (img*scale).astype(dtype)
+            
+            for tiles in (None, mask):
+                expected = target_recognition(wide, tpar, 0, cpar, mask=tiles)
+                self.assertGreater(len(expected), 10)
+                
+                for num_threads in (0, 3):
+                    targs = target_recognition(wide, uf_tpar, 0, cpar, 
+                        mask=tiles, num_threads=num_threads)
+                    self.assertEqual(len(targs), len(expected))
+                    for t, e in zip(targs, expected):
+                        np.testing.assert_array_almost_equal(t.pos(), e.pos())
+                        self.assertEqual(t.count_pixels(), e.count_pixels())
+                        self.assertEqual(t.sum_grey_value(), 
+                            e.sum_grey_value())
+                
+                seg = Segmenter(cpar, uf_tpar, mask=tiles, dtype=dtype)
+                self.assertEqual(len(seg.segment(wide, 0)), len(expected))
+        
+        # A large blob is one target
+        uf_tpar.set_grey_thresholds([20]*4)
+        uf_tpar.set_max_discontinuity(5)
+        uf_tpar.set_min_sum_grey(10)
+        uf_tpar.set_pixel_count_bounds((1, 20000))
+        uf_tpar.set_xsize_bounds((1, 200))
+        uf_tpar.set_ysize_bounds((1, 200))
+        cpar = ControlParams(4, image_size=(420, 400))
+        img = np.zeros((400, 420), dtype=np.uint8)
+        img[100:220, 50:200] = 100
+        img[160, 125] = 101
+        targs = target_recognition(img, uf_tpar, 0, cpar)
+        self.assertEqual(len(targs), 1)
+        self.assertEqual(targs[0].count_pixels(), (150*120, 150, 120))
+        
+        # Touching blobs are split at a steep valley, by both engines
+        img[:] = 0
+        img[100:110, 100:120] = [100]*8 + [70, 40, 41, 70] + [90]*8
+        img[104, 104] = 101
+        img[104, 115] = 91
+        tpar = TargetParams(gvthresh=[20, 20, 20, 20], discont=5,
+            pixel_count_bounds=(1, 20000), min_sum_grey=10, 
+            xsize_bounds=(1, 200), ysize_bounds=(1, 200))
+        for tp in (tpar, uf_tpar):
+            targs = target_recognition(img, tp, 0, cpar)
+            self.assertEqual([t.count_pixels() for t in targs], 
+                [(100, 10, 10), (100, 10, 10)])
+
+    def test_static_mask(self):
+        """Masked pixels are skipped like the zeros of a subtracted mask"""
+        rng = np.random.RandomState(6)
+        cpar = ControlParams(4, image_size=(100, 160))
+        tpar = TargetParams(gvthresh=[20, 20, 20, 20], discont=255,
+            pixel_count_bounds=(2, 400), min_sum_grey=50, 
+            xsize_bounds=(2, 40), ysize_bounds=(2, 60))
+        
+        yy, xx = np.mgrid[:160, :100]
+        img = rng.randint(0, 15, size=(160, 100)).astype(float)
+        for x in range(8, 100, 14):
+            for y in range(8, 160, 14):
+                img += 200*np.exp(-((xx - x)**2 + (yy - y)**2)/3.)
+        img = np.clip(img, 0, 255).astype(np.uint8)
+        
+        # Whole blobs, a stripe through blobs and single pixels are masked
+        keep = np.ones((160, 100), dtype=np.uint8)
+        keep[30:70, 30:60] = 0
+        keep[100:150, 75:80] = 0
+        keep[::5, 1::7] = 0
+        static = StaticMask(keep)
+        
+        tiles = TileMask(cpar, 16)
+        tiles.set_rect(0, 100, 16, 160)
+        masked = TileMask(cpar, 16)
+        masked.set_tiles(tiles.get_tiles())
+        masked.set_static(static)
+        
+        for engine in ("grow", "union_find"):
+            tpar.set_engine(engine)
+            for plain, mask in ((None, TileMask.from_static(cpar, static, 16)),
+                                (tiles, masked)):
+                expected = target_recognition(img * keep, tpar, 0, cpar, 
+                    mask=plain)
+                self.assertGreater(len(expected), 30)
+                for num_threads in (1, 3):
+                    targs = target_recognition(img, tpar, 0, cpar, mask=mask,
+                        num_threads=num_threads)
+                    self.assertEqual(len(targs), len(expected))
+                    for t, e in zip(targs, expected):
+                        np.testing.assert_array_almost_equal(t.pos(), e.pos())
+                        self.assertEqual(t.count_pixels(), e.count_pixels())
+                        self.assertEqual(t.sum_grey_value(), 
+                            e.sum_grey_value())
+                
+                seg = Segmenter(cpar, tpar, mask=mask)
+                self.assertEqual(len(seg.segment(img, 0)), len(expected))
+
+    def test_statistics(self):
+        """Histograms of the targets and counts of the blobs rejected"""
+        cpar = ControlParams(4, image_size=(120, 100))
+        tpar = TargetParams(gvthresh=[20, 20, 20, 20], discont=255,
+            pixel_count_bounds=(2, 40), min_sum_grey=500, 
+            xsize_bounds=(1, 8), ysize_bounds=(1, 8))
+        
+        img = np.zeros((100, 120), dtype=np.uint8)
+        img[10:13, 10:13] = 100     # accepted, 9 pixels
+        img[11, 11] = 101
+        img[30:32, 10:15] = 200     # accepted, 10 pixels
+        img[30, 12] = 201
+        img[50, 10] = 250           # a single pixel
+        img[70, 10:22] = 100        # 12 wide
+        img[70, 15] = 101
+        img[10:22, 60] = 100        # 12 high
+        img[15, 60] = 101
+        img[40:42, 60:62] = 50      # too dim
+        img[40, 60] = 51
+        
+        expected = [0, 1, 1, 1, 1]
+        for engine in ("grow", "union_find"):
+            tpar.set_engine(engine)
+            targs, stats = target_recognition(img, tpar, 0, cpar, stats=True)
+            self.assertEqual(len(targs), 2)
+            np.testing.assert_array_equal(stats['rejected'], expected)
+            self.assertEqual(len(REJECT_REASONS), len(stats['rejected']))
+            
+            self.assertEqual(stats['n'].shape, (64,))
+            self.assertEqual(stats['n'][9], 1)
+            self.assertEqual(stats['n'][10], 1)
+            self.assertEqual(stats['nx'][3], 1)
+            self.assertEqual(stats['nx'][5], 1)
+            self.assertEqual(stats['ny'][2], 1)
+            self.assertEqual(stats['ny'][3], 1)
+            # 9*100 + 1 in [512, 1024), 10*200 + 1 in [1024, 2048)
+            self.assertEqual(stats['sumg'][9], 1)
+            self.assertEqual(stats['sumg'][10], 1)
+            self.assertEqual(stats['sumg'].sum(), 2)
+        
+        # Large values go to the last bin
+        tpar.set_engine("grow")
+        tpar.set_xsize_bounds((1, 100))
+        tpar.set_pixel_count_bounds((1, 100))
+        targs, stats = target_recognition(img, tpar, 0, cpar, stats=True)
+        self.assertEqual(stats['nx'][12], 1)
+        
+        # No statistics without asking
+        targs = target_recognition(img, tpar, 0, cpar)
+        self.assertEqual(len(targs), 3)
+    
+    def test_statistics_parallel(self):
+        """Statistics are the same whatever the search"""
+        rng = np.random.RandomState(7)
+        cpar = ControlParams(4, image_size=(100, 160))
+        tpar = TargetParams(gvthresh=[20, 20, 20, 20], discont=30,
+            pixel_count_bounds=(3, 40), min_sum_grey=500, 
+            xsize_bounds=(2, 10), ysize_bounds=(2, 10))
+        
+        yy, xx = np.mgrid[:160, :100]
+        img = rng.randint(0, 30, size=(160, 100)).astype(float)
+        for x, y in rng.uniform(3, 97, size=(120, 2)) * [1, 1.6]:
+            img += 200*np.exp(-((xx - x)**2 + (yy - y)**2)/3.)
+        for x, y in rng.uniform(10, 90, size=(6, 2)) * [1, 1.6]:
+            img += 150*np.exp(-(xx - x)**2/4. - (yy - y)**2/300.)
+        img = np.clip(img, 0, 255).astype(np.uint8)
+        
+        targs, stats = target_recognition(img, tpar, 0, cpar, stats=True)
+        arr = np.asarray(targs)
+        self.assertGreater(stats['rejected'].sum(), 10)
+        for name in ('n', 'nx', 'ny'):
+            np.testing.assert_array_equal(stats[name], 
+                np.bincount(arr[name], minlength=64))
+        np.testing.assert_array_equal(stats['sumg'], np.bincount(
+            np.log2(arr['sumg']).astype(int), minlength=32))
+        
+        for num_threads in (2, 3, 7):
+            t, s = target_recognition(img, tpar, 0, cpar, 
+                num_threads=num_threads, stats=True)
+            for name in stats:
+                np.testing.assert_array_equal(s[name], stats[name])
+        
+        seg = Segmenter(cpar, tpar, stats=True)
+        seg.segment(img, 0)
+        seg.segment(img, 0)
+        for name, counts in seg.statistics().items():
+            np.testing.assert_array_equal(counts, 2*stats[name])
+        seg.reset_statistics()
+        self.assertEqual(seg.statistics()['rejected'].sum(), 0)
+        seg.segment(img, 0)
+        np.testing.assert_array_equal(seg.statistics()['n'], stats['n'])
+        
+        with self.assertRaises(ValueError):
+            Segmenter(cpar, tpar).statistics()
+
+    def test_frame_batch(self):
+        """All cameras at once give the per-camera detection results"""
+        rng = np.random.RandomState(11)
+        cpar = ControlParams(4, image_size=(120, 100), pixel_size=(0.1, 0.1))
+        tpar = TargetParams(gvthresh=[20, 25, 30, 20], discont=30,
+            pixel_count_bounds=(2, 40), min_sum_grey=50, 
+            xsize_bounds=(2, 8), ysize_bounds=(2, 8))
+        tpar16 = TargetParams(gvthresh=[5000]*4, discont=7680,
+            pixel_count_bounds=(2, 40), min_sum_grey=12800, 
+            xsize_bounds=(2, 8), ysize_bounds=(2, 8))
+        
+        yy, xx = np.mgrid[:100, :120]
+        images, cals = [], []
+        for cam in range(4):
+            img = rng.randint(0, 30, size=(100, 120)).astype(float)
+            for x, y in rng.uniform(3, 97, size=(25, 2)) * [1.2, 1]:
+                img += 200*np.exp(-((xx - x)**2 + (yy - y)**2)/3.)
+            images.append(np.clip(img, 0, 255).astype(np.uint8))
+            
+            cal = Calibration()
+            cal.from_file(
+                b"testing_fodder/calibration/sym_cam%d.tif.ori" % (cam + 1),
+                b"testing_fodder/calibration/cam1.tif.addpar")
+            cals.append(cal)
+        images[3] = images[3].astype(np.uint16) * 256
+        tpars = [tpar] * 3 + [tpar16]
+        
+        targets, corrected = frame_target_recognition(images, tpars, cpar, 
+            cals, num_threads=2)
+        self.assertEqual(len(targets), 4)
+        
+        for cam in range(4):
+            expected = target_recognition(images[cam], tpars[cam], cam, cpar)
+            expected.sort_y()
+            mc = MatchedCoords(expected, cpar, cals[cam])
+            
+            self.assertGreater(len(expected), 5)
+            self.assertEqual(len(targets[cam]), len(expected))
+            for t, e in zip(targets[cam], expected):
+                self.assertEqual(t.pnr(), e.pnr())
+                np.testing.assert_array_equal(t.pos(), e.pos())
+            
+            pos, pnr = corrected[cam].as_arrays()
+            exp_pos, exp_pnr = mc.as_arrays()
+            np.testing.assert_array_equal(pnr, exp_pnr)
+            np.testing.assert_array_equal(pos, exp_pos)
+        
+        with self.assertRaises(ValueError):
+            frame_target_recognition(images, tpars, cpar, cals[:3])
+
 if __name__ == "__main__":
     unittest.main()
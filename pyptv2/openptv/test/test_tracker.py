@@ -12,7 +12,10 @@ import unittest
 import yaml
 import shutil
 import os
+import tempfile
+import numpy as np
 from optv.tracker import Tracker
+from optv.tracking_framebuf import Frame, read_targets
 from optv.calibration import Calibration
 from optv.parameters import ControlParams, VolumeParams, TrackingParams, \
     SequenceParams
@@ -49,6 +52,8 @@ class TestTracker(unittest.TestCase):
             frame_range=(seq_cfg['first'], seq_cfg['last']))
 
         self.tracker = Tracker(cpar, vpar, tpar, spar, cals, framebuf_naming)
+        self.params = (cpar, vpar, tpar, spar, cals, framebuf_naming)
+        self.img_base = img_base
 
     def test_forward(self):
         """Manually running a full forward tracking run."""
@@ -88,6 +93,112 @@ class TestTracker(unittest.TestCase):
         # if it passes without error, we assume it's ok. The actual test is in
         # the C code.
 
+    def test_memory_framebuf(self):
+        """Tracking in memory links the particles like tracking files."""
+        shutil.copytree(
+            "testing_fodder/track/res_orig/", "testing_fodder/track/res/")
+        self.tracker.full_forward()
+        target_bases = [base.encode() for base in self.img_base]
+        expected = {}
+        for frame_num in range(10001, 10006):
+            frm = Frame(3)
+            if frm.read(framebuf_naming['corres'], framebuf_naming['linkage'],
+                    target_bases, frame_num, None):
+                expected[frame_num] = (frm.positions(), frm.links())
+        
+        spill_dir = tempfile.mkdtemp()
+        for kwds in ({}, {'memory_budget': 1, 'spill_dir': spill_dir}):
+            tracker = Tracker(*self.params, backend='memory', **kwds)
+            for frame_num in range(10001, 10006):
+                # The sequence output, without going through files
+                with open("testing_fodder/track/res_orig/particles.%d" 
+                        % frame_num) as f:
+                    rows = [line.split() for line in f.readlines()[1:]]
+                parts = np.array(rows, dtype=float).reshape(-1, 8)
+                tracker.put_frame(frame_num, parts[:, 1:4], parts[:, 4:].T,
+                    [read_targets(base, frame_num) for base in self.img_base])
+            
+            tracker.full_forward()
+            for frame_num, (pos, links) in expected.items():
+                frm = tracker.get_frame(frame_num)
+                np.testing.assert_array_equal(frm.positions(), pos)
+                np.testing.assert_array_equal(frm.links(), links)
+            
+            if kwds:
+                self.assertEqual(tracker.num_spilled(), 5)
+                # The frames, and the lock file claiming their names
+                self.assertEqual(len(os.listdir(spill_dir)), 6)
+            else:
+                self.assertEqual(tracker.num_spilled(), 0)
+            with self.assertRaises(KeyError):
+                tracker.get_frame(10010)
+            del tracker
+        
+        # Spill files go with the tracker
+        self.assertEqual(os.listdir(spill_dir), [])
+        os.rmdir(spill_dir)
+    
+    def test_memory_framebuf_spill_files(self):
+        """Spill files are replaced, removed and kept apart between buffers."""
+        targets = [read_targets(base, 10001) for base in self.img_base]
+        positions = np.random.rand(50, 3)
+        corresp = np.full((3, 50), -1)
+        
+        spill_dir = tempfile.mkdtemp()
+        tracker = Tracker(*self.params, backend='memory', memory_budget=2000,
+            spill_dir=spill_dir)
+        other = Tracker(*self.params, backend='memory', memory_budget=1,
+            spill_dir=spill_dir)
+        
+        tracker.put_frame(10001, positions, corresp, targets)
+        other.put_frame(10001, positions[:2], corresp[:, :2], targets)
+        self.assertEqual(tracker.num_spilled(), 1)
+        self.assertEqual(other.num_spilled(), 1)
+        np.testing.assert_array_equal(
+            tracker.get_frame(10001).positions(), positions)
+        np.testing.assert_array_equal(
+            other.get_frame(10001).positions(), positions[:2])
+        
+        # Stored again within budget, the old spill file goes.
+        tracker.put_frame(10001, positions[:1], corresp[:, :1], targets)
+        self.assertEqual(tracker.num_spilled(), 0)
+        np.testing.assert_array_equal(
+            tracker.get_frame(10001).positions(), positions[:1])
+        del tracker
+        
+        np.testing.assert_array_equal(
+            other.get_frame(10001).positions(), positions[:2])
+        del other
+        self.assertEqual(os.listdir(spill_dir), [])
+        os.rmdir(spill_dir)
+    
+    def test_memory_framebuf_large_frame(self):
+        """Frames are stored whatever their number of particles."""
+        targets = [read_targets(base, 10001) for base in self.img_base]
+        positions = np.random.rand(30000, 3)
+        corresp = np.full((3, 30000), -1)
+
+        tracker = Tracker(*self.params, backend='memory')
+        tracker.put_frame(10001, positions, corresp, targets)
+        np.testing.assert_array_equal(
+            tracker.get_frame(10001).positions(), positions)
+
+    def test_framebuf_args(self):
+        """Frame buffer selection and its errors."""
+        with self.assertRaises(ValueError):
+            Tracker(*self.params, backend='tape')
+        with self.assertRaises(ValueError):
+            Tracker(*self.params, backend='memory', memory_budget=1000)
+        with self.assertRaises(ValueError):
+            self.tracker.get_frame(10001)
+        
+        tracker = Tracker(*self.params, backend='memory')
+        with self.assertRaises(ValueError):
+            tracker.put_frame(10001, np.zeros((2, 3)), np.zeros((3, 3)), 
+                [read_targets(base, 10001) for base in self.img_base])
+        with self.assertRaises(ValueError):
+            tracker.put_frame(10001, np.zeros((0, 3)), [], [])
+
     def tearDown(self):
         if os.path.exists("testing_fodder/track/res/"):
             shutil.rmtree("testing_fodder/track/res/")
@@ -214,6 +214,7 @@ def create_target_params_from_yaml(yaml_params):
     target_par.set_max_discontinuity(targ_rec_params.discont)
     target_par.set_min_sum_grey(targ_rec_params.sumg_min)
     target_par.set_cross_size(targ_rec_params.cr_sz)
+    target_par.set_engine(getattr(targ_rec_params, "engine", "grow"))
     
     return target_par
 
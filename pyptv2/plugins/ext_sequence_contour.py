@@ -11,7 +11,8 @@ from skimage.segmentation import clear_border
 from skimage.morphology import binary_erosion, binary_dilation, disk
 from skimage.util import img_as_ubyte
 
-from optv.correspondences import correspondences, MatchedCoords
+from optv.correspondences import correspondences
+from optv.segmentation import frame_target_recognition
 from optv.tracker import default_naming
 from optv.orientation import point_positions
 
@@ -228,8 +229,7 @@ class Sequence:
         for frame in range(first_frame, last_frame + 1):
             # print(f"processing {frame = }")
 
-            detections = []
-            corrected = []
+            high_passes = []
             for i_cam in range(n_cams):
                 base_image_name = spar.get_img_base_name(i_cam).decode()
                 imname = Path(base_image_name % frame) # works with jumps from 1 to 10 
@@ -244,14 +244,11 @@ class Sequence:
 
                         
                 
-                high_pass = self.ptv.simple_highpass(masked_image, cpar)
-                targs = self.ptv.target_recognition(high_pass, tpar, i_cam, cpar)
+                high_passes.append(self.ptv.simple_highpass(masked_image, cpar))
 
-                targs.sort_y()
-                detections.append(targs)
-                masked_coords = MatchedCoords(targs, cpar, cals[i_cam])
-                pos, _ = masked_coords.as_arrays()
-                corrected.append(masked_coords)
+            # Targets and flat coordinates of all cameras in one native call
+            detections, corrected = frame_target_recognition(
+                high_passes, tpar, cpar, cals)
 
             #        if any([len(det) == 0 for det in detections]):
             #            return False
@@ -11,23 +11,28 @@ from skimage.segmentation import clear_border
 from skimage.morphology import binary_erosion, binary_dilation, disk
 from skimage.util import img_as_ubyte
 
-from optv.correspondences import correspondences, MatchedCoords
+from optv.correspondences import correspondences
+from optv.segmentation import frame_target_recognition
 from optv.tracker import default_naming
 from optv.orientation import point_positions
 
+from pyptv2.image_stack import open_stacks
+
 import matplotlib.pyplot as plt
 
 from rembg import remove, new_session
 session = new_session('u2net')
 
 
-def mask_image(imname : Path, display: bool = False) -> np.ndarray:
+def mask_image(imname : Path, display: bool = False, img: np.ndarray = None) -> np.ndarray:
     """Mask the image using a simple high pass filter.
     
     Parameters
     ----------
-    img : np.ndarray
-        The image to be masked.
+    imname : Path
+        The image file to be masked, read unless ``img`` is given.
+    img : np.ndarray, optional
+        The already loaded image, e.g. a frame of an image stack.
         
     Returns
     -------
@@ -35,7 +40,7 @@ def mask_image(imname : Path, display: bool = False) -> np.ndarray:
         The masked image.
     """
     # session = new_session('u2net')
-    input_data = imread(imname)
+    input_data = imread(imname) if img is None else img
     result = remove(input_data, session=session)
     result = img_as_ubyte(rgb2gray(result[:,:,:3]))
 
@@ -85,16 +90,23 @@ class Sequence:
         first_frame = spar.get_first()
         last_frame = spar.get_last()
         print(f" From {first_frame = } to {last_frame = }")
+
+        # Memory-mapped image stacks, where converted, spare the decoding
+        stacks = open_stacks(
+            [spar.get_img_base_name(i_cam).decode() for i_cam in range(n_cams)]
+        )
         
         for frame in range(first_frame, last_frame + 1):
             # print(f"processing {frame = }")
 
-            detections = []
-            corrected = []
+            high_passes = []
             for i_cam in range(n_cams):
                 base_image_name = spar.get_img_base_name(i_cam).decode()
                 imname = Path(base_image_name % frame) # works with jumps from 1 to 10 
-                masked_image = mask_image(imname)
+                if stacks[i_cam] is not None and frame in stacks[i_cam]:
+                    masked_image = mask_image(imname, img=stacks[i_cam].frame(frame))
+                else:
+                    masked_image = mask_image(imname)
 
                 # img = imread(imname)
                 # if img.ndim > 2:
@@ -105,14 +117,11 @@ class Sequence:
 
                         
                 
-                high_pass = self.ptv.simple_highpass(masked_image, cpar)
-                targs = self.ptv.target_recognition(high_pass, tpar, i_cam, cpar)
-
-                targs.sort_y()
-                detections.append(targs)
-                masked_coords = MatchedCoords(targs, cpar, cals[i_cam])
-                pos, _ = masked_coords.as_arrays()
-                corrected.append(masked_coords)
+                high_passes.append(self.ptv.simple_highpass(masked_image, cpar))
+
+            # Targets and flat coordinates of all cameras in one native call
+            detections, corrected = frame_target_recognition(
+                high_passes, tpar, cpar, cals)
 
             #        if any([len(det) == 0 for det in detections]):
             #            return False
@@ -0,0 +1,280 @@
+"""Parallel, prefetching loader for multi-camera image sequences.
+
+Decoding the images of a sequence is often the slowest part of stepping
+through it: every frame needs one decode per camera, and the cameras are
+independent of each other. The loader in this module decodes all cameras of
+a frame concurrently on a thread pool and keeps a window of upcoming frames
+in flight, so that when the next frame is requested it is usually ready.
+
+The memory held by decoded frames is bounded by a byte budget, and jumping
+to a frame outside the current window cancels the reads that are no longer
+needed. Cameras backed by a memory-mapped image stack (see
+``pyptv2.image_stack``) bypass decoding altogether; their frames follow the
+same depth policy as decoded images, so 16-bit stacks are converted to 8
+bits unless the loader keeps the native depth.
+"""
+
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+from skimage.io import imread
+from skimage.util import img_as_ubyte
+from skimage.color import rgb2gray
+
+# Default number of frames read ahead of the requested one
+DEFAULT_READ_AHEAD = 4
+
+# Default budget for decoded frames held by the loader, in bytes
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+def read_image(path: str) -> np.ndarray:
+    """Read an image file as a 2D 8-bit gray image.
+
+    Args:
+        path: Path to the image file
+
+    Returns:
+        2D uint8 array
+    """
+    img = imread(path)
+    if img.ndim > 2:
+        img = rgb2gray(img)
+    return img_as_ubyte(img)
+
+
+class SequenceFrameLoader:
+    """Load the frames of a multi-camera sequence ahead of time.
+
+    Each requested frame is decoded with one task per camera on a shared
+    thread pool. After serving a frame, the loader schedules the next
+    ``read_ahead`` frames in the direction of travel, as far as the memory
+    budget allows. Decoded frames outside the window are dropped.
+    """
+
+    def __init__(
+        self,
+        base_names: Sequence[Optional[str]],
+        read_ahead: int = DEFAULT_READ_AHEAD,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        max_workers: Optional[int] = None,
+        first_frame: Optional[int] = None,
+        last_frame: Optional[int] = None,
+        reader: Callable[[str], np.ndarray] = read_image,
+        stacks: Optional[Sequence] = None,
+        native_depth: bool = False,
+    ):
+        """Initialize the loader.
+
+        Args:
+            base_names: Per-camera printf-style base names, e.g. ``img/cam1.%d``,
+                or names of multi-page files opened as ``stacks``.
+                A camera whose base name is None cannot be loaded.
+            read_ahead: Number of frames to prefetch after the requested one
+            max_bytes: Budget for decoded frames held by the loader, in bytes.
+                The requested frame is always kept, even if it alone exceeds
+                the budget.
+            max_workers: Size of the decoding thread pool (default: one thread
+                per camera)
+            first_frame, last_frame: Optional frame range; no frames outside
+                it are prefetched.
+            reader: Function decoding one image file into an array
+            stacks: Optional per-camera ImageStack or PageStack objects (None
+                for cameras without one). Frames found in a stack are returned as views
+                into it, without decoding or prefetching.
+            native_depth: Whether 16-bit stack frames keep their depth. If
+                not, they are converted to 8 bits like ``read_image`` converts
+                image files, into a new array. Should match ``reader``.
+        """
+        self.base_names = list(base_names)
+        self.n_cams = len(self.base_names)
+        self.read_ahead = max(0, int(read_ahead))
+        self.max_bytes = int(max_bytes)
+        self.first_frame = first_frame
+        self.last_frame = last_frame
+        self.reader = reader
+        self.stacks = list(stacks) if stacks is not None else [None] * self.n_cams
+        self.native_depth = native_depth
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or max(1, self.n_cams),
+            thread_name_prefix="frame-loader",
+        )
+        self._lock = threading.Lock()
+        # frame number -> list of per-camera futures, oldest first
+        self._frames = OrderedDict()
+        self._frame_bytes = None
+        self._last_frame = None
+        self._direction = 1
+
+    def image_path(self, frame_num: int, cam: int) -> str:
+        """Return the image file name of a camera in a given frame."""
+        base_name = self.base_names[cam]
+        if not base_name:
+            raise ValueError(f"Base name for camera {cam} is not set")
+        if "%" not in base_name:
+            # A multi-page file, served by the camera's stack if it opened
+            raise ValueError(
+                f"Frame {frame_num} of camera {cam} is not in {base_name}, "
+                "which has no frame number specifier"
+            )
+        return base_name % frame_num
+
+    def _stack_frame(self, frame_num: int, cam: int) -> Optional[np.ndarray]:
+        """Return the frame if the camera's stack holds it.
+
+        The frame is a view into the stack, or an 8-bit copy of a 16-bit
+        frame if the loader does not keep the native depth.
+        """
+        stack = self.stacks[cam]
+        if stack is None or frame_num not in stack:
+            return None
+        img = stack.frame(frame_num)
+        if not self.native_depth and img.dtype != np.uint8:
+            img = img_as_ubyte(img)
+        return img
+
+    def _in_stacks(self, frame_num: int) -> bool:
+        return all(
+            stack is not None and frame_num in stack for stack in self.stacks
+        )
+
+    def _read(self, frame_num: int, cam: int) -> np.ndarray:
+        img = self._stack_frame(frame_num, cam)
+        if img is not None:
+            return img
+        return self.reader(self.image_path(frame_num, cam))
+
+    def _submit(self, frame_num: int) -> List:
+        """Schedule all cameras of a frame, unless already scheduled.
+
+        Reads that failed or were cancelled are scheduled again, so that an
+        image written after a failed request is picked up by the next one.
+        """
+        futures = self._frames.get(frame_num)
+        if futures is None:
+            futures = [
+                self._executor.submit(self._read, frame_num, cam)
+                for cam in range(self.n_cams)
+            ]
+            self._frames[frame_num] = futures
+            return futures
+
+        for cam, future in enumerate(futures):
+            if future.cancelled() or (
+                future.done() and future.exception() is not None
+            ):
+                futures[cam] = self._executor.submit(self._read, frame_num, cam)
+        return futures
+
+    def _window(self, frame_num: int) -> List[int]:
+        """Frames to keep around ``frame_num``, requested frame first."""
+        depth = self.read_ahead
+        if self._frame_bytes:
+            depth = min(depth, max(0, self.max_bytes // self._frame_bytes - 1))
+
+        window = [frame_num]
+        for step in range(1, depth + 1):
+            ahead = frame_num + self._direction * step
+            if self.first_frame is not None and ahead < self.first_frame:
+                break
+            if self.last_frame is not None and ahead > self.last_frame:
+                break
+            window.append(ahead)
+        return window
+
+    def _evict(self, keep: Sequence[int]) -> None:
+        """Cancel or drop every frame not in ``keep``."""
+        for frame_num in list(self._frames):
+            if frame_num in keep:
+                continue
+            for future in self._frames.pop(frame_num):
+                future.cancel()
+
+    def _schedule(self, frame_num: int) -> List:
+        with self._lock:
+            if self._last_frame is not None and frame_num != self._last_frame:
+                self._direction = 1 if frame_num > self._last_frame else -1
+            self._last_frame = frame_num
+
+            window = self._window(frame_num)
+            self._evict(window)
+            futures = self._submit(frame_num)
+            for ahead in window[1:]:
+                self._submit(ahead)
+        return futures
+
+    def _account(self, images: Sequence[np.ndarray]) -> None:
+        """Record the size of a decoded frame for the memory budget."""
+        if self._frame_bytes is None:
+            nbytes = sum(img.nbytes for img in images if img is not None)
+            if nbytes > 0:
+                self._frame_bytes = nbytes
+
+    def get(self, frame_num: int, cam: int) -> np.ndarray:
+        """Return the image of one camera, prefetching the following frames.
+
+        Args:
+            frame_num: Frame number to load
+            cam: Camera index
+
+        Returns:
+            The decoded image
+
+        Raises:
+            Whatever the reader raised while decoding this image.
+        """
+        if not 0 <= cam < self.n_cams:
+            raise ValueError(f"Invalid camera ID: {cam}")
+        img = self._stack_frame(frame_num, cam)
+        if img is not None:
+            return img
+
+        futures = self._schedule(frame_num)
+        img = futures[cam].result()
+        # Estimate the frame size from one camera until a full frame is seen
+        self._account([img] * self.n_cams)
+        return img
+
+    def get_frame(self, frame_num: int) -> List[np.ndarray]:
+        """Return the images of all cameras, prefetching the following frames.
+
+        Raises:
+            The first decoding error, if any camera failed. Use ``get()`` per
+            camera to handle failures individually.
+        """
+        if self._in_stacks(frame_num):
+            return [
+                self._stack_frame(frame_num, cam) for cam in range(self.n_cams)
+            ]
+
+        futures = self._schedule(frame_num)
+        images = [future.result() for future in futures]
+        self._account(images)
+        return images
+
+    def prefetch(self, frame_nums: Sequence[int]) -> None:
+        """Schedule frames for decoding without waiting for them."""
+        with self._lock:
+            for frame_num in frame_nums:
+                self._submit(frame_num)
+
+    def cancel(self) -> None:
+        """Cancel all pending reads and drop all decoded frames."""
+        with self._lock:
+            self._evict(())
+            self._last_frame = None
+
+    def close(self) -> None:
+        """Cancel pending work and shut the thread pool down."""
+        self.cancel()
+        self._executor.shutdown(wait=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
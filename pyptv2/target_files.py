@@ -0,0 +1,106 @@
+"""Text and binary _targets files.
+
+Detection writes the targets of every camera and frame to a _targets file,
+which tracking reads back. In the traditional text format each target is a
+line to format and parse, which dominates the sequence and tracking stages
+of long, dense experiments. The binary format holds the same fields as
+packed records after a 16-byte header (see ``TargetArray.write()``), and is
+written and read with one bulk call.
+
+The readers of liboptv tell the formats apart by the file's magic, so both
+can be mixed freely. Files of an existing experiment are converted with
+``convert_targets()``, or from the command line::
+
+    python -m pyptv2.target_files res/cam1. res/cam2. 10001 10100
+
+and back to text with ``--text``.
+"""
+
+import argparse
+import os
+from typing import Optional
+
+from optv.tracking_framebuf import read_targets
+
+# First bytes of a binary _targets file, TARGETS_BIN_MAGIC of liboptv
+BINARY_MAGIC = b"PTVTRG01"
+
+
+def targets_path(file_base: str, frame: int) -> str:
+    """Return the name of a frame's _targets file, as liboptv makes it.
+
+    Args:
+        file_base: Base name, e.g. ``res/cam1.``
+        frame: Frame number; 0 or less for none
+
+    Returns:
+        File name
+    """
+    if frame > 0:
+        return f"{file_base}{frame:04d}_targets"
+    return f"{file_base}_targets"
+
+
+def is_binary_targets(path: str) -> bool:
+    """Return whether a _targets file is in the binary format.
+
+    Args:
+        path: File name
+
+    Returns:
+        True for a binary file
+    """
+    with open(path, "rb") as f:
+        return f.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+
+
+def convert_targets(
+    file_base: str, first: int, last: int, binary: bool = True
+) -> int:
+    """Convert the _targets files of a frame range in place.
+
+    Frames without a _targets file, and files already in the requested
+    format, are skipped.
+
+    Args:
+        file_base: Base name of the files, e.g. ``res/cam1.``
+        first: First frame number
+        last: Last frame number
+        binary: Convert to binary if True, else to text
+
+    Returns:
+        Number of files converted
+    """
+    converted = 0
+    for frame in range(first, last + 1):
+        path = targets_path(file_base, frame)
+        if not os.path.exists(path) or is_binary_targets(path) == binary:
+            continue
+        targets = read_targets(file_base, frame)
+        targets.write(file_base.encode(), frame, binary=binary)
+        converted += 1
+    return converted
+
+
+def main(argv: Optional[list] = None) -> None:
+    """Convert _targets files between the formats from the command line."""
+    parser = argparse.ArgumentParser(
+        description="Convert _targets files between text and binary format"
+    )
+    parser.add_argument("file_bases", nargs="+",
+                        help="target file base names, e.g. res/cam1.")
+    parser.add_argument("first", type=int, help="First frame number")
+    parser.add_argument("last", type=int, help="Last frame number")
+    parser.add_argument("--text", action="store_true",
+                        help="convert binary files back to text")
+    args = parser.parse_args(argv)
+
+    for file_base in args.file_bases:
+        converted = convert_targets(
+            file_base, args.first, args.last, binary=not args.text
+        )
+        print(f"Converted {converted} files of {file_base}")
+
+
+if __name__ == "__main__":
+    main()
@@ -29,6 +29,7 @@ from PySide6.QtWidgets import (
     QSlider,
     QComboBox
 )
+from optv.segmentation import REJECT_REASONS
 
 from pyptv.ui.camera_view import CameraView, MatplotlibCanvas
 
@@ -121,6 +122,17 @@ class DetectionDialog(QDialog):
         
         self.threshold_layout.addLayout(threshold_value_layout)
         
+        # Live preview: re-detect from cached candidates on every change
+        self.live_preview = QCheckBox("Live preview")
+        self.live_preview.setToolTip(
+            "Update the detected particles while the threshold and size "
+            "limits change. Approximate; use Detect Particles for the final "
+            "detection."
+        )
+        self.live_preview.toggled.connect(self.preview_particles)
+        self.threshold_value.valueChanged.connect(self.preview_particles)
+        self.threshold_layout.addWidget(self.live_preview)
+        
         self.params_layout.addWidget(self.threshold_group)
         
         # Particle size group
@@ -137,6 +149,9 @@ class DetectionDialog(QDialog):
         self.max_size.setValue(20)
         self.size_layout.addRow("Max Size:", self.max_size)
         
+        self.min_size.valueChanged.connect(self.preview_particles)
+        self.max_size.valueChanged.connect(self.preview_particles)
+        
         self.params_layout.addWidget(self.size_group)
         
         # Highpass filter group
@@ -282,17 +297,48 @@ class DetectionDialog(QDialog):
                 self, "Detect Particles", f"Error detecting particles: {e}"
             )
     
+    @Slot()
+    def preview_particles(self):
+        """Re-detect particles with the current settings, if live preview is on."""
+        if not self.live_preview.isChecked():
+            return
+        try:
+            x_coords, y_coords = self.ptv_core.preview_particles(
+                self.threshold_value.value(),
+                (self.min_size.value(), self.max_size.value()),
+            )
+        except Exception as e:
+            self.live_preview.setChecked(False)
+            QMessageBox.critical(
+                self, "Live Preview", f"Error previewing particles: {e}"
+            )
+            return
+        
+        self.detection_points = list(zip(x_coords, y_coords))
+        for i, view in enumerate(self.camera_views):
+            view.clear_overlays()
+            if i < len(x_coords):
+                view.add_points(x_coords[i], y_coords[i], color='blue', size=5)
+    
     @Slot()
     def show_statistics(self):
         """Show detection statistics."""
         try:
+            # Size histograms and rejection counts, gathered in liboptv
+            try:
+                cam_stats = self.ptv_core.detection_statistics()
+            except ValueError:
+                cam_stats = []
+            
             # Calculate statistics
             stats = []
             for i, points in enumerate(self.detection_points):
                 if isinstance(points, tuple) and len(points) == 2:
                     x, y = points
-                    num_points = len(x) if isinstance(x, list) else 0
+                    num_points = len(x)
                     stats.append(f"Camera {i+1}: {num_points} particles")
+                    if i < len(cam_stats):
+                        stats.append(self._format_statistics(cam_stats[i]))
             
             # Show statistics
             if stats:
@@ -309,6 +355,24 @@ class DetectionDialog(QDialog):
                 self, "Statistics", f"Error calculating statistics: {e}"
             )
     
+    @staticmethod
+    def _format_statistics(stats):
+        """Summarize one camera's detection statistics in a line."""
+        sizes = stats["n"]
+        mean_size = (
+            np.dot(np.arange(len(sizes)), sizes) / sizes.sum()
+            if sizes.sum() else 0.
+        )
+        rejected = ", ".join(
+            f"{reason.replace('_', ' ')} {count}"
+            for reason, count in zip(REJECT_REASONS, stats["rejected"])
+            if count
+        )
+        return (
+            f"  mean size {mean_size:.1f} pixels, "
+            f"rejected: {rejected or 'none'}"
+        )
+    
     @Slot()
     def save_configuration(self):
         """Save detection configuration."""
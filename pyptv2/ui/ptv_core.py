@@ -10,9 +10,6 @@ import time
 import importlib
 from pathlib import Path
 import numpy as np
-from skimage.io import imread
-from skimage.util import img_as_ubyte
-from skimage.color import rgb2gray
 
 # NumPy is configured once at import time
 np.set_printoptions(precision=4, suppress=True)
@@ -21,6 +18,16 @@ np.set_printoptions(precision=4, suppress=True)
 from pyptv import ptv
 import optv.orientation
 import optv.epipolar
+from pyptv2.frame_processing import (
+    FrameProcessor,
+    PreprocessOptions,
+    SequenceLayout,
+)
+from pyptv2.background import DEFAULT_WINDOW
+from pyptv2.windowed_detection import (
+    DEFAULT_FULL_SCAN_INTERVAL,
+    DEFAULT_TILE_SIZE,
+)
 
 # Import YAML parameter system
 from pyptv.yaml_parameters import (
@@ -78,6 +85,12 @@ class PTVCore:
         self.sorted_pos = None
         self.sorted_corresp = None
         self.num_targs = None
+        
+        # Image processing state: the prefetching frame loader and its image
+        # stacks, quick-look binning, flat-field corrections, background
+        # models, tile, static and detection-window masks, detection
+        # preview tables (see pyptv2.frame_processing)
+        self.processor = FrameProcessor()
     
     def _load_plugins(self):
         """Load the available plugins."""
@@ -146,10 +159,7 @@ class PTVCore:
                         if not os.path.exists(img_path):
                             raise FileNotFoundError(f"Image file {img_path} not found")
                             
-                        img = imread(img_path)
-                        if img.ndim > 2:
-                            img = rgb2gray(img)
-                        self.orig_images[i] = img_as_ubyte(img)
+                        self.orig_images[i] = self._image_reader()(img_path)
                     else:
                         print(f"Warning: Reference image for camera {i+1} not found, using blank image")
                         self.orig_images[i] = np.zeros((imy, imx), dtype=np.uint8)
@@ -170,6 +180,7 @@ class PTVCore:
                     self.epar,
                 ) = ptv.py_start_proc_c(self.n_cams, exp_path=self.exp_path)
                 print("Successfully created parameter objects from YAML parameters")
+                self._update_processor()
             except Exception as init_error:
                 print(f"Error initializing core PTV: {init_error}")
                 # Check if experiment attribute exists before creating
@@ -241,74 +252,159 @@ class PTVCore:
                     self.yaml_params[param_type] = updated_param
                     break
     
+    def _preprocess_options(self):
+        """Return the preprocessing steps selected in the parameters."""
+        if self.yaml_params:
+            seq_params = self.yaml_params.get("SequenceParams")
+            return PreprocessOptions(
+                inverse=seq_params.Inverse,
+                subtract_mask=seq_params.Subtr_Mask,
+                base_name_mask=seq_params.Base_Name_Mask,
+                background_mode=getattr(seq_params, "Background_Model", ""),
+                background_window=getattr(
+                    seq_params, "Background_Window", DEFAULT_WINDOW
+                ),
+                dark_name=getattr(seq_params, "Dark_Name", ""),
+                flat_name=getattr(seq_params, "Flat_Name", ""),
+                highpass=bool(self.yaml_params.get("PtvParams").hp_flag),
+            )
+        
+        # Use legacy parameters
+        m_params = self.experiment.active_params.m_params
+        return PreprocessOptions(
+            inverse=m_params.Inverse,
+            subtract_mask=m_params.Subtr_Mask,
+            base_name_mask=m_params.Base_Name_Mask,
+            highpass=bool(m_params.Hp_flag),
+        )
+    
     def apply_highpass(self):
-        """Apply highpass filter to the images."""
+        """Apply highpass filter to the images.
+        
+        Runs the preprocessing selected in the parameters - dark/flat-field
+        correction, inversion, background subtraction and highpass
+        filtering - see ``FrameProcessor.preprocess``.
+        """
         if not self.initialized:
             raise ValueError("PTV system not initialized")
         
-        # Check if we're using YAML parameters
-        if self.yaml_params:
-            seq_params = self.yaml_params.get("SequenceParams")
-            inverse = seq_params.Inverse
-            subtr_mask = seq_params.Subtr_Mask
-            base_name_mask = seq_params.Base_Name_Mask
-        else:
-            # Use legacy parameters
-            inverse = self.experiment.active_params.m_params.Inverse
-            subtr_mask = self.experiment.active_params.m_params.Subtr_Mask
-            base_name_mask = self.experiment.active_params.m_params.Base_Name_Mask
+        self.orig_images = self.processor.preprocess(
+            self.orig_images, self._preprocess_options()
+        )
+        return self.orig_images
+    
+    def set_binning(self, factor):
+        """Switch quick-look binning on or off.
         
-        # Apply inverse if needed
-        if inverse:
-            for i, im in enumerate(self.orig_images):
-                self.orig_images[i] = 255 - im
+        See ``FrameProcessor.set_binning``. Detected targets are in
+        full-resolution pixel coordinates, so ``detect_particles`` and
+        everything after it work in full-resolution units, while
+        ``orig_images`` hold the binned images.
         
-        # Apply mask subtraction if needed
-        if subtr_mask:
-            try:
-                for i, im in enumerate(self.orig_images):
-                    background_name = base_name_mask.replace("#", str(i))
-                    background = imread(background_name)
-                    self.orig_images[i] = np.clip(
-                        self.orig_images[i] - background, 0, 255
-                    ).astype(np.uint8)
-            except Exception as e:
-                raise ValueError(f"Failed subtracting mask: {e}")
+        Args:
+            factor: Binning factor, e.g. 2 or 4; 1 for full resolution
+        """
+        self.processor.set_binning(factor)
+    
+    def reset_background(self):
+        """Forget the rolling background models, e.g. when a new sequence starts."""
+        self.processor.reset_background()
+    
+    def set_windowed_detection(self, enabled=True,
+                               full_scan_interval=DEFAULT_FULL_SCAN_INTERVAL,
+                               tile_size=DEFAULT_TILE_SIZE):
+        """Switch windowed detection of sequence frames on or off.
         
-        # Apply highpass filter - check if highpass is enabled
-        if self.yaml_params and self.yaml_params.get("PtvParams").hp_flag:
-            self.orig_images = ptv.py_pre_processing_c(
-                self.orig_images, self.cpar
-            )
-        elif not self.yaml_params and self.experiment.active_params.m_params.Hp_flag:
-            self.orig_images = ptv.py_pre_processing_c(
-                self.orig_images, self.cpar
-            )
+        See ``FrameProcessor.set_windowed_detection``.
+        """
+        self.processor.set_windowed_detection(
+            enabled, full_scan_interval, tile_size
+        )
+    
+    def build_tile_masks(self, tile_size=64, margin=1):
+        """Restrict processing to the image regions that see the volume.
         
-        return self.orig_images
+        See ``FrameProcessor.build_tile_masks``.
+        
+        Returns:
+            List of the per-camera live fractions
+        """
+        if not self.initialized:
+            raise ValueError("PTV system not initialized")
+        return self.processor.build_tile_masks(tile_size, margin)
+    
+    def load_static_masks(self, base_name_mask, tile_size=DEFAULT_TILE_SIZE):
+        """Skip static image regions, e.g. reflections, in every frame.
+        
+        See ``FrameProcessor.load_static_masks``.
+        
+        Returns:
+            List of the per-camera fractions of processed pixels
+        """
+        if not self.initialized:
+            raise ValueError("PTV system not initialized")
+        return self.processor.load_static_masks(base_name_mask, tile_size)
     
     def detect_particles(self):
-        """Detect particles in the images."""
+        """Detect particles in the images.
+        
+        Returns:
+            Tuple (x, y) of per-camera arrays of target image coordinates
+        """
         if not self.initialized:
             raise ValueError("PTV system not initialized")
         
         # Run detection
-        (
-            self.detections,
-            self.corrected,
-        ) = ptv.py_detection_proc_c(
-            self.orig_images,
-            self.cpar,
-            self.tpar,
-            self.cals,
-        )
+        if self.processor.masks() is not None or self.processor.binning > 1:
+            self.orig_images = self.processor.quick_look(self.orig_images)
+            self.detections, self.corrected = self.processor.detect(
+                self.orig_images
+            )
+        else:
+            (
+                self.detections,
+                self.corrected,
+            ) = ptv.py_detection_proc_c(
+                self.orig_images,
+                self.cpar,
+                self.tpar,
+                self.cals,
+            )
         
-        # Extract detection coordinates
-        x = [[i.pos()[0] for i in row] for row in self.detections]
-        y = [[i.pos()[1] for i in row] for row in self.detections]
+        # Extract detection coordinates from zero-copy views of the targets
+        views = [np.asarray(row) for row in self.detections]
+        x = [view["x"] for view in views]
+        y = [view["y"] for view in views]
         
         return x, y
     
+    def preview_particles(self, threshold=None, pixel_count_bounds=None):
+        """Detect particles quickly while detection parameters are tuned.
+        
+        See ``FrameProcessor.preview``; run ``detect_particles`` for the
+        final detection.
+        
+        Returns:
+            Tuple (x, y) of per-camera arrays of target image coordinates
+        """
+        if not self.initialized:
+            raise ValueError("PTV system not initialized")
+        return self.processor.preview(
+            self.orig_images, threshold, pixel_count_bounds
+        )
+    
+    def detection_statistics(self):
+        """Gather detection statistics of the current images.
+        
+        See ``FrameProcessor.statistics``.
+        
+        Returns:
+            List of per-camera dicts of NumPy arrays
+        """
+        if not self.initialized:
+            raise ValueError("PTV system not initialized")
+        return self.processor.statistics(self.orig_images)
+    
     def find_correspondences(self):
         """Find correspondences between particles in different cameras."""
         if not self.initialized:
@@ -412,6 +508,14 @@ class PTVCore:
         if sequence_alg != "default":
             # Run external plugin
             ptv.run_plugin(self)
+            return True
+        
+        self._update_processor()
+        layout = self._sequence_layout()
+        options = self._preprocess_options()
+        if self.processor.needs_own_loop(layout, options):
+            # pyptv's loop knows nothing of the processor's options
+            self.processor.run_sequence(layout, options, start_frame, end_frame)
         else:
             # Run default sequence
             ptv.py_sequence_loop(self)
@@ -683,20 +787,8 @@ class PTVCore:
         
         return epipolar_lines
     
-    def load_sequence_image(self, frame_num, camera_id=None):
-        """Load an image from a sequence.
-        
-        Args:
-            frame_num: Frame number to load
-            camera_id: Optional camera ID to load for (if None, loads all cameras)
-            
-        Returns:
-            List of loaded images or a single image if camera_id is specified
-        """
-        if not self.initialized:
-            raise ValueError("PTV system not initialized")
-        
-        # Get base names for sequence images
+    def _sequence_base_names(self):
+        """Return the per-camera image base names of the sequence."""
         if self.yaml_params:
             # Use YAML parameters
             seq_params = self.yaml_params.get("SequenceParams")
@@ -713,53 +805,87 @@ class PTVCore:
                 getattr(self.experiment.active_params.m_params, f"Basename_{i+1}_Seq")
                 for i in range(self.n_cams)
             ]
+        return base_names
+    
+    def _sequence_layout(self):
+        """Return where the sequence's frames are stored.
         
-        if camera_id is not None:
-            # Load image for a specific camera
-            if 0 <= camera_id < self.n_cams:
-                try:
-                    if base_names[camera_id]:
-                        img_path = base_names[camera_id] % frame_num
-                        img = imread(img_path)
-                        if img.ndim > 2:
-                            img = rgb2gray(img)
-                        return img_as_ubyte(img)
-                    else:
-                        raise ValueError(f"Base name for camera {camera_id} is not set")
-                except Exception as e:
-                    print(f"Error loading image {camera_id} for frame {frame_num}: {e}")
-                    # Return empty image with the correct dimensions
-                    if self.yaml_params:
-                        h_img = self.yaml_params.get("PtvParams").imx
-                        v_img = self.yaml_params.get("PtvParams").imy
-                    else:
-                        h_img = self.experiment.active_params.m_params.imx
-                        v_img = self.experiment.active_params.m_params.imy
-                    return np.zeros((v_img, h_img), dtype=np.uint8)
-            else:
-                raise ValueError(f"Invalid camera ID: {camera_id}")
+        The first page of a multi-page file is frame ``Seq_First``; raw files
+        have frames of the configured image size, laid out as given by the
+        ``Raw_*`` sequence parameters.
+        """
+        if self.yaml_params:
+            seq_params = self.yaml_params.get("SequenceParams")
         else:
-            # Load images for all cameras
-            images = []
-            for i, base_name in enumerate(base_names):
-                try:
-                    if base_name:
-                        img_path = base_name % frame_num
-                        img = imread(img_path)
-                        if img.ndim > 2:
-                            img = rgb2gray(img)
-                        images.append(img_as_ubyte(img))
-                    else:
-                        raise ValueError(f"Base name for camera {i} is not set")
-                except Exception as e:
-                    print(f"Error loading image {i} for frame {frame_num}: {e}")
-                    # Add empty image with the correct dimensions
-                    if self.yaml_params:
-                        h_img = self.yaml_params.get("PtvParams").imx
-                        v_img = self.yaml_params.get("PtvParams").imy
-                    else:
-                        h_img = self.experiment.active_params.m_params.imx
-                        v_img = self.experiment.active_params.m_params.imy
-                    images.append(np.zeros((v_img, h_img), dtype=np.uint8))
+            seq_params = self.experiment.active_params.m_params
+        return SequenceLayout(
+            self._sequence_base_names(),
+            first_frame=getattr(seq_params, "Seq_First", None),
+            last_frame=getattr(seq_params, "Seq_Last", None),
+            raw_dtype=getattr(seq_params, "Raw_Pixel_Type", "uint8"),
+            raw_header_size=getattr(seq_params, "Raw_Header_Size", 0),
+            raw_frame_header_size=getattr(
+                seq_params, "Raw_Frame_Header_Size", 0
+            ),
+        )
+    
+    def _image_reader(self):
+        """Return the function decoding the camera images.
+        
+        With ``native_depth`` set in the PTV parameters, 16-bit images keep
+        their depth through highpass filtering and detection, and the target
+        thresholds are in 16-bit units. Otherwise all images are converted
+        to 8 bits. See ``FrameProcessor.image_reader``.
+        """
+        self._update_processor()
+        return self.processor.image_reader()
+    
+    def _update_processor(self):
+        """Give the frame processor the current parameters."""
+        self.processor.set_parameters(
+            self.cpar, self.tpar, self.vpar, self.cals, self.track_par
+        )
+        self.processor.native_depth = self._native_depth()
+        self.processor.binary_targets = self._binary_targets()
+    
+    def _native_depth(self):
+        """Tell whether 16-bit images keep their depth, see ``_image_reader``."""
+        if self.yaml_params:
+            return bool(getattr(
+                self.yaml_params.get("PtvParams"), "native_depth", False
+            ))
+        return False
+    
+    def _binary_targets(self):
+        """Tell whether the sequence writes binary ``_targets`` files."""
+        if self.yaml_params:
+            return bool(getattr(
+                self.yaml_params.get("SequenceParams"), "Binary_Targets", False
+            ))
+        return False
+    
+    def load_sequence_image(self, frame_num, camera_id=None):
+        """Load an image from a sequence.
+        
+        All cameras are decoded in parallel, and the following frames are
+        prefetched in the background (see ``FrameProcessor.frame_loader``).
+        Frames of cameras with an image stack, or recorded as one multi-page
+        TIFF or raw file, come from the memory-mapped file. In quick-look
+        mode (see ``set_binning``) the images are returned binned.
+        
+        Args:
+            frame_num: Frame number to load
+            camera_id: Optional camera ID to load for (if None, loads all cameras)
             
-            return images
\ No newline at end of file
+        Returns:
+            List of loaded images or a single image if camera_id is specified
+        """
+        if not self.initialized:
+            raise ValueError("PTV system not initialized")
+        
+        if camera_id is not None and not 0 <= camera_id < self.n_cams:
+            raise ValueError(f"Invalid camera ID: {camera_id}")
+        self._update_processor()
+        return self.processor.load_frame(
+            self._sequence_layout(), frame_num, camera_id
+        )
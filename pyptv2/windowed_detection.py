@@ -0,0 +1,198 @@
+"""Windowed particle detection for sparse sequences.
+
+In a sparse experiment most of each image is empty, yet highpass filtering
+and target recognition scan it all in every frame. A particle found in one
+frame can only move as far as the tracking parameters allow before the
+next: its next position is inside the box spanned by the velocity limits
+(dvxmin..dvxmax, ...) around its current one, the same search volume the
+tracker uses. ``DetectionWindows`` projects these boxes through each
+camera's calibration and marks the tiles they cover live in a TileMask, so
+that the next frame is only processed around the predicted particles.
+
+Particles entering the volume are not predicted by anything. A full-frame
+scan is therefore run every ``full_scan_interval`` frames, and whenever
+there are no positions to predict from.
+"""
+
+from typing import List, Optional, Sequence
+
+import numpy as np
+from optv.image_processing import TileMask
+from optv.imgcoord import image_coordinates
+from optv.parameters import ControlParams, TargetParams, TrackingParams
+from optv.transforms import convert_arr_metric_to_pixel
+
+# Default number of frames between full-frame scans
+DEFAULT_FULL_SCAN_INTERVAL = 10
+
+# Default tile size of the window masks, in pixels
+DEFAULT_TILE_SIZE = 32
+
+
+def search_boxes(
+    positions: np.ndarray, track_par: TrackingParams
+) -> np.ndarray:
+    """Return the corners of the boxes a particle can move into in a frame.
+
+    Args:
+        positions: (N, 3) array of 3D positions
+        track_par: Tracking parameters with the velocity limits, in units
+            of length per frame
+
+    Returns:
+        (N, 8, 3) array of box corners
+    """
+    low = np.array([
+        track_par.get_dvxmin(), track_par.get_dvymin(), track_par.get_dvzmin()
+    ])
+    high = np.array([
+        track_par.get_dvxmax(), track_par.get_dvymax(), track_par.get_dvzmax()
+    ])
+    # All combinations of the low and high bound of each axis
+    select = np.array(np.meshgrid([0, 1], [0, 1], [0, 1], indexing="ij"))
+    select = select.reshape(3, 8).T.astype(bool)
+    steps = np.where(select, high, low)
+    return positions[:, None, :] + steps[None, :, :]
+
+
+def image_windows(
+    corners: np.ndarray, cal, cpar: ControlParams, pad: float = 0.
+) -> np.ndarray:
+    """Project boxes into a camera and return their pixel bounding boxes.
+
+    Args:
+        corners: (N, 8, 3) array of box corners, see ``search_boxes()``
+        cal: Calibration of the camera
+        cpar: ControlParams with the image size, pixel size and multimedia
+            parameters
+        pad: Pixels to add on each side, e.g. for the target size
+
+    Returns:
+        (N, 4) array of (xmin, xmax, ymin, ymax) in pixels
+    """
+    flat = np.ascontiguousarray(corners.reshape(-1, 3), dtype=np.float64)
+    metric = image_coordinates(flat, cal, cpar.get_multimedia_params())
+    pixels = convert_arr_metric_to_pixel(metric, cpar).reshape(-1, 8, 2)
+    low = pixels.min(axis=1) - pad
+    high = pixels.max(axis=1) + pad
+    return np.column_stack([low[:, 0], high[:, 0], low[:, 1], high[:, 1]])
+
+
+def window_mask(
+    windows: np.ndarray,
+    cpar: ControlParams,
+    tile_size: int = DEFAULT_TILE_SIZE,
+    within: Optional[TileMask] = None,
+) -> TileMask:
+    """Make a TileMask with the tiles covered by pixel windows live.
+
+    Args:
+        windows: (N, 4) array of (xmin, xmax, ymin, ymax) in pixels
+        cpar: ControlParams with the image size
+        tile_size: Side of a tile in pixels
+        within: Optional mask to restrict the live tiles to, e.g. the tiles
+            that see the observed volume. Its static mask, if any, is
+            attached to the new mask.
+
+    Returns:
+        New TileMask
+    """
+    mask = TileMask(cpar, tile_size)
+    tiles = np.zeros_like(mask.get_tiles())
+    rows, cols = tiles.shape
+
+    # Tile ranges, clipped to the image; windows outside it, or of points
+    # that could not be projected, cover nothing
+    windows = windows[np.isfinite(windows).all(axis=1)]
+    first = np.floor(windows / tile_size).astype(int)
+    col0 = np.clip(first[:, 0], 0, cols)
+    col1 = np.clip(first[:, 1] + 1, 0, cols)
+    row0 = np.clip(first[:, 2], 0, rows)
+    row1 = np.clip(first[:, 3] + 1, 0, rows)
+    for c0, c1, r0, r1 in zip(col0, col1, row0, row1):
+        tiles[r0:r1, c0:c1] = True
+
+    if within is not None:
+        tiles &= within.get_tiles()
+    mask.set_tiles(tiles)
+    if within is not None and within.static is not None:
+        mask.set_static(within.static)
+    return mask
+
+
+class DetectionWindows:
+    """Per-frame detection windows around the particles of the last frame."""
+
+    def __init__(
+        self,
+        full_scan_interval: int = DEFAULT_FULL_SCAN_INTERVAL,
+        tile_size: int = DEFAULT_TILE_SIZE,
+    ):
+        """Initialize without known positions, so the first frame is scanned.
+
+        Args:
+            full_scan_interval: Scan the whole frame every this many frames;
+                1 scans every frame
+            tile_size: Side of the mask tiles in pixels
+        """
+        if full_scan_interval < 1:
+            raise ValueError(
+                f"Full scan interval must be at least 1, got {full_scan_interval}"
+            )
+        self.full_scan_interval = int(full_scan_interval)
+        self.tile_size = int(tile_size)
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget the last positions, e.g. when a new sequence starts."""
+        self._positions = None
+        self._since_full_scan = 0
+
+    def masks(
+        self,
+        cpar: ControlParams,
+        cals: Sequence,
+        track_par: TrackingParams,
+        tpar: TargetParams,
+        within: Optional[Sequence[TileMask]] = None,
+    ) -> Optional[List[TileMask]]:
+        """Return the masks to process the next frame with.
+
+        Args:
+            cpar: ControlParams of the images
+            cals: Per-camera calibrations
+            track_par: Tracking parameters with the velocity limits
+            tpar: Target parameters; windows are padded by the largest
+                target size
+            within: Optional per-camera masks to restrict the windows to
+
+        Returns:
+            Per-camera TileMasks, or None when the whole frame (or
+            ``within``) is to be scanned
+        """
+        if (
+            self._positions is None
+            or len(self._positions) == 0
+            or self._since_full_scan + 1 >= self.full_scan_interval
+        ):
+            return None
+
+        corners = search_boxes(self._positions, track_par)
+        pad = max(tpar.get_xsize_bounds()[1], tpar.get_ysize_bounds()[1]) + 1
+        return [
+            window_mask(
+                image_windows(corners, cal, cpar, pad), cpar, self.tile_size,
+                None if within is None else within[i_cam],
+            )
+            for i_cam, cal in enumerate(cals)
+        ]
+
+    def update(self, positions: np.ndarray, full_scan: bool) -> None:
+        """Record the 3D positions found in a frame.
+
+        Args:
+            positions: (N, 3) array of the particles' 3D positions
+            full_scan: Whether the frame was scanned whole
+        """
+        self._positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        self._since_full_scan = 0 if full_scan else self._since_full_scan + 1
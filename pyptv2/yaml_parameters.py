@@ -145,6 +145,7 @@ class PtvParams(ParameterBase):
     pix_x: float = 0.012  # Pixel size horizontal [mm]
     pix_y: float = 0.012  # Pixel size vertical [mm]
     chfield: int = 0  # Field flag (0=frame, 1=odd, 2=even)
+    native_depth: bool = False  # Keep 16-bit images 16-bit (thresholds in 16-bit units)
     mmp_n1: float = 1.0  # Refractive index air
     mmp_n2: float = 1.33  # Refractive index water
     mmp_n3: float = 1.46  # Refractive index glass
@@ -312,6 +313,14 @@ class SequenceParams(ParameterBase):
     Inverse: bool = False    # Invert images
     Subtr_Mask: bool = False  # Subtract mask/background
     Base_Name_Mask: str = ""  # Base name for mask files
+    Background_Model: str = ""  # Rolling background: "min", "median", "mean" or "" for Base_Name_Mask files
+    Background_Window: int = 50  # Memory of the "mean" rolling background, in frames
+    Dark_Name: str = ""  # Dark frame for flat-field correction (# = camera index), "" for none
+    Flat_Name: str = ""  # Flat frame for flat-field correction (# = camera index), "" for none
+    Raw_Pixel_Type: str = "uint8"  # Pixel type of .raw multi-frame base names: "uint8" or "uint16"
+    Raw_Header_Size: int = 0  # Bytes before the first frame of .raw files
+    Raw_Frame_Header_Size: int = 0  # Bytes before each frame of .raw files
+    Binary_Targets: bool = False  # Write the sequence's _targets files in the binary format
     
     @property
     def filename(self) -> str:
@@ -495,6 +504,10 @@ class CriteriaParams(ParameterBase):
             print(f"Error saving legacy criteria parameters: {e}")
 
 
+# Target recognition engines, in the order of their targ_rec.par numbers
+TARGET_ENGINES = ("grow", "union_find")
+
+
 @dataclass
 class TargetParams(ParameterBase):
     """Target recognition parameters (targ_rec.par/targ_rec.yaml)."""
@@ -513,6 +526,7 @@ class TargetParams(ParameterBase):
     nymax: int = 100        # Maximum size in y
     sumg_min: int = 150     # Minimum sum of gray values
     cr_sz: int = 2          # Cross size
+    engine: str = "grow"    # Target recognition engine: grow or union_find
     
     @property
     def filename(self) -> str:
@@ -550,6 +564,15 @@ class TargetParams(ParameterBase):
                 self.sumg_min = int(lines[idx])
                 idx += 1
                 self.cr_sz = int(lines[idx])
+                idx += 1
+                
+                # Optional, files older than the engine choice end here
+                self.engine = "grow"
+                if idx < len(lines) and lines[idx]:
+                    engine = int(lines[idx])
+                    if not 0 <= engine < len(TARGET_ENGINES):
+                        raise ValueError(f"unknown target recognition engine {engine}")
+                    self.engine = TARGET_ENGINES[engine]
                 
         except Exception as e:
             print(f"Error loading legacy target parameters: {e}")
@@ -573,6 +596,8 @@ class TargetParams(ParameterBase):
                 f.write(f"{self.nymax}\n")
                 f.write(f"{self.sumg_min}\n")
                 f.write(f"{self.cr_sz}\n")
+                if self.engine != "grow":
+                    f.write(f"{TARGET_ENGINES.index(self.engine)}\n")
                 
         except Exception as e:
             print(f"Error saving legacy target parameters: {e}")
@@ -0,0 +1,86 @@
+"""Tests for the rolling background models."""
+
+import unittest
+
+import numpy as np
+
+from pyptv2.background import BackgroundModel, subtract_background
+
+
+class TestBackgroundModel(unittest.TestCase):
+    """Tests for BackgroundModel and subtract_background."""
+
+    def test_subtract_background(self):
+        """Test that subtraction clips at zero, also in place."""
+        img = np.array([[10, 200], [0, 255]], dtype=np.uint8)
+        background = np.array([[20, 100], [0, 5]], dtype=np.uint8)
+        np.testing.assert_array_equal(
+            subtract_background(img, background), [[0, 100], [0, 250]]
+        )
+
+        subtract_background(img, background, out=img)
+        np.testing.assert_array_equal(img, [[0, 100], [0, 250]])
+
+    def test_min(self):
+        """Test the running minimum."""
+        model = BackgroundModel("min")
+        for value in (30, 10, 20):
+            model.update(np.full((2, 3), value, dtype=np.uint8))
+        self.assertEqual(model.background[0, 0], 10)
+        self.assertEqual(model.n_frames, 3)
+
+    def test_median(self):
+        """Test that the median estimate ignores short-lived particles."""
+        model = BackgroundModel("median")
+        frame = np.full((4, 4), 50, dtype=np.uint16)
+        model.update(frame)
+        for i in range(40):
+            img = frame.copy()
+            img[i % 4, 1] = 1000  # moving particle
+            img[3, 3] = 50 + min(i, 20)  # slowly brightening background
+            model.update(img)
+
+        background = model.background
+        self.assertEqual(background.dtype, np.uint16)
+        self.assertTrue(np.all(background[:, 1] < 70))
+        self.assertEqual(background[3, 3], 70)
+
+    def test_median_steps(self):
+        """Test that the median moves one gray level per frame, whatever the window."""
+        short, long = BackgroundModel("median", 1), BackgroundModel("median", 100)
+        for model in (short, long):
+            model.update(np.full((2, 2), 100, dtype=np.uint16))
+            for _ in range(3):
+                model.update(np.full((2, 2), 5000, dtype=np.uint16))
+        np.testing.assert_array_equal(short.background, 103)
+        np.testing.assert_array_equal(long.background, 103)
+
+    def test_mean(self):
+        """Test the exponential mean and that apply() subtracts it."""
+        model = BackgroundModel("mean", window=2)
+        model.update(np.full((2, 2), 10, dtype=np.uint8))
+        model.update(np.full((2, 2), 20, dtype=np.uint8))
+        self.assertEqual(model.background[0, 0], 15)
+
+        res = model.apply(np.full((2, 2), 25, dtype=np.uint8))
+        self.assertEqual(model.background[0, 0], 20)
+        self.assertEqual(res[0, 0], 5)
+
+    def test_restart_on_new_shape(self):
+        """Test that a frame of another size restarts the model."""
+        model = BackgroundModel("min")
+        model.update(np.zeros((2, 2), dtype=np.uint8))
+        model.update(np.full((3, 3), 7, dtype=np.uint8))
+        self.assertEqual(model.background.shape, (3, 3))
+        self.assertEqual(model.n_frames, 1)
+
+    def test_bad_arguments(self):
+        """Test that unknown modes and windows are rejected."""
+        with self.assertRaises(ValueError):
+            BackgroundModel("max")
+        with self.assertRaises(ValueError):
+            BackgroundModel("mean", window=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+"""Tests for binned quick-look processing."""
+
+import unittest
+
+import numpy as np
+
+try:
+    from optv.parameters import ControlParams, TargetParams
+    from optv.segmentation import target_recognition
+    from pyptv2.binning import (
+        bin_image,
+        binned_control_params,
+        binned_target_params,
+        unbin_targets,
+    )
+except ImportError:  # the liboptv bindings are not built
+    ControlParams = None
+
+
+@unittest.skipIf(ControlParams is None, "optv is not available")
+class TestBinning(unittest.TestCase):
+    """Tests for the binning helpers."""
+
+    def setUp(self):
+        """Full-resolution parameters and an image with two blobs."""
+        self.cpar = ControlParams(
+            2, ["hp"], image_size=(64, 48), pixel_size=(0.01, 0.012),
+            cam_side_n=1., wall_ns=[1.5], wall_thicks=[5.], object_side_n=1.33,
+        )
+        self.tpar = TargetParams(
+            discont=5, gvthresh=[20, 30], pixel_count_bounds=(4, 200),
+            xsize_bounds=(2, 15), ysize_bounds=(3, 15), min_sum_grey=100,
+        )
+
+        y, x = np.mgrid[:48, :64]
+        self.centers = [(20.3, 15.6), (45.8, 30.2)]
+        img = np.zeros((48, 64))
+        for cx, cy in self.centers:
+            img += 200 * np.exp(-((x - cx) ** 2 + (y - cy) ** 2) / 8.)
+        self.img = img.astype(np.uint8)
+
+    def test_bin_image(self):
+        """Test block means, with incomplete blocks dropped."""
+        img = np.arange(30, dtype=np.uint16).reshape(5, 6) * 1000
+        binned = bin_image(img, 2)
+        self.assertEqual(binned.shape, (2, 3))
+        self.assertEqual(binned.dtype, np.uint16)
+        self.assertEqual(binned[1, 2], (16 + 17 + 22 + 23) * 1000 // 4)
+        self.assertIs(bin_image(img, 1), img)
+        with self.assertRaises(ValueError):
+            bin_image(img, 0)
+
+    def test_binned_params(self):
+        """Test scaling of image size, pixel size and target limits."""
+        cpar = binned_control_params(self.cpar, 4)
+        self.assertEqual(cpar.get_image_size(), (16, 12))
+        np.testing.assert_allclose(cpar.get_pixel_size(), (0.04, 0.048))
+        self.assertTrue(cpar.get_hp_flag())
+        self.assertEqual(cpar.get_multimedia_params().get_n3(), 1.33)
+
+        tpar = binned_target_params(self.tpar, 2, 2)
+        self.assertEqual(list(tpar.get_grey_thresholds(2)), [20, 30])
+        self.assertEqual(tpar.get_pixel_count_bounds(), (1, 50))
+        self.assertEqual(tpar.get_xsize_bounds(), (1, 8))
+        self.assertEqual(tpar.get_ysize_bounds(), (1, 8))
+        self.assertEqual(tpar.get_min_sum_grey(), 25)
+        self.assertEqual(tpar.get_max_discontinuity(), 5)
+
+    def test_targets_map_back(self):
+        """Test that binned detection finds the blobs at full resolution."""
+        full = target_recognition(self.img, self.tpar, 0, self.cpar)
+        self.assertEqual(len(full), 2)
+
+        for factor in (2, 4):
+            targs = target_recognition(
+                bin_image(self.img, factor),
+                binned_target_params(self.tpar, factor, 2), 0,
+                binned_control_params(self.cpar, factor),
+            )
+            unbin_targets(targs, factor)
+            self.assertEqual(len(targs), 2)
+            for targ, ref in zip(targs, full):
+                np.testing.assert_allclose(targ.pos(), ref.pos(), atol=0.5)
+                self.assertAlmostEqual(
+                    targ.sum_grey_value() / ref.sum_grey_value(), 1., delta=0.2
+                )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+"""Tests for instant re-detection from candidate tables."""
+
+import unittest
+
+import numpy as np
+
+try:
+    from optv.parameters import ControlParams, TargetParams
+    from optv.segmentation import target_recognition
+    from pyptv2.detection_preview import CandidateTable
+except ImportError:  # the liboptv bindings are not built
+    ControlParams = None
+
+
+@unittest.skipIf(ControlParams is None, "optv is not available")
+class TestCandidateTable(unittest.TestCase):
+    """Tests for CandidateTable."""
+
+    def setUp(self):
+        """An image of separate blobs of different size and brightness."""
+        self.cpar = ControlParams(
+            1, ["hp"], image_size=(120, 80), pixel_size=(0.01, 0.01),
+            cam_side_n=1., wall_ns=[1.], wall_thicks=[1.], object_side_n=1.,
+        )
+        y, x = np.mgrid[:80, :120]
+        img = np.zeros((80, 120))
+        blobs = [(15.3, 12.6, 200, 3.), (50.8, 20.2, 90, 8.),
+                 (90.1, 15.5, 250, 1.5), (30.6, 60.4, 60, 4.),
+                 (75.2, 55.9, 160, 12.), (105.7, 65.1, 120, 2.)]
+        for cx, cy, peak, width in blobs:
+            img += peak * np.exp(-((x - cx) ** 2 + (y - cy) ** 2) / width)
+        self.img = img.astype(np.uint8)
+
+    def tpar(self, threshold, pixel_count_bounds=(1, 400), min_sum_grey=0):
+        """Target parameters with the given limits."""
+        return TargetParams(
+            discont=10, gvthresh=[threshold],
+            pixel_count_bounds=pixel_count_bounds, xsize_bounds=(1, 30),
+            ysize_bounds=(1, 30), min_sum_grey=min_sum_grey,
+        )
+
+    def assert_targets_equal(self, table, tpar):
+        """Compare re-detection from the table with target recognition."""
+        expected = np.asarray(target_recognition(self.img, tpar, 0, self.cpar))
+        targets = table.detect_params(tpar)
+        self.assertEqual(len(targets), len(expected))
+        for name in ("x", "y"):
+            np.testing.assert_allclose(targets[name], expected[name])
+        for name in ("pnr", "n", "nx", "ny", "sumg", "tnr"):
+            np.testing.assert_array_equal(targets[name], expected[name])
+
+    def test_base_threshold(self):
+        """Test that detection at the base threshold is exact."""
+        table = CandidateTable(self.img, 10, 10, self.cpar)
+        self.assertEqual(len(table), 6)
+        self.assert_targets_equal(table, self.tpar(10))
+        self.assert_targets_equal(table, self.tpar(10, (5, 40), 500))
+
+    def test_higher_threshold(self):
+        """Test re-detection of blobs that stay connected above the base."""
+        table = CandidateTable(self.img, 10, 10, self.cpar)
+        for threshold in (25, 50, 100, 180):
+            self.assert_targets_equal(table, self.tpar(threshold))
+        for threshold in (25, 50, 100):
+            self.assert_targets_equal(
+                table, self.tpar(threshold, (4, 60), 1000)
+            )
+
+    def test_limits(self):
+        """Test the base threshold bound and empty tables."""
+        table = CandidateTable(self.img, 30, 10, self.cpar)
+        with self.assertRaises(ValueError):
+            table.detect(20)
+
+        empty = CandidateTable(np.zeros_like(self.img), 10, 10, self.cpar)
+        self.assertEqual(len(empty), 0)
+        self.assertEqual(len(empty.detect(10)), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,344 @@
+"""Tests for the sequence and detection glue of pyptv2.frame_processing."""
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import tifffile
+
+try:
+    from optv.calibration import Calibration
+    from optv.imgcoord import image_coordinates
+    from optv.parameters import (
+        ControlParams,
+        TargetParams,
+        TrackingParams,
+        VolumeParams,
+    )
+    from optv.tracking_framebuf import read_targets
+    from optv.transforms import convert_arr_metric_to_pixel
+    from pyptv2.frame_processing import (
+        FrameProcessor,
+        PreprocessOptions,
+        SequenceLayout,
+    )
+    from pyptv2.target_files import is_binary_targets, targets_path
+except ImportError:  # the liboptv bindings are not built
+    ControlParams = None
+
+
+@unittest.skipIf(ControlParams is None, "optv is not available")
+class TestFrameProcessor(unittest.TestCase):
+    """Tests for FrameProcessor on two synthetic cameras."""
+
+    def setUp(self):
+        """Two cameras looking down the Z axis at three particles."""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cpar = ControlParams(
+            2, ["hp"], image_size=(400, 300), pixel_size=(0.01, 0.01),
+            cam_side_n=1., wall_ns=[1.], wall_thicks=[1.], object_side_n=1.,
+        )
+        self.cals = [
+            Calibration(
+                pos=np.r_[x, 0., 200.], prim_point=np.r_[0., 0., 50.],
+                glass=np.r_[0., 0., 100.],
+            )
+            for x in (-2., 2.)
+        ]
+        self.vpar = VolumeParams(
+            x_span=[-20., 20.], z_spans=[[-10., 10.], [-10., 10.]],
+            pixels_tot=0., pixels_x=0., pixels_y=0., ref_gray=0.,
+            epipolar_band=0.05, min_correlation=0.,
+        )
+        self.tpar = TargetParams(
+            discont=50, gvthresh=[30, 30], pixel_count_bounds=(4, 200),
+            xsize_bounds=(2, 20), ysize_bounds=(2, 20), min_sum_grey=0,
+        )
+        self.track_par = TrackingParams(
+            velocity_lims=[[-1., 1.], [-1., 1.], [-1., 1.]],
+            accel_lim=1., angle_lim=90., add_particle=0,
+        )
+        self.points = np.array([[0., 0., 0.], [3., 2., 1.], [-2., -3., -2.]])
+        self.processor = FrameProcessor(
+            self.cpar, self.tpar, self.vpar, self.cals, self.track_par
+        )
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def render(self, cal, points):
+        """Draw gaussian blobs where the points project into a camera."""
+        pix = convert_arr_metric_to_pixel(
+            image_coordinates(points, cal, self.cpar.get_multimedia_params()),
+            self.cpar,
+        )
+        yy, xx = np.mgrid[:300, :400]
+        img = np.zeros((300, 400))
+        for x, y in pix:
+            img += 200 * np.exp(-((xx - x)**2 + (yy - y)**2) / (2 * 1.5**2))
+        return img.astype(np.uint8)
+
+    def write_stacks(self, num_frames, step):
+        """Write a 16-bit multi-page TIFF per camera of moving particles.
+
+        Returns:
+            The sequence layout of the stacks
+        """
+        base_names = []
+        for cam, cal in enumerate(self.cals):
+            frames = np.array([
+                self.render(cal, self.points + [step * frame, 0., 0.])
+                for frame in range(num_frames)
+            ]).astype(np.uint16) * 256
+            name = os.path.join(self.tmp_dir.name, f"cam{cam + 1}.tif")
+            tifffile.imwrite(name, frames, photometric="minisblack")
+            base_names.append(name)
+        return SequenceLayout(base_names, first_frame=1, last_frame=num_frames)
+
+    def write_frames(self, num_frames, step):
+        """Write an 8-bit TIFF file per camera and frame of moving particles.
+
+        Returns:
+            The sequence layout of the files
+        """
+        base_names = []
+        for cam, cal in enumerate(self.cals):
+            name = os.path.join(self.tmp_dir.name, f"cam{cam + 1}.%d.tif")
+            for frame in range(1, num_frames + 1):
+                img = self.render(cal, self.points + [step * (frame - 1), 0., 0.])
+                tifffile.imwrite(name % frame, img)
+            base_names.append(name)
+        return SequenceLayout(base_names, first_frame=1, last_frame=num_frames)
+
+    def read_rt_is(self, corres_base, frame):
+        """Return the 3D positions of an rt_is file, sorted by X."""
+        with open(f"{corres_base}.{frame}", encoding="utf8") as rt_is:
+            num = int(rt_is.readline())
+            pos = np.array([
+                [float(v) for v in rt_is.readline().split()[1:4]]
+                for _ in range(num)
+            ])
+        return pos.reshape(-1, 3)[np.argsort(pos.reshape(-1, 3)[:, 0])]
+
+    def test_load_frame(self):
+        """Stack frames come in 8-bit; unreadable cameras come in blank."""
+        layout = self.write_stacks(2, 0.)
+
+        images = self.processor.load_frame(layout, 2)
+        self.assertEqual(len(images), 2)
+        for img, cal in zip(images, self.cals):
+            self.assertEqual(img.dtype, np.uint8)
+            np.testing.assert_array_equal(img, self.render(cal, self.points))
+
+        layout.base_names[1] = os.path.join(self.tmp_dir.name, "missing.tif")
+        blank = self.processor.load_frame(layout, 1, camera_id=1)
+        self.assertEqual(blank.shape, (300, 400))
+        self.assertFalse(blank.any())
+
+    def test_load_frame_native_depth(self):
+        """With native depth on, 16-bit stack frames stay 16-bit."""
+        layout = self.write_stacks(1, 0.)
+        self.processor.native_depth = True
+        img = self.processor.load_frame(layout, 1, camera_id=0)
+        self.assertEqual(img.dtype, np.uint16)
+
+    def test_preprocess(self):
+        """Inversion and the highpass filter keep the particles detectable."""
+        images = [self.render(cal, self.points) for cal in self.cals]
+
+        highpassed = self.processor.preprocess(images, PreprocessOptions())
+        detections, _ = self.processor.detect(highpassed)
+        self.assertEqual([len(targs) for targs in detections], [3, 3])
+
+        inverted = [255 - img for img in images]
+        restored = self.processor.preprocess(
+            inverted, PreprocessOptions(inverse=True, highpass=False)
+        )
+        for img, orig in zip(restored, images):
+            np.testing.assert_array_equal(img, orig)
+
+    def test_flat_field(self):
+        """The dark frame of each camera is subtracted before the rest."""
+        dark_name = os.path.join(self.tmp_dir.name, "dark#.tif")
+        for cam in range(2):
+            tifffile.imwrite(dark_name.replace("#", str(cam)),
+                             np.full((300, 400), 10, dtype=np.uint8))
+
+        images = [self.render(cal, self.points) for cal in self.cals]
+        corrected = self.processor.preprocess(
+            [img + 10 for img in images],
+            PreprocessOptions(dark_name=dark_name, highpass=False),
+        )
+        for img, orig in zip(corrected, images):
+            np.testing.assert_array_equal(img, orig)
+
+        with self.assertRaises(ValueError):
+            self.processor.preprocess(images, PreprocessOptions(
+                flat_name=os.path.join(self.tmp_dir.name, "missing#.tif")
+            ))
+
+    def test_quick_look(self):
+        """In quick-look mode frames are loaded binned."""
+        layout = self.write_stacks(1, 0.)
+        self.processor.set_binning(2)
+        images = self.processor.load_frame(layout, 1)
+        self.assertEqual([img.shape for img in images], [(150, 200)] * 2)
+        self.assertEqual(self.processor.image_cpar().get_image_size(),
+                         (200, 150))
+
+        with self.assertRaises(ValueError):
+            self.processor.set_binning(0)
+
+    def test_binned_detection(self):
+        """Binned detection reports targets in full-resolution pixels."""
+        images = [self.render(cal, self.points) for cal in self.cals]
+        full, _ = self.processor.detect(images)
+
+        self.processor.set_binning(2)
+        binned, _ = self.processor.detect(images)
+        for full_targs, binned_targs in zip(full, binned):
+            self.assertEqual(len(binned_targs), len(full_targs))
+            full_pos = sorted(t.pos()[0] for t in full_targs)
+            binned_pos = sorted(t.pos()[0] for t in binned_targs)
+            np.testing.assert_allclose(binned_pos, full_pos, atol=1.)
+
+    def test_tile_masks(self):
+        """Tile masks keep the particles inside the observed volume."""
+        images = [self.render(cal, self.points) for cal in self.cals]
+        fractions = self.processor.build_tile_masks(tile_size=32)
+        self.assertTrue(all(0. < frac <= 1. for frac in fractions))
+
+        detections, _ = self.processor.detect(images)
+        self.assertEqual([len(targs) for targs in detections], [3, 3])
+
+        self.processor.set_binning(2)
+        self.assertIsNone(self.processor.masks())
+
+    def test_preview(self):
+        """The preview finds the particles detection finds."""
+        images = [self.render(cal, self.points) for cal in self.cals]
+        detections, _ = self.processor.detect(images)
+        x, y = self.processor.preview(images)
+        for cam_x, targs in zip(x, detections):
+            np.testing.assert_allclose(
+                np.sort(cam_x), sorted(t.pos()[0] for t in targs), atol=0.5
+            )
+
+        # Above the particles' peak nothing is left
+        x, _ = self.processor.preview(images, threshold=250)
+        self.assertEqual([len(cam_x) for cam_x in x], [0, 0])
+
+        stats = self.processor.statistics(images)
+        self.assertEqual([cam_stats["n"].sum() for cam_stats in stats], [3, 3])
+
+    def test_windowed_detection(self):
+        """Windowed detection is switched on with its own settings."""
+        self.processor.set_windowed_detection(full_scan_interval=5)
+        self.assertEqual(self.processor.detection_windows.full_scan_interval, 5)
+        self.processor.set_windowed_detection(False)
+        self.assertIsNone(self.processor.detection_windows)
+
+    def test_static_masks(self):
+        """Particles under a static mask are not detected."""
+        images = [self.render(cal, self.points) for cal in self.cals]
+        detections, _ = self.processor.detect(images)
+
+        mask_name = os.path.join(self.tmp_dir.name, "mask#.tif")
+        for cam, targs in enumerate(detections):
+            x, y = (int(c) for c in targs[0].pos())
+            mask = np.full((300, 400), 255, dtype=np.uint8)
+            mask[y - 10:y + 10, x - 10:x + 10] = 0
+            tifffile.imwrite(mask_name.replace("#", str(cam)), mask)
+
+        fractions = self.processor.load_static_masks(mask_name)
+        self.assertTrue(all(0. < frac < 1. for frac in fractions))
+        masked, _ = self.processor.detect(images)
+        self.assertEqual([len(targs) for targs in masked], [2, 2])
+
+        self.assertIsNone(self.processor.load_static_masks(None))
+        unmasked, _ = self.processor.detect(images)
+        self.assertEqual([len(targs) for targs in unmasked], [3, 3])
+
+
+    def test_run_sequence(self):
+        """The sequence loop writes targets and 3D positions per frame."""
+        layout = self.write_stacks(3, 0.2)
+        corres_base = os.path.join(self.tmp_dir.name, "rt_is")
+        self.processor.run_sequence(
+            layout, PreprocessOptions(), 1, 3, corres_base=corres_base
+        )
+
+        for frame in range(1, 4):
+            truth = self.points + [0.2 * (frame - 1), 0., 0.]
+            pos = self.read_rt_is(corres_base, frame)
+            np.testing.assert_allclose(
+                pos, truth[np.argsort(truth[:, 0])], atol=0.1
+            )
+            for base_name in layout.base_names:
+                targs = read_targets(base_name, frame)
+                self.assertEqual(len(targs), 3)
+
+    def test_run_background_sequence(self):
+        """A rolling background alone takes the sequence through run_sequence."""
+        layout = self.write_frames(3, 0.2)
+        self.assertFalse(
+            self.processor.needs_own_loop(layout, PreprocessOptions())
+        )
+
+        # The running minimum of the first frame is the frame itself, which
+        # leaves only the dummy target of empty images (1 pixel at (1, 1))
+        options = PreprocessOptions(subtract_mask=True, background_mode="min")
+        self.assertTrue(self.processor.needs_own_loop(layout, options))
+        self.processor.run_sequence(
+            layout, options, 1, 3,
+            corres_base=os.path.join(self.tmp_dir.name, "rt_is"),
+        )
+        for base_name in layout.base_names:
+            self.assertEqual(
+                [[t.count_pixels()[0] > 1 for t in read_targets(base_name, frame)]
+                 for frame in range(1, 4)],
+                [[False], [True] * 3, [True] * 3],
+            )
+
+    def test_run_binary_sequence(self):
+        """Binary targets output takes the sequence through run_sequence."""
+        layout = self.write_frames(2, 0.2)
+        self.processor.binary_targets = True
+        self.assertTrue(
+            self.processor.needs_own_loop(layout, PreprocessOptions())
+        )
+        self.processor.run_sequence(
+            layout, PreprocessOptions(), 1, 2,
+            corres_base=os.path.join(self.tmp_dir.name, "rt_is"),
+        )
+        for base_name in layout.base_names:
+            for frame in range(1, 3):
+                self.assertTrue(
+                    is_binary_targets(targets_path(base_name, frame))
+                )
+                self.assertEqual(len(read_targets(base_name, frame)), 3)
+
+    def test_run_windowed_sequence(self):
+        """Windowed detection follows the particles through the sequence."""
+        layout = self.write_stacks(4, 0.2)
+        corres_base = os.path.join(self.tmp_dir.name, "rt_is")
+        self.processor.set_windowed_detection(full_scan_interval=10)
+        self.assertTrue(
+            self.processor.needs_own_loop(layout, PreprocessOptions())
+        )
+
+        self.processor.run_sequence(
+            layout, PreprocessOptions(), 1, 4, corres_base=corres_base
+        )
+        self.assertIsNone(self.processor._frame_masks)
+        for frame in range(1, 5):
+            truth = self.points + [0.2 * (frame - 1), 0., 0.]
+            pos = self.read_rt_is(corres_base, frame)
+            np.testing.assert_allclose(
+                pos, truth[np.argsort(truth[:, 0])], atol=0.1
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
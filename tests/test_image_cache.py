@@ -0,0 +1,104 @@
+"""Tests for the decoded-image cache."""
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+from skimage.io import imsave
+
+from pyptv2.image_cache import ImageCache, read_image_cached
+from pyptv2.sequence_loader import read_image
+
+
+class TestImageCache(unittest.TestCase):
+    """Tests for ImageCache."""
+
+    def setUp(self):
+        """Create a few small images on disk and a counting reader."""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.paths = []
+        for i in range(3):
+            path = os.path.join(self.tmp_dir.name, f"img{i}.tif")
+            imsave(path, np.full((8, 10), i, dtype=np.uint8),
+                   check_contrast=False)
+            self.paths.append(path)
+
+        self.reads = []
+
+        def reader(path):
+            self.reads.append(path)
+            return read_image(path)
+
+        self.reader = reader
+
+    def tearDown(self):
+        """Remove the temporary images."""
+        self.tmp_dir.cleanup()
+
+    def test_hit(self):
+        """Test that a cached image is returned without decoding."""
+        cache = ImageCache()
+        img = cache.get(self.paths[0], self.reader, "uint8")
+        self.assertIs(cache.get(self.paths[0], self.reader, "uint8"), img)
+        self.assertEqual(len(self.reads), 1)
+        self.assertFalse(img.flags.writeable)
+        self.assertEqual(cache.nbytes, 80)
+
+        # Another pixel type is another entry
+        cache.get(self.paths[0], self.reader, "native")
+        self.assertEqual(len(self.reads), 2)
+
+    def test_modified_file(self):
+        """Test that a file changed on disk is decoded again."""
+        cache = ImageCache()
+        cache.get(self.paths[0], self.reader, "uint8")
+
+        imsave(self.paths[0], np.full((8, 10), 7, dtype=np.uint8),
+               check_contrast=False)
+        stat = os.stat(self.paths[0])
+        os.utime(self.paths[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+        img = cache.get(self.paths[0], self.reader, "uint8")
+        self.assertEqual(img[0, 0], 7)
+        self.assertEqual(len(self.reads), 2)
+        # The outdated version was dropped
+        self.assertEqual(len(cache), 1)
+
+    def test_lru_eviction(self):
+        """Test that the least recently used images go first."""
+        cache = ImageCache(max_bytes=160)
+        cache.get(self.paths[0], self.reader, "uint8")
+        cache.get(self.paths[1], self.reader, "uint8")
+        cache.get(self.paths[0], self.reader, "uint8")
+        cache.get(self.paths[2], self.reader, "uint8")
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.nbytes, 160)
+
+        cache.get(self.paths[0], self.reader, "uint8")
+        self.assertEqual(len(self.reads), 3)
+        cache.get(self.paths[1], self.reader, "uint8")
+        self.assertEqual(len(self.reads), 4)
+
+        cache.max_bytes = 50
+        cache.evict()
+        self.assertEqual(len(cache), 0)
+        # Images over the budget are not cached at all
+        cache.get(self.paths[0], self.reader, "uint8")
+        self.assertEqual(len(cache), 0)
+
+    def test_missing_file(self):
+        """Test that missing files raise like the reader does."""
+        with self.assertRaises(OSError):
+            ImageCache().get(os.path.join(self.tmp_dir.name, "none.tif"),
+                             self.reader, "uint8")
+
+    def test_process_wide(self):
+        """Test the shared cache used by PTVCore."""
+        img = read_image_cached(self.paths[2])
+        self.assertIs(read_image_cached(self.paths[2]), img)
+        self.assertEqual(img[0, 0], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
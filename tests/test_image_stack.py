@@ -0,0 +1,243 @@
+"""Tests for memory-mapped image stacks."""
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import tifffile
+from skimage.io import imsave
+from skimage.util import img_as_ubyte
+
+from pyptv2.image_stack import (
+    ImageStack,
+    RawStack,
+    TiffStack,
+    convert_sequence,
+    create_image_stack,
+    is_page_stack,
+    open_stacks,
+    stack_path,
+)
+from pyptv2.sequence_loader import SequenceFrameLoader
+
+
+class TestImageStack(unittest.TestCase):
+    """Tests for the image stack format and converter."""
+
+    def setUp(self):
+        """Create a short 16-bit sequence on disk."""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.base_name = os.path.join(self.tmp_dir.name, "cam1.%d")
+        for frame in range(1, 4):
+            img = np.arange(48, dtype=np.uint16).reshape(6, 8) * 1000 + frame
+            imsave(self.base_name % frame + ".tif", img, check_contrast=False)
+        self.base_name += ".tif"
+
+    def tearDown(self):
+        """Remove the temporary files."""
+        self.tmp_dir.cleanup()
+
+    def test_stack_path(self):
+        """Test deriving stack names from base names."""
+        self.assertEqual(stack_path("img/cam1.%d"), "img/cam1.ptvstack")
+        self.assertEqual(stack_path("img/cam1.%04d.tif"), "img/cam1.ptvstack")
+        self.assertEqual(stack_path("img/cam1.ptvstack"), "img/cam1.ptvstack")
+
+    def test_convert_and_read(self):
+        """Test that converted frames read back unchanged and zero-copy."""
+        path = convert_sequence(self.base_name, 1, 3)
+        self.assertEqual(path, os.path.join(self.tmp_dir.name, "cam1.ptvstack"))
+
+        stack = ImageStack(path)
+        self.assertEqual((stack.first_frame, stack.last_frame), (1, 3))
+        self.assertEqual(stack.frame_shape, (6, 8))
+        self.assertEqual(stack.dtype, np.uint16)
+
+        frame = stack.frame(2)
+        self.assertEqual(frame[2, 3], 19002)
+        self.assertTrue(np.shares_memory(frame, stack.data))
+        self.assertNotIn(4, stack)
+        with self.assertRaises(IndexError):
+            stack.frame(4)
+        stack.close()
+
+    def test_stale_stack(self):
+        """Test that stacks older than their images are not used."""
+        path = convert_sequence(self.base_name, 1, 3)
+        stack = ImageStack(path)
+        self.assertTrue(stack.native_depth)
+        self.assertEqual(stack.source_mtime,
+                         os.path.getmtime(self.base_name % 3))
+        stack.close()
+        self.assertIsNotNone(open_stacks([self.base_name])[0])
+
+        # A deleted image does not matter, a changed one does
+        os.remove(self.base_name % 1)
+        self.assertIsNotNone(open_stacks([self.base_name])[0])
+        mtime = stack.source_mtime + 10
+        os.utime(self.base_name % 2, (mtime, mtime))
+        self.assertEqual(open_stacks([self.base_name]), [None])
+
+    def test_stack_depth(self):
+        """Test that 8-bit stacks of 16-bit images are not used in native depth."""
+        convert_sequence(self.base_name, 1, 3, native_depth=False)
+        stack = ImageStack(stack_path(self.base_name))
+        self.assertEqual(stack.dtype, np.uint8)
+        self.assertIs(stack.native_depth, False)
+        stack.close()
+
+        self.assertIsNotNone(open_stacks([self.base_name])[0])
+        self.assertEqual(open_stacks([self.base_name], native_depth=True), [None])
+
+    def test_create_and_write(self):
+        """Test writing frames into a new stack."""
+        path = os.path.join(self.tmp_dir.name, "new.ptvstack")
+        stack = create_image_stack(path, 100, 2, (2, 3))
+        stack.data[1] = 7
+        stack.flush()
+        stack.close()
+
+        self.assertEqual(ImageStack(path).frame(101).sum(), 42)
+
+    def test_bad_file(self):
+        """Test that non-stack files are rejected."""
+        path = os.path.join(self.tmp_dir.name, "bad.ptvstack")
+        with open(path, "wb") as f:
+            f.write(b"\0" * 100)
+        with self.assertRaises(ValueError):
+            ImageStack(path)
+
+    def test_loader_uses_stack(self):
+        """Test that the frame loader serves stack frames as views."""
+        convert_sequence(self.base_name, 1, 3)
+        stacks = open_stacks([self.base_name, None])
+        self.assertIsNone(stacks[1])
+
+        with SequenceFrameLoader([self.base_name], stacks=stacks[:1],
+                                 native_depth=True) as loader:
+            frame = loader.get(3, 0)
+            self.assertEqual(frame[0, 1], 1003)
+            self.assertTrue(np.shares_memory(frame, stacks[0].data))
+            self.assertEqual(len(loader._frames), 0)
+
+
+class TestPageStack(unittest.TestCase):
+    """Tests for multi-page TIFF and raw files read as stacks."""
+
+    def setUp(self):
+        """Create the frames of a short recording."""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.frames = (
+            np.arange(5 * 6 * 8, dtype=np.uint16).reshape(5, 6, 8) * 100
+        )
+
+    def tearDown(self):
+        """Remove the temporary files."""
+        self.tmp_dir.cleanup()
+
+    def test_is_page_stack(self):
+        """Test telling multi-page files from base name patterns."""
+        self.assertTrue(is_page_stack("img/cam1.tif"))
+        self.assertTrue(is_page_stack("img/cam1.TIFF"))
+        self.assertTrue(is_page_stack("img/cam1.raw"))
+        self.assertFalse(is_page_stack("img/cam1.%04d.tif"))
+        self.assertFalse(is_page_stack("img/cam1."))
+        self.assertFalse(is_page_stack(None))
+
+    def test_tiff_pages(self):
+        """Test that TIFF and BigTIFF pages map to the frames, either byte order."""
+        for bigtiff in (False, True):
+            for byteorder in ("<", ">"):
+                for dtype in (np.uint8, np.uint16):
+                    frames = self.frames.astype(dtype)
+                    path = os.path.join(self.tmp_dir.name, "cam1.tif")
+                    tifffile.imwrite(
+                        path, frames, bigtiff=bigtiff, byteorder=byteorder,
+                        rowsperstrip=2, photometric="minisblack",
+                    )
+                    stack = TiffStack(path, first_frame=10)
+                    self.assertEqual((stack.first_frame, stack.last_frame), (10, 14))
+                    self.assertEqual(stack.frame_shape, (6, 8))
+                    for frame_num in (10, 12, 14):
+                        np.testing.assert_array_equal(
+                            stack.frame(frame_num), frames[frame_num - 10]
+                        )
+                    self.assertTrue(stack.frame(11).dtype.isnative)
+                    with self.assertRaises(IndexError):
+                        stack.frame(15)
+                    stack.close()
+
+    def test_tiff_zero_copy(self):
+        """Test that pages of native byte order are views into the map."""
+        path = os.path.join(self.tmp_dir.name, "cam1.tif")
+        tifffile.imwrite(path, self.frames, photometric="minisblack")
+        stack = TiffStack(path)
+        frame = stack.frame(3)
+        self.assertTrue(np.shares_memory(frame, stack._map))
+        self.assertFalse(frame.flags.writeable)
+
+    def test_compressed_tiff(self):
+        """Test that pages that cannot be mapped are rejected."""
+        path = os.path.join(self.tmp_dir.name, "cam1.tif")
+        tifffile.imwrite(path, self.frames, compression="zlib",
+                         photometric="minisblack")
+        with self.assertRaises(ValueError):
+            TiffStack(path)
+        # ... and the camera is left to the per-frame reader
+        self.assertEqual(open_stacks([path]), [None])
+
+    def test_raw(self):
+        """Test raw files with file and frame headers."""
+        path = os.path.join(self.tmp_dir.name, "cam1.raw")
+        with open(path, "wb") as f:
+            f.write(b"h" * 16)
+            for frame in self.frames:
+                f.write(b"f" * 4 + frame.astype("<u2").tobytes())
+
+        stack = RawStack(path, (6, 8), np.uint16, first_frame=1,
+                         header_size=16, frame_header_size=4)
+        self.assertEqual(len(stack), 5)
+        np.testing.assert_array_equal(stack.frame(5), self.frames[4])
+
+        stacks = open_stacks([path], first_frame=1, frame_shape=(6, 8),
+                             raw_dtype="uint16", raw_header_size=16,
+                             raw_frame_header_size=4)
+        np.testing.assert_array_equal(stacks[0].frame(2), self.frames[1])
+
+    def test_loader_uses_pages(self):
+        """Test that the frame loader serves multi-page files."""
+        path = os.path.join(self.tmp_dir.name, "cam1.tif")
+        tifffile.imwrite(path, self.frames, photometric="minisblack")
+        stacks = open_stacks([path], first_frame=101)
+
+        with SequenceFrameLoader([path], stacks=stacks,
+                                 native_depth=True) as loader:
+            np.testing.assert_array_equal(loader.get_frame(103)[0], self.frames[2])
+            with self.assertRaises(ValueError):
+                loader.get(106, 0)
+
+    def test_loader_depth(self):
+        """Test that 16-bit pages follow the loader's depth policy."""
+        path = os.path.join(self.tmp_dir.name, "cam1.tif")
+        tifffile.imwrite(path, self.frames, photometric="minisblack")
+        stacks = open_stacks([path], first_frame=101)
+        self.assertEqual(stacks[0].dtype, np.uint16)
+
+        # Converted to 8 bits like read_image() converts 16-bit files
+        with SequenceFrameLoader([path], stacks=stacks) as loader:
+            for frame in (loader.get(102, 0), loader.get_frame(102)[0]):
+                self.assertEqual(frame.dtype, np.uint8)
+                np.testing.assert_array_equal(
+                    frame, img_as_ubyte(self.frames[1])
+                )
+
+        with SequenceFrameLoader([path], stacks=stacks,
+                                 native_depth=True) as loader:
+            frame = loader.get(102, 0)
+            self.assertEqual(frame.dtype, np.uint16)
+            self.assertTrue(np.shares_memory(frame, stacks[0]._map))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+"""Tests for the prefetching sequence frame loader."""
+
+import os
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+from skimage.io import imsave
+
+from pyptv2.sequence_loader import SequenceFrameLoader, read_image
+
+
+class TestSequenceFrameLoader(unittest.TestCase):
+    """Tests for SequenceFrameLoader."""
+
+    def setUp(self):
+        """Create a small two-camera sequence on disk."""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.base_names = []
+        for cam in range(2):
+            base_name = os.path.join(self.tmp_dir.name, f"cam{cam + 1}.%d.tif")
+            self.base_names.append(base_name)
+            for frame in range(10001, 10006):
+                img = np.full((8, 10), frame - 10000 + 10 * cam, dtype=np.uint8)
+                imsave(base_name % frame, img, check_contrast=False)
+
+    def tearDown(self):
+        """Remove the temporary sequence."""
+        self.tmp_dir.cleanup()
+
+    def test_read_image(self):
+        """Test decoding a single image file."""
+        img = read_image(self.base_names[0] % 10001)
+        self.assertEqual(img.dtype, np.uint8)
+        self.assertEqual(img.shape, (8, 10))
+
+    def test_get_all_cameras(self):
+        """Test that every camera of a frame gets its own image."""
+        with SequenceFrameLoader(self.base_names) as loader:
+            images = loader.get_frame(10003)
+            self.assertEqual(images[0][0, 0], 3)
+            self.assertEqual(images[1][0, 0], 13)
+            self.assertEqual(loader.get(10003, 1)[0, 0], 13)
+
+    def test_read_ahead(self):
+        """Test that following frames are scheduled and stay in range."""
+        with SequenceFrameLoader(self.base_names, read_ahead=2,
+                                 last_frame=10005) as loader:
+            loader.get_frame(10001)
+            self.assertEqual(list(loader._frames), [10001, 10002, 10003])
+
+            loader.get_frame(10004)
+            self.assertEqual(list(loader._frames), [10004, 10005])
+
+    def test_backward_read_ahead(self):
+        """Test that stepping backwards prefetches earlier frames."""
+        with SequenceFrameLoader(self.base_names, read_ahead=1) as loader:
+            loader.get_frame(10004)
+            loader.get_frame(10003)
+            self.assertEqual(sorted(loader._frames), [10002, 10003])
+
+    def test_memory_budget(self):
+        """Test that the byte budget limits the read-ahead window."""
+        frame_bytes = 2 * 8 * 10
+        with SequenceFrameLoader(self.base_names, read_ahead=4,
+                                 max_bytes=2 * frame_bytes) as loader:
+            loader.get_frame(10001)
+            loader.get_frame(10002)
+            self.assertEqual(list(loader._frames), [10002, 10003])
+
+    def test_jump_cancels_pending(self):
+        """Test that jumping away cancels reads that were not started."""
+        release = threading.Event()
+
+        def slow_reader(path):
+            release.wait(5)
+            return np.zeros((2, 2), dtype=np.uint8)
+
+        loader = SequenceFrameLoader(self.base_names, read_ahead=3,
+                                     max_workers=1, reader=slow_reader)
+        try:
+            loader.prefetch([10001, 10002, 10003])
+            pending = loader._frames[10003]
+            loader.cancel()
+            release.set()
+            self.assertTrue(all(future.cancelled() for future in pending))
+            self.assertEqual(len(loader._frames), 0)
+        finally:
+            release.set()
+            loader.close()
+
+    def test_missing_file(self):
+        """Test that decoding errors are raised per camera."""
+        base_names = [self.base_names[0], self.base_names[1] + ".missing"]
+        with SequenceFrameLoader(base_names) as loader:
+            self.assertEqual(loader.get(10001, 0)[0, 0], 1)
+            with self.assertRaises(Exception):
+                loader.get(10001, 1)
+
+    def test_file_appears_after_failure(self):
+        """Test that a failed read is retried by the next request."""
+        path = self.base_names[1] % 10006
+        with SequenceFrameLoader(self.base_names, read_ahead=0) as loader:
+            with self.assertRaises(Exception):
+                loader.get(10006, 1)
+
+            imsave(path, np.full((8, 10), 16, dtype=np.uint8),
+                   check_contrast=False)
+            self.assertEqual(loader.get(10006, 1)[0, 0], 16)
+            with self.assertRaises(Exception):
+                loader.get_frame(10006)
+
+    def test_unset_base_name(self):
+        """Test that a camera without base name fails to load."""
+        with SequenceFrameLoader([None]) as loader:
+            with self.assertRaises(ValueError):
+                loader.get(10001, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+"""Tests for text and binary _targets files."""
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+try:
+    from optv.tracking_framebuf import TARGET_DTYPE, TargetArray, read_targets
+    from pyptv2.target_files import (
+        convert_targets,
+        is_binary_targets,
+        main,
+        targets_path,
+    )
+except ImportError:  # the liboptv bindings are not built
+    TargetArray = None
+
+
+@unittest.skipIf(TargetArray is None, "optv is not available")
+class TestTargetFiles(unittest.TestCase):
+    """Tests for the _targets file converter."""
+
+    def setUp(self):
+        """Write text targets files of three frames."""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.file_base = os.path.join(self.tmp_dir.name, "cam1.")
+        self.targets = {}
+        for frame in range(1, 4):
+            arr = np.zeros(5, dtype=TARGET_DTYPE)
+            arr["pnr"] = np.arange(5)
+            arr["x"] = np.linspace(10.25, 50.5, 5) + frame
+            arr["y"] = np.linspace(3.125, 80., 5)
+            arr["n"], arr["nx"], arr["ny"] = 12, 4, 3
+            arr["sumg"] = 300 * frame
+            arr["tnr"] = -1
+            TargetArray.from_array(arr).write(self.file_base.encode(), frame)
+            self.targets[frame] = arr
+
+    def tearDown(self):
+        """Remove the temporary files."""
+        self.tmp_dir.cleanup()
+
+    def assert_targets(self, frame):
+        """Check the targets read back for a frame."""
+        targets = np.asarray(read_targets(self.file_base, frame))
+        expected = self.targets[frame]
+        for name in ("pnr", "n", "nx", "ny", "sumg", "tnr"):
+            np.testing.assert_array_equal(targets[name], expected[name])
+        for name in ("x", "y"):
+            np.testing.assert_allclose(targets[name], expected[name],
+                                       atol=1e-4)
+
+    def test_targets_path(self):
+        """Test the file names liboptv uses."""
+        self.assertEqual(targets_path("res/cam1.", 7), "res/cam1.0007_targets")
+        self.assertEqual(targets_path("res/cam1.", 10001),
+                         "res/cam1.10001_targets")
+        self.assertEqual(targets_path("res/cam1", 0), "res/cam1_targets")
+
+    def test_convert(self):
+        """Test conversion to binary and back."""
+        path = targets_path(self.file_base, 2)
+        self.assertFalse(is_binary_targets(path))
+
+        self.assertEqual(convert_targets(self.file_base, 1, 5), 3)
+        self.assertTrue(is_binary_targets(path))
+        for frame in range(1, 4):
+            self.assert_targets(frame)
+        # Nothing left to convert
+        self.assertEqual(convert_targets(self.file_base, 1, 3), 0)
+
+        main([self.file_base, "2", "3", "--text"])
+        self.assertTrue(is_binary_targets(targets_path(self.file_base, 1)))
+        self.assertFalse(is_binary_targets(path))
+        for frame in range(1, 4):
+            self.assert_targets(frame)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+"""Tests for windowed detection around predicted particles."""
+
+import unittest
+
+import numpy as np
+
+try:
+    from optv.calibration import Calibration
+    from optv.image_processing import StaticMask, TileMask
+    from optv.parameters import ControlParams, TargetParams, TrackingParams
+    from optv.segmentation import target_recognition
+    from pyptv2.windowed_detection import (
+        DetectionWindows,
+        image_windows,
+        search_boxes,
+        window_mask,
+    )
+except ImportError:  # the liboptv bindings are not built
+    ControlParams = None
+
+
+@unittest.skipIf(ControlParams is None, "optv is not available")
+class TestDetectionWindows(unittest.TestCase):
+    """Tests for the detection windows."""
+
+    def setUp(self):
+        """A camera looking down the Z axis at a 400x300 pixel image."""
+        self.cpar = ControlParams(
+            1, ["hp"], image_size=(400, 300), pixel_size=(0.01, 0.01),
+            cam_side_n=1., wall_ns=[1.], wall_thicks=[1.], object_side_n=1.,
+        )
+        self.cal = Calibration(
+            pos=np.r_[0., 0., 200.], prim_point=np.r_[0., 0., 50.],
+            glass=np.r_[0., 0., 100.],
+        )
+        self.track_par = TrackingParams(
+            velocity_lims=[[-1., 1.], [-0.5, 2.], [-1., 1.]],
+            accel_lim=1., angle_lim=90., add_particle=0,
+        )
+        self.tpar = TargetParams(
+            discont=10, gvthresh=[20], pixel_count_bounds=(1, 100),
+            xsize_bounds=(1, 8), ysize_bounds=(1, 8), min_sum_grey=0,
+        )
+
+    def test_search_boxes(self):
+        """Test the corners of the velocity boxes."""
+        corners = search_boxes(np.array([[1., 2., 3.]]), self.track_par)
+        self.assertEqual(corners.shape, (1, 8, 3))
+        np.testing.assert_array_equal(corners[0].min(axis=0), [0., 1.5, 2.])
+        np.testing.assert_array_equal(corners[0].max(axis=0), [2., 4., 4.])
+        self.assertEqual(len({tuple(c) for c in corners[0]}), 8)
+
+    def test_image_windows(self):
+        """Test that windows contain the projected positions."""
+        corners = search_boxes(np.array([[0., 0., 0.], [5., -3., 0.]]),
+                               self.track_par)
+        windows = image_windows(corners, self.cal, self.cpar, pad=2.)
+        self.assertEqual(windows.shape, (2, 4))
+        # The origin is seen at the image center
+        xmin, xmax, ymin, ymax = windows[0]
+        self.assertTrue(xmin < 200. < xmax and ymin < 150. < ymax)
+        # 1 mm at 200 mm distance and 50 mm focal length is 25 pixels
+        self.assertAlmostEqual(xmax - xmin, 2 * 25. * 200. / 199. + 4., 0)
+
+        mask = window_mask(windows, self.cpar, tile_size=32)
+        tiles = mask.get_tiles()
+        self.assertTrue(tiles[150 // 32, 200 // 32])
+        self.assertFalse(tiles[0, 0])
+        self.assertLess(mask.live_fraction(), 0.25)
+
+        within = TileMask(self.cpar, 32)
+        within.set_rect(0, 200, 0, 300)
+        mask = window_mask(windows, self.cpar, 32, within)
+        self.assertFalse(mask.get_tiles()[:, 200 // 32 + 1:].any())
+        self.assertIsNone(mask.static)
+
+        # The static mask of the restricting mask is carried along
+        within.set_static(StaticMask(np.ones((300, 400))))
+        mask = window_mask(windows, self.cpar, 32, within)
+        self.assertIs(mask.static, within.static)
+
+    def test_schedule(self):
+        """Test windowed frames between full scans."""
+        windows = DetectionWindows(full_scan_interval=3, tile_size=32)
+        args = (self.cpar, [self.cal], self.track_par, self.tpar)
+        self.assertIsNone(windows.masks(*args))
+
+        windows.update(np.zeros((1, 3)), full_scan=True)
+        masks = windows.masks(*args)
+        self.assertEqual(len(masks), 1)
+        windows.update(np.zeros((1, 3)), full_scan=False)
+        self.assertIsNotNone(windows.masks(*args))
+        windows.update(np.zeros((1, 3)), full_scan=False)
+        self.assertIsNone(windows.masks(*args))
+
+        # Nothing to predict from
+        windows.update(np.empty((0, 3)), full_scan=True)
+        self.assertIsNone(windows.masks(*args))
+
+        windows.update(np.zeros((1, 3)), full_scan=True)
+        windows.reset()
+        self.assertIsNone(windows.masks(*args))
+        with self.assertRaises(ValueError):
+            DetectionWindows(full_scan_interval=0)
+
+    def test_detection(self):
+        """Test that only particles near the predicted ones are found."""
+        y, x = np.mgrid[:300, :400]
+        img = np.zeros((300, 400))
+        for cx, cy in ((210.3, 140.6), (50.2, 260.8)):
+            img += 200 * np.exp(-((x - cx) ** 2 + (y - cy) ** 2) / 3.)
+        img = img.astype(np.uint8)
+        self.assertEqual(
+            len(target_recognition(img, self.tpar, 0, self.cpar)), 2
+        )
+
+        windows = DetectionWindows(tile_size=32)
+        windows.update(np.zeros((1, 3)), full_scan=True)
+        mask, = windows.masks(self.cpar, [self.cal], self.track_par, self.tpar)
+        targs = target_recognition(img, self.tpar, 0, self.cpar, mask=mask)
+        self.assertEqual(len(targs), 1)
+        np.testing.assert_allclose(targs[0].pos(), (210.8, 141.1), atol=0.2)
+
+
+if __name__ == '__main__':
+    unittest.main()